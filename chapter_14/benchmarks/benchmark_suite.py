@@ -0,0 +1,392 @@
+# Copyright (c) 2023 Michael Hu.
+# This code is part of the book "The Art of Reinforcement Learning: Fundamentals, Mathematics, and Implementation with Python.".
+# See the accompanying LICENSE file for details.
+
+
+"""A reproducible benchmark suite for the hot paths of the self-play actors, with JSON baselines to compare across commits.
+
+For 9x9 Go, 19x19 Go and 15x15 Gomoku, the suite measures:
+
+    env                   random self-play games on the environment, in env steps per second
+    uct_search            single-threaded MCTS search, in simulations per second
+    parallel_uct_search   MCTS search with batched evaluation, in simulations per second
+    selfplay              complete self-play games with `pipeline.play_and_record_one_game`, in moves and simulations per second
+
+The search and self-play cases run with a deterministic stub evaluation function (uniform prior probabilities and zero value),
+so the network cost is excluded, and with a small randomly initialized `AlphaZeroNet` on CPU with a single thread.
+
+Every case runs with fixed seeds in a fresh process, so the peak RSS is measured per case,
+and the fastest of a few repeated runs is reported, as the timing is noisy on a busy machine.
+The Python allocations are measured in a second run of the case under `tracemalloc`, so the tracing doesn't affect the timing,
+note `tracemalloc` doesn't see the memory allocated by PyTorch and NumPy outside of the Python allocator.
+Each case also reports a fingerprint of the moves played, if an optimization changes the fingerprint,
+it also changes the search results, not just the speed.
+
+Example usage:
+```
+python3 -m benchmarks.benchmark_suite --output=./benchmarks/baseline.json
+python3 -m benchmarks.benchmark_suite --baseline=./benchmarks/baseline.json --output=./benchmarks/new.json
+python3 -m benchmarks.benchmark_suite --cases=go9/uct_search/stub,gomoku15/env
+```
+"""
+from absl import flags
+from collections import OrderedDict
+from typing import Any, Mapping, Text
+import json
+import logging
+import multiprocessing as mp
+import platform
+import resource
+import subprocess
+import sys
+import time
+import timeit
+import tracemalloc
+import zlib
+
+import numpy as np
+import torch
+
+from envs.go import GoEnv
+from envs.gomoku import GomokuEnv
+import mcts_v2
+from network import AlphaZeroNet
+from pipeline import create_eval_func, create_mcts_player, play_and_record_one_game, set_seed
+
+FLAGS = flags.FLAGS
+flags.DEFINE_list('cases', [], 'Comma separated list of cases to run, default runs all the cases, see `CASES`.')
+flags.DEFINE_integer('num_searches', 10, 'Number of searches for the search cases, one search per move.')
+flags.DEFINE_integer('num_simulations', 200, 'Number of simulations per MCTS search for the search cases.')
+flags.DEFINE_integer('num_parallel', 8, 'Number of leaves to collect per batch for the parallel search cases.')
+flags.DEFINE_integer('selfplay_simulations', 32, 'Number of simulations per move for the self-play cases.')
+flags.DEFINE_integer('selfplay_max_steps', 100, 'Maximum number of moves for the self-play cases on the game of Go.')
+flags.DEFINE_integer('env_games', 20, 'Number of random games for the env cases.')
+flags.DEFINE_integer('num_res_blocks', 2, 'Number of residual blocks in the small neural network.')
+flags.DEFINE_integer('num_filters', 32, 'Number of filters for the conv2d layers in the small neural network.')
+flags.DEFINE_integer('num_fc_units', 64, 'Number of hidden units in the linear layer of the small neural network.')
+flags.DEFINE_integer('repeats', 3, 'Run each case this number of times, and report the fastest run to reduce the noise.')
+flags.DEFINE_bool(
+    'trace_allocations', True, 'Run each case a second time under tracemalloc to measure the Python allocations.'
+)
+flags.DEFINE_string('output', '', 'Save the results to this JSON file, which can be used as a baseline later.')
+flags.DEFINE_string('baseline', '', 'Compare the results against the baseline JSON file.')
+flags.DEFINE_float('tolerance', 0.05, 'Report a regression if the throughput is lower than the baseline by this fraction.')
+flags.DEFINE_integer('seed', 1, 'Seed the runtime.')
+
+# Initialize flags
+FLAGS(sys.argv)
+
+
+GAMES = OrderedDict(
+    [
+        ('go9', dict(game='go', board_size=9)),
+        ('go19', dict(game='go', board_size=19)),
+        ('gomoku15', dict(game='gomoku', board_size=15)),
+    ]
+)
+WORKLOADS = ('env', 'uct_search', 'parallel_uct_search', 'selfplay')
+EVAL_FUNCS = ('stub', 'net')
+
+# The env cases don't use the evaluation function
+CASES = tuple(
+    f'{game}/{workload}' if workload == 'env' else f'{game}/{workload}/{eval_func}'
+    for game in GAMES
+    for workload in WORKLOADS
+    for eval_func in (EVAL_FUNCS if workload != 'env' else EVAL_FUNCS[:1])
+)
+
+# The metrics where higher is better, used to detect regressions against the baseline
+THROUGHPUT_METRICS = ('env_steps_per_second', 'simulations_per_second', 'moves_per_second')
+
+
+def create_env(game: str, board_size: int, max_steps: int = None):
+    if game == 'go':
+        return GoEnv(board_size=board_size, num_stack=8, max_steps=max_steps)
+    return GomokuEnv(board_size=board_size, num_stack=8)
+
+
+def create_stub_eval_func(action_dim):
+    """Returns a evaluation function with uniform prior probabilities and a fixed value, so the cost is negligible."""
+    prior_prob = np.full(action_dim, 1.0 / action_dim, dtype=np.float32)
+
+    def eval_func(state, batched=False):
+        if batched:
+            B = state.shape[0]
+            return [prior_prob] * B, [0.0] * B
+        return prior_prob, 0.0
+
+    return eval_func
+
+
+def create_network(env, settings):
+    """Returns a small randomly initialized network on CPU, the weights only depend on the seed."""
+    torch.manual_seed(settings['seed'])
+    network = AlphaZeroNet(
+        env.observation_space.shape,
+        env.action_space.n,
+        settings['num_res_blocks'],
+        settings['num_filters'],
+        settings['num_fc_units'],
+        isinstance(env, GomokuEnv),
+    )
+    return network.eval()
+
+
+def get_fingerprint(moves) -> str:
+    return f'{zlib.crc32(repr([int(m) for m in moves]).encode()):08x}'
+
+
+def run_env_case(env, settings, random_state) -> Mapping[Text, Any]:
+    """Plays random games on the environment, the time for choosing the random moves is excluded."""
+    timer = timeit.default_timer
+    elapsed = 0.0
+    num_steps = 0
+    moves = []
+
+    for _ in range(settings['env_games']):
+        env.reset()
+        done = False
+        while not done:
+            legal_actions = np.flatnonzero(env.legal_actions)
+            if env.has_pass_move:
+                # Avoid ending the game too early with two consecutive passes
+                legal_actions = legal_actions[legal_actions != env.pass_move] if len(legal_actions) > 1 else legal_actions
+            move = random_state.choice(legal_actions)
+            moves.append(move)
+
+            start = timer()
+            _, _, done, _ = env.step(move)
+            elapsed += timer() - start
+            num_steps += 1
+
+    return OrderedDict(
+        env_steps=num_steps,
+        seconds=elapsed,
+        env_steps_per_second=num_steps / elapsed,
+        fingerprint=get_fingerprint(moves),
+    )
+
+
+def run_search_case(env, eval_func, settings, parallel: bool) -> Mapping[Text, Any]:
+    """Runs one search per move with a new search tree, and plays the move, so every search runs the same simulations."""
+    timer = timeit.default_timer
+    elapsed = 0.0
+    num_simulations = 0
+    moves = []
+
+    env.reset()
+    for _ in range(settings['num_searches']):
+        start = timer()
+        if parallel:
+            move, *_ = mcts_v2.parallel_uct_search(
+                env,
+                eval_func,
+                None,
+                19652,
+                1.25,
+                settings['num_simulations'],
+                settings['num_parallel'],
+                root_noise=True,
+            )
+            num_simulations += settings['num_simulations'] + settings['num_parallel']
+        else:
+            move, *_ = mcts_v2.uct_search(env, eval_func, None, 19652, 1.25, settings['num_simulations'], root_noise=True)
+            num_simulations += settings['num_simulations']
+        elapsed += timer() - start
+
+        moves.append(move)
+        _, _, done, _ = env.step(move)
+        if done:
+            env.reset()
+
+    return OrderedDict(
+        searches=settings['num_searches'],
+        simulations=num_simulations,
+        seconds=elapsed,
+        simulations_per_second=num_simulations / elapsed,
+        fingerprint=get_fingerprint(moves),
+    )
+
+
+def run_selfplay_case(env, network, eval_func, settings) -> Mapping[Text, Any]:
+    """Plays one complete self-play game like the actors, with parallel search and sub-tree reuse."""
+    mcts_player = create_mcts_player(
+        network=network,
+        device=torch.device('cpu'),
+        num_simulations=settings['selfplay_simulations'],
+        num_parallel=settings['num_parallel'],
+        root_noise=True,
+        deterministic=False,
+        eval_func=eval_func,
+    )
+
+    start = timeit.default_timer()
+    _, stats = play_and_record_one_game(
+        env=env,
+        mcts_player=mcts_player,
+        resign_disabled=True,
+        c_puct_base=19652,
+        c_puct_init=1.25,
+        warm_up_steps=30,
+        check_resign_after_steps=0,
+        resign_threshold=-1.0,
+        logger=logging.getLogger(),
+    )
+    elapsed = timeit.default_timer() - start
+
+    num_moves = stats['game_length']
+    # The sub-tree reuse means the searches run a few less simulations, this is only an approximate number
+    num_simulations = num_moves * (settings['selfplay_simulations'] + settings['num_parallel'])
+    return OrderedDict(
+        moves=num_moves,
+        seconds=elapsed,
+        moves_per_second=num_moves / elapsed,
+        simulations_per_second=num_simulations / elapsed,
+        fingerprint=get_fingerprint([m.move for m in env.history]),
+    )
+
+
+@torch.no_grad()
+def run_case(name: str, settings: Mapping[Text, Any]) -> Mapping[Text, Any]:
+    """Runs a single benchmark case.
+
+    Args:
+        name: the name of the case, see `CASES`.
+        settings: the settings for the suite, such as the number of simulations and the seed.
+
+    Returns:
+        a ordered dict of the results.
+
+    Raises:
+        ValueError:
+            if name is not one of `CASES`.
+    """
+    if name not in CASES:
+        raise ValueError(f'Expect name to be one of {CASES}, got "{name}"')
+
+    game, workload, *eval_name = name.split('/')
+    torch.set_num_threads(1)
+    set_seed(settings['seed'])
+    random_state = np.random.RandomState(settings['seed'])
+
+    max_steps = settings['selfplay_max_steps'] if workload == 'selfplay' else None
+    env = create_env(max_steps=max_steps, **GAMES[game])
+
+    if workload == 'env':
+        return run_env_case(env, settings, random_state)
+
+    network = None
+    if eval_name[0] == 'stub':
+        eval_func = create_stub_eval_func(env.action_dim)
+    else:
+        network = create_network(env, settings)
+        eval_func = create_eval_func(network, torch.device('cpu'))
+
+    if workload == 'selfplay':
+        return run_selfplay_case(env, network, eval_func, settings)
+    return run_search_case(env, eval_func, settings, workload == 'parallel_uct_search')
+
+
+def run_case_with_memory_stats(name: str, settings: Mapping[Text, Any]) -> Mapping[Text, Any]:
+    """Runs the case, and adds the peak RSS and Python allocations, this is expected to run in a fresh process."""
+    # Every run plays the same moves, as the seeds are reset at the beginning of the case
+    results = min((run_case(name, settings) for _ in range(settings['repeats'])), key=lambda r: r['seconds'])
+
+    # On Linux the max RSS is in kilobytes, on macOS it's in bytes
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    results['peak_rss_mb'] = max_rss / (1024**2 if sys.platform == 'darwin' else 1024)
+
+    if settings['trace_allocations']:
+        tracemalloc.start()
+        run_case(name, settings)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        results['traced_peak_mb'] = peak / 1024**2
+
+    return results
+
+
+def get_metadata(settings: Mapping[Text, Any]) -> Mapping[Text, Any]:
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = ''
+
+    return OrderedDict(
+        commit=commit,
+        time=time.strftime('%Y-%m-%d %H:%M:%S'),
+        python=platform.python_version(),
+        numpy=np.__version__,
+        torch=torch.__version__,
+        platform=platform.platform(),
+        cpu_count=mp.cpu_count(),
+        settings=settings,
+    )
+
+
+def compare_results(baseline: Mapping[Text, Any], results: Mapping[Text, Any], tolerance: float) -> None:
+    """Prints the change of the throughput metrics against the baseline, and flags the regressions."""
+    # The number of repeats and tracing the allocations don't change the workload
+    ignored_keys = ('repeats', 'trace_allocations')
+    base_settings = {k: v for k, v in baseline['metadata']['settings'].items() if k not in ignored_keys}
+    settings = {k: v for k, v in results['metadata']['settings'].items() if k not in ignored_keys}
+    if base_settings != settings:
+        print('Warning: the baseline was run with different settings, the results are not comparable')
+
+    print(f'Compare against baseline at commit "{baseline["metadata"]["commit"][:10]}"')
+    for name, case in results['cases'].items():
+        if name not in baseline['cases']:
+            continue
+        base_case = baseline['cases'][name]
+        for metric in THROUGHPUT_METRICS:
+            if metric not in case or metric not in base_case:
+                continue
+            change = case[metric] / base_case[metric] - 1
+            flag = '  REGRESSION' if change < -tolerance else ''
+            print(f'{name:36s} {metric:24s} {base_case[metric]:11.1f} -> {case[metric]:11.1f} {change:+7.1%}{flag}')
+        if case['fingerprint'] != base_case['fingerprint']:
+            print(f'{name:36s} fingerprint changed, the moves played are different from the baseline')
+
+
+def main():
+    names = FLAGS.cases if FLAGS.cases else CASES
+    for name in names:
+        if name not in CASES:
+            raise ValueError(f'Expect cases to be in {CASES}, got "{name}"')
+
+    settings = OrderedDict(
+        num_searches=FLAGS.num_searches,
+        num_simulations=FLAGS.num_simulations,
+        num_parallel=FLAGS.num_parallel,
+        selfplay_simulations=FLAGS.selfplay_simulations,
+        selfplay_max_steps=FLAGS.selfplay_max_steps,
+        env_games=FLAGS.env_games,
+        num_res_blocks=FLAGS.num_res_blocks,
+        num_filters=FLAGS.num_filters,
+        num_fc_units=FLAGS.num_fc_units,
+        repeats=FLAGS.repeats,
+        trace_allocations=FLAGS.trace_allocations,
+        seed=FLAGS.seed,
+    )
+    results = OrderedDict(metadata=get_metadata(settings), cases=OrderedDict())
+
+    # Every case runs in a fresh process, so the peak RSS is not affected by previous cases
+    ctx = mp.get_context('spawn')
+    for name in names:
+        with ctx.Pool(processes=1) as pool:
+            case = pool.apply(run_case_with_memory_stats, (name, settings))
+        results['cases'][name] = case
+        print(f'{name:36s} ' + ', '.join(f'{k}={v:.4g}' if isinstance(v, float) else f'{k}={v}' for k, v in case.items()))
+
+    if FLAGS.output:
+        with open(FLAGS.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if FLAGS.baseline:
+        with open(FLAGS.baseline, 'r') as f:
+            baseline = json.load(f)
+        compare_results(baseline, results, FLAGS.tolerance)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+# Copyright (c) 2023 Michael Hu.
+# This code is part of the book "The Art of Reinforcement Learning: Fundamentals, Mathematics, and Implementation with Python.".
+# See the accompanying LICENSE file for details.
+
+
+"""Compare the speed of sending self-play games from actors to learner,
+by pickling the games over the queue, or through the shared memory buffer.
+
+Example usage:
+```
+python3 -m benchmarks.game_transport_benchmark --board_size=19 --game_length=400
+python3 -m benchmarks.game_transport_benchmark --board_size=9 --game_length=100 --num_actors=4
+```
+"""
+from absl import flags
+import multiprocessing as mp
+import sys
+import timeit
+
+import numpy as np
+
+from game_transport import SharedGameBuffer
+from replay import Transition
+
+FLAGS = flags.FLAGS
+flags.DEFINE_integer('board_size', 19, 'Board size.')
+flags.DEFINE_integer('num_stack', 8, 'Stack N previous states.')
+flags.DEFINE_integer('game_length', 400, 'Number of transitions in each game.')
+flags.DEFINE_integer('num_games', 200, 'Number of games sent by each actor.')
+flags.DEFINE_integer('num_actors', 2, 'Number of actor processes.')
+flags.DEFINE_integer('slots_per_actor', 2, 'Number of shared memory slots per actor.')
+
+
+def make_game(board_size, num_stack, game_length):
+    state_shape = (num_stack * 2 + 1, board_size, board_size)
+    num_actions = board_size**2 + 1
+    rs = np.random.RandomState(1)
+    return [
+        Transition(
+            state=rs.randint(0, 2, size=state_shape).astype(np.int8),
+            pi_prob=rs.dirichlet(np.ones(num_actions)),
+            value=1.0,
+        )
+        for _ in range(game_length)
+    ]
+
+
+def run_actor(data_queue, game_buffer, game_seq, num_games):
+    stop_event = mp.Event()
+    for _ in range(num_games):
+        if game_buffer is not None:
+            data_queue.put((game_buffer.write_game(game_seq, stop_event), len(game_seq)))
+        else:
+            data_queue.put((game_seq, len(game_seq)))
+    if game_buffer is not None:
+        game_buffer.close()
+
+
+def run_benchmark(game_seq, game_buffer):
+    """Returns the number of games received by the learner per second."""
+    data_queue = mp.Queue(maxsize=FLAGS.num_actors)
+    actors = [
+        mp.Process(target=run_actor, args=(data_queue, game_buffer, game_seq, FLAGS.num_games))
+        for _ in range(FLAGS.num_actors)
+    ]
+
+    start = timeit.default_timer()
+    for actor in actors:
+        actor.start()
+
+    for _ in range(FLAGS.num_actors * FLAGS.num_games):
+        game, length = data_queue.get()
+        if game_buffer is not None:
+            game = game_buffer.read_game(game, length)
+
+    elapsed = timeit.default_timer() - start
+
+    for actor in actors:
+        actor.join()
+
+    return FLAGS.num_actors * FLAGS.num_games / elapsed
+
+
+def main():
+    # Initialize flags
+    FLAGS(sys.argv)
+
+    game_seq = make_game(FLAGS.board_size, FLAGS.num_stack, FLAGS.game_length)
+    game_buffer = SharedGameBuffer(
+        num_slots=FLAGS.num_actors * FLAGS.slots_per_actor,
+        max_game_length=FLAGS.game_length,
+        state_shape=game_seq[0].state.shape,
+        num_actions=len(game_seq[0].pi_prob),
+    )
+
+    try:
+        print(f'Pickle over queue: {run_benchmark(game_seq, None):7.1f} games/second')
+        print(f'Shared memory:     {run_benchmark(game_seq, game_buffer):7.1f} games/second')
+    finally:
+        game_buffer.close(unlink=True)
+
+
+if __name__ == '__main__':
+    mp.set_start_method('spawn')
+    main()
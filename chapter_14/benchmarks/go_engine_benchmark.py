@@ -0,0 +1,96 @@
+# Copyright (c) 2023 Michael Hu.
+# This code is part of the book "The Art of Reinforcement Learning: Fundamentals, Mathematics, and Implementation with Python.".
+# See the accompanying LICENSE file for details.
+
+
+"""Compare the speed of the Go engines, by replaying the same random games on each engine.
+
+Example usage:
+```
+python3 -m benchmarks.go_engine_benchmark --board_size=9
+python3 -m benchmarks.go_engine_benchmark --board_size=19 --num_games=5
+```
+"""
+from absl import flags
+import copy
+import sys
+import timeit
+
+import numpy as np
+
+from envs.go import ENGINES
+
+FLAGS = flags.FLAGS
+flags.DEFINE_integer('board_size', 9, 'Board size.')
+flags.DEFINE_integer('num_games', 20, 'Number of random games to replay.')
+flags.DEFINE_integer('seed', 1, 'Seed the runtime.')
+
+# Initialize flags
+FLAGS(sys.argv)
+
+
+def generate_random_games(position_cls, num_games, random_state):
+    """Returns a list of random games, each game is a list of moves. Passing is rare, so the board gets crowded."""
+    games = []
+    for _ in range(num_games):
+        position = position_cls(board_size=FLAGS.board_size)
+        moves = []
+        for _ in range(FLAGS.board_size**2 * 2):
+            legal_moves = np.flatnonzero(position.all_legal_moves())
+            if len(legal_moves) > 1 and random_state.rand() > 0.02:
+                move = divmod(int(random_state.choice(legal_moves[:-1])), FLAGS.board_size)
+            else:
+                move = None
+            position.play_move(move, mutate=True)
+            moves.append(move)
+        games.append(moves)
+    return games
+
+
+def run_benchmark(position_cls, games):
+    """Returns the time spent in each operation, and the number of calls."""
+    timer = timeit.default_timer
+    elapsed = {'play_move': 0.0, 'all_legal_moves': 0.0, 'deepcopy': 0.0, 'score': 0.0}
+    num_moves = 0
+
+    for moves in games:
+        position = position_cls(board_size=FLAGS.board_size)
+        for move in moves:
+            start = timer()
+            position.play_move(move, mutate=True)
+            elapsed['play_move'] += timer() - start
+
+            start = timer()
+            position.all_legal_moves()
+            elapsed['all_legal_moves'] += timer() - start
+
+            start = timer()
+            copy.deepcopy(position)
+            elapsed['deepcopy'] += timer() - start
+
+            num_moves += 1
+
+        start = timer()
+        position.score()
+        elapsed['score'] += timer() - start
+
+    return elapsed, num_moves
+
+
+def main():
+    random_state = np.random.RandomState(FLAGS.seed)
+    games = generate_random_games(ENGINES['minigo'], FLAGS.num_games, random_state)
+
+    for name, position_cls in ENGINES.items():
+        elapsed, num_moves = run_benchmark(position_cls, games)
+        print(
+            f'{name:8s} {FLAGS.board_size}x{FLAGS.board_size}: '
+            f'{num_moves / elapsed["play_move"]:9.0f} moves/second, '
+            f'{num_moves / elapsed["all_legal_moves"]:9.0f} legal moves generation/second, '
+            f'{num_moves / elapsed["deepcopy"]:9.0f} copies/second, '
+            f'{len(games) / elapsed["score"]:7.0f} scores/second'
+        )
+
+
+if __name__ == '__main__':
+    main()
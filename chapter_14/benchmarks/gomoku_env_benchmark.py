@@ -0,0 +1,109 @@
+# Copyright (c) 2023 Michael Hu.
+# This code is part of the book "The Art of Reinforcement Learning: Fundamentals, Mathematics, and Implementation with Python.".
+# See the accompanying LICENSE file for details.
+
+
+"""Measure the speed of the Gomoku environment (steps per second), by playing random self-play games.
+
+The MCTS search restores the environment to the root position at the beginning of every simulation,
+so we also measure the speed of playing a few moves from a snapshot, like in the search.
+
+Example usage:
+```
+python3 -m benchmarks.gomoku_env_benchmark --board_size=15
+python3 -m benchmarks.gomoku_env_benchmark --board_size=13 --num_games=50
+```
+"""
+from absl import flags
+import sys
+import timeit
+
+import numpy as np
+
+from envs.gomoku import GomokuEnv
+
+FLAGS = flags.FLAGS
+flags.DEFINE_integer('board_size', 15, 'Board size.')
+flags.DEFINE_integer('num_to_win', 5, 'Number of connected stones to win.')
+flags.DEFINE_integer('num_games', 20, 'Number of random self-play games.')
+flags.DEFINE_integer('num_simulations', 200, 'Number of simulations from the snapshot of each game.')
+flags.DEFINE_integer('simulation_depth', 10, 'Number of moves for each simulation.')
+flags.DEFINE_integer('seed', 1, 'Seed the runtime.')
+
+# Initialize flags
+FLAGS(sys.argv)
+
+
+def generate_random_actions(num_games, random_state):
+    """Returns a random permutation of the board points for each game, the games end earlier if one player won."""
+    return [random_state.permutation(FLAGS.board_size**2) for _ in range(num_games)]
+
+
+def run_selfplay_benchmark(env, games):
+    """Returns the time spent on playing the games, and the number of steps."""
+    timer = timeit.default_timer
+    elapsed = 0.0
+    num_steps = 0
+
+    for actions in games:
+        env.reset()
+        done = False
+        start = timer()
+        for action in actions:
+            _, _, done, _ = env.step(action)
+            num_steps += 1
+            if done:
+                break
+        elapsed += timer() - start
+
+    return elapsed, num_steps
+
+
+def run_simulation_benchmark(env, games):
+    """Returns the time spent on restoring the snapshot and playing the moves, and the number of steps."""
+    timer = timeit.default_timer
+    elapsed = 0.0
+    num_steps = 0
+
+    for actions in games:
+        env.reset()
+        # Take the snapshot in the middle game
+        root_steps = FLAGS.board_size**2 // 4
+        for action in actions[:root_steps]:
+            _, _, done, _ = env.step(action)
+            if done:
+                break
+        if done:
+            continue
+
+        snapshot = env.snapshot()
+        start = timer()
+        for _ in range(FLAGS.num_simulations):
+            env.restore(snapshot)
+            for action in actions[root_steps : root_steps + FLAGS.simulation_depth]:  # noqa: E203
+                _, _, done, _ = env.step(action)
+                num_steps += 1
+                if done:
+                    break
+        elapsed += timer() - start
+
+    return elapsed, num_steps
+
+
+def main():
+    random_state = np.random.RandomState(FLAGS.seed)
+    games = generate_random_actions(FLAGS.num_games, random_state)
+    env = GomokuEnv(board_size=FLAGS.board_size, num_to_win=FLAGS.num_to_win, num_stack=8)
+
+    elapsed, num_steps = run_selfplay_benchmark(env, games)
+    print(f'Self-play {FLAGS.board_size}x{FLAGS.board_size}: {num_steps / elapsed:9.0f} steps/second')
+
+    elapsed, num_steps = run_simulation_benchmark(env, games)
+    print(
+        f'Simulation {FLAGS.board_size}x{FLAGS.board_size}: {num_steps / elapsed:9.0f} steps/second, '
+        f'including restoring the snapshot'
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+# Copyright (c) 2023 Michael Hu.
+# This code is part of the book "The Art of Reinforcement Learning: Fundamentals, Mathematics, and Implementation with Python.".
+# See the accompanying LICENSE file for details.
+
+
+"""Compare the CPU inference backends for the neural network, the speed (positions per second) for different batch sizes,
+and the accuracy drift against the float32 eager model.
+
+The latency for a single position is also measured through `pipeline.create_eval_func` with `batched=False`,
+which is how the serial MCTS search and the evaluation players call the network, including the conversions.
+
+The drift is measured on random positions, and if `eval_games_dir` is provided,
+also on the professional games using `pipeline.eval_on_pro_games`, which is only for the game of Go.
+
+Example usage:
+```
+python3 -m benchmarks.inference_benchmark --board_size=9
+python3 -m benchmarks.inference_benchmark --load_ckpt=./checkpoints/go/9x9/training_steps_150000.ckpt --eval_games_dir=./pro_games/go/9x9
+python3 -m benchmarks.inference_benchmark --game=gomoku --board_size=13 --num_filters=40 --num_fc_units=80
+```
+"""
+from absl import flags
+import os
+import sys
+import timeit
+
+import numpy as np
+import torch
+
+from envs.go import GoEnv
+from envs.gomoku import GomokuEnv
+from eval_dataset import build_eval_dataset
+from inference_backend import BACKENDS, InferenceModel
+from network import AlphaZeroNet
+from pipeline import create_eval_func, eval_on_pro_games
+
+FLAGS = flags.FLAGS
+flags.DEFINE_enum('game', 'go', ['go', 'gomoku'], 'The game for the neural network.')
+flags.DEFINE_integer('board_size', 9, 'Board size.')
+flags.DEFINE_integer('num_stack', 8, 'Stack N previous states.')
+flags.DEFINE_integer('num_res_blocks', 10, 'Number of residual blocks in the neural network.')
+flags.DEFINE_integer('num_filters', 128, 'Number of filters for the conv2d layers in the neural network.')
+flags.DEFINE_integer('num_fc_units', 128, 'Number of hidden units in the linear layer of the neural network.')
+flags.DEFINE_string('load_ckpt', '', 'Load the checkpoint file, otherwise use random weights.')
+flags.DEFINE_list('batch_sizes', ['1', '8', '32'], 'Batch sizes to measure.')
+flags.DEFINE_float('duration', 2.0, 'Seconds to measure for each backend and batch size.')
+flags.DEFINE_integer('num_threads', 1, 'Number of threads for PyTorch, the actors usually run with a single thread.')
+flags.DEFINE_string('eval_games_dir', '', 'Directory of the professional games in sgf format, only for Go.')
+flags.DEFINE_integer('seed', 1, 'Seed the runtime.')
+
+# Initialize flags
+FLAGS(sys.argv)
+
+
+def measure_speed(model, states):
+    """Returns the number of positions per second."""
+    timer = timeit.default_timer
+    # Warm up, which also exports the model
+    for _ in range(3):
+        model(states)
+
+    num_calls = 0
+    start = timer()
+    while timer() - start < FLAGS.duration:
+        model(states)
+        num_calls += 1
+    return num_calls * len(states) / (timer() - start)
+
+
+def measure_drift(model, network, states):
+    """Returns the maximum absolute difference of the action probabilities and values against the eager model."""
+    pi_logits, value = model(states)
+    expected_pi_logits, expected_value = network(states)
+    pi_diff = torch.max(torch.abs(torch.softmax(pi_logits, dim=-1) - torch.softmax(expected_pi_logits, dim=-1))).item()
+    value_diff = torch.max(torch.abs(value - expected_value)).item()
+    return pi_diff, value_diff
+
+
+@torch.no_grad()
+def main():
+    torch.manual_seed(FLAGS.seed)
+    torch.set_num_threads(FLAGS.num_threads)
+    random_state = np.random.RandomState(FLAGS.seed)
+
+    if FLAGS.game == 'go':
+        env = GoEnv(board_size=FLAGS.board_size, num_stack=FLAGS.num_stack)
+    else:
+        env = GomokuEnv(board_size=FLAGS.board_size, num_stack=FLAGS.num_stack)
+
+    network = AlphaZeroNet(
+        env.observation_space.shape,
+        env.action_space.n,
+        FLAGS.num_res_blocks,
+        FLAGS.num_filters,
+        FLAGS.num_fc_units,
+        FLAGS.game == 'gomoku',
+    )
+    if FLAGS.load_ckpt and os.path.isfile(FLAGS.load_ckpt):
+        loaded_state = torch.load(FLAGS.load_ckpt, map_location=torch.device('cpu'))
+        network.load_state_dict(loaded_state['network'])
+    network.eval()
+
+    models = {backend: network if backend == 'eager' else InferenceModel(network, backend) for backend in BACKENDS}
+
+    for batch_size in [int(v) for v in FLAGS.batch_sizes]:
+        states = torch.from_numpy((random_state.rand(batch_size, *env.observation_space.shape) > 0.7).astype(np.float32))
+        results = []
+        for backend, model in models.items():
+            results.append(f'{backend} {measure_speed(model, states):7.0f}')
+        print(f'Batch size {batch_size:4d}, positions/second: ' + ', '.join(results))
+
+    # A single position at a time, as the serial search and the evaluation players call the network
+    state = (random_state.rand(*env.observation_space.shape) > 0.7).astype(np.int8)
+    results = []
+    for backend in BACKENDS:
+        eval_func = create_eval_func(network, torch.device('cpu'), backend=backend)
+        results.append(f'{backend} {1000 / measure_speed(lambda x: eval_func(x[0], False), state[None, ...]):.3f}')
+    print('Single position with create_eval_func, milliseconds/call: ' + ', '.join(results))
+
+    states = torch.from_numpy((random_state.rand(256, *env.observation_space.shape) > 0.7).astype(np.float32))
+    for backend, model in models.items():
+        if backend != 'eager':
+            pi_diff, value_diff = measure_drift(model, network, states)
+            print(f'{backend} max absolute difference on random positions: policy {pi_diff:.6f}, value {value_diff:.6f}')
+
+    if FLAGS.game == 'go' and FLAGS.eval_games_dir and os.path.exists(FLAGS.eval_games_dir):
+        eval_dataset = build_eval_dataset(FLAGS.eval_games_dir, FLAGS.board_size, FLAGS.num_stack)
+        for backend, model in models.items():
+            stats = eval_on_pro_games(model, torch.device('cpu'), eval_dataset)
+            print(f'{backend} on {len(eval_dataset)} positions from pro games: {stats}')
+
+
+if __name__ == '__main__':
+    main()
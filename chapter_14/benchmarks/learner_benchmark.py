@@ -0,0 +1,114 @@
+# Copyright (c) 2023 Michael Hu.
+# This code is part of the book "The Art of Reinforcement Learning: Fundamentals, Mathematics, and Implementation with Python.".
+# See the accompanying LICENSE file for details.
+
+
+"""Measure the learner training speed (steps per second), with and without prefetching the training batches.
+
+Example usage:
+```
+python3 -m benchmarks.learner_benchmark --board_size=9
+python3 -m benchmarks.learner_benchmark --board_size=19 --replay=packed --prefetch_workers=4
+```
+"""
+from absl import flags
+import sys
+import threading
+import timeit
+
+import numpy as np
+import torch
+
+from network import AlphaZeroNet
+from pipeline import compute_losses
+from prefetcher import BatchPrefetcher, sample_batches
+from replay import PackedUniformReplay, Transition, UniformReplay
+
+FLAGS = flags.FLAGS
+flags.DEFINE_integer('board_size', 9, 'Board size.')
+flags.DEFINE_integer('num_stack', 8, 'Stack N previous states.')
+flags.DEFINE_string('replay', 'snappy', 'Replay storage mode, one of [list, snappy, packed].')
+flags.DEFINE_integer('capacity', 20000, 'Replay capacity, which is filled before training.')
+flags.DEFINE_integer('batch_size', 256, 'Sample batch size.')
+flags.DEFINE_integer('num_steps', 50, 'Number of training steps.')
+flags.DEFINE_integer('num_res_blocks', 6, 'Number of residual blocks in the neural network.')
+flags.DEFINE_integer('num_filters', 32, 'Number of filters for the conv2d layers in the neural network.')
+flags.DEFINE_integer('num_fc_units', 64, 'Number of hidden units in the linear layer of the neural network.')
+flags.DEFINE_bool('argument_data', True, 'Apply random rotation and mirroring to the training data.')
+flags.DEFINE_integer('prefetch_batches', 4, 'Number of training batches to prepare ahead of time.')
+flags.DEFINE_integer('prefetch_workers', 2, 'Number of background threads used to prefetch the training batches.')
+flags.DEFINE_integer('seed', 1, 'Seed the runtime.')
+
+flags.register_validator('replay', lambda x: x in ['list', 'snappy', 'packed'])
+
+# Initialize flags
+FLAGS(sys.argv)
+
+
+def create_replay(state_shape, num_actions, random_state):
+    """Returns a replay filled with random transitions."""
+    if FLAGS.replay == 'packed':
+        replay = PackedUniformReplay(FLAGS.capacity, random_state, state_shape, num_actions)
+    else:
+        replay = UniformReplay(FLAGS.capacity, random_state, compress_data=FLAGS.replay == 'snappy')
+
+    for _ in range(FLAGS.capacity):
+        replay.add(
+            Transition(
+                state=(random_state.rand(*state_shape) > 0.8).astype(np.int8),
+                pi_prob=random_state.dirichlet(np.ones(num_actions)),
+                value=float(random_state.choice([-1.0, 1.0])),
+            )
+        )
+    return replay
+
+
+def run_benchmark(network, optimizer, device, batches, argumentation):
+    """Returns the number of training steps per second."""
+    network.train()
+    start = timeit.default_timer()
+    for transitions in batches:
+        optimizer.zero_grad()
+        pi_loss, v_loss = compute_losses(network, device, transitions, argumentation)
+        loss = pi_loss + v_loss
+        loss.backward()
+        optimizer.step()
+    return FLAGS.num_steps / (timeit.default_timer() - start)
+
+
+def main():
+    torch.manual_seed(FLAGS.seed)
+    random_state = np.random.RandomState(FLAGS.seed)
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+
+    state_shape = (FLAGS.num_stack * 2 + 1, FLAGS.board_size, FLAGS.board_size)
+    num_actions = FLAGS.board_size**2 + 1
+    replay = create_replay(state_shape, num_actions, random_state)
+
+    network = AlphaZeroNet(state_shape, num_actions, FLAGS.num_res_blocks, FLAGS.num_filters, FLAGS.num_fc_units).to(device)
+    optimizer = torch.optim.SGD(network.parameters(), lr=0.01, momentum=0.9)
+
+    # Warm up
+    run_benchmark(network, optimizer, device, sample_batches(replay, FLAGS.batch_size, 5), FLAGS.argument_data)
+
+    steps_per_second = run_benchmark(
+        network, optimizer, device, sample_batches(replay, FLAGS.batch_size, FLAGS.num_steps), FLAGS.argument_data
+    )
+    print(f'No prefetch:   {steps_per_second:7.2f} steps/second')
+
+    prefetcher = BatchPrefetcher(
+        replay=replay,
+        batch_size=FLAGS.batch_size,
+        argumentation=FLAGS.argument_data,
+        pin_memory=device.type == 'cuda',
+        num_workers=FLAGS.prefetch_workers,
+        max_prefetch=FLAGS.prefetch_batches,
+        stop_event=threading.Event(),
+    )
+    # The prefetched batches already had random transformation applied
+    steps_per_second = run_benchmark(network, optimizer, device, prefetcher.batches(FLAGS.num_steps), False)
+    print(f'With prefetch: {steps_per_second:7.2f} steps/second')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,172 @@
+# Copyright (c) 2023 Michael Hu.
+# This code is part of the book "The Art of Reinforcement Learning: Fundamentals, Mathematics, and Implementation with Python.".
+# See the accompanying LICENSE file for details.
+
+
+"""Measure the MCTS search speed (simulations per second), using a stub evaluation function.
+
+Example usage:
+```
+python3 -m benchmarks.mcts_benchmark --game=go --board_size=9
+python3 -m benchmarks.mcts_benchmark --game=go --board_size=9 --go_engine=bitboard
+python3 -m benchmarks.mcts_benchmark --game=gomoku --board_size=15 --num_parallel=1
+python3 -m benchmarks.mcts_benchmark --game=go --board_size=9 --profile_search
+python3 -m benchmarks.mcts_benchmark --game=go --board_size=9 --compare_trees --repeats=3
+python3 -m benchmarks.mcts_benchmark --game=go --board_size=9 --restore_mode=deepcopy
+```
+"""
+from absl import flags
+import copy
+import sys
+import timeit
+
+import numpy as np
+
+from envs.go import GoEnv
+from envs.gomoku import GomokuEnv
+import mcts_v2
+import mcts_v3
+from search_profiler import SearchProfiler
+
+FLAGS = flags.FLAGS
+flags.DEFINE_string('game', 'go', 'Which game to run the search on, one of [go, gomoku].')
+flags.DEFINE_integer('board_size', 9, 'Board size.')
+flags.DEFINE_integer('num_stack', 8, 'Stack N previous states.')
+flags.DEFINE_string('go_engine', 'minigo', 'Implementation of the Go rules, one of [minigo, bitboard].')
+flags.DEFINE_integer('num_simulations', 200, 'Number of simulations per MCTS search.')
+flags.DEFINE_integer('num_parallel', 8, 'Number of leaves to collect per batch, 1 means no parallel search.')
+flags.DEFINE_integer('num_moves', 30, 'Number of moves to play, one search per move.')
+flags.DEFINE_bool('array_tree', False, 'Use the array-backed search tree from mcts_v3.')
+flags.DEFINE_bool(
+    'compare_trees', False, 'Run both mcts_v2 and mcts_v3 on the same games, and report the speedup of mcts_v3 over mcts_v2.'
+)
+flags.DEFINE_integer('repeats', 1, 'Repeat each run and report the fastest one, as the timings are noisy.')
+flags.DEFINE_string(
+    'restore_mode',
+    'snapshot',
+    'How the environment is reset to the root state for every simulation, one of [snapshot, deepcopy], '
+    'deepcopy is the baseline which deep copies the entire environment for every simulation.',
+)
+flags.DEFINE_bool('profile_search', False, 'Record and print the time per search phase, see search_profiler.py.')
+flags.DEFINE_integer('seed', 1, 'Seed the runtime.')
+
+flags.register_validator('game', lambda x: x in ['go', 'gomoku'])
+flags.register_validator('repeats', lambda x: x >= 1)
+flags.register_validator('restore_mode', lambda x: x in ['snapshot', 'deepcopy'])
+
+# Initialize flags
+FLAGS(sys.argv)
+
+
+def create_stub_eval_func(action_dim):
+    """Returns a evaluation function with uniform prior probabilities and a fixed value, so the cost is negligible."""
+    prior_prob = np.full(action_dim, 1.0 / action_dim, dtype=np.float32)
+
+    def eval_func(state, batched=False):
+        if batched:
+            B = state.shape[0]
+            return [prior_prob] * B, [0.0] * B
+        return prior_prob, 0.0
+
+    return eval_func
+
+
+class DeepcopyRestoreMixin:
+    """Replace the lightweight snapshot with a deep copy of the entire environment."""
+
+    def snapshot(self):
+        return copy.deepcopy(self)
+
+    def restore(self, snapshot):
+        # Copy again so the snapshot can be reused
+        self.__dict__.update(copy.deepcopy(snapshot).__dict__)
+
+
+def create_env():
+    if FLAGS.game == 'go':
+        env_cls, kwargs = GoEnv, dict(engine=FLAGS.go_engine)
+    else:
+        env_cls, kwargs = GomokuEnv, {}
+    if FLAGS.restore_mode == 'deepcopy':
+        env_cls = type(env_cls.__name__, (DeepcopyRestoreMixin, env_cls), {})
+    return env_cls(board_size=FLAGS.board_size, num_stack=FLAGS.num_stack, **kwargs)
+
+
+def run_search(mcts, profiler=None):
+    """Play the moves with one search per move, returns the environment, the elapsed search time and number of simulations."""
+    np.random.seed(FLAGS.seed)
+    env = create_env()
+    env.reset()
+    eval_func = create_stub_eval_func(env.action_dim)
+    if profiler is not None:
+        eval_func = profiler.wrap(eval_func)
+
+    num_simulations = 0
+    elapsed = 0.0
+    for _ in range(FLAGS.num_moves):
+        # Always start with a new search tree, so every search runs the same number of simulations.
+        start = timeit.default_timer()
+        if FLAGS.num_parallel > 1:
+            move, *_ = mcts.parallel_uct_search(
+                env,
+                eval_func,
+                None,
+                19652,
+                1.25,
+                FLAGS.num_simulations,
+                FLAGS.num_parallel,
+                root_noise=True,
+                profiler=profiler,
+            )
+            num_simulations += FLAGS.num_simulations + FLAGS.num_parallel
+        else:
+            move, *_ = mcts.uct_search(
+                env, eval_func, None, 19652, 1.25, FLAGS.num_simulations, root_noise=True, profiler=profiler
+            )
+            num_simulations += FLAGS.num_simulations
+        elapsed += timeit.default_timer() - start
+
+        _, _, done, _ = env.step(move)
+        if done:
+            break
+
+    return env, elapsed, num_simulations
+
+
+def main():
+    if FLAGS.compare_trees:
+        mcts_modules = [mcts_v2, mcts_v3]
+    else:
+        mcts_modules = [mcts_v3 if FLAGS.array_tree else mcts_v2]
+
+    profiler = SearchProfiler() if FLAGS.profile_search else None
+
+    # Alternate the runs, so both trees see similar noise from the machine
+    best = {}
+    for _ in range(FLAGS.repeats):
+        for mcts in mcts_modules:
+            if profiler is not None:
+                profiler.reset_stats()
+            env, elapsed, num_simulations = run_search(mcts, profiler)
+            if mcts not in best or elapsed < best[mcts][1]:
+                best[mcts] = (env.steps, elapsed, num_simulations)
+
+    for mcts in mcts_modules:
+        steps, elapsed, num_simulations = best[mcts]
+        print(
+            f'{env.id} {FLAGS.board_size}x{FLAGS.board_size}, {mcts.__name__}, '
+            f'num_parallel={FLAGS.num_parallel}, restore_mode={FLAGS.restore_mode}: {steps} moves in {elapsed:.2f} seconds, '
+            f'{num_simulations / elapsed:.1f} simulations/second'
+        )
+
+    if FLAGS.compare_trees:
+        # Both trees play the same moves, as the searches are the same
+        print(f'mcts_v3 speedup over mcts_v2: {best[mcts_v2][1] / best[mcts_v3][1]:.2f}x')
+
+    if profiler is not None:
+        for k, v in profiler.stats().items():
+            print(f'{k}: {v}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+# Copyright (c) 2023 Michael Hu.
+# This code is part of the book "The Art of Reinforcement Learning: Fundamentals, Mathematics, and Implementation with Python.".
+# See the accompanying LICENSE file for details.
+
+
+"""Compare the memory usage and sampling speed of the replay storage modes,
+using the observations from random Go games.
+
+Example usage:
+```
+python3 -m benchmarks.replay_benchmark --board_size=9
+python3 -m benchmarks.replay_benchmark --board_size=19 --capacity=50000
+```
+"""
+from absl import flags
+import sys
+import timeit
+import tracemalloc
+
+import numpy as np
+
+from envs.go import GoEnv
+from replay import PackedUniformReplay, Transition, UniformReplay
+
+FLAGS = flags.FLAGS
+flags.DEFINE_integer('board_size', 9, 'Board size.')
+flags.DEFINE_integer('num_stack', 8, 'Stack N previous states.')
+flags.DEFINE_integer('capacity', 100000, 'Replay capacity, which is filled before sampling.')
+flags.DEFINE_integer('batch_size', 256, 'Sample batch size.')
+flags.DEFINE_integer('num_batches', 200, 'Number of batches to sample.')
+flags.DEFINE_integer('seed', 1, 'Seed the runtime.')
+
+# Initialize flags
+FLAGS(sys.argv)
+
+
+def generate_random_games(env, num_transitions, random_state):
+    """Returns a list of random games, with at least `num_transitions` transitions in total."""
+    games = []
+    total = 0
+    while total < num_transitions:
+        obs = env.reset()
+        game_seq = []
+        done = False
+        while not done:
+            legal_actions = np.flatnonzero(env.legal_actions)
+            pi_prob = np.zeros(env.action_space.n)
+            pi_prob[legal_actions] = random_state.dirichlet(np.ones(len(legal_actions)))
+            game_seq.append(Transition(state=obs, pi_prob=pi_prob, value=float(random_state.choice([-1.0, 1.0]))))
+            obs, _, done, _ = env.step(random_state.choice(legal_actions))
+        games.append(game_seq)
+        total += len(game_seq)
+    return games
+
+
+def run_benchmark(replay_builder, games):
+    """Returns the memory used by the replay in MB, and the number of samples per second."""
+    tracemalloc.start()
+    start_memory = tracemalloc.get_traced_memory()[0]
+    replay = replay_builder()
+    for game_seq in games:
+        # Add copies like the learner does after receiving the games, so the memory is owned by the replay
+        replay.add_game([t._replace(state=t.state.copy(), pi_prob=t.pi_prob.copy()) for t in game_seq])
+    memory = (tracemalloc.get_traced_memory()[0] - start_memory) / 1024**2
+    tracemalloc.stop()
+
+    start = timeit.default_timer()
+    for _ in range(FLAGS.num_batches):
+        replay.sample(FLAGS.batch_size)
+    elapsed = timeit.default_timer() - start
+
+    return memory, FLAGS.num_batches * FLAGS.batch_size / elapsed
+
+
+def main():
+    random_state = np.random.RandomState(FLAGS.seed)
+    env = GoEnv(board_size=FLAGS.board_size, num_stack=FLAGS.num_stack)
+    games = generate_random_games(env, FLAGS.capacity, random_state)
+
+    replays = {
+        'list': lambda: UniformReplay(FLAGS.capacity, np.random.RandomState(FLAGS.seed), compress_data=False),
+        'snappy': lambda: UniformReplay(FLAGS.capacity, np.random.RandomState(FLAGS.seed), compress_data=True),
+        'packed': lambda: PackedUniformReplay(
+            FLAGS.capacity, np.random.RandomState(FLAGS.seed), env.observation_space.shape, env.action_space.n
+        ),
+    }
+
+    for name, replay_builder in replays.items():
+        memory, samples_per_second = run_benchmark(replay_builder, games)
+        print(
+            f'{name:6s} {FLAGS.board_size}x{FLAGS.board_size}: '
+            f'{memory:8.1f} MB for {FLAGS.capacity} transitions, '
+            f'{samples_per_second:9.0f} samples/second'
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -3,8 +3,8 @@
 # See the accompanying LICENSE file for details.
 
 
-from typing import Iterable, Tuple, Mapping, Text
-from collections import deque, namedtuple
+from typing import Any, Iterable, Tuple, Mapping, Text
+from collections import namedtuple
 import os
 import sys
 from copy import copy
@@ -77,8 +77,12 @@ class BoardGameEnv(gym.Env):
         self.last_player = None
         self.last_move = None
 
-        # Save last N board, so we can stack history planes
-        self.board_deltas = self.get_empty_queue()
+        # Save the feature planes of last N board in a ring buffer, so we can stack history planes.
+        # We keep two copies of the planes, one for each player's perspective, where the current player's stones come first,
+        # and each entry is written twice at index i and i + num_stack, so last N planes are always contiguous in memory.
+        self.history_planes = np.zeros((2, self.num_stack * 2, 2, self.board_size, self.board_size), dtype=np.int8)
+        # Index of the latest board in the ring buffer
+        self.history_index = 0
 
         self.history: Iterable[PlayerMove] = []
 
@@ -101,7 +105,8 @@ class BoardGameEnv(gym.Env):
         self.last_player = None
         self.last_move = None
 
-        self.board_deltas = self.get_empty_queue()
+        self.history_planes.fill(0)
+        self.history_index = 0
 
         del self.history[:]
 
@@ -202,17 +207,57 @@ class BoardGameEnv(gym.Env):
         row_index, col_index = self.action_to_coords(action)
         self.board[row_index, col_index] = self.to_play
 
-        # Make sure the latest board position is always at index 0
-        self.board_deltas.appendleft(np.copy(self.board))
+        self.update_history_planes()
 
         # Switch next player
         self.to_play = self.opponent_player
 
         return self.observation(), 0, False, {}
 
+    def snapshot(self) -> Mapping[Text, Any]:
+        """Returns a lightweight snapshot of the game state, which can be used to restore the game later.
+
+        This is much cheaper than `copy.deepcopy(env)`, as we only copy the mutable game state,
+        and share the immutable parts like history moves.
+        """
+        return {
+            'board': np.copy(self.board),
+            'legal_actions': np.copy(self.legal_actions),
+            'to_play': self.to_play,
+            'steps': self.steps,
+            'winner': self.winner,
+            'last_player': self.last_player,
+            'last_move': self.last_move,
+            'history_planes': np.copy(self.history_planes),
+            'history_index': self.history_index,
+            # History moves are only appended, so we only need to record the length
+            'history_length': len(self.history),
+        }
+
+    def restore(self, snapshot: Mapping[Text, Any]) -> None:
+        """Restore the game state from a snapshot created by `snapshot()`, the snapshot can be reused for multiple times.
+
+        Note this only works if the history moves are the same as when the snapshot was created,
+        which is the case when we make some moves and then restore the game back to the snapshot, like in MCTS search.
+        """
+        self.restore_board(snapshot['board'])
+        self.legal_actions = np.copy(snapshot['legal_actions'])
+        self.to_play = snapshot['to_play']
+        self.steps = snapshot['steps']
+        self.winner = snapshot['winner']
+        self.last_player = snapshot['last_player']
+        self.last_move = snapshot['last_move']
+        np.copyto(self.history_planes, snapshot['history_planes'])
+        self.history_index = snapshot['history_index']
+        history_length = snapshot['history_length']
+        del self.history[history_length:]
+
+    def restore_board(self, board: np.ndarray) -> None:
+        """Restore the board from a snapshot, subclasses which keep the board elsewhere can copy it only once."""
+        self.board = np.copy(board)
+
     def close(self):
-        """Clean up deques"""
-        self.board_deltas.clear()
+        """Clean up history"""
         del self.history[:]
 
         return super().close()
@@ -221,7 +266,7 @@ class BoardGameEnv(gym.Env):
         if move != self.resign_move:
             self.history.append(PlayerMove(color=self.get_player_name_by_id(player_id), move=move))
 
-    def observation(self) -> np.ndarray:
+    def observation(self, out: np.ndarray = None) -> np.ndarray:
         """Stack N history of feature planes and one plane represent the color to play.
 
         Specifics:
@@ -232,31 +277,37 @@ class BoardGameEnv(gym.Env):
             The stack order is
             [Xt, Yt, Xt-1, Yt-1, Xt-2, Yt-2, ..., C]
 
+        Args:
+            out: optional int8 array with the same shape as the observation to write the result into,
+                for example one row of a preallocated batch, default None.
+
         Returns a 3D tensor with the dimension [N, board_size, board_size],
             where N = 2 x num_stack + 1
         """
-        # Create an empty array to hold the stacked planes, with shape (16, 19, 19)
-        features = np.zeros((self.num_stack * 2, self.board_size, self.board_size), dtype=np.int8)
+        if out is None:
+            out = np.empty(self.observation_space.shape, dtype=np.int8)
 
-        deltas = np.array(self.board_deltas)
-
-        # Current player first, then the opponent
-        features[::2] = deltas == self.to_play
-        features[1::2] = deltas == self.opponent_player
+        # The history planes for current player's perspective, already in the order of [Xt, Yt, Xt-1, Yt-1, ...]
+        perspective = 0 if self.to_play == self.black_player else 1
+        start, end = self.history_index, self.history_index + self.num_stack
+        out[:-1] = self.history_planes[perspective, start:end].reshape(-1, self.board_size, self.board_size)
 
         # Color to play is a plane with all zeros for white, ones for black.
-        color_to_play = np.zeros((1, self.board_size, self.board_size), dtype=np.int8)
-        if self.to_play == self.black_player:
-            color_to_play += 1
+        out[-1] = 1 if self.to_play == self.black_player else 0
 
-        # Using [C, H, W] channel first for PyTorch
-        stacked_obs = np.concatenate([features, color_to_play], axis=0)
+        return out
 
-        return stacked_obs
+    def update_history_planes(self) -> None:
+        """Add the feature planes of current board to the history, this should be called once the board has changed."""
+        black_plane = self.board == self.black_player
+        white_plane = self.board == self.white_player
 
-    def get_empty_queue(self) -> deque:
-        """Returns empty queue with stack_N * all zeros planes."""
-        return deque([np.zeros((self.board_size, self.board_size))] * self.num_stack, maxlen=self.num_stack)
+        self.history_index = (self.history_index - 1) % self.num_stack
+        for i in (self.history_index, self.history_index + self.num_stack):
+            self.history_planes[0, i, 0] = black_plane
+            self.history_planes[0, i, 1] = white_plane
+            self.history_planes[1, i, 0] = white_plane
+            self.history_planes[1, i, 1] = black_plane
 
     def is_board_full(self) -> bool:
         return np.all(self.board != 0)
@@ -4,16 +4,20 @@
 
 
 """Go env class."""
-from typing import Tuple, Mapping, Text
+from typing import Any, Tuple, Mapping, Text
 import re
-from copy import copy
+from copy import copy, deepcopy
 import numpy as np
 
 from envs.base import BoardGameEnv
 import envs.go_engine as go
+import envs.go_engine_bitboard as go_bitboard
 import sgf_wrapper
 from util import get_time_stamp
 
+# Available implementations of the go.Position interface
+ENGINES = {'minigo': go.Position, 'bitboard': go_bitboard.Position}
+
 
 class GoEnv(BoardGameEnv):
     """Gym environment for board game Go.
@@ -36,28 +40,41 @@ class GoEnv(BoardGameEnv):
     such as use simulation to play more moves, or use neural networks to prediction the score.
     Consequently, there is a possibility of incorrect scores for certain games.
 
+    An alternative engine in the go_engine_bitboard.py module implements the same rules using bitboards, which is faster.
+    It can be selected by setting `engine='bitboard'`.
+
     """
 
     metadata = {'render.modes': ['terminal'], 'players': ['black', 'white']}
 
     def __init__(
         self,
+        board_size: int = go.DEFAULT_BOARD_SIZE,
         komi: float = 7.5,
         num_stack: int = 8,
-        max_steps: int = go.N * go.N * 2,
+        max_steps: int = None,
+        engine: str = 'minigo',
     ) -> None:
         """
         Args:
+            board_size: board size, default 19.
             komi: default 7.5
             num_stack: stack last N history states,
                 the final state is a image contains N x 2 + 1 binary planes,
                 default 8.
             max_steps: maximum steps per game, default N x N x 2.
+            engine: the implementation of the game rules, one of ['minigo', 'bitboard'], default 'minigo'.
+
+        Raises:
+            ValueError:
+                if `engine` is not one of ['minigo', 'bitboard'].
         """
+        if engine not in ENGINES:
+            raise ValueError(f'Expect `engine` to be one of {list(ENGINES.keys())}, got {engine}')
 
         super().__init__(
             id='Go',
-            board_size=go.N,
+            board_size=board_size,
             num_stack=num_stack,
             black_player_id=go.BLACK,
             white_player_id=go.WHITE,
@@ -66,9 +83,11 @@ class GoEnv(BoardGameEnv):
         )
 
         self.komi = komi
-        self.max_steps = max_steps
+        self.max_steps = max_steps if max_steps is not None else board_size * board_size * 2
+        self.engine = engine
+        self.position_cls = ENGINES[engine]
 
-        self.position = go.Position(komi=self.komi)
+        self.position = self.position_cls(komi=self.komi, board_size=self.board_size)
 
         self.board = self.position.board
         self.legal_actions = self.position.all_legal_moves()
@@ -77,7 +96,7 @@ class GoEnv(BoardGameEnv):
         """Reset game to initial state."""
         super().reset(**kwargs)
 
-        self.position = go.Position(komi=self.komi)
+        self.position = self.position_cls(komi=self.komi, board_size=self.board_size)
 
         self.board = self.position.board
         self.legal_actions = self.position.all_legal_moves()
@@ -103,8 +122,7 @@ class GoEnv(BoardGameEnv):
             self.position = self.position.flip_playerturn(mutate=True)
             self.board = self.position.board
 
-            # Make sure the latest board position is always at index 0
-            self.board_deltas.appendleft(np.copy(self.board))
+            self.update_history_planes()
 
             # After game ended, no move should be allowed.
             self.legal_actions = np.zeros(self.action_dim, dtype=np.int8)
@@ -128,8 +146,7 @@ class GoEnv(BoardGameEnv):
         self.board = self.position.board
         self.legal_actions = self.position.all_legal_moves()
 
-        # Make sure the latest board position is always at index 0
-        self.board_deltas.appendleft(np.copy(self.board))
+        self.update_history_planes()
 
         done = self.is_game_over()
 
@@ -159,6 +176,56 @@ class GoEnv(BoardGameEnv):
 
         return self.observation(), reward, done, {}
 
+    def snapshot(self) -> Mapping[Text, Any]:
+        """Returns a lightweight snapshot of the game state, including the go.Position."""
+        snapshot = super().snapshot()
+        # The go.Position (including board and liberty tracker) is modified in place when making moves.
+        if self.engine == 'minigo':
+            # Only record the fields, so restoring can copy them back into the existing position,
+            # the board is already in the snapshot.
+            lib_tracker = self.position.lib_tracker
+            snapshot['position'] = {
+                'n': self.position.n,
+                'caps': self.position.caps,
+                'ko': self.position.ko,
+                'recent': self.position.recent,
+                'to_play': self.position.to_play,
+                'group_index': np.copy(lib_tracker.group_index),
+                'liberty_cache': np.copy(lib_tracker.liberty_cache),
+                'groups': copy(lib_tracker.groups),
+                'max_group_id': lib_tracker.max_group_id,
+            }
+        else:
+            snapshot['position'] = deepcopy(self.position)
+        return snapshot
+
+    def restore(self, snapshot: Mapping[Text, Any]) -> None:
+        """Restore the game state from a snapshot created by `snapshot()`."""
+        super().restore(snapshot)
+        if self.engine == 'minigo':
+            # This runs once per MCTS simulation, so copy the arrays in place instead of deep copying the go.Position.
+            # The groups are immutable, but the dict is modified in place when making moves.
+            state = snapshot['position']
+            lib_tracker = self.position.lib_tracker
+            np.copyto(lib_tracker.group_index, state['group_index'])
+            np.copyto(lib_tracker.liberty_cache, state['liberty_cache'])
+            lib_tracker.groups = copy(state['groups'])
+            lib_tracker.max_group_id = state['max_group_id']
+            self.position.n = state['n']
+            self.position.caps = state['caps']
+            self.position.ko = state['ko']
+            self.position.recent = state['recent']
+            self.position.to_play = state['to_play']
+        else:
+            # Copy again so the snapshot can be reused.
+            self.position = deepcopy(snapshot['position'])
+        self.board = self.position.board
+
+    def restore_board(self, board: np.ndarray) -> None:
+        """The board is part of the go.Position, which is restored in `restore`."""
+        if self.engine == 'minigo':
+            np.copyto(self.position.board, board)
+
     def render_additional_header(self, outfile, black_stone, white_stone):
         caps = self.get_captures()
         outfile.write(f'{black_stone} captures: {caps[self.black_player]}, {white_stone} captures: {caps[self.white_player]} ')
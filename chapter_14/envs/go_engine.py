@@ -27,15 +27,13 @@ A PlayerMove is a (Color, Move) tuple
 """
 from collections import namedtuple
 import copy
+import functools
 import itertools
 import numpy as np
-import os
 
 from envs.coords import CoordsConvertor
 
-N = int(os.environ.get('BOARD_SIZE', 19))
-
-cc = CoordsConvertor(N)
+DEFAULT_BOARD_SIZE = 19
 
 # Represent a board as a numpy array, with 0 empty, 1 is black, -1 is white.
 # This means that swapping colors is as simple as multiplying array by -1.
@@ -44,19 +42,35 @@ WHITE, EMPTY, BLACK, FILL, KO, UNKNOWN = range(-1, 5)
 # Represents "group not found" in the LibertyTracker object
 MISSING_GROUP_ID = -1
 
-ALL_COORDS = [(i, j) for i in range(N) for j in range(N)]
-EMPTY_BOARD = np.zeros([N, N], dtype=np.int8)
+
+class BoardTables(namedtuple('BoardTables', ['N', 'all_coords', 'empty_board', 'neighbors', 'diagonals', 'cc'])):
+    """
+    N: board size
+    all_coords: a list of all Coordinates on the board
+    empty_board: a NxN numpy array of zeros, must not be modified
+    neighbors: a dict of Coordinate to a list of its neighboring Coordinates
+    diagonals: a dict of Coordinate to a list of its diagonal Coordinates
+    cc: a CoordsConvertor object
+    """
 
 
-def _check_bounds(c):
-    return 0 <= c[0] < N and 0 <= c[1] < N
+@functools.lru_cache(maxsize=None)
+def get_board_tables(board_size):
+    """Returns the precomputed BoardTables for the given board size, which are shared by all positions of that size."""
+    N = board_size
 
+    def _check_bounds(c):
+        return 0 <= c[0] < N and 0 <= c[1] < N
 
-NEIGHBORS = {(x, y): list(filter(_check_bounds, [(x + 1, y), (x - 1, y), (x, y + 1), (x, y - 1)])) for x, y in ALL_COORDS}
-DIAGONALS = {
-    (x, y): list(filter(_check_bounds, [(x + 1, y + 1), (x + 1, y - 1), (x - 1, y + 1), (x - 1, y - 1)]))
-    for x, y in ALL_COORDS
-}
+    all_coords = [(i, j) for i in range(N) for j in range(N)]
+    empty_board = np.zeros([N, N], dtype=np.int8)
+    empty_board.setflags(write=False)
+    neighbors = {(x, y): list(filter(_check_bounds, [(x + 1, y), (x - 1, y), (x, y + 1), (x, y - 1)])) for x, y in all_coords}
+    diagonals = {
+        (x, y): list(filter(_check_bounds, [(x + 1, y + 1), (x + 1, y - 1), (x - 1, y + 1), (x - 1, y - 1)]))
+        for x, y in all_coords
+    }
+    return BoardTables(N, all_coords, empty_board, neighbors, diagonals, CoordsConvertor(N))
 
 
 class IllegalMove(Exception):
@@ -73,6 +87,7 @@ def place_stones(board, color, stones):
 
 
 def find_reached(board, c):
+    neighbors = get_board_tables(board.shape[0]).neighbors
     color = board[c]
     chain = set([c])
     reached = set()
@@ -80,7 +95,7 @@ def find_reached(board, c):
     while frontier:
         current = frontier.pop()
         chain.add(current)
-        for n in NEIGHBORS[current]:
+        for n in neighbors[current]:
             if board[n] == color and n not in chain:
                 frontier.append(n)
             elif board[n] != color:
@@ -92,7 +107,7 @@ def is_koish(board, c):
     'Check if c is surrounded on all sides by 1 color, and return that color'
     if board[c] != EMPTY:
         return None
-    neighbors = {board[n] for n in NEIGHBORS[c]}
+    neighbors = {board[n] for n in get_board_tables(board.shape[0]).neighbors[c]}
     if len(neighbors) == 1 and EMPTY not in neighbors:
         return list(neighbors)[0]
     else:
@@ -108,7 +123,7 @@ def is_eyeish(board, c):
     if color is None:
         return None
     diagonal_faults = 0
-    diagonals = DIAGONALS[c]
+    diagonals = get_board_tables(board.shape[0]).diagonals[c]
     if len(diagonals) < 4:
         diagonal_faults += 1
     for d in diagonals:
@@ -168,7 +183,7 @@ class LibertyTracker:
     def from_board(board):
         board = np.copy(board)
         curr_group_id = 0
-        lib_tracker = LibertyTracker()
+        lib_tracker = LibertyTracker(board_size=board.shape[0])
         for color in (WHITE, BLACK):
             while color in board:
                 curr_group_id += 1
@@ -184,7 +199,7 @@ class LibertyTracker:
 
         lib_tracker.max_group_id = curr_group_id
 
-        liberty_counts = np.zeros([N, N], dtype=np.uint8)
+        liberty_counts = np.zeros(board.shape, dtype=np.uint8)
         for group in lib_tracker.groups.values():
             num_libs = len(group.liberties)
             for s in group.stones:
@@ -193,14 +208,18 @@ class LibertyTracker:
 
         return lib_tracker
 
-    def __init__(self, group_index=None, groups=None, liberty_cache=None, max_group_id=1):
+    def __init__(self, group_index=None, groups=None, liberty_cache=None, max_group_id=1, board_size=DEFAULT_BOARD_SIZE):
         # group_index: a NxN numpy array of group_ids. -1 means no group
         # groups: a dict of group_id to groups
         # liberty_cache: a NxN numpy array of liberty counts
-        self.group_index = group_index if group_index is not None else -np.ones([N, N], dtype=np.int32)
+        # board_size: only used when group_index is not provided
+        if group_index is not None:
+            board_size = group_index.shape[0]
+        self.group_index = group_index if group_index is not None else -np.ones([board_size, board_size], dtype=np.int32)
         self.groups = groups or {}
-        self.liberty_cache = liberty_cache if liberty_cache is not None else np.zeros([N, N], dtype=np.uint8)
+        self.liberty_cache = liberty_cache if liberty_cache is not None else np.zeros([board_size, board_size], dtype=np.uint8)
         self.max_group_id = max_group_id
+        self.neighbors = get_board_tables(board_size).neighbors
 
     def __deepcopy__(self, memodict={}):
         new_group_index = np.copy(self.group_index)
@@ -216,7 +235,7 @@ class LibertyTracker:
         friendly_neighboring_group_ids = set()
         empty_neighbors = set()
 
-        for n in NEIGHBORS[c]:
+        for n in self.neighbors[c]:
             neighbor_group_id = self.group_index[n]
             if neighbor_group_id != MISSING_GROUP_ID:
                 neighbor_group = self.groups[neighbor_group_id]
@@ -286,7 +305,7 @@ class LibertyTracker:
 
     def _handle_captures(self, captured_stones):
         for s in captured_stones:
-            for n in NEIGHBORS[s]:
+            for n in self.neighbors[s]:
                 group_id = self.group_index[n]
                 if group_id != MISSING_GROUP_ID:
                     self._update_liberties(group_id, add={s})
@@ -303,6 +322,7 @@ class Position:
         ko=None,
         recent=tuple(),
         to_play=BLACK,
+        board_size=None,
     ):
         """
         board: a numpy array
@@ -313,9 +333,16 @@ class Position:
         ko: a Move
         recent: a tuple of PlayerMoves, such that recent[-1] is the last move.
         to_play: BLACK or WHITE
+        board_size: an int, only used when board is not provided, default DEFAULT_BOARD_SIZE
         """
         assert type(recent) is tuple
-        self.board = board if board is not None else np.copy(EMPTY_BOARD)
+        if board is not None:
+            board_size = board.shape[0]
+        elif board_size is None:
+            board_size = DEFAULT_BOARD_SIZE
+        self.board_size = board_size
+        self.tables = get_board_tables(board_size)
+        self.board = board if board is not None else np.copy(self.tables.empty_board)
         # With a full history, self.n == len(self.recent) == num moves played
         self.n = n
         self.komi = komi
@@ -352,6 +379,7 @@ class Position:
         if self.ko is not None:
             place_stones(board, KO, [self.ko])
         raw_board_contents = []
+        N = self.board_size
         for i in range(N):
             row = [' ']
             for j in range(N):
@@ -371,7 +399,7 @@ class Position:
 
     def is_move_suicidal(self, move):
         potential_libs = set()
-        for n in NEIGHBORS[move]:
+        for n in self.tables.neighbors[move]:
             neighbor_group_id = self.lib_tracker.group_index[n]
             if neighbor_group_id == MISSING_GROUP_ID:
                 # at least one liberty after playing here, so not a suicide
@@ -401,7 +429,8 @@ class Position:
         return True
 
     def all_legal_moves(self):
-        'Returns a np.array of size go.N**2 + 1, with 1 = legal, 0 = illegal'
+        'Returns a np.array of size N**2 + 1, with 1 = legal, 0 = illegal'
+        N = self.board_size
         # by default, every move is legal
         legal_moves = np.ones([N, N], dtype=np.int8)
         # ...unless there is already a stone there
@@ -459,7 +488,9 @@ class Position:
 
         if not self.is_move_legal(c):
             raise IllegalMove(
-                '{} move at {} is illegal: \n{}'.format('Black' if self.to_play == BLACK else 'White', cc.to_gtp(c), self)
+                '{} move at {} is illegal: \n{}'.format(
+                    'Black' if self.to_play == BLACK else 'White', self.tables.cc.to_gtp(c), self
+                )
             )
 
         potential_ko = is_koish(self.board, c)
@@ -470,7 +501,7 @@ class Position:
 
         opp_color = color * -1
 
-        new_board_delta = np.zeros([N, N], dtype=np.int8)
+        new_board_delta = np.zeros([self.board_size, self.board_size], dtype=np.int8)
         new_board_delta[c] = color
         place_stones(new_board_delta, color, captured_stones)
 
@@ -0,0 +1,406 @@
+# Copyright (c) 2023 Michael Hu.
+# This code is part of the book "The Art of Reinforcement Learning: Fundamentals, Mathematics, and Implementation with Python.".
+# See the accompanying LICENSE file for details.
+
+
+"""
+A faster alternative to the go_engine.py module, which implements the same `Position` interface using bitboards.
+
+The stones of each player are stored as a single Python integer, where bit (row * (N + 1) + col) is set if there's a stone.
+Each row has one extra always-empty column at the end, so the neighbors of a set of points can be computed by
+four shifts and a single mask, without wrapping around to the previous or next row.
+
+Instead of the per-stone Python sets in the LibertyTracker, the ChainTracker is a union-find over the board points,
+where the root of each chain holds the bitboard of the chain. The liberties of a chain are then computed by
+`neighbors(chain) & empty`. Legality, captures, ko, and area scoring are all computed by bit operations.
+
+The numpy `board` is still maintained incrementally, since it's used by the environment to build the observation.
+"""
+import copy
+import functools
+import numpy as np
+
+from envs.go_engine import DEFAULT_BOARD_SIZE, BLACK, WHITE, EMPTY, IllegalMove, PlayerMove, get_board_tables
+import envs.go_engine as go_engine
+
+
+def iter_bits(bits):
+    """Yields each set bit as a separate integer."""
+    while bits:
+        lowest = bits & -bits
+        yield lowest
+        bits ^= lowest
+
+
+def bit_index(bit):
+    return bit.bit_length() - 1
+
+
+class Bitboard:
+    """Precomputed masks and bit operations for a given board size."""
+
+    def __init__(self, board_size):
+        N = board_size
+        # Width of each row in the bitboard, including the padding column.
+        W = N + 1
+        self.N = N
+        self.W = W
+        self.num_points = N * W
+        self.num_bytes = (N * W + 7) // 8
+
+        # All valid points on the board, excluding the padding column.
+        self.board_mask = sum(1 << (i * W + j) for i in range(N) for j in range(N))
+
+        self.point_bits = {(i, j): 1 << (i * W + j) for i in range(N) for j in range(N)}
+        self.neighbor_bits = {c: self.neighbors(bit) for c, bit in self.point_bits.items()}
+
+    def neighbors(self, bits):
+        """Returns the neighbor points of all points in `bits`, which may include the points themselves."""
+        W = self.W
+        return ((bits << 1) | (bits >> 1) | (bits << W) | (bits >> W)) & self.board_mask
+
+    def flood_fill(self, seed, stones):
+        """Returns all points in `stones` which are connected to `seed`."""
+        W = self.W
+        chain = seed
+        while True:
+            grown = (chain | (chain << 1) | (chain >> 1) | (chain << W) | (chain >> W)) & stones
+            if grown == chain:
+                return chain
+            chain = grown
+
+    def to_coord(self, bit):
+        return divmod(bit_index(bit), self.W)
+
+    def to_bits(self, mask):
+        """Converts a NxN boolean numpy array to bitboard."""
+        N, W = self.N, self.W
+        padded = np.zeros([N, W], dtype=np.uint8)
+        padded[:, :N] = mask
+        return int.from_bytes(np.packbits(padded.ravel(), bitorder='little').tobytes(), 'little')
+
+    def to_array(self, bits):
+        """Converts a bitboard to NxN boolean numpy array."""
+        N, W = self.N, self.W
+        unpacked = np.unpackbits(np.frombuffer(bits.to_bytes(self.num_bytes, 'little'), dtype=np.uint8), bitorder='little')
+        return unpacked[: N * W].reshape(N, W)[:, :N].astype(bool)
+
+    def area_score(self, black, white):
+        """Same Tromp-Taylor area scoring as `go_engine.area_score`, but on bitboards.
+
+        Returns the area score for black and white player.
+        """
+        black_score = black.bit_count()
+        white_score = white.bit_count()
+
+        unassigned = self.board_mask & ~(black | white)
+        while unassigned:
+            territory = self.flood_fill(unassigned & -unassigned, unassigned)
+            unassigned &= ~territory
+            borders = self.neighbors(territory)
+            X_border = borders & black
+            O_border = borders & white
+            if X_border and not O_border:
+                black_score += territory.bit_count()
+            elif O_border and not X_border:
+                white_score += territory.bit_count()
+
+        return black_score, white_score
+
+
+@functools.lru_cache(maxsize=None)
+def get_bitboard(board_size):
+    """Returns the Bitboard for the given board size, which is shared by all positions of that size."""
+    return Bitboard(board_size)
+
+
+class ChainTracker:
+    """Union-find over the board points, where the root of each chain holds the bitboard of all stones in the chain.
+
+    This replaces the flood fills to find the chain of a stone, which is slow for large chains.
+    """
+
+    @staticmethod
+    def from_stones(bitboard, black, white):
+        chain_tracker = ChainTracker(bitboard.num_points)
+        for stones in (black, white):
+            while stones:
+                chain = bitboard.flood_fill(stones & -stones, stones)
+                stones &= ~chain
+                root = bit_index(chain & -chain)
+                for stone in iter_bits(chain):
+                    chain_tracker.parent[bit_index(stone)] = root
+                chain_tracker.chains[root] = chain
+        return chain_tracker
+
+    def __init__(self, num_points, parent=None, chains=None):
+        # num_points: number of points in the bitboard, including the padding column
+        # parent: a list of parent point index for each point, the root of a chain (and empty points) points to itself
+        # chains: a list of chain bitboard for each root point, 0 for non-root points
+        self.num_points = num_points
+        self.parent = parent if parent is not None else list(range(num_points))
+        self.chains = chains if chains is not None else [0] * num_points
+
+    def __deepcopy__(self, memodict={}):
+        return ChainTracker(self.num_points, self.parent.copy(), self.chains.copy())
+
+    def find(self, index):
+        parent = self.parent
+        while parent[index] != index:
+            # path halving
+            parent[index] = parent[parent[index]]
+            index = parent[index]
+        return index
+
+    def chain(self, stone):
+        """Returns the chain bitboard which includes the given stone."""
+        return self.chains[self.find(bit_index(stone))]
+
+    def add_stone(self, bit, friendly_neighbors):
+        """Place a stone and merge it with the chains of the friendly neighboring stones, returns the new chain."""
+        index = bit_index(bit)
+        roots = {self.find(bit_index(stone)) for stone in iter_bits(friendly_neighbors)}
+        chain = bit
+        root = index
+        for other in roots:
+            chain |= self.chains[other]
+        if roots:
+            # union by size
+            root = max(roots, key=lambda r: self.chains[r].bit_count())
+            for other in roots:
+                self.parent[other] = root
+                self.chains[other] = 0
+        self.parent[index] = root
+        self.chains[root] = chain
+        return chain
+
+    def remove_chain(self, chain):
+        for stone in iter_bits(chain):
+            index = bit_index(stone)
+            self.parent[index] = index
+            self.chains[index] = 0
+
+
+class Position(go_engine.Position):
+    def __init__(
+        self,
+        board=None,
+        n=0,
+        komi=7.5,
+        caps=(0, 0),
+        ko=None,
+        recent=tuple(),
+        to_play=BLACK,
+        board_size=None,
+        stones=None,
+        chain_tracker=None,
+    ):
+        """
+        board: a numpy array
+        n: an int representing moves played so far
+        komi: a float, representing points given to the second player.
+        caps: a (int, int) tuple of captures for B, W.
+        ko: a Move
+        recent: a tuple of PlayerMoves, such that recent[-1] is the last move.
+        to_play: BLACK or WHITE
+        board_size: an int, only used when board is not provided, default DEFAULT_BOARD_SIZE
+        stones: optional (int, int) tuple of bitboards for B, W, must match the board if provided.
+        chain_tracker: optional ChainTracker object, must match the stones if provided.
+        """
+        assert type(recent) is tuple
+        if board is not None:
+            board_size = board.shape[0]
+        elif board_size is None:
+            board_size = DEFAULT_BOARD_SIZE
+        self.board_size = board_size
+        self.tables = get_board_tables(board_size)
+        self.bitboard = get_bitboard(board_size)
+        self.board = board if board is not None else np.copy(self.tables.empty_board)
+        self.n = n
+        self.komi = komi
+        self.caps = caps
+        self.ko = ko
+        self.recent = recent
+        self.to_play = to_play
+        if stones is None:
+            stones = (self.bitboard.to_bits(self.board == BLACK), self.bitboard.to_bits(self.board == WHITE))
+        self.black, self.white = stones
+        self.chain_tracker = chain_tracker or ChainTracker.from_stones(self.bitboard, self.black, self.white)
+
+    def __deepcopy__(self, memodict={}):
+        # Bitboards are immutable integers, no need to copy them.
+        return Position(
+            np.copy(self.board),
+            self.n,
+            self.komi,
+            self.caps,
+            self.ko,
+            self.recent,
+            self.to_play,
+            self.board_size,
+            (self.black, self.white),
+            copy.deepcopy(self.chain_tracker),
+        )
+
+    def _stones(self, color):
+        """Returns a tuple of (own, opponent) bitboards for the given color."""
+        if color == BLACK:
+            return self.black, self.white
+        return self.white, self.black
+
+    def is_move_suicidal(self, move):
+        bitboard = self.bitboard
+        own, opp = self._stones(self.to_play)
+        empty = bitboard.board_mask & ~(own | opp)
+        bit = bitboard.point_bits[move]
+        nbs = bitboard.neighbor_bits[move]
+        if nbs & empty:
+            # at least one liberty after playing here, so not a suicide
+            return False
+
+        potential_libs = 0
+        for stone in iter_bits(nbs):
+            libs = bitboard.neighbors(self.chain_tracker.chain(stone)) & empty
+            if stone & own:
+                potential_libs |= libs
+            elif libs == bit:
+                # would capture an opponent group if they only had one lib.
+                return False
+        # it's possible to suicide by connecting several friendly groups
+        # each of which had one liberty.
+        return not potential_libs & ~bit
+
+    def is_move_legal(self, move):
+        'Checks that a move is on an empty space, not on ko, and not suicide'
+        if move is None:
+            return True
+        if self.bitboard.point_bits[move] & (self.black | self.white):
+            return False
+        if move == self.ko:
+            return False
+        if self.is_move_suicidal(move):
+            return False
+
+        return True
+
+    def all_legal_moves(self):
+        'Returns a np.array of size N**2 + 1, with 1 = legal, 0 = illegal'
+        bitboard = self.bitboard
+        neighbors = bitboard.neighbors
+        chain = self.chain_tracker.chain
+        own, opp = self._stones(self.to_play)
+        empty = bitboard.board_mask & ~(own | opp)
+        legal = empty
+
+        # Only empty spots without any empty neighbors can possibly be suicidal.
+        for bit in iter_bits(empty & ~neighbors(empty)):
+            for stone in iter_bits(neighbors(bit)):
+                libs = neighbors(chain(stone)) & empty
+                if stone & own:
+                    # connecting to a friendly chain with other liberties
+                    if libs != bit:
+                        break
+                elif libs == bit:
+                    # would capture an opponent chain
+                    break
+            else:
+                legal ^= bit
+
+        # ...and retaking ko is always illegal
+        if self.ko is not None:
+            legal &= ~bitboard.point_bits[self.ko]
+
+        legal_moves = bitboard.to_array(legal).astype(np.int8)
+        # and pass is always legal
+        return np.concatenate([legal_moves.ravel(), [1]])
+
+    def get_liberties(self):
+        bitboard = self.bitboard
+        liberty_counts = np.zeros([self.board_size, self.board_size], dtype=np.uint8)
+        empty = bitboard.board_mask & ~(self.black | self.white)
+        for chain in self.chain_tracker.chains:
+            if chain:
+                liberty_counts[bitboard.to_array(chain)] = (bitboard.neighbors(chain) & empty).bit_count()
+        return liberty_counts
+
+    def play_move(self, c, color=None, mutate=False):
+        # Obeys CGOS Rules of Play. In short:
+        # No suicides
+        # Chinese/area scoring
+        # Positional superko (this is very crudely approximate at the moment.)
+        if color is None:
+            color = self.to_play
+
+        pos = self if mutate else copy.deepcopy(self)
+
+        if c is None:
+            pos = pos.pass_move(mutate=mutate)
+            return pos
+
+        if not self.is_move_legal(c):
+            raise IllegalMove(
+                '{} move at {} is illegal: \n{}'.format(
+                    'Black' if self.to_play == BLACK else 'White', self.tables.cc.to_gtp(c), self
+                )
+            )
+
+        bitboard = self.bitboard
+        bit = bitboard.point_bits[c]
+        nbs = bitboard.neighbor_bits[c]
+        own, opp = pos._stones(color)
+        own |= bit
+        empty = bitboard.board_mask & ~(own | opp)
+
+        # Check if c is surrounded on all sides by the opponent.
+        potential_ko = nbs & opp == nbs
+
+        captured = 0
+        for stone in iter_bits(nbs & opp):
+            if stone & captured:
+                continue
+            chain = pos.chain_tracker.chain(stone)
+            if not bitboard.neighbors(chain) & empty:
+                captured |= chain
+                pos.chain_tracker.remove_chain(chain)
+        opp &= ~captured
+
+        new_chain = pos.chain_tracker.add_stone(bit, nbs & own)
+
+        # suicide is illegal
+        if not bitboard.neighbors(new_chain) & (empty | captured):
+            raise IllegalMove('Move at {} would commit suicide!\n'.format(c))
+
+        pos.board[c] = color
+        num_captured = captured.bit_count()
+        if num_captured > 0:
+            pos.board[bitboard.to_array(captured)] = EMPTY
+
+        if color == BLACK:
+            pos.black, pos.white = own, opp
+        else:
+            pos.white, pos.black = own, opp
+
+        if num_captured == 1 and potential_ko:
+            new_ko = bitboard.to_coord(captured)
+        else:
+            new_ko = None
+
+        if pos.to_play == BLACK:
+            new_caps = (pos.caps[0] + num_captured, pos.caps[1])
+        else:
+            new_caps = (pos.caps[0], pos.caps[1] + num_captured)
+
+        pos.n += 1
+        pos.caps = new_caps
+        pos.ko = new_ko
+        pos.recent += (PlayerMove(color, c),)
+
+        pos.to_play *= -1
+        return pos
+
+    def score(self):
+        """Return estimated score from black's perspective. If white is winning, score is negative."""
+        black_score, white_score = self.bitboard.area_score(self.black, self.white)
+
+        white_score += self.komi
+        return black_score - white_score
@@ -4,7 +4,7 @@
 
 
 """Gomoku env class."""
-from typing import Tuple
+from typing import Any, Mapping, Text, Tuple
 import numpy as np
 from copy import copy
 
@@ -37,6 +37,51 @@ class GomokuEnv(BoardGameEnv):
 
         self.num_to_win = num_to_win
 
+        # To avoid scanning the board after every move, we track the length of the same color stones
+        # on the four lines (horizontal, vertical, diagonal, anti-diagonal) through each point.
+        # The board is flattened with one point of padding on each side, so we never need to check the bounds,
+        # and the line directions become offsets on the flattened board.
+        padded_size = self.board_size + 2
+        self.line_offsets = (1, padded_size, padded_size + 1, padded_size - 1)
+        self.reset_lines()
+
+    def reset(self, **kwargs) -> np.ndarray:
+        """Reset game to initial state."""
+        obs = super().reset(**kwargs)
+        self.reset_lines()
+        return obs
+
+    def reset_lines(self) -> None:
+        padded_size = self.board_size + 2
+        # Stone color for each point on the padded board, the padding is always empty
+        self.stones = [0] * (padded_size * padded_size)
+        # For each line direction, the length of the same color stones through the point,
+        # note the length is only up to date at both ends of the stones, which are the only points
+        # we need to read when placing a new stone next to them.
+        self.line_lengths = [[0] * (padded_size * padded_size) for _ in self.line_offsets]
+        self.num_empty_points = self.board_size * self.board_size
+        # The longest line of the last move
+        self.last_line_length = 0
+
+    def update_lines(self, row_index: int, col_index: int, color: int) -> None:
+        """Merge the new stone with the same color stones on both sides for each line direction,
+        this only reads and writes a few points, regardless of the board size."""
+        index = (row_index + 1) * (self.board_size + 2) + col_index + 1
+        stones = self.stones
+        stones[index] = color
+
+        longest = 0
+        for offset, lengths in zip(self.line_offsets, self.line_lengths):
+            before = lengths[index - offset] if stones[index - offset] == color else 0
+            after = lengths[index + offset] if stones[index + offset] == color else 0
+            length = before + after + 1
+            # Update both ends of the merged stones
+            lengths[index] = lengths[index - before * offset] = lengths[index + after * offset] = length
+            longest = max(longest, length)
+
+        self.last_line_length = longest
+        self.num_empty_points -= 1
+
     def step(self, action: int) -> Tuple[np.ndarray, float, bool, dict]:
         """Plays one move."""
         if self.is_game_over():
@@ -60,9 +105,9 @@ class GomokuEnv(BoardGameEnv):
         # Update board state.
         row_index, col_index = self.action_to_coords(action)
         self.board[row_index, col_index] = self.to_play
+        self.update_lines(row_index, col_index, self.to_play)
 
-        # Make sure the latest board position is always at index 0
-        self.board_deltas.appendleft(np.copy(self.board))
+        self.update_history_planes()
 
         # The reward is always computed from last player's perspective
         # which follows standard MDP practice, where reward function r_t = R(s_t, a_t)
@@ -78,50 +123,11 @@ class GomokuEnv(BoardGameEnv):
         return self.observation(), reward, done, {}
 
     def is_current_player_won(self) -> bool:
-        """This is a simple and quick way to check N connected sequence of stones,
-        by starting from the last postion, without doing a full scan of the board."""
-        # Less than num_to_win steps for each player.
-        if self.steps < (self.num_to_win - 1) * 2:
-            return False
-
-        x_last, y_last = self.action_to_coords(self.last_move)
-        color = self.to_play
-
-        board = np.copy(self.board)
+        """Returns whether the last move made N connected sequence of stones, which is tracked when making the move."""
+        return self.steps > 0 and self.last_line_length >= self.num_to_win
 
-        # Check vertical
-        vertical_dirs = (
-            (0, -1),  # left
-            (0, 1),  # right
-        )
-        if count_sequence_length_on_dir(board, x_last, y_last, color, vertical_dirs) >= self.num_to_win:
-            return True
-
-        # Check horizontal
-        horizontal_dirs = (
-            (-1, 0),  # up
-            (1, 0),  # down
-        )
-        if count_sequence_length_on_dir(board, x_last, y_last, color, horizontal_dirs) >= self.num_to_win:
-            return True
-
-        # Check diagonal top-left to bottom-right
-        diagonal_dirs_1 = (
-            (-1, -1),  # to top-left
-            (1, 1),  # to down-right
-        )
-        if count_sequence_length_on_dir(board, x_last, y_last, color, diagonal_dirs_1) >= self.num_to_win:
-            return True
-
-        # Check diagonal top-right to bottom-left
-        diagonal_dirs_2 = (
-            (-1, 1),  # to top-right
-            (1, -1),  # to down-left
-        )
-        if count_sequence_length_on_dir(board, x_last, y_last, color, diagonal_dirs_2) >= self.num_to_win:
-            return True
-
-        return False
+    def is_board_full(self) -> bool:
+        return self.num_empty_points == 0
 
     def is_game_over(self) -> bool:
         if self.winner is not None:
@@ -130,6 +136,24 @@ class GomokuEnv(BoardGameEnv):
             return True
         return False
 
+    def snapshot(self) -> Mapping[Text, Any]:
+        """Returns a lightweight snapshot of the game state, including the tracked lines."""
+        snapshot = super().snapshot()
+        snapshot['stones'] = list(self.stones)
+        snapshot['line_lengths'] = [list(lengths) for lengths in self.line_lengths]
+        snapshot['num_empty_points'] = self.num_empty_points
+        snapshot['last_line_length'] = self.last_line_length
+        return snapshot
+
+    def restore(self, snapshot: Mapping[Text, Any]) -> None:
+        """Restore the game state from a snapshot created by `snapshot()`."""
+        super().restore(snapshot)
+        # Copy again so the snapshot can be reused.
+        self.stones = list(snapshot['stones'])
+        self.line_lengths = [list(lengths) for lengths in snapshot['line_lengths']]
+        self.num_empty_points = snapshot['num_empty_points']
+        self.last_line_length = snapshot['last_line_length']
+
     def get_result_string(self) -> str:
         if not self.is_game_over():
             return ''
@@ -52,8 +52,6 @@ flags.DEFINE_integer('seed', 1, 'Seed the runtime.')
 # Initialize flags
 FLAGS(sys.argv)
 
-os.environ['BOARD_SIZE'] = str(FLAGS.board_size)
-
 from envs.go import GoEnv
 from envs.gui import BoardGameGui
 from network import AlphaZeroNet
@@ -71,7 +69,7 @@ def main():
     elif torch.backends.mps.is_available():
         runtime_device = 'mps'
 
-    eval_env = GoEnv(komi=FLAGS.komi, num_stack=FLAGS.num_stack)
+    eval_env = GoEnv(board_size=FLAGS.board_size, komi=FLAGS.komi, num_stack=FLAGS.num_stack)
 
     input_shape = eval_env.observation_space.shape
     num_actions = eval_env.action_space.n
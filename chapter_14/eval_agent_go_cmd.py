@@ -53,8 +53,6 @@ flags.DEFINE_integer('seed', 1, 'Seed the runtime.')
 # Initialize flags
 FLAGS(sys.argv)
 
-os.environ['BOARD_SIZE'] = str(FLAGS.board_size)
-
 from envs.go import GoEnv
 from network import AlphaZeroNet
 from pipeline import create_mcts_player, set_seed, disable_auto_grad
@@ -71,7 +69,7 @@ def main():
     elif torch.backends.mps.is_available():
         runtime_device = 'mps'
 
-    eval_env = GoEnv(komi=FLAGS.komi, num_stack=FLAGS.num_stack)
+    eval_env = GoEnv(board_size=FLAGS.board_size, komi=FLAGS.komi, num_stack=FLAGS.num_stack)
 
     input_shape = eval_env.observation_space.shape
     num_actions = eval_env.action_space.n
@@ -7,11 +7,10 @@
 from absl import flags
 import os
 import sys
-import re
 from collections import OrderedDict
-import logging
 import multiprocessing as mp
 
+import numpy as np
 import torch
 
 FLAGS = flags.FLAGS
@@ -19,20 +18,27 @@ flags.DEFINE_integer('board_size', 9, 'Board size for Go.')
 flags.DEFINE_float('komi', 7.5, 'Komi rule for Go.')
 flags.DEFINE_integer('num_stack', 8, 'Stack N previous states, the state is an image of N x 2 + 1 binary planes.')
 
-# 12b64 version is black
-flags.DEFINE_integer('black_num_res_blocks', 11, 'Number of residual blocks in the neural network.')
-flags.DEFINE_integer('black_num_filters', 64, 'Number of filters for the conv2d layers in the neural network.')
-flags.DEFINE_integer('black_num_fc_units', 64, 'Number of hidden units in the linear layer of the neural network.')
-flags.DEFINE_string(
-    'black_ckpt', './checkpoints/go/9x9_12b64/training_steps_190000.ckpt', 'Load the checkpoint file for black player.'
+# Each checkpoint can have a different network architecture, a single value is used for all the checkpoints
+flags.DEFINE_list(
+    'ckpt_files',
+    [
+        './checkpoints/go/9x9_12b64/training_steps_190000.ckpt',
+        './checkpoints/go/9x9_11b128/training_steps_139000.ckpt',
+    ],
+    'Comma separated list of checkpoint files for the tournament players.',
 )
-
-# 11b128 version
-flags.DEFINE_integer('white_num_res_blocks', 10, 'Number of residual blocks in the neural network.')
-flags.DEFINE_integer('white_num_filters', 128, 'Number of filters for the conv2d layers in the neural network.')
-flags.DEFINE_integer('white_num_fc_units', 128, 'Number of hidden units in the linear layer of the neural network.')
-flags.DEFINE_string(
-    'white_ckpt', './checkpoints/go/9x9_11b128/training_steps_139000.ckpt', 'Load the checkpoint file for white player.'
+flags.DEFINE_list('num_res_blocks', ['11', '10'], 'Number of residual blocks in the neural network, for each checkpoint.')
+flags.DEFINE_list(
+    'num_filters', ['64', '128'], 'Number of filters for the conv2d layers in the neural network, for each checkpoint.'
+)
+flags.DEFINE_list(
+    'num_fc_units', ['64', '128'], 'Number of hidden units in the linear layer of the neural network, for each checkpoint.'
+)
+flags.DEFINE_enum(
+    'schedule',
+    'round_robin',
+    ['round_robin', 'gauntlet'],
+    'Play every checkpoint against every other checkpoint, or only the first checkpoint against the others.',
 )
 
 flags.DEFINE_integer('num_simulations', 200, 'Number of iterations per MCTS search.')
@@ -42,92 +48,62 @@ flags.DEFINE_integer(
     'Number of leaves to collect before using the neural network to evaluate the positions during MCTS search, 1 means no parallel search.',
 )
 
+flags.DEFINE_enum(
+    'eval_symmetry',
+    'none',
+    ['none', 'random', 'average'],
+    'Evaluate each position on a random board symmetry, or average over all 8 symmetries (8 times the compute).',
+)
+
 flags.DEFINE_float('c_puct_base', 19652, 'Exploration constants balancing priors vs. search values.')
 flags.DEFINE_float('c_puct_init', 1.25, 'Exploration constants balancing priors vs. search values.')
 
-flags.DEFINE_integer('num_games', 20, '')
+flags.DEFINE_integer('num_games', 20, 'Number of games for each pair of checkpoints, with alternating colors.')
 
-flags.DEFINE_integer('num_processes', 16, 'Run the games using multiple child processes')
+flags.DEFINE_integer('num_processes', 16, 'Run the games using multiple long-lived child processes.')
+flags.DEFINE_integer(
+    'max_cached_networks', 8, 'Maximum number of networks kept in each child process, the networks are loaded once.'
+)
 
 flags.DEFINE_string('save_match_dir', './9x9_matches', 'Path to save statistics and game record in sgf format.')
 
 flags.DEFINE_integer('seed', 1, 'Seed the runtime.')
 
 flags.register_validator('num_games', lambda x: x >= 1)
+flags.register_validator('num_processes', lambda x: x >= 1)
+flags.register_validator('max_cached_networks', lambda x: x >= 2)
+flags.register_validator('ckpt_files', lambda x: len(x) >= 2)
 
 # Initialize flags
 FLAGS(sys.argv)
 
-os.environ['BOARD_SIZE'] = str(FLAGS.board_size)
-
 from envs.go import GoEnv
-from network import AlphaZeroNet
-from pipeline import create_mcts_player, set_seed, disable_auto_grad, maybe_create_dir
+from pipeline import set_seed, maybe_create_dir
+from rating import fit_bradley_terry
+from tournament import PlayerSpec, create_schedule, get_score_matrix, play_tournament
 from util import create_logger, get_time_stamp
 from csv_writer import CsvWriter
 
 
-def load_checkpoint_for_net(network, ckpt_file, device):
-    if ckpt_file and os.path.isfile(ckpt_file):
-        loaded_state = torch.load(ckpt_file, map_location=torch.device(device))
-        network.load_state_dict(loaded_state['network'])
-    else:
-        logging.warning(f'Invalid checkpoint file "{ckpt_file}"')
+def get_player_specs():
+    num_players = len(FLAGS.ckpt_files)
 
+    def per_player(values, name):
+        if len(values) == 1:
+            values = values * num_players
+        if len(values) != num_players:
+            raise ValueError(f'Expect {name} to have 1 or {num_players} values, got {len(values)}')
+        return [int(v) for v in values]
 
-def mcts_player_builder(network, ckpt_file, device):
-    network = network.to(device)
-    disable_auto_grad(network)
-    load_checkpoint_for_net(network, ckpt_file, device)
-    network.eval()
-
-    return create_mcts_player(
-        network=network,
-        device=device,
-        num_simulations=FLAGS.num_simulations,
-        num_parallel=FLAGS.num_parallel,
-        root_noise=False,
-        deterministic=False,
-    )
-
-
-def play_one_match(id, sgf_dir, env, black_network, white_network, black_ckpt, white_ckpt, device, c_puct_base, c_puct_init):
-    black_player = mcts_player_builder(black_network, black_ckpt, device)
-    white_player = mcts_player_builder(white_network, white_ckpt, device)
-
-    _ = env.reset()
-    while True:
-        if env.to_play == env.black_player:
-            active_player = black_player
-        else:
-            active_player = white_player
-        move, *_ = active_player(env, None, c_puct_base, c_puct_init)
-        _, _, done, _ = env.step(move)
-        if done:
-            break
-
-    try:
-        if os.path.exists(sgf_dir) and os.path.isdir(sgf_dir):
-            sgf_content = env.to_sgf()
-            sgf_file = os.path.join(sgf_dir, f'game_{id}.sgf')
-            with open(sgf_file, 'w') as f:
-                f.write(sgf_content)
-                f.close()
-    except Exception:
-        pass
-
-    return {
-        'datetime': get_time_stamp(),
-        'black': FLAGS.black_ckpt,
-        'white': FLAGS.white_ckpt,
-        'game': id,
-        'game_result': env.get_result_string(),
-        'game_length': env.steps,
-    }
-
-
-def play_match_wrapper(args):
-    return play_one_match(*args)
+    return [
+        PlayerSpec(ckpt_file, ckpt_file, *arch)
+        for ckpt_file, *arch in zip(
+            FLAGS.ckpt_files,
+            per_player(FLAGS.num_res_blocks, 'num_res_blocks'),
+            per_player(FLAGS.num_filters, 'num_filters'),
+            per_player(FLAGS.num_fc_units, 'num_fc_units'),
+        )
+    ]
 
 
 def main():
@@ -143,57 +119,68 @@ def main():
     elif torch.backends.mps.is_available():
         runtime_device = 'mps'
 
-    def env_builder():
-        return GoEnv(komi=FLAGS.komi, num_stack=FLAGS.num_stack)
-
-    eval_env = env_builder()
-    input_shape = eval_env.observation_space.shape
-    num_actions = eval_env.action_space.n
-
-    black_network = AlphaZeroNet(
-        input_shape, num_actions, FLAGS.black_num_res_blocks, FLAGS.black_num_filters, FLAGS.black_num_fc_units
-    )
-    white_network = AlphaZeroNet(
-        input_shape, num_actions, FLAGS.white_num_res_blocks, FLAGS.white_num_filters, FLAGS.white_num_fc_units
-    )
-
-    black_won = 0
-    white_won = 0
-
-    logger.info(f'Black: "{FLAGS.black_ckpt}"')
-    logger.info(f'White: "{FLAGS.white_ckpt}"')
-
-    process_args = [
-        (
-            i,
-            FLAGS.save_match_dir,
-            env_builder(),
-            black_network,
-            white_network,
-            FLAGS.black_ckpt,
-            FLAGS.white_ckpt,
-            runtime_device,
-            FLAGS.c_puct_base,
-            FLAGS.c_puct_init,
-        )
-        for i in range(FLAGS.num_games)
-    ]
+    players = get_player_specs()
+    for i, player in enumerate(players):
+        logger.info(f'Player {i}: "{player.ckpt_file}"')
 
-    logger.info(f'Starting to play {FLAGS.num_games} games, this will take some time...')
-    with mp.Pool(processes=FLAGS.num_processes) as pool:
-        result = pool.map_async(play_match_wrapper, process_args)
-        stats = result.get()
-        stats = sorted(stats, key=lambda x: x['game'])
+    schedule = create_schedule(len(players), FLAGS.num_games, FLAGS.schedule)
+    logger.info(f'Starting to play {len(schedule)} games, this will take some time...')
 
-    for item in stats:
-        writer.write(OrderedDict((n, v) for n, v in item.items()))
-        if re.match(r'B\+', item['game_result'], re.IGNORECASE):
-            black_won += 1
-        elif re.match(r'W\+', item['game_result'], re.IGNORECASE):
-            white_won += 1
+    game_results = []
+    for result in play_tournament(
+        players=players,
+        schedule=schedule,
+        env=GoEnv(board_size=FLAGS.board_size, komi=FLAGS.komi, num_stack=FLAGS.num_stack),
+        device=runtime_device,
+        num_workers=FLAGS.num_processes,
+        num_simulations=FLAGS.num_simulations,
+        num_parallel=FLAGS.num_parallel,
+        c_puct_base=FLAGS.c_puct_base,
+        c_puct_init=FLAGS.c_puct_init,
+        seed=FLAGS.seed,
+        max_cached_networks=FLAGS.max_cached_networks,
+        eval_symmetry=FLAGS.eval_symmetry,
+    ):
+        game_results.append(result)
+        sgf_content = result.pop('sgf')
+        with open(os.path.join(FLAGS.save_match_dir, f'game_{result["game"]}.sgf'), 'w') as f:
+            f.write(sgf_content)
+            f.close()
+
+        # Write the results as soon as each game finishes
+        writer.write(
+            OrderedDict(
+                [
+                    ('datetime', get_time_stamp()),
+                    ('black', players[result['black']].name),
+                    ('white', players[result['white']].name),
+                    ('game', result['game']),
+                    ('game_result', result['game_result']),
+                    ('game_length', result['game_length']),
+                ]
+            )
+        )
+        logger.info(f'Finished {len(game_results)}/{len(schedule)} games')
 
     writer.close()
-    logger.info(f'Total games {FLAGS.num_games}, black won {black_won}, white won {white_won}')
+
+    # Fit the ratings on all the games at once, relative to the first checkpoint
+    scores = get_score_matrix(len(players), game_results)
+    ratings = fit_bradley_terry(scores, anchor=0)
+    rating_writer = CsvWriter(os.path.join(FLAGS.save_match_dir, 'ratings.csv'), 1)
+    for i in np.argsort(-ratings):
+        num_games = sum(1 for r in game_results if i in (r['black'], r['white']))
+        stats = OrderedDict(
+            [
+                ('player', players[i].name),
+                ('elo_rating', round(ratings[i], 1)),
+                ('games', num_games),
+                ('score', scores[i].sum()),
+            ]
+        )
+        rating_writer.write(stats)
+        logger.info(f'Elo {stats["elo_rating"]:8.1f}, score {stats["score"]}/{num_games}: "{players[i].name}"')
+    rating_writer.close()
 
 
 if __name__ == '__main__':
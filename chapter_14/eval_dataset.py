@@ -3,20 +3,32 @@
 # See the accompanying LICENSE file for details.
 
 
-"""Implements the functions to build a evaluation dataset by loading Go game (in sgf format)"""
+"""Implements the functions to build a evaluation dataset by loading Go game (in sgf format)
+
+The games are replayed by a pool of processes, and the positions are stored as bit-packed planes plus the
+action index of the human move, instead of float32 planes and one-hot policies, which takes much less memory.
+The dataset is cached on disk, keyed by the sgf files and the settings, so the evaluator only replays the games once.
+"""
+from typing import Dict, Iterable, Iterator, NamedTuple, Optional, Set, Tuple
+import functools
+import hashlib
+import multiprocessing as mp
 import os
 import re
 import numpy as np
 import torch
-from torch.utils.data import TensorDataset
 
 from envs.go import GoEnv
+from replay import pack_states, unpack_states
 import sgf_wrapper
 from util import create_logger
 
+# Increase the version whenever the format of the cache changes
+CACHE_VERSION = 1
+
 # keep a history of player names so we can avoid adding duplicates
 GAME_COUNTS = {}
-MATCHES = []
+MATCHES = set()
 MISMATCH_GAMES = {
     'winner_mismatch': 0,
     'score_mismatch': 0,
@@ -75,9 +87,26 @@ def _extract_ratings(black_player, white_player, black_rank, white_rank):
     return ratings
 
 
+class ParsedGame(NamedTuple):
+    """A replayed game, where the states are bit-packed, see `parse_sgf`."""
+
+    match_str: str
+    player_ids: Tuple[str, str]
+    states: np.ndarray
+    moves: np.ndarray
+    values: np.ndarray
+    mismatch: Tuple[str, ...]
+    message: str
+
+
 # A elo of 2100 is roughly the level of amateur 1 dan
-def replay_sgf(sgf_file, num_stack, logger, skip_n=0, min_elo=2100, max_games_per_player=200):  # noqa: C901
-    """Replay a game in sgf format and return the transitions tuple (states, target_pi, target_v) for every move in the game."""
+def parse_sgf(sgf_file, board_size, num_stack, skip_n=0, min_elo=2100) -> Optional[ParsedGame]:  # noqa: C901
+    """Replay a game in sgf format, without checking for duplicates, so it can run in a separate process.
+
+    Returns None if the game does not meet the requirements (board size, result, player ratings),
+    otherwise returns a `ParsedGame`, where the states are None if the game could not be replayed,
+    note the caller still needs to check for duplicates even if the states are None, see `accept_game`.
+    """
     sgf_content = None
 
     try:
@@ -90,17 +119,14 @@ def replay_sgf(sgf_file, num_stack, logger, skip_n=0, min_elo=2100, max_games_pe
 
     props = root_node.properties
 
-    board_size = sgf_wrapper.sgf_prop(props.get('SZ', ''))
-    if board_size is None or board_size == '' or int(board_size) != int(os.environ['BOARD_SIZE']):
-        logger.debug(f'Game "{sgf_file}" board size mismatch')
+    sgf_board_size = sgf_wrapper.sgf_prop(props.get('SZ', ''))
+    if sgf_board_size is None or sgf_board_size == '' or int(sgf_board_size) != board_size:
         return None
 
     result_str = sgf_wrapper.sgf_prop(props.get('RE', ''))
     if result_str is None or result_str == '' or len(result_str) < 3:
-        logger.debug(f'Game "{sgf_file}" has no result property')
         return None
     elif re.search(r'\+T', result_str):  # Skip won by timeout
-        logger.debug(f'Game "{sgf_file}" with result {result_str} does not have a natural winner')
         return None
 
     black_player = sgf_wrapper.sgf_prop(props.get('PB', ''))
@@ -112,10 +138,8 @@ def replay_sgf(sgf_file, num_stack, logger, skip_n=0, min_elo=2100, max_games_pe
 
     elo_ratings = _extract_ratings(black_player, white_player, black_rank, white_rank)
     if len(elo_ratings) > 0 and any(v < min_elo for v in elo_ratings):
-        logger.info(f'Game "{sgf_file}" with player ratings {elo_ratings} is too weak')
         return None
 
-    # Avoid potential duplicates
     black_id = _get_player_str(black_player)
     white_id = _get_player_str(white_player)
 
@@ -126,26 +150,15 @@ def replay_sgf(sgf_file, num_stack, logger, skip_n=0, min_elo=2100, max_games_pe
     num_moves = len(move_sequences)
 
     match_str = f'{black_id}-{white_id}-{num_moves}-{result_str}'
-    if match_str in MATCHES:
-        logger.info(f'Game "{sgf_file}" might be duplicate')
-        return None
-    MATCHES.append(match_str)
 
-    # Avoid too much games from the same player
-    for id in [black_id, white_id]:
-        if id in GAME_COUNTS:
-            if GAME_COUNTS[id] > max_games_per_player:
-                logger.info(f'Too many games from player {id}')
-                return None
-            GAME_COUNTS[id] += 1
-        else:
-            GAME_COUNTS[id] = 1
+    def invalid_game(message: str) -> ParsedGame:
+        return ParsedGame(match_str, (black_id, white_id), None, None, None, (), message)
 
     komi = 0
     if props.get('KM') is not None:
         komi = float(sgf_wrapper.sgf_prop(props.get('KM')))
 
-    env = GoEnv(komi=komi, num_stack=num_stack)
+    env = GoEnv(board_size=board_size, komi=komi, num_stack=num_stack)
     obs = env.reset()
 
     winner = None
@@ -157,7 +170,9 @@ def replay_sgf(sgf_file, num_stack, logger, skip_n=0, min_elo=2100, max_games_pe
     node = root_node
     assert node.first
 
-    history = []
+    states = []
+    moves = []
+    values = []
 
     # Replay the game, check for end move, also exclude 'TW' and 'TB', which are territory markup
     while node.next is not None and 'TW' not in node.next.properties and 'TB' not in node.next.properties:
@@ -173,16 +188,16 @@ def replay_sgf(sgf_file, num_stack, logger, skip_n=0, min_elo=2100, max_games_pe
             next_move = env.cc.from_sgf(props['B'][0])
 
         if next_player is None:
-            return
+            return invalid_game(f'Game "{sgf_file}" has no move at step {env.steps}')
 
         next_move = env.cc.to_flat(next_move)
 
         if not env.is_legal_move(next_move):
-            return None
+            return invalid_game(f'Game "{sgf_file}" has illegal move at step {env.steps}')
 
         if next_player is not None and env.to_play != next_player:
             # Game might have handicap moves
-            return None
+            return invalid_game(f'Game "{sgf_file}" might have handicap moves')
 
         value = 0.0
         if winner is not None and winner in [env.black_player, env.white_player]:
@@ -192,27 +207,27 @@ def replay_sgf(sgf_file, num_stack, logger, skip_n=0, min_elo=2100, max_games_pe
                 value = -1.0
 
         if env.steps > skip_n:
-            history.append((obs, _one_hot(next_move, env.action_dim), value))
+            states.append(obs)
+            moves.append(next_move)
+            values.append(value)
 
         try:
             obs, _, _, _ = env.step(next_move)
             node = node.next
         except Exception:
-            logger.debug(f"Skipping game '{sgf_file}', as move {node.next.properties} at step {env.steps} is illegal")
-            return None
+            return invalid_game(f"Skipping game '{sgf_file}', as move {node.next.properties} at step {env.steps} is illegal")
 
     if env.steps != num_moves:
-        return None
+        return invalid_game(f'Game "{sgf_file}" has {num_moves} moves, but only replayed {env.steps} moves')
 
     # Additional check to see how many games have mismatching results
+    mismatch = ()
     env_result_str = env.get_result_string()
     env_result_str = env_result_str.upper()
     result_str = result_str.upper()
     if not re.search(r'\+T', result_str, re.IGNORECASE) and not re.search(r'\+R', result_str, re.IGNORECASE):
-        is_mismatch = False
         if env_result_str[:2] != result_str[:2]:
-            is_mismatch = True
-            MISMATCH_GAMES['winner_mismatch'] += 1
+            mismatch = ('winner_mismatch',)
         else:
             sgf_score = re.findall(r'[-+]?\d*\.\d+|\d+', result_str)
             env_score = re.findall(r'[-+]?\d*\.\d+|\d+', env_result_str)
@@ -221,56 +236,211 @@ def replay_sgf(sgf_file, num_stack, logger, skip_n=0, min_elo=2100, max_games_pe
             if env_score:
                 env_score = float(env_score[0])
             if sgf_score != env_score:
-                is_mismatch = True
-                MISMATCH_GAMES['score_mismatch'] += 1
                 delta = abs(sgf_score - env_score)
                 if delta <= 1:
-                    MISMATCH_GAMES['score_mismatch_le_1'] += 1
+                    mismatch = ('score_mismatch', 'score_mismatch_le_1')
                 elif 1 < delta <= 2:
-                    MISMATCH_GAMES['score_mismatch_gt_1_le_2'] += 1
+                    mismatch = ('score_mismatch', 'score_mismatch_gt_1_le_2')
                 elif 2 < delta <= 4:
-                    MISMATCH_GAMES['score_mismatch_gt_2_le_4'] += 1
+                    mismatch = ('score_mismatch', 'score_mismatch_gt_2_le_4')
                 else:
-                    MISMATCH_GAMES['score_mismatch_gt_4'] += 1
+                    mismatch = ('score_mismatch', 'score_mismatch_gt_4')
+
+    message = ''
+    if mismatch:
+        message = f'Game "{sgf_file}" has mismatching result, env result: {env_result_str}, SGF result: {result_str}'
+
+    if states:
+        packed_states = pack_states(np.stack(states, axis=0))
+    else:
+        packed_states = np.zeros((0, (int(np.prod(env.observation_space.shape)) + 7) // 8), dtype=np.uint8)
+
+    return ParsedGame(
+        match_str=match_str,
+        player_ids=(black_id, white_id),
+        states=packed_states,
+        moves=np.array(moves, dtype=np.int16),
+        values=np.array(values, dtype=np.int8),
+        mismatch=mismatch,
+        message=message,
+    )
+
+
+def accept_game(
+    game: Optional[ParsedGame],
+    matches: Set[str],
+    game_counts: Dict[str, int],
+    mismatch_games: Dict[str, int],
+    logger,
+    max_games_per_player=200,
+) -> bool:
+    """Check for duplicates and the number of games from the same player, returns True if the game can be used.
+
+    The games need to be checked in the same order every time, as the results depend on the games checked before.
+    """
+    if game is None:
+        return False
 
-        if is_mismatch:
-            logger.debug(f'Game "{sgf_file}" has mismatching result, env result: {env_result_str}, SGF result: {result_str}')
+    # Avoid potential duplicates
+    if game.match_str in matches:
+        logger.info(f'Game "{game.match_str}" might be duplicate')
+        return False
+    matches.add(game.match_str)
+
+    # Avoid too much games from the same player
+    for id in game.player_ids:
+        if id in game_counts:
+            if game_counts[id] > max_games_per_player:
+                logger.info(f'Too many games from player {id}')
+                return False
+            game_counts[id] += 1
+        else:
+            game_counts[id] = 1
+
+    for key in game.mismatch:
+        mismatch_games[key] += 1
+    if game.message:
+        logger.debug(game.message)
+
+    return game.states is not None
 
-    return history
 
+def replay_sgf(sgf_file, board_size, num_stack, logger, skip_n=0, min_elo=2100, max_games_per_player=200):
+    """Replay a game in sgf format and return the transitions tuple (states, target_pi, target_v) for every move in the game."""
+    game = parse_sgf(sgf_file, board_size, num_stack, skip_n, min_elo)
+    if not accept_game(game, MATCHES, GAME_COUNTS, MISMATCH_GAMES, logger, max_games_per_player):
+        return None
 
-def build_eval_dataset(games_dir, num_stack, logger=None) -> TensorDataset:
+    action_dim = board_size**2 + 1
+    states = unpack_states(game.states, (num_stack * 2 + 1, board_size, board_size))
+    return [(s, _one_hot(m, action_dim), float(v)) for s, m, v in zip(states, game.moves, game.values)]
+
+
+class PackedEvalDataset:
+    """Positions from the evaluation games, where the states are stored as bit-packed planes,
+    and the human moves as action indices, the batches are unpacked on the fly."""
+
+    def __init__(self, states: np.ndarray, moves: np.ndarray, values: np.ndarray, state_shape: Tuple[int, int, int]) -> None:
+        """
+        Args:
+            states: bit-packed states [N, ceil(C*H*W/8)], see `replay.pack_states`.
+            moves: the action index of the human move for each state [N,].
+            values: the game result from the perspective of the player to move for each state [N,].
+            state_shape: the shape of the unpacked state (C, H, W).
+        """
+        self.states = states
+        self.moves = moves
+        self.values = values
+        self.state_shape = tuple(state_shape)
+
+    def __len__(self) -> int:
+        return len(self.moves)
+
+    def batches(self, batch_size: int) -> Iterator[Tuple[torch.Tensor, torch.Tensor, torch.Tensor]]:
+        """Yields (states, moves, values) tensors, with float32 states [B, C, H, W], int64 moves, and float32 values."""
+        for start in range(0, len(self), batch_size):
+            end = start + batch_size
+            states = unpack_states(np.asarray(self.states[start:end]), self.state_shape)
+            yield (
+                torch.from_numpy(states).to(dtype=torch.float32),
+                torch.from_numpy(np.asarray(self.moves[start:end], dtype=np.int64)),
+                torch.from_numpy(np.asarray(self.values[start:end], dtype=np.float32)),
+            )
+
+
+def _get_cache_key(sgf_files, games_dir, board_size, num_stack, skip_n, min_elo, max_games_per_player) -> str:
+    """The cache key changes whenever the games or the settings to build the dataset change."""
+    hasher = hashlib.sha1()
+    hasher.update(f'{CACHE_VERSION}-{board_size}-{num_stack}-{skip_n}-{min_elo}-{max_games_per_player}'.encode())
+    for sgf_file in sgf_files:
+        stat = os.stat(sgf_file)
+        hasher.update(f'{os.path.relpath(sgf_file, games_dir)}-{stat.st_size}-{stat.st_mtime_ns}'.encode())
+    return hasher.hexdigest()
+
+
+def build_eval_dataset(
+    games_dir,
+    board_size,
+    num_stack,
+    logger=None,
+    cache_dir=None,
+    num_workers=None,
+    skip_n=0,
+    min_elo=2100,
+    max_games_per_player=200,
+) -> PackedEvalDataset:
+    """Build the evaluation dataset from the games in sgf format.
+
+    The games are replayed by a pool of `num_workers` processes, default the number of CPUs.
+    The result is cached in `cache_dir`, default `games_dir/.cache`, and is reused as long as
+    the games and the settings are the same.
+    """
     if logger is None:
         logger = create_logger()
 
-    logger.info('Building evaluation dataset...')
+    sgf_files = sorted(get_sgf_files(games_dir))
+    state_shape = (num_stack * 2 + 1, board_size, board_size)
 
-    sgf_files = get_sgf_files(games_dir)
+    if cache_dir is None:
+        cache_dir = os.path.join(games_dir, '.cache')
+    cache_key = _get_cache_key(sgf_files, games_dir, board_size, num_stack, skip_n, min_elo, max_games_per_player)
+    cache_file = os.path.join(cache_dir, f'eval_dataset_{cache_key}.npz')
 
-    states = []
-    target_pi = []
-    target_v = []
+    if os.path.exists(cache_file):
+        with np.load(cache_file) as cache:
+            eval_dataset = PackedEvalDataset(cache['states'], cache['moves'], cache['values'], state_shape)
+        logger.info(f'Loaded {len(eval_dataset)} positions from evaluation dataset cache "{cache_file}"')
+        return eval_dataset
 
-    valid_games = 0
-    for sgf_file in sgf_files:
-        history = replay_sgf(sgf_file, num_stack, logger)
-        if history is None:
-            continue
-        valid_games += 1
-        for transition in history:
-            states.append(transition[0])
-            target_pi.append(transition[1])
-            target_v.append(transition[2])
-
-    states = torch.from_numpy(np.stack(states, axis=0)).to(dtype=torch.float32)
-    target_pi = torch.from_numpy(np.stack(target_pi, axis=0)).to(dtype=torch.float32)
-    target_v = torch.from_numpy(np.stack(target_v, axis=0)).to(dtype=torch.float32)
-
-    eval_dataset = TensorDataset(states, target_pi, target_v)
-
-    logger.warning(f'Number of games with mismatched results: {MISMATCH_GAMES}')
-    sorted_game_counts = dict(sorted(GAME_COUNTS.items(), key=lambda x: x[1], reverse=True))
+    logger.info(f'Building evaluation dataset from {len(sgf_files)} games...')
+
+    parse_func = functools.partial(parse_sgf, board_size=board_size, num_stack=num_stack, skip_n=skip_n, min_elo=min_elo)
+    if num_workers is None:
+        num_workers = os.cpu_count()
+
+    matches = set()
+    game_counts = {}
+    mismatch_games = {k: 0 for k in MISMATCH_GAMES}
+    states = []
+    moves = []
+    values = []
+
+    def add_games(games: Iterable[Optional[ParsedGame]]) -> None:
+        # The games are checked for duplicates in the same order as the files
+        for game in games:
+            if accept_game(game, matches, game_counts, mismatch_games, logger, max_games_per_player):
+                states.append(game.states)
+                moves.append(game.moves)
+                values.append(game.values)
+
+    if num_workers > 1:
+        with mp.Pool(num_workers) as pool:
+            add_games(pool.imap(parse_func, sgf_files, chunksize=16))
+    else:
+        add_games(map(parse_func, sgf_files))
+
+    num_bytes = (int(np.prod(state_shape)) + 7) // 8
+    eval_dataset = PackedEvalDataset(
+        np.concatenate(states, axis=0) if states else np.zeros((0, num_bytes), dtype=np.uint8),
+        np.concatenate(moves, axis=0) if moves else np.zeros((0,), dtype=np.int16),
+        np.concatenate(values, axis=0) if values else np.zeros((0,), dtype=np.int8),
+        state_shape,
+    )
+
+    logger.warning(f'Number of games with mismatched results: {mismatch_games}')
+    sorted_game_counts = dict(sorted(game_counts.items(), key=lambda x: x[1], reverse=True))
     logger.debug(f'Number of games by player: {sorted_game_counts}')
 
-    logger.info(f'Finished loading {len(eval_dataset)} positions from {valid_games} games')
+    logger.info(f'Finished loading {len(eval_dataset)} positions from {len(states)} games')
+
+    # Write to a temporary file first, so a crash in the middle never leaves a broken cache
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_file = cache_file + '.tmp.npz'
+        np.savez(tmp_file, states=eval_dataset.states, moves=eval_dataset.moves, values=eval_dataset.values)
+        os.replace(tmp_file, cache_file)
+        logger.info(f'Evaluation dataset cached at "{cache_file}"')
+    except OSError as e:
+        logger.warning(f'Failed to cache the evaluation dataset at "{cache_dir}": {e}')
+
     return eval_dataset
@@ -0,0 +1,137 @@
+# Copyright (c) 2023 Michael Hu.
+# This code is part of the book "The Art of Reinforcement Learning: Fundamentals, Mathematics, and Implementation with Python.".
+# See the accompanying LICENSE file for details.
+
+
+"""Components to transfer self-play games from the actors to the learner through shared memory.
+
+By default, the actors send the entire game (a list of Transition) over the `data_queue`,
+which pickles every state and policy vector, and the learner has to unpickle them again.
+
+Instead, the `SharedGameBuffer` preallocates a number of fixed-size slots in shared memory,
+where each slot can hold one complete game. The actor writes the game into a free slot,
+and only sends the slot index (and the small game statistics) over the `data_queue`.
+The learner then reads the game straight from the slot with a single copy, and returns the slot to the free list.
+"""
+
+from multiprocessing import shared_memory
+from typing import Any, List, Mapping, Optional, Sequence, Text, Tuple
+import multiprocessing as mp
+import queue
+import numpy as np
+
+from replay import Transition
+
+
+class SharedGameBuffer:
+    """Fixed-size slots in shared memory for states, policies, and values of complete games."""
+
+    def __init__(
+        self,
+        num_slots: int,
+        max_game_length: int,
+        state_shape: Tuple[int, int, int],
+        num_actions: int,
+    ) -> None:
+        """
+        Args:
+            num_slots: number of slots, which is the maximum number of games in transit at the same time.
+            max_game_length: maximum number of transitions in a single game.
+            state_shape: the shape of a single state, in the format of [C, H, W].
+            num_actions: number of total actions, including illegal move.
+
+        Raises:
+            ValueError:
+                if `num_slots` or `max_game_length` is not a positive integer.
+        """
+        if num_slots < 1:
+            raise ValueError(f'Expect `num_slots` to be a positive integer, got {num_slots}')
+        if max_game_length < 1:
+            raise ValueError(f'Expect `max_game_length` to be a positive integer, got {max_game_length}')
+
+        self.num_slots = num_slots
+        self.max_game_length = max_game_length
+        self.state_shape = tuple(state_shape)
+        self.num_actions = num_actions
+
+        size = sum(int(np.prod(shape)) * np.dtype(dtype).itemsize for shape, dtype in self._layout())
+        self.shm = shared_memory.SharedMemory(create=True, size=size)
+        self._attach_arrays()
+
+        # Indices of the slots which are not used by any game
+        self.free_slots = mp.Queue()
+        for i in range(num_slots):
+            self.free_slots.put(i)
+
+    def _layout(self) -> List[Tuple[Tuple[int, ...], np.dtype]]:
+        """Returns the (shape, dtype) of the states, policies, and values arrays, in the order they're stored."""
+        return [
+            ((self.num_slots, self.max_game_length, *self.state_shape), np.int8),
+            ((self.num_slots, self.max_game_length, self.num_actions), np.float32),
+            ((self.num_slots, self.max_game_length), np.float32),
+        ]
+
+    def _attach_arrays(self) -> None:
+        arrays = []
+        offset = 0
+        for shape, dtype in self._layout():
+            array = np.ndarray(shape, dtype=dtype, buffer=self.shm.buf, offset=offset)
+            offset += array.nbytes
+            arrays.append(array)
+        self.states, self.pi_probs, self.values = arrays
+
+    def __getstate__(self) -> Mapping[Text, Any]:
+        # The shared memory is pickled by name, the arrays are attached again in the new process
+        state = self.__dict__.copy()
+        del state['states'], state['pi_probs'], state['values']
+        return state
+
+    def __setstate__(self, state: Mapping[Text, Any]) -> None:
+        self.__dict__.update(state)
+        self._attach_arrays()
+
+    def write_game(self, game_seq: Sequence[Transition], stop_event: mp.Event) -> Optional[int]:
+        """Copy the game into a free slot, block until a slot is available.
+
+        Returns the slot index, or None if `stop_event` is set while waiting for a free slot.
+
+        Raises:
+            ValueError:
+                if the game is longer than `max_game_length`.
+        """
+        length = len(game_seq)
+        if not 0 < length <= self.max_game_length:
+            raise ValueError(f'Expect game length to be in the range [1, {self.max_game_length}], got {length}')
+
+        while True:
+            try:
+                slot = self.free_slots.get(timeout=1.0)
+                break
+            except queue.Empty:
+                if stop_event.is_set():
+                    return None
+
+        np.stack([transition.state for transition in game_seq], out=self.states[slot, :length])
+        np.stack([transition.pi_prob for transition in game_seq], out=self.pi_probs[slot, :length], casting='same_kind')
+        self.values[slot, :length] = [transition.value for transition in game_seq]
+        return slot
+
+    def read_game(self, slot: int, length: int) -> List[Transition]:
+        """Returns the game stored in the slot, and release the slot."""
+        states = self.states[slot, :length].copy()
+        pi_probs = self.pi_probs[slot, :length].copy()
+        values = self.values[slot, :length].tolist()
+        self.release(slot)
+
+        return [Transition(state=states[i], pi_prob=pi_probs[i], value=values[i]) for i in range(length)]
+
+    def release(self, slot: int) -> None:
+        """Return the slot to the free list, without reading the game."""
+        self.free_slots.put(slot)
+
+    def close(self, unlink: bool = False) -> None:
+        """Close the shared memory in current process, the process which created the buffer should also unlink it."""
+        self.states = self.pi_probs = self.values = None
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
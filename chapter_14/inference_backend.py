@@ -0,0 +1,117 @@
+# Copyright (c) 2023 Michael Hu.
+# This code is part of the book "The Art of Reinforcement Learning: Fundamentals, Mathematics, and Implementation with Python.".
+# See the accompanying LICENSE file for details.
+
+
+"""Optimized CPU inference backends for the neural network, used by the self-play actors and evaluation players.
+
+During inference, the batch normalization layers are just a fixed affine transformation,
+which we fold into the weights and bias of the preceding convolution layers, then the network is traced
+and frozen as a TorchScript model, so each forward pass runs a single graph without the Python module overhead.
+
+The 'torchscript_int8' backend also applies dynamic int8 quantization to the linear layers in the heads,
+PyTorch only supports dynamic quantization for linear (and recurrent) layers, so the convolutions stay in float32.
+
+Since the exported model is a copy of the network, `InferenceModel` keeps track of the in-place updates
+to the network weights (for example when the actor loads a new checkpoint), and exports the model again when needed.
+Note only in-place updates are tracked, replacing a parameter or buffer of the network with a new tensor is not supported.
+"""
+from typing import Tuple
+import copy
+import torch
+from torch import nn
+from torch.nn.utils.fusion import fuse_conv_bn_eval
+
+
+BACKENDS = ('eager', 'torchscript', 'torchscript_int8')
+
+
+def fold_batch_norm(network: nn.Module) -> nn.Module:
+    """Returns a copy of the network in evaluation mode, where every Conv2d followed by a BatchNorm2d
+    inside a nn.Sequential is replaced by a single Conv2d, and the BatchNorm2d is replaced by nn.Identity."""
+    network = copy.deepcopy(network).eval()
+    for module in network.modules():
+        if not isinstance(module, nn.Sequential):
+            continue
+        for i in range(len(module) - 1):
+            if isinstance(module[i], nn.Conv2d) and isinstance(module[i + 1], nn.BatchNorm2d):
+                module[i] = fuse_conv_bn_eval(module[i], module[i + 1])
+                module[i + 1] = nn.Identity()
+    return network
+
+
+@torch.no_grad()
+def export_network(network: nn.Module, example_inputs: torch.Tensor, backend: str) -> torch.jit.ScriptModule:
+    """Returns the TorchScript model on CPU for the network, with batch normalization folded into the convolutions.
+
+    Args:
+        network: the neural network.
+        example_inputs: a batch of example states used to trace the network, the batch size can be different later.
+        backend: one of 'torchscript', 'torchscript_int8'.
+
+    Raises:
+        ValueError:
+            if backend is not one of 'torchscript', 'torchscript_int8'.
+    """
+    if backend not in BACKENDS[1:]:
+        raise ValueError(f'Expect backend to be one of {BACKENDS[1:]}, got "{backend}"')
+
+    model = fold_batch_norm(network).to('cpu')
+    if backend == 'torchscript_int8':
+        model = torch.ao.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+
+    traced = torch.jit.trace(model, example_inputs.to(device='cpu', dtype=torch.float32))
+    return torch.jit.freeze(traced.eval())
+
+
+class InferenceModel:
+    """Runs the exported model for the network, and exports the model again after the network weights changed.
+
+    Usage example:
+    ```
+    model = InferenceModel(network, 'torchscript')
+    pi_logits, value = model(states)
+
+    # The next call uses the new weights
+    network.load_state_dict(new_state_dict)
+    pi_logits, value = model(states)
+    ```
+
+    """
+
+    def __init__(self, network: nn.Module, backend: str) -> None:
+        """
+        Args:
+            network: the neural network, which is expected to be on CPU.
+            backend: one of 'torchscript', 'torchscript_int8'.
+
+        Raises:
+            ValueError:
+                if backend is not one of 'torchscript', 'torchscript_int8'.
+        """
+        if backend not in BACKENDS[1:]:
+            raise ValueError(f'Expect backend to be one of {BACKENDS[1:]}, got "{backend}"')
+
+        self.network = network
+        self.backend = backend
+        self.model = None
+        self.weights_version = None
+        self.num_exports = 0
+
+        # Building the state dict is expensive compared to a small forward pass, so only collect the tensors once.
+        # This works because the updates are done in place on the same tensors.
+        self.tensors = list(network.state_dict(keep_vars=True).values())
+
+    def _get_weights_version(self) -> Tuple[int, ...]:
+        # Every in-place update to a tensor increases its version counter, which includes `load_state_dict`,
+        # the optimizer steps and copying the weights from shared memory.
+        return tuple(t._version for t in self.tensors)
+
+    def __call__(self, x: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+        weights_version = self._get_weights_version()
+        if self.model is None or weights_version != self.weights_version:
+            self.model = export_network(self.network, x, self.backend)
+            self.weights_version = weights_version
+            self.num_exports += 1
+
+        return self.model(x)
@@ -0,0 +1,136 @@
+# Copyright (c) 2023 Michael Hu.
+# This code is part of the book "The Art of Reinforcement Learning: Fundamentals, Mathematics, and Implementation with Python.".
+# See the accompanying LICENSE file for details.
+
+
+"""Components to share a single neural network between all self-play actors.
+
+Instead of having a copy of the neural network inside each actor process,
+the actors send the positions to a single inference server process,
+which gathers the requests from multiple actors and evaluates them in one batch.
+
+The positions and the evaluation results are exchanged through shared memory buffers,
+where each actor (client) owns a fixed slot. Only the small request messages (client id, number of positions)
+are sent over the queue, and the server notifies the client using an event once the results are ready.
+
+The server switches to new checkpoints on its own, possibly while the actors are in the middle of a game,
+so each response also carries the training steps of the checkpoint used to evaluate it,
+see `InferenceClient.response_training_steps`.
+
+The server loop is implemented in `pipeline.run_inference_server_loop`.
+"""
+
+from typing import Iterable, Tuple
+import multiprocessing as mp
+import time
+import numpy as np
+import torch
+
+
+class InferenceChannels:
+    """Shared memory buffers and synchronization primitives between the inference server and clients."""
+
+    def __init__(
+        self,
+        num_clients: int,
+        max_positions_per_request: int,
+        state_shape: Tuple[int, int, int],
+        num_actions: int,
+    ) -> None:
+        """
+        Args:
+            num_clients: number of clients (actors), each client has its own slot in the buffers.
+            max_positions_per_request: maximum number of positions in a single request, which is `num_parallel` for MCTS search,
+                or `num_parallel * num_games` when the actor plays multiple games at the same time.
+            state_shape: the shape of a single state, in the format of [C, H, W].
+            num_actions: number of total actions, including illegal move.
+        """
+        if num_clients < 1:
+            raise ValueError(f'Expect `num_clients` to be a positive integer, got {num_clients}')
+        if max_positions_per_request < 1:
+            raise ValueError(f'Expect `max_positions_per_request` to be a positive integer, got {max_positions_per_request}')
+
+        self.num_clients = num_clients
+        self.max_positions_per_request = max_positions_per_request
+        self.num_actions = num_actions
+
+        self.state_buffer = torch.zeros((num_clients, max_positions_per_request, *state_shape), dtype=torch.int8)
+        self.pi_buffer = torch.zeros((num_clients, max_positions_per_request, num_actions), dtype=torch.float32)
+        self.value_buffer = torch.zeros((num_clients, max_positions_per_request), dtype=torch.float32)
+        self.state_buffer.share_memory_()
+        self.pi_buffer.share_memory_()
+        self.value_buffer.share_memory_()
+
+        # The training steps of the checkpoint used to evaluate the last request of each client
+        self.response_steps = torch.zeros(num_clients, dtype=torch.int64)
+        self.response_steps.share_memory_()
+
+        # Each request is a tuple of (client_id, num_positions, request_time)
+        self.request_queue = mp.Queue()
+        self.response_events = [mp.Event() for _ in range(num_clients)]
+
+        # The training steps of the checkpoint currently used by the server
+        self.training_steps = mp.Value('i', 0)
+
+    def client(self, client_id: int, stop_event: mp.Event) -> 'InferenceClient':
+        """Returns a client for the given slot."""
+        if not 0 <= client_id < self.num_clients:
+            raise ValueError(f'Expect `client_id` to be in the range [0, {self.num_clients}), got {client_id}')
+        return InferenceClient(self, client_id, stop_event)
+
+
+class InferenceClient:
+    """Evaluate positions using the inference server, this is a drop-in replacement for the `eval_position` function
+    inside `pipeline.create_mcts_player`."""
+
+    def __init__(self, channels: InferenceChannels, client_id: int, stop_event: mp.Event) -> None:
+        self.channels = channels
+        self.client_id = client_id
+        self.stop_event = stop_event
+        # The training steps of the checkpoint used to evaluate the last request, None before the first response
+        self.response_training_steps = None
+
+    @property
+    def training_steps(self) -> int:
+        """The training steps of the checkpoint currently used by the server."""
+        return self.channels.training_steps.value
+
+    def __call__(self, state: np.ndarray, batched: bool = False) -> Tuple[Iterable[np.ndarray], Iterable[float]]:
+        """Give a game state tensor, returns the action probabilities
+        and estimated state value from current player's perspective."""
+        if not batched:
+            state = state[None, ...]
+
+        B = state.shape[0]
+        if B > self.channels.max_positions_per_request:
+            raise ValueError(f'Expect at most {self.channels.max_positions_per_request} positions per request, got {B}')
+
+        event = self.channels.response_events[self.client_id]
+        event.clear()
+        self.channels.state_buffer[self.client_id, :B] = torch.from_numpy(state)
+        self.channels.request_queue.put((self.client_id, B, time.time()))
+
+        while not event.wait(timeout=1.0):
+            # The server may already stopped, returns uniform prior probabilities and zero values
+            # so the actor can exit quickly, the game will be discarded anyway.
+            if self.stop_event.is_set():
+                pi = np.full((B, self.channels.num_actions), 1.0 / self.channels.num_actions, dtype=np.float32)
+                v = np.zeros(B, dtype=np.float32)
+                return self._unpack(pi, v, batched)
+
+        pi = self.channels.pi_buffer[self.client_id, :B].numpy().copy()
+        v = self.channels.value_buffer[self.client_id, :B].numpy().copy()
+        self.response_training_steps = int(self.channels.response_steps[self.client_id])
+        return self._unpack(pi, v, batched)
+
+    def _unpack(self, pi: np.ndarray, v: np.ndarray, batched: bool) -> Tuple[Iterable[np.ndarray], Iterable[float]]:
+        v = v.tolist()  # To list
+
+        # Unpack the batched array into a list of NumPy arrays
+        pi = [pi[i] for i in range(pi.shape[0])]
+
+        if not batched:
+            pi = pi[0]
+            v = v[0]
+
+        return pi, v
@@ -46,10 +46,11 @@ In this case, a max(-0.8, -0.3) will give us the correct results for black playe
 import copy
 import collections
 import math
-from typing import Callable, Tuple, Mapping, Iterable, Any
+from typing import Callable, Generator, Tuple, Mapping, Iterable, Any
 import numpy as np
 
 from envs.base import BoardGameEnv
+from search_profiler import SearchProfiler
 
 
 class DummyNode(object):
@@ -295,6 +296,7 @@ def uct_search(
     root_noise: bool = False,
     warm_up: bool = False,
     deterministic: bool = False,
+    profiler: SearchProfiler = None,
 ) -> Tuple[int, np.ndarray, float, float, Node]:
     """Single-threaded Upper Confidence Bound (UCB) for Trees (UCT) search without any rollout.
 
@@ -324,6 +326,7 @@ def uct_search(
         warm_up: if true, use temperature 1.0 to generate play policy, other wise use 0.1, default off.
         deterministic: after the MCTS search, choose the child node with most visits number to play in the game,
             instead of sample through a probability distribution, default off.
+        profiler: record the time per phase and the search statistics, see `search_profiler.py`, default None.
 
     Returns:
         tuple contains:
@@ -353,6 +356,8 @@ def uct_search(
         root_node = Node(to_play=env.to_play, num_actions=env.action_dim, parent=DummyNode())
         expand(root_node, prior_prob)
         backup(root_node, value)
+        if profiler is not None:
+            profiler.nodes_created += 1
 
     assert root_node.to_play == env.to_play
 
@@ -362,13 +367,25 @@ def uct_search(
     if root_noise:
         add_dirichlet_noise(root_node, root_legal_actions)
 
+    if profiler is not None:
+        profiler.num_searches += 1
+        t = profiler.timer()
+
+    # Only copy the environment once, and restore it to the root state at the beginning of every simulation,
+    # which is much cheaper than doing a deep copy for every simulation.
+    sim_env = copy.deepcopy(env)
+    root_snapshot = sim_env.snapshot()
+
     while root_node.N < num_simulations:
         node = root_node
+        depth = 0
 
         # Make sure do not touch the actual environment.
-        sim_env = copy.deepcopy(env)
+        sim_env.restore(root_snapshot)
         obs = sim_env.observation()
         done = sim_env.is_game_over()
+        if profiler is not None:
+            t = profiler.lap('copy_env', t)
 
         # Phase 1 - Select
         # Select best child node until one of the following is true:
@@ -377,26 +394,43 @@ def uct_search(
         while node.is_expanded:
             # Select the best move and create the child node on demand
             node = best_child(node, sim_env.legal_actions, c_puct_base, c_puct_init, sim_env.opponent_player)
+            depth += 1
+            if profiler is not None:
+                t = profiler.lap('best_child', t)
             # Make move on the simulation environment.
             obs, reward, done, _ = sim_env.step(node.move)
+            if profiler is not None:
+                t = profiler.lap('env_step', t)
             if done:
                 break
 
         assert node.to_play == sim_env.to_play
+        if profiler is not None:
+            profiler.add_simulation(depth)
 
         # Special case - If game is over, using the actual reward from the game to update statistics
         if done:
             # The reward is for the last player who made the move won/loss the game.
             assert node.to_play != sim_env.last_player
             backup(node, -reward)
+            if profiler is not None:
+                t = profiler.lap('backup', t)
             continue
 
         # Phase 2 - Expand and evaluation
         prior_prob, value = eval_func(obs, False)
+        if profiler is not None:
+            # The evaluation time is recorded by the wrapped evaluation function
+            t = profiler.timer()
         expand(node, prior_prob)
+        if profiler is not None:
+            profiler.nodes_created += 1
+            t = profiler.lap('expand', t)
 
         # Phase 3 - Backup statistics
         backup(node, value)
+        if profiler is not None:
+            t = profiler.lap('backup', t)
 
     # Play - generate search policy action probability from the root node's child visit number.
     search_pi = generate_search_policy(root_node.child_N, 1.0 if warm_up else 0.1, root_legal_actions)
@@ -474,6 +508,7 @@ def parallel_uct_search(
     root_noise: bool = False,
     warm_up: bool = False,
     deterministic: bool = False,
+    profiler: SearchProfiler = None,
 ) -> Tuple[int, np.ndarray, float, float, Node]:
     """Single-threaded Upper Confidence Bound (UCB) for Trees (UCT) search without any rollout.
 
@@ -507,6 +542,7 @@ def parallel_uct_search(
         warm_up: if true, use temperature 1.0 to generate play policy, other wise use 0.1, default off.
         deterministic: after the MCTS search, choose the child node with most visits number to play in the game,
             instead of sample through a probability distribution, default off.
+        profiler: record the time per phase and the search statistics, see `search_profiler.py`, default None.
 
 
     Returns:
@@ -524,6 +560,45 @@ def parallel_uct_search(
         RuntimeError:
             if the game is over.
     """
+    return run_with_eval_func(
+        parallel_uct_search_generator(
+            env=env,
+            root_node=root_node,
+            c_puct_base=c_puct_base,
+            c_puct_init=c_puct_init,
+            num_simulations=num_simulations,
+            num_parallel=num_parallel,
+            root_noise=root_noise,
+            warm_up=warm_up,
+            deterministic=deterministic,
+            profiler=profiler,
+        ),
+        eval_func,
+    )
+
+
+def parallel_uct_search_generator(  # noqa: C901
+    env: BoardGameEnv,
+    root_node: Node,
+    c_puct_base: float,
+    c_puct_init: float,
+    num_simulations: int,
+    num_parallel: int,
+    root_noise: bool = False,
+    warm_up: bool = False,
+    deterministic: bool = False,
+    profiler: SearchProfiler = None,
+) -> Generator[np.ndarray, Tuple[Iterable[np.ndarray], Iterable[float]], Tuple[int, np.ndarray, float, float, Node]]:
+    """Same as `parallel_uct_search`, but instead of calling the evaluation function,
+    the generator yields the batched states to be evaluated, and expects the action probabilities
+    and predicted values for these states to be sent back. The search results are returned when the generator is exhausted.
+
+    This allows the caller to evaluate the leaves from multiple search trees (for example multiple games) in a single batch.
+    See `run_with_eval_func` for how to drive the generator.
+
+    Note the yielded array is a view of a preallocated batch which is reused by the search,
+    so the caller should make a copy if the states are needed after sending back the results.
+    """
     if not isinstance(env, BoardGameEnv):
         raise ValueError(f'Expect `env` to be a valid BoardGameEnv instance, got {env}')
     if not 1 <= num_simulations:
@@ -533,10 +608,12 @@ def parallel_uct_search(
 
     # Create root node
     if root_node is None:
-        prior_prob, value = eval_func(env.observation(), False)
+        prior_probs, values = yield env.observation()[None, ...]
         root_node = Node(to_play=env.to_play, num_actions=env.action_dim, parent=DummyNode())
-        expand(root_node, prior_prob)
-        backup(root_node, value)
+        expand(root_node, prior_probs[0])
+        backup(root_node, values[0])
+        if profiler is not None:
+            profiler.nodes_created += 1
 
     assert root_node.to_play == env.to_play
 
@@ -546,6 +623,18 @@ def parallel_uct_search(
     if root_noise:
         add_dirichlet_noise(root_node, root_legal_actions)
 
+    if profiler is not None:
+        profiler.num_searches += 1
+        t = profiler.timer()
+
+    # Only copy the environment once, and restore it to the root state at the beginning of every simulation,
+    # which is much cheaper than doing a deep copy for every simulation.
+    sim_env = copy.deepcopy(env)
+    root_snapshot = sim_env.snapshot()
+
+    # The observations of the leaves are written directly into the preallocated batch.
+    batched_obs = np.empty((num_parallel, *env.observation_space.shape), dtype=np.int8)
+
     while root_node.N < num_simulations + num_parallel:
         leaves = []
         failsafe = 0
@@ -555,11 +644,13 @@ def parallel_uct_search(
             # as we use the actual game results to update statistic
             failsafe += 1
             node = root_node
+            depth = 0
 
             # Make sure do not touch the actual environment.
-            sim_env = copy.deepcopy(env)
-            obs = sim_env.observation()
+            sim_env.restore(root_snapshot)
             done = sim_env.is_game_over()
+            if profiler is not None:
+                t = profiler.lap('copy_env', t)
 
             # Phase 1 - Select
             # Select best child node until one of the following is true:
@@ -568,37 +659,63 @@ def parallel_uct_search(
             while node.is_expanded:
                 # Select the best move and create the child node on demand
                 node = best_child(node, sim_env.legal_actions, c_puct_base, c_puct_init, sim_env.opponent_player)
+                depth += 1
+                if profiler is not None:
+                    t = profiler.lap('best_child', t)
                 # Make move on the simulation environment.
-                obs, reward, done, _ = sim_env.step(node.move)
+                _, reward, done, _ = sim_env.step(node.move)
+                if profiler is not None:
+                    t = profiler.lap('env_step', t)
                 if done:
                     break
 
             assert node.to_play == sim_env.to_play
+            if profiler is not None:
+                profiler.add_simulation(depth)
 
             # Special case - If game is over, using the actual reward from the game to update statistics.
             if done:
                 # The reward is for the last player who made the move won/loss the game.
                 assert node.to_play != sim_env.last_player
                 backup(node, -reward)
+                if profiler is not None:
+                    t = profiler.lap('backup', t)
                 continue
             else:
                 add_virtual_loss(node)
-                leaves.append((node, obs))
+                if profiler is not None:
+                    t = profiler.lap('backup', t)
+                sim_env.observation(out=batched_obs[len(leaves)])
+                leaves.append(node)
+                if profiler is not None:
+                    t = profiler.lap('env_step', t)
         if leaves:
-            batched_nodes, batched_obs = map(list, zip(*leaves))
-            prior_probs, values = eval_func(np.stack(batched_obs, axis=0), True)
+            prior_probs, values = yield batched_obs[: len(leaves)]
+            num_collisions = 0
+            if profiler is not None:
+                t = profiler.timer()
 
-            for leaf, prior_prob, value in zip(batched_nodes, prior_probs, values):
+            for leaf, prior_prob, value in zip(leaves, prior_probs, values):
                 revert_virtual_loss(leaf)
 
                 # If a node was picked multiple times (despite virtual losses), we shouldn't
                 # expand it more than once.
                 if leaf.is_expanded:
+                    num_collisions += 1
                     continue
 
+                if profiler is not None:
+                    t = profiler.lap('backup', t)
                 expand(leaf, prior_prob)
+                if profiler is not None:
+                    t = profiler.lap('expand', t)
                 backup(leaf, value)
 
+            if profiler is not None:
+                t = profiler.lap('backup', t)
+                profiler.add_leaves(len(leaves), num_collisions)
+                profiler.nodes_created += len(leaves) - num_collisions
+
     # Play - generate search policy action probability from the root node's child visit number.
     search_pi = generate_search_policy(root_node.child_N, 1.0 if warm_up else 0.1, root_legal_actions)
 
@@ -630,3 +747,321 @@ def parallel_uct_search(
     assert root_legal_actions[move] == 1
 
     return (move, search_pi, root_node.Q, best_child_Q, next_root_node)
+
+
+def run_with_eval_func(
+    generator: Generator[np.ndarray, Tuple[Iterable[np.ndarray], Iterable[float]], Any],
+    eval_func: Callable[[np.ndarray, bool], Tuple[Iterable[np.ndarray], Iterable[float]]],
+) -> Any:
+    """Run the search generator until it's exhausted, using `eval_func` to evaluate the yielded batched states.
+
+    Returns:
+        the return value of the generator, which is the search results.
+    """
+    try:
+        states = next(generator)
+        while True:
+            states = generator.send(eval_func(states, True))
+    except StopIteration as e:
+        return e.value
+
+
+def get_completed_q_scores(
+    root_node: Node, root_value: float, logits: np.ndarray, legal_actions: np.ndarray, c_visit: float, c_scale: float
+) -> np.ndarray:
+    """Returns the monotonically transformed completed Q values sigma(completedQ(a)) for the root node,
+    as in the paper "Policy improvement by planning with Gumbel" by Danihelka et al.
+
+    The Q values of the visited children are from the root node's perspective, and the unvisited children are completed
+    with the mixed value, which interpolates the root value and the Q values of the visited children weighted by the prior.
+    The completed Q values are rescaled to [0, 1] with the min and max of the legal actions.
+
+    Args:
+        root_node: the root node of the search tree.
+        root_value: the value of the root node from the root node's perspective.
+        logits: the log prior probabilities of the root node, -inf for illegal actions.
+        legal_actions: a 1D bool numpy.array mask for all actions,
+            where `1` represents legal move and `0` represents illegal move.
+        c_visit: a float constant for the scale of the completed Q values, which grows with the number of visits.
+        c_scale: a float constant for the scale of the completed Q values.
+
+    Returns:
+        a 1D numpy.array contains the transformed completed Q values for all actions.
+    """
+    legal = legal_actions == 1
+    child_N = root_node.child_N
+    visited = child_N > 0
+
+    # The child Q value is evaluated from the opponent perspective.
+    q = -root_node.child_Q()
+
+    probs = np.exp(logits - np.max(logits))
+    probs /= np.sum(probs)
+
+    sum_N = np.sum(child_N)
+    visited_probs = np.sum(probs[visited])
+    mixed_value = root_value
+    if sum_N > 0 and visited_probs > 0:
+        weighted_q = np.sum(probs[visited] * q[visited]) / visited_probs
+        mixed_value = (root_value + sum_N * weighted_q) / (1 + sum_N)
+
+    completed_q = np.where(visited, q, mixed_value)
+    min_q, max_q = np.min(completed_q[legal]), np.max(completed_q[legal])
+    completed_q = (completed_q - min_q) / max(max_q - min_q, 1e-8)
+
+    return (c_visit + np.max(child_N)) * c_scale * completed_q
+
+
+def gumbel_search(
+    env: BoardGameEnv,
+    eval_func: Callable[[np.ndarray, bool], Tuple[Iterable[np.ndarray], Iterable[float]]],
+    root_node: Node,
+    c_puct_base: float,
+    c_puct_init: float,
+    num_simulations: int,
+    num_considered_actions: int = 16,
+    warm_up: bool = False,
+    deterministic: bool = False,
+    c_visit: float = 50.0,
+    c_scale: float = 0.1,
+    profiler: SearchProfiler = None,
+) -> Tuple[int, np.ndarray, float, float, Node]:
+    """MCTS search with Gumbel-top-k sampling and sequential halving at the root node, which improves the policy
+    even with a small number of simulations, as in the paper "Policy improvement by planning with Gumbel" by Danihelka et al.
+
+    The root node samples `num_considered_actions` actions without replacement using the Gumbel-top-k trick,
+    then the simulations are divided equally among the considered actions over log2(num_considered_actions) phases,
+    after each phase, only the better half of the actions are kept, scored by the Gumbel noise, log prior probability
+    and the transformed Q value. Below the root node, the children are selected with PUCT like in `uct_search`.
+
+    The search policy is the improved policy softmax(logits + sigma(completedQ)), instead of the visit counts,
+    this is a valid policy target even if most of the actions were never visited.
+    The Gumbel noise replaces the dirichlet noise for exploration.
+
+    Args:
+        env: a gym like custom BoardGameEnv environment.
+        eval_func: a evaluation function when called returns the
+            action probabilities and predicted value from
+            current player's perspective.
+        root_node: root node of the search tree, this comes from reuse sub-tree.
+        c_puct_base: a float constant determining the level of exploration.
+        c_puct_init: a float constant determining the level of exploration.
+        num_simulations: number of new simulations to run, not including the visits from the reused sub-tree.
+        num_considered_actions: number of actions sampled at the root node, default 16.
+        warm_up: if true, sample the action to play from the improved policy, instead of the action selected by the
+            sequential halving, default off.
+        deterministic: don't add the Gumbel noise, so the action with the best score is played, default off.
+        c_visit: a float constant for the scale of the completed Q values, default 50.
+        c_scale: a float constant for the scale of the completed Q values, default 0.1.
+        profiler: record the time per phase and the search statistics, see `search_profiler.py`, default None.
+
+    Returns:
+        tuple contains:
+            a integer indicate the sampled action to play in the environment.
+            a 1D numpy.array search policy action probabilities from the MCTS search result.
+            a float indicate the root node value
+            a float indicate the best child value
+            a Node instance represent subtree of this MCTS search, which can be used as next root node for MCTS search.
+
+    Raises:
+        ValueError:
+            if input argument `env` is not valid BoardGameEnv instance.
+            if input argument `num_simulations` is not a positive integer.
+            if input argument `num_considered_actions` is not a positive integer.
+        RuntimeError:
+            if the game is over.
+    """
+    return run_with_eval_func(
+        gumbel_search_generator(
+            env=env,
+            root_node=root_node,
+            c_puct_base=c_puct_base,
+            c_puct_init=c_puct_init,
+            num_simulations=num_simulations,
+            num_considered_actions=num_considered_actions,
+            warm_up=warm_up,
+            deterministic=deterministic,
+            c_visit=c_visit,
+            c_scale=c_scale,
+            profiler=profiler,
+        ),
+        eval_func,
+    )
+
+
+def gumbel_search_generator(  # noqa: C901
+    env: BoardGameEnv,
+    root_node: Node,
+    c_puct_base: float,
+    c_puct_init: float,
+    num_simulations: int,
+    num_considered_actions: int = 16,
+    warm_up: bool = False,
+    deterministic: bool = False,
+    c_visit: float = 50.0,
+    c_scale: float = 0.1,
+    profiler: SearchProfiler = None,
+) -> Generator[np.ndarray, Tuple[Iterable[np.ndarray], Iterable[float]], Tuple[int, np.ndarray, float, float, Node]]:
+    """Same as `gumbel_search`, but yields the states to be evaluated (one at a time, with a batch dimension),
+    see `parallel_uct_search_generator`."""
+    if not isinstance(env, BoardGameEnv):
+        raise ValueError(f'Expect `env` to be a valid BoardGameEnv instance, got {env}')
+    if not 1 <= num_simulations:
+        raise ValueError(f'Expect `num_simulations` to a positive integer, got {num_simulations}')
+    if not 1 <= num_considered_actions:
+        raise ValueError(f'Expect `num_considered_actions` to a positive integer, got {num_considered_actions}')
+    if env.is_game_over():
+        raise RuntimeError('Game is over.')
+
+    # Create root node
+    if root_node is None:
+        prior_probs, values = yield env.observation()[None, ...]
+        root_node = Node(to_play=env.to_play, num_actions=env.action_dim, parent=DummyNode())
+        expand(root_node, prior_probs[0])
+        backup(root_node, values[0])
+        if profiler is not None:
+            profiler.nodes_created += 1
+
+    assert root_node.to_play == env.to_play
+
+    # The root value for the mixed value, which is the average value of the reused sub-tree
+    root_value = root_node.Q
+    root_legal_actions = env.legal_actions
+    legal = root_legal_actions == 1
+
+    with np.errstate(divide='ignore'):
+        logits = np.where(legal, np.log(root_node.child_P), -np.inf)
+    # The actions with zero prior probability are still legal
+    logits = np.where(legal, np.maximum(logits, -1e9), -np.inf)
+
+    gumbel = np.zeros(env.action_dim) if deterministic else np.random.gumbel(size=env.action_dim)
+
+    # Sample the actions without replacement using the Gumbel-top-k trick
+    num_considered = min(num_considered_actions, int(np.sum(legal)))
+    considered = np.argsort(-(gumbel + logits))[:num_considered]
+    num_phases = max(1, math.ceil(math.log2(num_considered)))
+
+    def get_scores(actions: np.ndarray) -> np.ndarray:
+        sigma_q = get_completed_q_scores(root_node, root_value, logits, root_legal_actions, c_visit, c_scale)
+        return (gumbel + logits + sigma_q)[actions]
+
+    if profiler is not None:
+        profiler.num_searches += 1
+        t = profiler.timer()
+
+    # Only copy the environment once, and restore it to the root state at the beginning of every simulation,
+    # which is much cheaper than doing a deep copy for every simulation.
+    sim_env = copy.deepcopy(env)
+    root_snapshot = sim_env.snapshot()
+
+    sims_done = 0
+    for phase in range(num_phases):
+        if sims_done >= num_simulations:
+            break
+
+        # The last phase uses the remaining simulations
+        if phase == num_phases - 1:
+            visits_per_action = max(1, (num_simulations - sims_done) // len(considered))
+        else:
+            visits_per_action = max(1, num_simulations // (num_phases * len(considered)))
+
+        for _ in range(visits_per_action):
+            for root_move in considered:
+                if sims_done >= num_simulations:
+                    break
+                sims_done += 1
+
+                # Make sure do not touch the actual environment.
+                sim_env.restore(root_snapshot)
+                if profiler is not None:
+                    t = profiler.lap('copy_env', t)
+
+                # Phase 1 - Select
+                # The root node plays the considered action, then select best child node until one of the following is true:
+                # - reach a leaf node.
+                # - game is over.
+                if root_move not in root_node.children:
+                    root_node.children[root_move] = Node(
+                        to_play=sim_env.opponent_player, num_actions=root_node.num_actions, move=root_move, parent=root_node
+                    )
+                node = root_node.children[root_move]
+                depth = 1
+                if profiler is not None:
+                    t = profiler.lap('best_child', t)
+                obs, reward, done, _ = sim_env.step(root_move)
+                if profiler is not None:
+                    t = profiler.lap('env_step', t)
+
+                while not done and node.is_expanded:
+                    node = best_child(node, sim_env.legal_actions, c_puct_base, c_puct_init, sim_env.opponent_player)
+                    depth += 1
+                    if profiler is not None:
+                        t = profiler.lap('best_child', t)
+                    obs, reward, done, _ = sim_env.step(node.move)
+                    if profiler is not None:
+                        t = profiler.lap('env_step', t)
+
+                assert node.to_play == sim_env.to_play
+                if profiler is not None:
+                    profiler.add_simulation(depth)
+
+                # Special case - If game is over, using the actual reward from the game to update statistics
+                if done:
+                    # The reward is for the last player who made the move won/loss the game.
+                    assert node.to_play != sim_env.last_player
+                    backup(node, -reward)
+                    if profiler is not None:
+                        t = profiler.lap('backup', t)
+                    continue
+
+                # Phase 2 - Expand and evaluation
+                prior_probs, values = yield obs[None, ...]
+                if profiler is not None:
+                    t = profiler.timer()
+                expand(node, prior_probs[0])
+                if profiler is not None:
+                    profiler.nodes_created += 1
+                    t = profiler.lap('expand', t)
+
+                # Phase 3 - Backup statistics
+                backup(node, values[0])
+                if profiler is not None:
+                    t = profiler.lap('backup', t)
+
+        # Sequential halving, only keep the better half of the considered actions
+        if phase < num_phases - 1 and len(considered) > 1:
+            num_keep = math.ceil(len(considered) / 2)
+            considered = considered[np.argsort(-get_scores(considered), kind='stable')[:num_keep]]
+
+    # Play - the improved policy from the completed Q values is the search policy.
+    sigma_q = get_completed_q_scores(root_node, root_value, logits, root_legal_actions, c_visit, c_scale)
+    search_pi = np.exp(logits + sigma_q - np.max(logits + sigma_q))
+    search_pi = (search_pi / np.sum(search_pi)).astype(np.float32)
+
+    next_root_node = None
+    best_child_Q = 0.0
+
+    if warm_up and not deterministic:
+        # Sample an action from the improved policy
+        # Prevent the agent to select pass move during opening moves
+        move = None
+        while move is None or (env.has_pass_move and move == env.pass_move and np.sum(legal) > 1):
+            move = np.random.choice(np.arange(search_pi.shape[0]), p=search_pi)
+    else:
+        move = considered[np.argmax(get_scores(considered))]
+
+    if move in root_node.children:
+        next_root_node = root_node.children[move]
+
+        N, W = copy.copy(next_root_node.N), copy.copy(next_root_node.W)
+        next_root_node.parent = DummyNode()
+        next_root_node.move = None
+        next_root_node.N = N
+        next_root_node.W = W
+
+        # Child value is computed from opponent's perspective, so we switch the sign
+        best_child_Q = -next_root_node.Q
+
+    assert root_legal_actions[move] == 1
+
+    return (move, search_pi, root_node.Q, best_child_Q, next_root_node)
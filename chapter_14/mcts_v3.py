@@ -0,0 +1,805 @@
+# Copyright (c) 2023 Michael Hu.
+# This code is part of the book "The Art of Reinforcement Learning: Fundamentals, Mathematics, and Implementation with Python.".
+# See the accompanying LICENSE file for details.
+
+
+"""An array-backed MCTS implementation for AlphaZero.
+
+This follows the same search algorithm as `mcts_v2.py`, but instead of allocating
+a `Node` object (with three NumPy arrays and a children dict) for every expanded position,
+all the node statistics live inside a single `Tree` object, in preallocated contiguous NumPy arrays indexed by node id:
+
+    child_W[node_id, action]    total action values of the children
+    child_N[node_id, action]    visit counts of the children
+    child_P[node_id, action]    prior probabilities of the children
+    children[node_id, action]   node id of the children, -1 if not created yet
+    parent[node_id]             node id of the parent
+    move[node_id]               the action which leads from parent to this node
+
+Same as in `mcts_v2.py`, the visit count and total value of a node are stored at the parent's level.
+Row 0 is reserved for a dummy node which holds the statistics for the root node,
+this makes computation possible for the root node, just like the `DummyNode` in `mcts_v2.py`.
+
+The position of a node's statistics in the flattened `child_W` and `child_N` arrays (`parent * num_actions + move`)
+is also kept in a plain list, so the backup and virtual loss loops only do scalar indexing on 1D views.
+
+Node ids released after reusing a sub-tree are put on a free-list, so we can reuse the rows later without allocating new memory.
+The arrays grow (doubling the capacity) only if we run out of rows.
+
+The search functions `uct_search` and `parallel_uct_search` have the same signature as the ones in `mcts_v2.py`,
+except here the `root_node` is a `Tree` instance (or None), and the returned next root node is the same `Tree`,
+re-rooted at the selected child.
+
+"""
+
+import copy
+import math
+from typing import Callable, Generator, Tuple, Iterable, List
+import numpy as np
+
+from envs.base import BoardGameEnv
+from mcts_v2 import generate_search_policy, run_with_eval_func
+from search_profiler import SearchProfiler
+
+# Row 0 is a place holder to make computation possible for the root node.
+DUMMY_NODE = 0
+# Represents "child node not created" in the children array
+MISSING_NODE = -1
+
+
+class Tree:
+    """MCTS search tree, where the statistics for all nodes are stored in preallocated NumPy arrays."""
+
+    def __init__(self, num_actions: int, capacity: int = 1024) -> None:
+        """
+        Args:
+            num_actions: number of total actions, including illegal move.
+            capacity: number of nodes to preallocate, the arrays will grow if more nodes are needed, default 1024.
+        """
+        if not isinstance(num_actions, int) or num_actions < 1:
+            raise ValueError(f'Expect `num_actions` to be a positive integer, got {num_actions}')
+        if not isinstance(capacity, int) or capacity < 2:
+            raise ValueError(f'Expect `capacity` to be a integer greater than 1, got {capacity}')
+
+        self.num_actions = num_actions
+        self.capacity = capacity
+
+        self.child_W = np.zeros((capacity, num_actions), dtype=np.float32)
+        self.child_N = np.zeros((capacity, num_actions), dtype=np.float32)
+        self.child_P = np.zeros((capacity, num_actions), dtype=np.float32)
+        self.children = np.full((capacity, num_actions), MISSING_NODE, dtype=np.int32)
+
+        self.parent = np.full(capacity, MISSING_NODE, dtype=np.int32)
+        self.move = np.zeros(capacity, dtype=np.int32)
+        self.node_to_play = np.zeros(capacity, dtype=np.int8)
+        self.is_expanded = np.zeros(capacity, dtype=np.bool_)
+        # Number of virtual losses on the node, only used in 'parallel_uct_search'
+        self.losses_applied = np.zeros(capacity, dtype=np.int32)
+
+        # Index of the node's own statistics in the flattened child_W and child_N arrays
+        self.stats_index = [0] * capacity
+        self._update_flat_views()
+
+        # Scratch buffers for computing the UCB scores in `best_child`, so no temporary arrays are allocated
+        self._ucb_scores = np.empty(num_actions, dtype=np.float32)
+        self._scratch = np.empty(num_actions, dtype=np.float32)
+
+        self.root = MISSING_NODE
+        self.reset()
+
+    def reset(self) -> None:
+        """Release all nodes, this does not free the underlying memory."""
+        self._free_ids: List[int] = []
+        self._next_id = DUMMY_NODE + 1
+        self.child_W[DUMMY_NODE] = 0
+        self.child_N[DUMMY_NODE] = 0
+        self.root = MISSING_NODE
+
+    def _update_flat_views(self) -> None:
+        self.flat_W = self.child_W.reshape(-1)
+        self.flat_N = self.child_N.reshape(-1)
+
+    @property
+    def num_nodes(self) -> int:
+        """Number of nodes currently in use, excluding the dummy node."""
+        return self._next_id - 1 - len(self._free_ids)
+
+    def new_node(self, to_play: int, parent: int, move: int) -> int:
+        """Returns the id of a new node, reusing released rows if possible."""
+        if self._free_ids:
+            node = self._free_ids.pop()
+        else:
+            if self._next_id == self.capacity:
+                self._grow()
+            node = self._next_id
+            self._next_id += 1
+
+        self.child_W[node] = 0
+        self.child_N[node] = 0
+        self.child_P[node] = 0
+        self.children[node] = MISSING_NODE
+        self.parent[node] = parent
+        self.move[node] = move
+        self.stats_index[node] = parent * self.num_actions + move
+        self.node_to_play[node] = to_play
+        self.is_expanded[node] = False
+        self.losses_applied[node] = 0
+
+        if parent != DUMMY_NODE:
+            self.children[parent, move] = node
+
+        return node
+
+    def new_root(self, to_play: int) -> int:
+        """Release all nodes and create a new root node."""
+        self.reset()
+        self.root = self.new_node(to_play=to_play, parent=DUMMY_NODE, move=0)
+        return self.root
+
+    def reroot(self, move: int) -> bool:
+        """Make the child node for the given move the new root, and release all other nodes.
+
+        Returns:
+            bool indicate whether the child node exists, if not the tree is left unchanged.
+        """
+        new_root = self.children[self.root, move]
+        if new_root == MISSING_NODE:
+            return False
+
+        N = self.child_N[self.root, move]
+        W = self.child_W[self.root, move]
+
+        # Release the old root and all the sub-trees not reachable from the new root, one level at a time.
+        frontier = np.array([self.root], dtype=np.int32)
+        while frontier.size > 0:
+            self._free_ids.extend(frontier.tolist())
+            kids = self.children[frontier]
+            frontier = kids[(kids != MISSING_NODE) & (kids != new_root)]
+
+        self.parent[new_root] = DUMMY_NODE
+        self.move[new_root] = 0
+        self.stats_index[new_root] = DUMMY_NODE * self.num_actions
+        self.child_N[DUMMY_NODE, 0] = N
+        self.child_W[DUMMY_NODE, 0] = W
+        self.root = new_root
+        return True
+
+    def _grow(self) -> None:
+        """Doubles the capacity of the arrays."""
+        extra = self.capacity
+
+        def _extend(array, fill_value):
+            padding = np.full((extra,) + array.shape[1:], fill_value, dtype=array.dtype)
+            return np.concatenate([array, padding], axis=0)
+
+        self.child_W = _extend(self.child_W, 0)
+        self.child_N = _extend(self.child_N, 0)
+        self.child_P = _extend(self.child_P, 0)
+        self.children = _extend(self.children, MISSING_NODE)
+        self.parent = _extend(self.parent, MISSING_NODE)
+        self.move = _extend(self.move, 0)
+        self.node_to_play = _extend(self.node_to_play, 0)
+        self.is_expanded = _extend(self.is_expanded, False)
+        self.losses_applied = _extend(self.losses_applied, 0)
+        self.stats_index.extend([0] * extra)
+        self.capacity += extra
+        self._update_flat_views()
+
+    def node_N(self, node: int) -> float:
+        """The number of visits for a node is stored at parent's level."""
+        return self.flat_N[self.stats_index[node]]
+
+    def node_W(self, node: int) -> float:
+        """The total value for a node is stored at parent's level."""
+        return self.flat_W[self.stats_index[node]]
+
+    def node_Q(self, node: int) -> float:
+        """Returns the mean action value Q(s, a) of a node."""
+        N = self.node_N(node)
+        if N > 0:
+            return self.node_W(node) / N
+        return 0.0
+
+    def child_U(self, node: int, c_puct_base: float, c_puct_init: float) -> np.ndarray:
+        """Returns a 1D numpy.array contains prior score for all child of a node."""
+        N = self.node_N(node)
+        pb_c = math.log((1 + N + c_puct_base) / c_puct_base) + c_puct_init
+        return pb_c * self.child_P[node] * (math.sqrt(N) / (1 + self.child_N[node]))
+
+    def child_Q(self, node: int) -> np.ndarray:
+        """Returns a 1D numpy.array contains mean action value for all child of a node."""
+        # Avoid division by zero
+        child_N = np.where(self.child_N[node] > 0, self.child_N[node], 1)
+
+        return self.child_W[node] / child_N
+
+    # These make the tree a drop-in replacement for the `mcts_v2.Node` root node.
+    @property
+    def to_play(self) -> int:
+        return self.node_to_play[self.root]
+
+    @property
+    def N(self) -> float:
+        return self.node_N(self.root)
+
+    @property
+    def W(self) -> float:
+        return self.node_W(self.root)
+
+    @property
+    def Q(self) -> float:
+        return self.node_Q(self.root)
+
+
+def best_child(
+    tree: Tree, node: int, legal_actions: np.ndarray, c_puct_base: float, c_puct_init: float, child_to_play: int
+) -> Tuple[int, int]:
+    """Returns best child node with maximum action value Q plus an upper confidence bound U.
+    And creates the selected best child node if not already exists.
+
+    Args:
+        tree: the search tree.
+        node: the id of current node in the search tree.
+        legal_actions: a 1D bool numpy.array mask for all actions,
+                where `1` represents legal move and `0` represents illegal move.
+        c_puct_base: a float constant determining the level of exploration.
+        c_puct_init: a float constant determining the level of exploration.
+        child_to_play: the player id for children nodes.
+
+    Returns:
+        a tuple of (child node id, move) corresponding to the UCT score.
+
+    Raises:
+        ValueError:
+            if the node instance itself is a leaf node.
+    """
+    if not tree.is_expanded[node]:
+        raise ValueError('Expand leaf node first.')
+
+    # Same as `-tree.child_Q(node) + tree.child_U(node, c_puct_base, c_puct_init)`, but computed in the scratch buffers,
+    # as this runs for every step of every simulation.
+    child_N = tree.child_N[node]
+    ucb_scores = tree._ucb_scores
+    scratch = tree._scratch
+
+    # Child Q values, avoid division by zero
+    np.maximum(child_N, 1, out=scratch)
+    np.divide(tree.child_W[node], scratch, out=ucb_scores)
+
+    # Child U values
+    N = float(tree.flat_N[tree.stats_index[node]])
+    pb_c = math.log((1 + N + c_puct_base) / c_puct_base) + c_puct_init
+    np.add(child_N, 1, out=scratch)
+    np.divide(math.sqrt(N), scratch, out=scratch)
+    scratch *= pb_c * tree.child_P[node]
+
+    # The child Q value is evaluated from the opponent perspective.
+    # when we select the best child for node, we want to do so from node.to_play's perspective,
+    # so we always switch the sign for node.child_Q values, this is required since we're talking about two-player, zero-sum games.
+    np.subtract(scratch, ucb_scores, out=ucb_scores)
+
+    # Exclude illegal actions, note in some cases, the max ucb_scores may be zero.
+    np.copyto(ucb_scores, -9999, where=legal_actions != 1)
+
+    move = int(ucb_scores.argmax())
+
+    assert legal_actions[move] == 1
+
+    child = tree.children[node, move]
+    if child == MISSING_NODE:
+        child = tree.new_node(to_play=child_to_play, parent=node, move=move)
+
+    return child, move
+
+
+def expand(tree: Tree, node: int, prior_prob: np.ndarray) -> None:
+    """Expand all actions, including illegal actions.
+
+    Args:
+        tree: the search tree.
+        node: the id of current leaf node in the search tree.
+        prior_prob: 1D numpy.array contains prior probabilities of the state for all actions.
+
+    Raises:
+        ValueError:
+            if node instance already expanded.
+            if input argument `prior` is not a valid 1D float numpy.array.
+    """
+    if tree.is_expanded[node]:
+        raise RuntimeError('Node already expanded.')
+    if (
+        not isinstance(prior_prob, np.ndarray)
+        or len(prior_prob.shape) != 1
+        or prior_prob.dtype not in (np.float32, np.float64)
+    ):
+        raise ValueError(f'Expect `prior_prob` to be a 1D float numpy.array, got {prior_prob}')
+
+    tree.child_P[node] = prior_prob
+    tree.is_expanded[node] = True
+
+
+def backup(tree: Tree, path: List[int], value: float) -> None:
+    """Update statistics of the leaf node and all traversed parent nodes.
+
+    Args:
+        tree: the search tree.
+        path: the ids of traversed nodes, starting from the root node and ending with current leaf node.
+        value: the evaluation value evaluated from current player's perspective.
+
+    Raises:
+        ValueError:
+            if input argument `value` is not float data type.
+    """
+
+    if not isinstance(value, float):
+        raise ValueError(f'Expect `value` to be a float type, got {type(value)}')
+
+    # Walk the path with scalar indexing, which is much cheaper than fancy indexing for such short paths.
+    flat_N, flat_W, stats_index = tree.flat_N, tree.flat_W, tree.stats_index
+    for node in reversed(path):
+        i = stats_index[node]
+        flat_N[i] += 1
+        flat_W[i] += value
+        # Switch the sign of the value at every level, the leaf node gets the value as is.
+        value = -value
+
+
+def add_dirichlet_noise(tree: Tree, node: int, legal_actions: np.ndarray, eps: float = 0.25, alpha: float = 0.03) -> None:
+    """Add dirichlet noise to a given node.
+
+    Args:
+        tree: the search tree.
+        node: the id of the root node we want to add noise to.
+        legal_actions: a 1D bool numpy.array mask for all actions,
+            where `1` represents legal move and `0` represents illegal move.
+        eps: epsilon constant to weight the priors vs. dirichlet noise.
+        alpha: parameter of the dirichlet noise distribution.
+
+    Raises:
+        ValueError:
+            if input argument `node` is not expanded.
+            if input argument `eps` or `alpha` is not float type
+                or not in the range of [0.0, 1.0].
+    """
+
+    if not tree.is_expanded[node]:
+        raise ValueError('Expect `node` to be expanded')
+    if not isinstance(eps, float) or not 0.0 <= eps <= 1.0:
+        raise ValueError(f'Expect `eps` to be a float in the range [0.0, 1.0], got {eps}')
+    if not isinstance(alpha, float) or not 0.0 <= alpha <= 1.0:
+        raise ValueError(f'Expect `alpha` to be a float in the range [0.0, 1.0], got {alpha}')
+
+    alphas = np.ones_like(legal_actions) * alpha
+    noise = legal_actions * np.random.dirichlet(alphas)
+
+    tree.child_P[node] = tree.child_P[node] * (1 - eps) + noise * eps
+
+
+def add_virtual_loss(tree: Tree, path: List[int]) -> None:
+    """Propagate a virtual loss to the traversed path.
+
+    Args:
+        tree: the search tree.
+        path: the ids of traversed nodes, starting from the root node and ending with current leaf node.
+    """
+    # This is a loss for both players in the traversed path,
+    # since we want to avoid multiple threads to select the same path.
+    # However since we'll switching the sign for child_Q when selecting best child,
+    # here we use +1 instead of -1.
+    flat_W, stats_index, losses_applied = tree.flat_W, tree.stats_index, tree.losses_applied
+    for node in path:
+        losses_applied[node] += 1
+        flat_W[stats_index[node]] += 1
+
+
+def revert_virtual_loss(tree: Tree, path: List[int]) -> None:
+    """Undo virtual loss to the traversed path.
+
+    Args:
+        tree: the search tree.
+        path: the ids of traversed nodes, starting from the root node and ending with current leaf node.
+    """
+    flat_W, stats_index, losses_applied = tree.flat_W, tree.stats_index, tree.losses_applied
+    for node in path:
+        if losses_applied[node] > 0:
+            losses_applied[node] -= 1
+            flat_W[stats_index[node]] -= 1
+
+
+def _prepare_root(
+    env: BoardGameEnv, root_node: Tree, tree: Tree
+) -> Generator[np.ndarray, Tuple[Iterable[np.ndarray], Iterable[float]], Tree]:
+    """Returns the tree to search on, create and evaluate a new root node if we're not reusing a sub-tree.
+    The root state is yielded for evaluation, same as `parallel_uct_search_generator`."""
+    if root_node is None:
+        if tree is None or tree.num_actions != env.action_dim:
+            tree = Tree(num_actions=env.action_dim)
+        prior_probs, values = yield env.observation()[None, ...]
+        root = tree.new_root(to_play=env.to_play)
+        expand(tree, root, prior_probs[0])
+        backup(tree, [root], values[0])
+        return tree
+
+    if not isinstance(root_node, Tree):
+        raise ValueError(f'Expect `root_node` to be a Tree instance or None, got {root_node}')
+    return root_node
+
+
+def _play_and_reroot(
+    env: BoardGameEnv,
+    tree: Tree,
+    root_legal_actions: np.ndarray,
+    warm_up: bool,
+    deterministic: bool,
+) -> Tuple[int, np.ndarray, float, float, Tree]:
+    """Select a move from the search results, and reuse the sub-tree of the selected move."""
+    root = tree.root
+
+    # Play - generate search policy action probability from the root node's child visit number.
+    search_pi = generate_search_policy(np.copy(tree.child_N[root]), 1.0 if warm_up else 0.1, root_legal_actions)
+
+    move = None
+    next_root_node = None
+    best_child_Q = 0.0
+    root_Q = tree.Q
+
+    if deterministic:
+        # Choose the child with most visit count.
+        move = np.argmax(tree.child_N[root])
+    else:
+        # Sample an action
+        # Prevent the agent to select pass move during opening moves
+        while move is None or (warm_up and env.has_pass_move and move == env.pass_move) or root_legal_actions[move] != 1:
+            move = np.random.choice(np.arange(search_pi.shape[0]), p=search_pi)
+
+    assert root_legal_actions[move] == 1
+
+    if tree.reroot(move):
+        next_root_node = tree
+
+        # Child value is computed from opponent's perspective, so we switch the sign
+        best_child_Q = -tree.Q
+
+    return (move, search_pi, root_Q, best_child_Q, next_root_node)
+
+
+def uct_search(
+    env: BoardGameEnv,
+    eval_func: Callable[[np.ndarray, bool], Tuple[Iterable[np.ndarray], Iterable[float]]],
+    root_node: Tree,
+    c_puct_base: float,
+    c_puct_init: float,
+    num_simulations: int = 800,
+    root_noise: bool = False,
+    warm_up: bool = False,
+    deterministic: bool = False,
+    tree: Tree = None,
+    profiler: SearchProfiler = None,
+) -> Tuple[int, np.ndarray, float, float, Tree]:
+    """Single-threaded Upper Confidence Bound (UCB) for Trees (UCT) search without any rollout.
+
+    Same as `mcts_v2.uct_search`, but uses the array-backed `Tree`.
+
+    Args:
+        env: a gym like custom BoardGameEnv environment.
+        eval_func: a evaluation function when called returns the
+            action probabilities and predicted value from
+            current player's perspective.
+        root_node: the search tree returned by last search (reuse sub-tree), or None to start a new search tree.
+        c_puct_base: a float constant determining the level of exploration.
+        c_puct_init: a float constant determining the level of exploration.
+        num_simulations: number of simulations to run, default 800.
+        root_noise: whether add dirichlet noise to root node to encourage exploration, default off.
+        warm_up: if true, use temperature 1.0 to generate play policy, other wise use 0.1, default off.
+        deterministic: after the MCTS search, choose the child node with most visits number to play in the game,
+            instead of sample through a probability distribution, default off.
+        tree: a preallocated tree to reuse the memory when `root_node` is None, default None.
+        profiler: record the time per phase and the search statistics, see `search_profiler.py`, default None.
+
+    Returns:
+        tuple contains:
+            a integer indicate the sampled action to play in the environment.
+            a 1D numpy.array search policy action probabilities from the MCTS search result.
+            a float indicate the root node value
+            a float indicate the best child value
+            a Tree instance re-rooted at the selected child, which can be used as next root node for MCTS search.
+
+    Raises:
+        ValueError:
+            if input argument `env` is not valid BoardGameEnv instance.
+            if input argument `num_simulations` is not a positive integer.
+        RuntimeError:
+            if the game is over.
+    """
+    if not isinstance(env, BoardGameEnv):
+        raise ValueError(f'Expect `env` to be a valid BoardGameEnv instance, got {env}')
+    if not 1 <= num_simulations:
+        raise ValueError(f'Expect `num_simulations` to a positive integer, got {num_simulations}')
+    if env.is_game_over():
+        raise RuntimeError('Game is over.')
+
+    tree = run_with_eval_func(_prepare_root(env, root_node, tree), eval_func)
+    root = tree.root
+    if profiler is not None and root_node is None:
+        profiler.nodes_created += 1
+
+    assert tree.to_play == env.to_play
+
+    root_legal_actions = env.legal_actions
+
+    # Add dirichlet noise to the prior probabilities to root node.
+    if root_noise:
+        add_dirichlet_noise(tree, root, root_legal_actions)
+
+    if profiler is not None:
+        profiler.num_searches += 1
+        t = profiler.timer()
+
+    # Only copy the environment once, and restore it to the root state at the beginning of every simulation,
+    # which is much cheaper than doing a deep copy for every simulation.
+    sim_env = copy.deepcopy(env)
+    root_snapshot = sim_env.snapshot()
+
+    while tree.N < num_simulations:
+        node = root
+        path = [root]
+
+        # Make sure do not touch the actual environment.
+        sim_env.restore(root_snapshot)
+        obs = sim_env.observation()
+        done = sim_env.is_game_over()
+        if profiler is not None:
+            t = profiler.lap('copy_env', t)
+
+        # Phase 1 - Select
+        # Select best child node until one of the following is true:
+        # - reach a leaf node.
+        # - game is over.
+        while tree.is_expanded[node]:
+            # Select the best move and create the child node on demand
+            node, move = best_child(tree, node, sim_env.legal_actions, c_puct_base, c_puct_init, sim_env.opponent_player)
+            path.append(node)
+            if profiler is not None:
+                t = profiler.lap('best_child', t)
+            # Make move on the simulation environment.
+            obs, reward, done, _ = sim_env.step(move)
+            if profiler is not None:
+                t = profiler.lap('env_step', t)
+            if done:
+                break
+
+        assert tree.node_to_play[node] == sim_env.to_play
+        if profiler is not None:
+            profiler.add_simulation(len(path) - 1)
+
+        # Special case - If game is over, using the actual reward from the game to update statistics
+        if done:
+            # The reward is for the last player who made the move won/loss the game.
+            assert tree.node_to_play[node] != sim_env.last_player
+            backup(tree, path, -reward)
+            if profiler is not None:
+                t = profiler.lap('backup', t)
+            continue
+
+        # Phase 2 - Expand and evaluation
+        prior_prob, value = eval_func(obs, False)
+        if profiler is not None:
+            # The evaluation time is recorded by the wrapped evaluation function
+            t = profiler.timer()
+        expand(tree, node, prior_prob)
+        if profiler is not None:
+            profiler.nodes_created += 1
+            t = profiler.lap('expand', t)
+
+        # Phase 3 - Backup statistics
+        backup(tree, path, value)
+        if profiler is not None:
+            t = profiler.lap('backup', t)
+
+    return _play_and_reroot(env, tree, root_legal_actions, warm_up, deterministic)
+
+
+def parallel_uct_search(
+    env: BoardGameEnv,
+    eval_func: Callable[[np.ndarray], Tuple[Iterable[np.ndarray], Iterable[float]]],
+    root_node: Tree,
+    c_puct_base: float,
+    c_puct_init: float,
+    num_simulations: int,
+    num_parallel: int,
+    root_noise: bool = False,
+    warm_up: bool = False,
+    deterministic: bool = False,
+    tree: Tree = None,
+    profiler: SearchProfiler = None,
+) -> Tuple[int, np.ndarray, float, float, Tree]:
+    """Upper Confidence Bound (UCB) for Trees (UCT) search without any rollout, which selects multiple leaves
+    on the array-backed `Tree` before evaluating them in a single batch.
+
+    For every batch, up to `num_parallel` leaves are selected one after another, virtual loss is added along
+    the path of each selected leaf, so the following selections are steered towards different leaves.
+    The virtual losses are reverted once the leaves are evaluated in one call to `eval_func`, then the leaves are expanded
+    and backed up. A leaf selected more than once in the same batch is only expanded and backed up once, and a simulation
+    which ends the game is backed up immediately with the game result. Note the selection still runs in a single thread.
+
+    Args:
+        env: a gym like custom GoEnv environment.
+        eval_func: a evaluation function when called returns the
+            action probabilities and predicted value from
+            current player's perspective.
+        root_node: the search tree returned by last search (reuse sub-tree), or None to start a new search tree.
+        c_puct_base: a float constant determining the level of exploration.
+        c_puct_init: a float constant determining the level of exploration.
+        num_simulations: number of simulations to run.
+        num_parallel: Number of parallel leaves for MCTS search. This is also the batch size for neural network evaluation.
+        root_noise: whether add dirichlet noise to root node to encourage exploration,
+            default off.
+        warm_up: if true, use temperature 1.0 to generate play policy, other wise use 0.1, default off.
+        deterministic: after the MCTS search, choose the child node with most visits number to play in the game,
+            instead of sample through a probability distribution, default off.
+        tree: a preallocated tree to reuse the memory when `root_node` is None, default None.
+        profiler: record the time per phase and the search statistics, see `search_profiler.py`, default None.
+
+    Returns:
+        tuple contains:
+            a integer indicate the sampled action to play in the environment.
+            a 1D numpy.array search policy action probabilities from the MCTS search result.
+            a float indicate the root node value
+            a float indicate the best child value
+            a Tree instance re-rooted at the selected child, which can be used as next root node for MCTS search.
+
+    Raises:
+        ValueError:
+            if input argument `env` is not valid GoEnv instance.
+            if input argument `num_simulations` is not a positive integer.
+        RuntimeError:
+            if the game is over.
+    """
+    return run_with_eval_func(
+        parallel_uct_search_generator(
+            env=env,
+            root_node=root_node,
+            c_puct_base=c_puct_base,
+            c_puct_init=c_puct_init,
+            num_simulations=num_simulations,
+            num_parallel=num_parallel,
+            root_noise=root_noise,
+            warm_up=warm_up,
+            deterministic=deterministic,
+            tree=tree,
+            profiler=profiler,
+        ),
+        eval_func,
+    )
+
+
+def parallel_uct_search_generator(
+    env: BoardGameEnv,
+    root_node: Tree,
+    c_puct_base: float,
+    c_puct_init: float,
+    num_simulations: int,
+    num_parallel: int,
+    root_noise: bool = False,
+    warm_up: bool = False,
+    deterministic: bool = False,
+    tree: Tree = None,
+    profiler: SearchProfiler = None,
+) -> Generator[np.ndarray, Tuple[Iterable[np.ndarray], Iterable[float]], Tuple[int, np.ndarray, float, float, Tree]]:
+    """Same as `parallel_uct_search`, but yields the batched states to be evaluated,
+    see `mcts_v2.parallel_uct_search_generator`."""
+    if not isinstance(env, BoardGameEnv):
+        raise ValueError(f'Expect `env` to be a valid BoardGameEnv instance, got {env}')
+    if not 1 <= num_simulations:
+        raise ValueError(f'Expect `num_simulations` to a positive integer, got {num_simulations}')
+    if env.is_game_over():
+        raise RuntimeError('Game is over.')
+
+    tree = yield from _prepare_root(env, root_node, tree)
+    root = tree.root
+    if profiler is not None and root_node is None:
+        profiler.nodes_created += 1
+
+    assert tree.to_play == env.to_play
+
+    root_legal_actions = env.legal_actions
+
+    # Add dirichlet noise to the prior probabilities to root node.
+    if root_noise:
+        add_dirichlet_noise(tree, root, root_legal_actions)
+
+    if profiler is not None:
+        profiler.num_searches += 1
+        t = profiler.timer()
+
+    # Only copy the environment once, and restore it to the root state at the beginning of every simulation,
+    # which is much cheaper than doing a deep copy for every simulation.
+    sim_env = copy.deepcopy(env)
+    root_snapshot = sim_env.snapshot()
+
+    # The observations of the leaves are written directly into the preallocated batch.
+    batched_obs = np.empty((num_parallel, *env.observation_space.shape), dtype=np.int8)
+
+    while tree.N < num_simulations + num_parallel:
+        leaves = []
+        failsafe = 0
+
+        while len(leaves) < num_parallel and failsafe < num_parallel * 2:
+            # This is necessary as when a game is over no leaf is added to leaves,
+            # as we use the actual game results to update statistic
+            failsafe += 1
+            node = root
+            path = [root]
+
+            # Make sure do not touch the actual environment.
+            sim_env.restore(root_snapshot)
+            done = sim_env.is_game_over()
+            if profiler is not None:
+                t = profiler.lap('copy_env', t)
+
+            # Phase 1 - Select
+            # Select best child node until one of the following is true:
+            # - reach a leaf node.
+            # - game is over.
+            while tree.is_expanded[node]:
+                # Select the best move and create the child node on demand
+                node, move = best_child(tree, node, sim_env.legal_actions, c_puct_base, c_puct_init, sim_env.opponent_player)
+                path.append(node)
+                if profiler is not None:
+                    t = profiler.lap('best_child', t)
+                # Make move on the simulation environment.
+                _, reward, done, _ = sim_env.step(move)
+                if profiler is not None:
+                    t = profiler.lap('env_step', t)
+                if done:
+                    break
+
+            assert tree.node_to_play[node] == sim_env.to_play
+            if profiler is not None:
+                profiler.add_simulation(len(path) - 1)
+
+            # Special case - If game is over, using the actual reward from the game to update statistics.
+            if done:
+                # The reward is for the last player who made the move won/loss the game.
+                assert tree.node_to_play[node] != sim_env.last_player
+                backup(tree, path, -reward)
+                if profiler is not None:
+                    t = profiler.lap('backup', t)
+                continue
+            else:
+                add_virtual_loss(tree, path)
+                if profiler is not None:
+                    t = profiler.lap('backup', t)
+                sim_env.observation(out=batched_obs[len(leaves)])
+                leaves.append(path)
+                if profiler is not None:
+                    t = profiler.lap('env_step', t)
+        if leaves:
+            prior_probs, values = yield batched_obs[: len(leaves)]
+            num_collisions = 0
+            if profiler is not None:
+                t = profiler.timer()
+
+            for path, prior_prob, value in zip(leaves, prior_probs, values):
+                revert_virtual_loss(tree, path)
+
+                # If a node was picked multiple times (despite virtual losses), we shouldn't
+                # expand it more than once.
+                leaf = path[-1]
+                if tree.is_expanded[leaf]:
+                    num_collisions += 1
+                    continue
+
+                if profiler is not None:
+                    t = profiler.lap('backup', t)
+                expand(tree, leaf, prior_prob)
+                if profiler is not None:
+                    t = profiler.lap('expand', t)
+                backup(tree, path, value)
+
+            if profiler is not None:
+                t = profiler.lap('backup', t)
+                profiler.add_leaves(len(leaves), num_collisions)
+                profiler.nodes_created += len(leaves) - num_collisions
+
+    return _play_and_reroot(env, tree, root_legal_actions, warm_up, deterministic)
@@ -5,7 +5,8 @@
 
 """Implements the core functions of training the AlphaZero agent."""
 import os
-from typing import Any, Text, Callable, Mapping, Iterable, Tuple
+from typing import Any, List, Text, Callable, Generator, Iterator, Mapping, Iterable, Optional, Tuple, Union
+from types import GeneratorType
 import time
 from pathlib import Path
 from collections import OrderedDict, deque
@@ -17,7 +18,6 @@ import random
 
 import torch
 import torch.nn.functional as F
-from torch.utils.data import DataLoader
 
 torch.autograd.set_detect_anomaly(True)
 
@@ -26,15 +26,31 @@ from copy import copy, deepcopy
 
 # from mcts_v1 import Node, parallel_uct_search, uct_search
 
-from mcts_v2 import Node, parallel_uct_search, uct_search
+from mcts_v2 import (
+    Node,
+    gumbel_search,
+    gumbel_search_generator,
+    parallel_uct_search,
+    parallel_uct_search_generator,
+    run_with_eval_func,
+    uct_search,
+)
+import mcts_v3
 
 from envs.base import BoardGameEnv
 from eval_dataset import build_eval_dataset
-from rating import EloRating
+from rating import SPRTGate, fit_bradley_terry
 from csv_writer import CsvWriter
-from replay import UniformReplay, Transition
-from transformation import apply_random_transformation
+from replay import UniformReplay, PackedUniformReplay, Transition
+from game_transport import SharedGameBuffer
+from inference_backend import BACKENDS, InferenceModel
+from prefetcher import BatchPrefetcher, sample_batches
+from replay_store import ReplayStore
+from search_profiler import SearchProfiler
+from transformation import NUM_SYMMETRIES, apply_random_transformation, inverse_transform_pi_probs, transform_states
+from transposition_table import TranspositionTable
 from util import Timer, create_logger, get_time_stamp
+from weight_broadcast import WeightBroadcast
 
 
 # =================================================================
@@ -71,6 +87,14 @@ def round_it(v, places=4) -> float:
     return round(v, places)
 
 
+def get_queue_size(q: mp.Queue) -> int:
+    """Returns the approximate number of items in the queue, -1 if not supported on the platform (e.g. macOS)."""
+    try:
+        return q.qsize()
+    except NotImplementedError:
+        return -1
+
+
 def _encode_bytes(in_str) -> Any:
     return str(in_str).encode('utf-8')
 
@@ -79,14 +103,43 @@ def _decode_bytes(b) -> str:
     return b.decode('utf-8')
 
 
-def create_mcts_player(
+EVAL_SYMMETRIES = ('none', 'random', 'average')
+
+# The root node selection for the MCTS players, see `create_mcts_player`
+ROOT_SEARCHES = ('puct', 'gumbel')
+
+
+def create_eval_func(
     network: torch.nn.Module,
     device: torch.device,
-    num_simulations: int,
-    num_parallel: int,
-    root_noise: bool = False,
-    deterministic: bool = False,
-) -> Callable[[BoardGameEnv, Node, float, float, bool], Tuple[int, np.ndarray, float, float, Node]]:
+    symmetry: str = 'none',
+    backend: str = 'eager',
+) -> Callable[[np.ndarray, bool], Tuple[Iterable[np.ndarray], Iterable[float]]]:
+    """Returns a evaluation function using the neural network.
+
+    Args:
+        network: the neural network.
+        device: the device for the neural network.
+        symmetry: one of 'none', 'random', 'average'. For 'random', each position is evaluated on a random board symmetry,
+            for 'average', the outputs are averaged over all 8 symmetries of each position, which is 8 times the compute.
+            In both cases, the action probabilities are mapped back to the original board.
+        backend: one of 'eager', 'torchscript', 'torchscript_int8', run the network in eager PyTorch,
+            or run the exported model on CPU, which is kept in sync with the network weights, see `inference_backend.py`.
+
+    Raises:
+        ValueError:
+            if symmetry is not one of 'none', 'random', 'average'.
+            if backend is not one of 'eager', 'torchscript', 'torchscript_int8', or not 'eager' for non-CPU device.
+    """
+    if symmetry not in EVAL_SYMMETRIES:
+        raise ValueError(f'Expect symmetry to be one of {EVAL_SYMMETRIES}, got "{symmetry}"')
+    if backend not in BACKENDS:
+        raise ValueError(f'Expect backend to be one of {BACKENDS}, got "{backend}"')
+    if backend != 'eager':
+        if torch.device(device).type != 'cpu':
+            raise ValueError(f'Expect device to be CPU for backend "{backend}", got {device}')
+        network = InferenceModel(network, backend)
+
     @torch.no_grad()
     def eval_position(
         state: np.ndarray,
@@ -99,15 +152,29 @@ def create_mcts_player(
             state = state[None, ...]
 
         state = torch.from_numpy(state).to(dtype=torch.float32, device=device, non_blocking=True)
+        B, *_ = state.shape
+
+        if symmetry == 'average':
+            symmetries = torch.arange(NUM_SYMMETRIES, device=state.device).repeat(B)
+            state = transform_states(state.repeat_interleave(NUM_SYMMETRIES, dim=0), symmetries)
+        elif symmetry == 'random':
+            symmetries = torch.randint(0, NUM_SYMMETRIES, (B,), device=state.device)
+            state = transform_states(state, symmetries)
+
         pi_logits, v = network(state)
 
         pi_logits = torch.detach(pi_logits)
         v = torch.detach(v)
 
-        pi = torch.softmax(pi_logits, dim=-1).cpu().numpy()
-        v = v.cpu().numpy()
+        pi = torch.softmax(pi_logits, dim=-1)
+        if symmetry != 'none':
+            pi = inverse_transform_pi_probs(pi, symmetries, state.shape[-1])
+        if symmetry == 'average':
+            pi = pi.reshape(B, NUM_SYMMETRIES, -1).mean(dim=1)
+            v = v.reshape(B, NUM_SYMMETRIES, -1).mean(dim=1)
 
-        B, *_ = state.shape
+        pi = pi.cpu().numpy()
+        v = v.cpu().numpy()
 
         v = np.squeeze(v, axis=1)
         v = v.tolist()  # To list
@@ -121,6 +188,48 @@ def create_mcts_player(
 
         return pi, v
 
+    return eval_position
+
+
+def create_mcts_player(
+    network: torch.nn.Module,
+    device: torch.device,
+    num_simulations: int,
+    num_parallel: int,
+    root_noise: bool = False,
+    deterministic: bool = False,
+    array_tree: bool = False,
+    eval_func: Callable[[np.ndarray, bool], Tuple[Iterable[np.ndarray], Iterable[float]]] = None,
+    transposition_table: TranspositionTable = None,
+    as_generator: bool = False,
+    eval_symmetry: str = 'none',
+    inference_backend: str = 'eager',
+    profiler: SearchProfiler = None,
+    root_search: str = 'puct',
+    num_considered_actions: int = 16,
+) -> Callable[[BoardGameEnv, Node, float, float, bool], Tuple[int, np.ndarray, float, float, Node]]:
+    if root_search not in ROOT_SEARCHES:
+        raise ValueError(f'Expect root_search to be one of {ROOT_SEARCHES}, got "{root_search}"')
+    if root_search == 'gumbel' and array_tree:
+        raise ValueError('Expect array_tree to be False for root_search "gumbel", which is only implemented in mcts_v2')
+
+    # Use the array-backed search tree from mcts_v3, the tree memory is preallocated once and reused for every search.
+    # Note the returned root node is a `mcts_v3.Tree` instance in this case, which should only be passed back to the same player.
+    search_tree = None
+
+    # Use a custom evaluation function instead of the local network, for example the `inference_server.InferenceClient`.
+    # Otherwise the local network optionally evaluates the positions on the board symmetries, see `create_eval_func`.
+    if eval_func is None:
+        eval_func = create_eval_func(network, device, eval_symmetry, inference_backend)
+
+    # Record the time and batch sizes for the evaluation function, only for the positions not in the cache.
+    if profiler is not None:
+        eval_func = profiler.wrap(eval_func)
+
+    # Only evaluate positions not in the cache, note the caller is responsible for clearing the cache when the network changed.
+    if transposition_table is not None:
+        eval_func = transposition_table.wrap(eval_func)
+
     def act(
         env: BoardGameEnv,
         root_node: Node,
@@ -128,10 +237,85 @@ def create_mcts_player(
         c_puct_init: float,
         warm_up: bool = False,
     ) -> Tuple[int, np.ndarray, float, float, Node]:
+        nonlocal search_tree
+
+        if array_tree and (search_tree is None or search_tree.num_actions != env.action_dim):
+            search_tree = mcts_v3.Tree(num_actions=env.action_dim, capacity=2 * (num_simulations + num_parallel))
+
+        # Gumbel-top-k sampling and sequential halving at the root node, the Gumbel noise replaces the dirichlet noise,
+        # and the leaves are evaluated one at a time, so `root_noise` and `num_parallel` are not used.
+        if root_search == 'gumbel':
+            kwargs = dict(
+                env=env,
+                root_node=root_node,
+                c_puct_base=c_puct_base,
+                c_puct_init=c_puct_init,
+                num_simulations=num_simulations,
+                num_considered_actions=num_considered_actions,
+                warm_up=warm_up,
+                deterministic=deterministic,
+                profiler=profiler,
+            )
+            if as_generator:
+                return gumbel_search_generator(**kwargs)
+            return gumbel_search(eval_func=eval_func, **kwargs)
+
+        # Returns the search generator which yields the leaves to be evaluated by the caller,
+        # so the leaves from multiple games can be evaluated in a single batch.
+        # In this case, the network and evaluation function are not used by the player,
+        # and it always uses the parallel search even if `num_parallel` is 1.
+        if as_generator:
+            kwargs = dict(
+                env=env,
+                root_node=root_node,
+                c_puct_base=c_puct_base,
+                c_puct_init=c_puct_init,
+                num_simulations=num_simulations,
+                num_parallel=num_parallel,
+                root_noise=root_noise,
+                warm_up=warm_up,
+                deterministic=deterministic,
+                profiler=profiler,
+            )
+            if array_tree:
+                return mcts_v3.parallel_uct_search_generator(tree=search_tree, **kwargs)
+            return parallel_uct_search_generator(**kwargs)
+
+        if array_tree:
+            if num_parallel > 1:
+                return mcts_v3.parallel_uct_search(
+                    env=env,
+                    eval_func=eval_func,
+                    root_node=root_node,
+                    c_puct_base=c_puct_base,
+                    c_puct_init=c_puct_init,
+                    num_simulations=num_simulations,
+                    num_parallel=num_parallel,
+                    root_noise=root_noise,
+                    warm_up=warm_up,
+                    deterministic=deterministic,
+                    tree=search_tree,
+                    profiler=profiler,
+                )
+            else:
+                return mcts_v3.uct_search(
+                    env=env,
+                    eval_func=eval_func,
+                    root_node=root_node,
+                    c_puct_base=c_puct_base,
+                    c_puct_init=c_puct_init,
+                    num_simulations=num_simulations,
+                    root_noise=root_noise,
+                    warm_up=warm_up,
+                    deterministic=deterministic,
+                    tree=search_tree,
+                    profiler=profiler,
+                )
+
         if num_parallel > 1:
             return parallel_uct_search(
                 env=env,
-                eval_func=eval_position,
+                eval_func=eval_func,
                 root_node=root_node,
                 c_puct_base=c_puct_base,
                 c_puct_init=c_puct_init,
@@ -140,11 +324,12 @@ def create_mcts_player(
                 root_noise=root_noise,
                 warm_up=warm_up,
                 deterministic=deterministic,
+                profiler=profiler,
             )
         else:
             return uct_search(
                 env=env,
-                eval_func=eval_position,
+                eval_func=eval_func,
                 root_node=root_node,
                 c_puct_base=c_puct_base,
                 c_puct_init=c_puct_init,
@@ -152,6 +337,7 @@ def create_mcts_player(
                 root_noise=root_noise,
                 warm_up=warm_up,
                 deterministic=deterministic,
+                profiler=profiler,
             )
 
     return act
@@ -162,7 +348,7 @@ def create_mcts_player(
 # =================================================================
 
 
-def run_selfplay_actor_loop(
+def run_selfplay_actor_loop(  # noqa: C901
     seed: int,
     rank: int,
     network: torch.nn.Module,
@@ -185,9 +371,63 @@ def run_selfplay_actor_loop(
     var_resign_threshold: mp.Value,
     ckpt_event: mp.Event,
     stop_event: mp.Event,
+    inference_client: Any = None,
+    transposition_table_mb: float = 0,
+    num_games: int = 1,
+    game_buffer: SharedGameBuffer = None,
+    weight_broadcast: WeightBroadcast = None,
+    max_staleness: int = 0,
+    inference_backend: str = 'eager',
+    profile_search: bool = False,
+    root_search: str = 'puct',
+    num_considered_actions: int = 16,
+    full_search_prob: float = 1.0,
+    fast_simulations: int = 0,
 ) -> None:
-    """Use the latest neural network to play against itself, and record the transitions for training."""
+    """Use the latest neural network to play against itself, and record the transitions for training.
+
+    If `inference_client` is provided, the positions are evaluated by the shared inference server,
+    and the local `network` is not used, in which case it can be None.
+    The server may switch to a new checkpoint while a game is in progress, the actor clears the transposition table
+    as soon as a response comes from a new checkpoint. Games played by more than one checkpoint are discarded,
+    or tagged with the training steps from the start of the game if `max_staleness` is positive.
+
+    If `transposition_table_mb` is positive, cache the evaluation results in a transposition table
+    with the given memory budget, the cache is cleared whenever the checkpoint changes.
+
+    If `num_games` is greater than 1, play multiple games at the same time,
+    and evaluate the leaves from all the games in a single batch, see `play_concurrent_games`.
+    Once a new checkpoint is available, no new game is started until the games in progress are finished,
+    so the network is only switched when no game is in progress.
+
+    If `game_buffer` is provided, the game is written into the shared memory buffer,
+    and only the slot index is sent over the `data_queue`, instead of the entire game.
+
+    If `weight_broadcast` is provided, the new weights are copied from shared memory as soon as the learner publishes them,
+    instead of loading the checkpoint file.
+
+    If `max_staleness` is positive, the games finished while the learner is creating new checkpoint are still sent,
+    as the learner accepts games played by up to `max_staleness` checkpoints before the latest one.
+
+    If `inference_backend` is not 'eager', the local network is exported to an optimized CPU model,
+    which is exported again after switching to new checkpoint, see `create_eval_func`.
+
+    If `profile_search` is true, record the time per search phase, the search statistics and the evaluation batch sizes,
+    the aggregates since last game finished are written to the actor CSV log file, see `search_profiler.py`.
+    When playing multiple games at the same time, the aggregates include the searches from all the games.
+
+    If `root_search` is 'gumbel', the players use Gumbel-top-k sampling with sequential halving at the root node,
+    sampling `num_considered_actions` actions, and the search policy is the improved policy from the completed Q values,
+    which works with much fewer simulations, see `mcts_v2.gumbel_search`.
+
+    If `full_search_prob` is less than 1, use playout cap randomization, only a random `full_search_prob` fraction of
+    the moves use the full search and are recorded for training, the other moves are played with a cheap search of
+    `fast_simulations` simulations, see `play_and_record_one_game`.
+    """
     assert num_simulations > 1
+    assert num_games >= 1
+    assert 0 < full_search_prob <= 1
+    assert full_search_prob == 1 or 1 <= fast_simulations < num_simulations
 
     set_seed(int(seed + rank))
     logger = create_logger(log_level)
@@ -195,91 +435,300 @@ def run_selfplay_actor_loop(
     timer = Timer()
 
     played_games = training_steps = 0
+    # Time spent waiting for the learner since last game was sent, either for new checkpoint or on the data queue
+    blocked_time = 0.0
     last_ckpt = None
+    last_version = 0
 
     should_save_sgf = False
     if save_sgf_dir is not None and os.path.isdir(save_sgf_dir) and os.path.exists(save_sgf_dir):
         should_save_sgf = True
 
-    disable_auto_grad(network)
-    network = network.to(device=device)
+    if inference_client is None:
+        disable_auto_grad(network)
+        network = network.to(device=device)
 
-    if load_ckpt is not None and os.path.exists(load_ckpt):
-        loaded_state = torch.load(load_ckpt, map_location=device)
-        network.load_state_dict(loaded_state['network'])
-        training_steps = loaded_state['training_steps']
-        logger.debug(f'Actor{rank} loaded state from checkpoint "{load_ckpt}"')
+        if load_ckpt is not None and os.path.exists(load_ckpt):
+            loaded_state = torch.load(load_ckpt, map_location=device)
+            network.load_state_dict(loaded_state['network'])
+            training_steps = loaded_state['training_steps']
+            logger.debug(f'Actor{rank} loaded state from checkpoint "{load_ckpt}"')
 
-    network.eval()
+        network.eval()
 
-    # resign_threshold <= -1 means no resign
-    resign_threshold = var_resign_threshold.value if env.has_resign_move else -1
-    mcts_player = create_mcts_player(
-        network=network,
-        device=device,
-        num_simulations=num_simulations,
-        num_parallel=num_parallel,
-        root_noise=True,
-        deterministic=False,
-    )
+    transposition_table = None
+    cached_training_steps = training_steps
+    if transposition_table_mb > 0:
+        transposition_table = TranspositionTable(
+            state_shape=env.observation_space.shape,
+            num_actions=env.action_space.n,
+            max_memory_mb=transposition_table_mb,
+        )
 
-    while not stop_event.is_set():
-        # Wait for learner to finish creating new checkpoint
-        if ckpt_event.is_set():
-            continue
+    profiler = SearchProfiler() if profile_search else None
+
+    # Number of times the inference server switched checkpoint, as seen from the responses
+    num_server_switches = 0
+
+    def maybe_switch_checkpoint() -> None:
+        nonlocal training_steps, last_ckpt, last_version, cached_training_steps
 
+        if inference_client is not None:
+            # The inference server is responsible for loading new checkpoints
+            training_steps = inference_client.training_steps
+        elif weight_broadcast is not None:
+            if weight_broadcast.version > last_version:
+                last_version, training_steps = weight_broadcast.load(network)
+                network.eval()
+                logger.debug(f'Actor{rank} switched to weights version {last_version}')
+        else:
+            new_ckpt = _decode_bytes(var_ckpt.value)
+            if new_ckpt != '' and new_ckpt != last_ckpt and os.path.exists(new_ckpt):
+                loaded_state = torch.load(new_ckpt, map_location=torch.device(device))
+                network.load_state_dict(loaded_state['network'])
+                training_steps = loaded_state['training_steps']
+                network.eval()
+                last_ckpt = new_ckpt
+                logger.debug(f'Actor{rank} switched to checkpoint "{new_ckpt}"')
+
+        # Cached evaluation results from previous checkpoint are no longer valid
+        if transposition_table is not None and training_steps != cached_training_steps:
+            transposition_table.clear()
+            cached_training_steps = training_steps
+
+    def watch_server_checkpoint(client: Any) -> Callable[[np.ndarray, bool], Tuple[Any, Any]]:
+        def eval_func(state: np.ndarray, batched: bool = False) -> Tuple[Any, Any]:
+            nonlocal num_server_switches, cached_training_steps
+
+            result = client(state, batched)
+            steps = client.response_training_steps
+            if steps is not None and steps != cached_training_steps:
+                num_server_switches += 1
+                cached_training_steps = steps
+                if transposition_table is not None:
+                    transposition_table.clear()
+            return result
+
+        return eval_func
+
+    def spans_server_switch(stats: Mapping[Text, Any], switches_at_start: int) -> bool:
+        if inference_client is None:
+            return False
+        stats['server_switches'] = num_server_switches - switches_at_start
+        return num_server_switches != switches_at_start
+
+    def has_new_checkpoint() -> bool:
+        if inference_client is not None:
+            return inference_client.training_steps != training_steps
+        if weight_broadcast is not None:
+            return weight_broadcast.version > last_version
         new_ckpt = _decode_bytes(var_ckpt.value)
-        if new_ckpt != '' and new_ckpt != last_ckpt and os.path.exists(new_ckpt):
-            loaded_state = torch.load(new_ckpt, map_location=torch.device(device))
-            network.load_state_dict(loaded_state['network'])
-            training_steps = loaded_state['training_steps']
-            network.eval()
-            last_ckpt = new_ckpt
-            logger.debug(f'Actor{rank} switched to checkpoint "{new_ckpt}"')
+        return new_ckpt != '' and new_ckpt != last_ckpt and os.path.exists(new_ckpt)
+
+    def wait_for_new_checkpoint() -> None:
+        nonlocal blocked_time
+
+        start = time.time()
+        if weight_broadcast is not None:
+            # Wake up as soon as the learner publishes the new weights
+            weight_broadcast.wait(weight_broadcast.version, timeout=0.1)
+        else:
+            time.sleep(0.01)
+        blocked_time += time.time() - start
 
-        if env.has_resign_move:
-            resign_threshold = var_resign_threshold.value
+    def sample_resign_settings() -> Tuple[bool, float]:
+        # resign_threshold <= -1 means no resign
+        resign_threshold = var_resign_threshold.value if env.has_resign_move else -1
 
         resign_disabled = True
         if env.has_resign_move and resign_threshold > -1.0 and np.random.rand() > disable_resign_ratio:
             resign_disabled = False
+        return resign_disabled, resign_threshold
 
-        with timer:
-            game_seq, stats = play_and_record_one_game(
-                env=env,
-                mcts_player=mcts_player,
-                resign_disabled=resign_disabled,
-                c_puct_base=c_puct_base,
-                c_puct_init=c_puct_init,
-                warm_up_steps=warm_up_steps,
-                check_resign_after_steps=check_resign_after_steps,
-                resign_threshold=resign_threshold,
-                logger=logger,
-            )
-
-        played_games += 1
-
-        # The second check is necessary, as the events could be set while the actor is in the middle of playing a game.
-        if stop_event.is_set():
-            break
-        if ckpt_event.is_set():
-            continue
+    def record_game(game_env: BoardGameEnv, game_seq: Iterable[Transition], stats: Mapping[Text, Any], steps: int) -> None:
+        nonlocal blocked_time
 
         # Logging
         stats['time_per_game'] = round_it(timer.mean_time())
-        stats['training_steps'] = training_steps
+        stats['training_steps'] = steps
+        stats['blocked_time'] = round_it(blocked_time)
         log_stats = {'datetime': get_time_stamp(), **stats}
         writer.write(OrderedDict((n, v) for n, v in log_stats.items()))
 
+        # With playout cap randomization, a short game may not have any full search
+        if not game_seq:
+            return
+
         # For monitoring
         if should_save_sgf and played_games % save_sgf_interval == 0:
-            sgf_content = env.to_sgf()
+            sgf_content = game_env.to_sgf()
             sgf_file = os.path.join(save_sgf_dir, f'actor{rank}_{get_time_stamp(True)}.sgf')
             with open(sgf_file, 'w') as f:
                 f.write(sgf_content)
                 f.close()
 
-        data_queue.put((game_seq, stats))
+        start = time.time()
+        if game_buffer is not None:
+            slot = game_buffer.write_game(game_seq, stop_event)
+            if slot is None:
+                return
+            data_queue.put((slot, stats))
+        else:
+            data_queue.put((game_seq, stats))
+        blocked_time = time.time() - start
+
+    def create_players(**kwargs) -> Tuple[Any, Any]:
+        # The fast player for playout cap randomization uses fewer simulations and no root noise
+        mcts_player = create_mcts_player(
+            num_simulations=num_simulations,
+            num_parallel=num_parallel,
+            root_noise=True,
+            deterministic=False,
+            profiler=profiler,
+            root_search=root_search,
+            num_considered_actions=num_considered_actions,
+            **kwargs,
+        )
+        fast_mcts_player = None
+        if full_search_prob < 1:
+            fast_mcts_player = create_mcts_player(
+                num_simulations=fast_simulations,
+                num_parallel=min(num_parallel, fast_simulations),
+                root_noise=False,
+                deterministic=False,
+                profiler=profiler,
+                root_search=root_search,
+                num_considered_actions=num_considered_actions,
+                **kwargs,
+            )
+        return mcts_player, fast_mcts_player
+
+    if num_games <= 1:
+        # Both players share the same evaluation function, so the network is only exported once for the inference backend
+        if inference_client is not None:
+            eval_func = watch_server_checkpoint(inference_client)
+        else:
+            eval_func = create_eval_func(network, device, backend=inference_backend)
+        mcts_player, fast_mcts_player = create_players(
+            network=network, device=device, eval_func=eval_func, transposition_table=transposition_table
+        )
+
+        while not stop_event.is_set():
+            # Wait for learner to finish creating new checkpoint
+            if ckpt_event.is_set():
+                wait_for_new_checkpoint()
+                continue
+
+            maybe_switch_checkpoint()
+            resign_disabled, resign_threshold = sample_resign_settings()
+            switches_at_start = num_server_switches
+
+            with timer:
+                game_seq, stats = play_and_record_one_game(
+                    env=env,
+                    mcts_player=mcts_player,
+                    resign_disabled=resign_disabled,
+                    c_puct_base=c_puct_base,
+                    c_puct_init=c_puct_init,
+                    warm_up_steps=warm_up_steps,
+                    check_resign_after_steps=check_resign_after_steps,
+                    resign_threshold=resign_threshold,
+                    logger=logger,
+                    fast_mcts_player=fast_mcts_player,
+                    full_search_prob=full_search_prob,
+                )
+
+            played_games += 1
+
+            if transposition_table is not None:
+                stats.update(transposition_table.stats())
+                transposition_table.reset_stats()
+            if profiler is not None:
+                stats.update(profiler.stats())
+                profiler.reset_stats()
+
+            # The second check is necessary, as the events could be set while the actor is in the middle of playing a game.
+            if stop_event.is_set():
+                break
+            if ckpt_event.is_set() and max_staleness == 0:
+                continue
+            # The game is tagged with the training steps from the start of the game, which is the older checkpoint
+            if spans_server_switch(stats, switches_at_start) and max_staleness == 0:
+                continue
+
+            record_game(env, game_seq, stats, training_steps)
+    else:
+        # Play multiple games at the same time, each game has its own environment and search tree,
+        # and the leaves from all games are evaluated in a single batch.
+        envs = [env] + [deepcopy(env) for _ in range(num_games - 1)]
+        mcts_players = [create_players(network=None, device=None, as_generator=True) for _ in range(num_games)]
+
+        if inference_client is not None:
+            eval_func = watch_server_checkpoint(inference_client)
+        else:
+            eval_func = create_eval_func(network, device, backend=inference_backend)
+        if profiler is not None:
+            eval_func = profiler.wrap(eval_func)
+        if transposition_table is not None:
+            eval_func = transposition_table.wrap(eval_func)
+
+        game_start_times = [0.0] * num_games
+        game_start_switches = [0] * num_games
+
+        def new_game(i: int) -> Generator:
+            # Stop starting new games once the learner is creating a new checkpoint, or a new checkpoint is available,
+            # the games in progress are played to the end with the current checkpoint.
+            if ckpt_event.is_set() or has_new_checkpoint():
+                return None
+
+            resign_disabled, resign_threshold = sample_resign_settings()
+            game_start_times[i] = time.time()
+            game_start_switches[i] = num_server_switches
+
+            return play_and_record_one_game_generator(
+                env=envs[i],
+                mcts_player=mcts_players[i][0],
+                resign_disabled=resign_disabled,
+                c_puct_base=c_puct_base,
+                c_puct_init=c_puct_init,
+                warm_up_steps=warm_up_steps,
+                check_resign_after_steps=check_resign_after_steps,
+                resign_threshold=resign_threshold,
+                logger=logger,
+                fast_mcts_player=mcts_players[i][1],
+                full_search_prob=full_search_prob,
+            )
+
+        while not stop_event.is_set():
+            # Wait for learner to finish creating new checkpoint
+            if ckpt_event.is_set():
+                wait_for_new_checkpoint()
+                continue
+
+            # The local network is only switched when no game is in progress, so every game is played by a single checkpoint
+            maybe_switch_checkpoint()
+
+            for i, (game_seq, stats) in play_concurrent_games(new_game, eval_func, num_games, stop_event):
+                played_games += 1
+
+                # The games are played at the same time, so the time to produce one game is much shorter
+                timer.history.append((time.time() - game_start_times[i]) / num_games)
+
+                if transposition_table is not None:
+                    stats.update(transposition_table.stats())
+                    transposition_table.reset_stats()
+                if profiler is not None:
+                    stats.update(profiler.stats())
+                    profiler.reset_stats()
+
+                # Discard games finished while the learner is creating new checkpoint, unless stale games are accepted
+                if ckpt_event.is_set() and max_staleness == 0:
+                    continue
+                # The inference server may switch checkpoint while the games are in progress
+                if spans_server_switch(stats, game_start_switches[i]) and max_staleness == 0:
+                    continue
+
+                record_game(envs[i], game_seq, stats, training_steps)
 
     logger.debug(f'Actor{rank} received stop signal.')
     writer.close()
@@ -295,7 +744,50 @@ def play_and_record_one_game(
     check_resign_after_steps: int,
     resign_threshold: float,
     logger: Any,
+    fast_mcts_player: Any = None,
+    full_search_prob: float = 1.0,
 ) -> Tuple[Iterable[Transition], Mapping[Text, Any]]:
+    """Play one self-play game, and returns the recorded transitions and the game statistics.
+
+    If `fast_mcts_player` is provided, use playout cap randomization as in the KataGo paper "Accelerating Self-Play Learning in Go",
+    each move uses the full search of `mcts_player` with probability `full_search_prob`, otherwise a cheap search of
+    `fast_mcts_player` (with fewer simulations and no root noise) is used to play the move, and the position is not recorded.
+    Both players should use the same type of search tree, as the sub-tree is reused between the searches.
+    """
+    return run_with_eval_func(
+        play_and_record_one_game_generator(
+            env=env,
+            mcts_player=mcts_player,
+            resign_disabled=resign_disabled,
+            c_puct_base=c_puct_base,
+            c_puct_init=c_puct_init,
+            warm_up_steps=warm_up_steps,
+            check_resign_after_steps=check_resign_after_steps,
+            resign_threshold=resign_threshold,
+            logger=logger,
+            fast_mcts_player=fast_mcts_player,
+            full_search_prob=full_search_prob,
+        ),
+        None,
+    )
+
+
+def play_and_record_one_game_generator(
+    env: BoardGameEnv,
+    mcts_player: Any,
+    resign_disabled: bool,
+    c_puct_base: float,
+    c_puct_init: float,
+    warm_up_steps: int,
+    check_resign_after_steps: int,
+    resign_threshold: float,
+    logger: Any,
+    fast_mcts_player: Any = None,
+    full_search_prob: float = 1.0,
+) -> Generator[np.ndarray, Tuple[Iterable[np.ndarray], Iterable[float]], Tuple[Iterable[Transition], Mapping[Text, Any]]]:
+    """Same as `play_and_record_one_game`, but if the `mcts_player` is created with `as_generator=True`,
+    the states to be evaluated by the search are yielded to the caller, see `mcts_v2.parallel_uct_search_generator`.
+    The game sequence and statistics are returned when the generator is exhausted."""
     obs = env.reset()
     done = False
 
@@ -309,20 +801,29 @@ def play_and_record_one_game(
     is_marked_for_resign = False
     is_could_won = False
     num_passes = 0
+    num_full_searches = 0
 
     while not done:  # For each step
-        (move, search_pi, root_Q, best_child_Q, root_node) = mcts_player(
+        # Playout cap randomization, only the positions with full search are recorded as training samples
+        is_full_search = fast_mcts_player is None or np.random.rand() < full_search_prob
+        num_full_searches += int(is_full_search)
+
+        search_results = (mcts_player if is_full_search else fast_mcts_player)(
             env=env,
             root_node=root_node,
             c_puct_base=c_puct_base,
             c_puct_init=c_puct_init,
             warm_up=False if env.steps > warm_up_steps else True,
         )
+        if isinstance(search_results, GeneratorType):
+            search_results = yield from search_results
+        (move, search_pi, root_Q, best_child_Q, root_node) = search_results
 
-        episode_states.append(obs)
-        episode_search_pis.append(search_pi)
-        episode_values.append(0.0)
-        to_plays.append(env.to_play)
+        if is_full_search:
+            episode_states.append(obs)
+            episode_search_pis.append(search_pi)
+            episode_values.append(0.0)
+            to_plays.append(env.to_play)
 
         if (
             env.has_resign_move
@@ -364,10 +865,14 @@ def play_and_record_one_game(
             is_could_won = True
 
     stats = {
-        'game_length': len(game_seq),
+        'game_length': env.steps,
+        'num_samples': len(game_seq),
         'game_result': env.get_result_string(),
     }
 
+    if fast_mcts_player is not None:
+        stats['full_search_ratio'] = round_it(num_full_searches / env.steps)
+
     if env.has_pass_move:
         stats['num_passes'] = num_passes
 
@@ -381,6 +886,212 @@ def play_and_record_one_game(
     return game_seq, stats
 
 
+def play_concurrent_games(
+    new_game: Callable[[int], Generator[np.ndarray, Tuple[Iterable[np.ndarray], Iterable[float]], Any]],
+    eval_func: Callable[[np.ndarray, bool], Tuple[Iterable[np.ndarray], Iterable[float]]],
+    num_games: int,
+    stop_event: mp.Event,
+) -> Iterator[Tuple[int, Any]]:
+    """Advance multiple games at the same time, where the states yielded by all the games are
+    evaluated in a single call to `eval_func`, this gives a much larger batch size for the neural network,
+    without the need to collect more leaves from a single search tree.
+
+    Args:
+        new_game: a function which takes the slot index and returns a new game generator,
+            for example `play_and_record_one_game_generator`, or None to leave the slot empty.
+        eval_func: the evaluation function.
+        num_games: number of games to play at the same time.
+        stop_event: stop playing once the event is set, note the unfinished games are discarded.
+
+    Yields:
+        the slot index and the return value of the game generator once a game is finished,
+        a new game is then started in the same slot. Returns once all the slots are empty.
+    """
+    games = [new_game(i) for i in range(num_games)]
+    results = [None] * num_games
+    states = [None] * num_games
+
+    while not stop_event.is_set():
+        # Advance each game until it needs to evaluate some states
+        for i in range(num_games):
+            while games[i] is not None:
+                try:
+                    states[i] = games[i].send(results[i])
+                    break
+                except StopIteration as e:
+                    yield i, e.value
+                    games[i] = new_game(i)
+                    results[i] = None
+
+        active = [i for i in range(num_games) if games[i] is not None]
+        if not active:
+            return
+
+        # Evaluate the states from all games in a single batch
+        sizes = [len(states[i]) for i in active]
+        prior_probs, values = eval_func(np.concatenate([states[i] for i in active], axis=0), True)
+
+        ends = np.cumsum(sizes)
+        for i, start, end in zip(active, ends - sizes, ends):
+            results[i] = (prior_probs[start:end], values[start:end])
+
+
+# =================================================================
+# Inference server
+# =================================================================
+
+
+@torch.no_grad()
+def run_inference_server_loop(
+    network: torch.nn.Module,
+    device: torch.device,
+    channels: Any,
+    max_batch_size: int,
+    batch_timeout: float,
+    num_threads: int,
+    log_interval: float,
+    logs_dir: str,
+    load_ckpt: str,
+    log_level: str,
+    var_ckpt: mp.Value,
+    stop_event: mp.Event,
+    weight_broadcast: WeightBroadcast = None,
+) -> None:
+    """Evaluate positions for all self-play actors using the latest neural network.
+
+    The server gathers requests from the actors until there are at least `max_batch_size` positions
+    or `batch_timeout` seconds have passed since the first request, then evaluate them in a single batch.
+    Note the actual batch size may exceed `max_batch_size` by less than one request, as we never split a request.
+
+    Args:
+        network: the neural network.
+        device: the device to run the neural network on.
+        channels: an `inference_server.InferenceChannels` instance shared with the actors.
+        max_batch_size: the maximum number of positions in a single batch.
+        batch_timeout: maximum seconds to wait for more requests before evaluating the batch.
+        num_threads: number of threads used by PyTorch for CPU inference.
+        log_interval: write batch-fill and latency metrics to the CSV file every `log_interval` seconds.
+        logs_dir: the directory for the CSV log file.
+        load_ckpt: resume from the checkpoint file.
+        log_level: the logging level.
+        var_ckpt: the latest checkpoint file, shared with the learner.
+        stop_event: the signal to stop the server.
+        weight_broadcast: if provided, copy the new weights from shared memory instead of loading the checkpoint file.
+    """
+    assert max_batch_size >= 1
+    assert batch_timeout >= 0
+    assert log_interval > 0
+
+    logger = create_logger(log_level)
+    writer = CsvWriter(os.path.join(logs_dir, 'inference_server.csv'), buffer_size=1)
+
+    if num_threads > 0:
+        torch.set_num_threads(num_threads)
+
+    disable_auto_grad(network)
+    network = network.to(device=device)
+
+    last_ckpt = None
+    last_version = 0
+    training_steps = 0
+    if load_ckpt is not None and os.path.exists(load_ckpt):
+        loaded_state = torch.load(load_ckpt, map_location=device)
+        network.load_state_dict(loaded_state['network'])
+        training_steps = loaded_state['training_steps']
+        logger.debug(f'Inference server loaded state from checkpoint "{load_ckpt}"')
+
+    network.eval()
+    channels.training_steps.value = training_steps
+
+    # Checking for new checkpoint requires communicating with the manager process, so only do it periodically
+    ckpt_check_interval = 1.0
+    last_ckpt_check = last_log_time = time.time()
+    num_batches = num_positions = num_requests = 0
+    total_latency = max_latency = 0.0
+
+    while not stop_event.is_set():
+        # Reading the version from shared memory is cheap, so check it before every batch
+        if weight_broadcast is not None and weight_broadcast.version > last_version:
+            last_version, training_steps = weight_broadcast.load(network)
+            network.eval()
+            channels.training_steps.value = training_steps
+            logger.debug(f'Inference server switched to weights version {last_version}')
+        elif weight_broadcast is None and time.time() - last_ckpt_check > ckpt_check_interval:
+            last_ckpt_check = time.time()
+            new_ckpt = _decode_bytes(var_ckpt.value)
+            if new_ckpt != '' and new_ckpt != last_ckpt and os.path.exists(new_ckpt):
+                loaded_state = torch.load(new_ckpt, map_location=torch.device(device))
+                network.load_state_dict(loaded_state['network'])
+                network.eval()
+                last_ckpt = new_ckpt
+                training_steps = loaded_state['training_steps']
+                channels.training_steps.value = training_steps
+                logger.debug(f'Inference server switched to checkpoint "{new_ckpt}"')
+
+        try:
+            requests = [channels.request_queue.get(timeout=1.0)]
+        except queue.Empty:
+            continue
+
+        # Gather more requests until the batch is full or timed out
+        batch_size = requests[0][1]
+        deadline = time.time() + batch_timeout
+        while batch_size < max_batch_size:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                request = channels.request_queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            requests.append(request)
+            batch_size += request[1]
+
+        state = torch.cat([channels.state_buffer[client_id, :n] for client_id, n, _ in requests], dim=0)
+        state = state.to(dtype=torch.float32, device=device, non_blocking=True)
+        pi_logits, v = network(state)
+        pi = torch.softmax(pi_logits, dim=-1).cpu()
+        v = v.squeeze(1).cpu()
+
+        # Write results back to each client's slot, then notify the client
+        sizes = [n for _, n, _ in requests]
+        now = time.time()
+        for (client_id, n, request_time), client_pi, client_v in zip(requests, pi.split(sizes), v.split(sizes)):
+            channels.pi_buffer[client_id, :n] = client_pi
+            channels.value_buffer[client_id, :n] = client_v
+            channels.response_steps[client_id] = training_steps
+            channels.response_events[client_id].set()
+
+            latency = now - request_time
+            total_latency += latency
+            max_latency = max(max_latency, latency)
+
+        num_batches += 1
+        num_requests += len(requests)
+        num_positions += batch_size
+
+        # Logging
+        if now - last_log_time > log_interval:
+            stats = {
+                'datetime': get_time_stamp(),
+                'training_steps': training_steps,
+                'num_batches': num_batches,
+                'avg_batch_size': round_it(num_positions / num_batches),
+                'avg_batch_fill': round_it(num_positions / (num_batches * max_batch_size)),
+                'avg_requests_per_batch': round_it(num_requests / num_batches),
+                'avg_latency_ms': round_it(1000 * total_latency / num_requests),
+                'max_latency_ms': round_it(1000 * max_latency),
+                'positions_per_second': round_it(num_positions / (now - last_log_time)),
+            }
+            writer.write(OrderedDict((n, v) for n, v in stats.items()))
+            last_log_time = now
+            num_batches = num_positions = num_requests = 0
+            total_latency = max_latency = 0.0
+
+    logger.debug('Inference server received stop signal.')
+    writer.close()
+
+
 # =================================================================
 # Learner
 # =================================================================
@@ -392,7 +1103,7 @@ def run_learner_loop(  # noqa: C901
     optimizer: torch.optim.Optimizer,
     lr_scheduler: torch.optim.lr_scheduler.MultiStepLR,
     device: torch.device,
-    replay: UniformReplay,
+    replay: Union[UniformReplay, PackedUniformReplay],
     logger: Any,
     argument_data: bool,
     batch_size: int,
@@ -417,9 +1128,33 @@ def run_learner_loop(  # noqa: C901
     var_resign_threshold: mp.Value,
     ckpt_event: mp.Event,
     stop_event: mp.Event,
+    game_buffer: SharedGameBuffer = None,
+    prefetch_batches: int = 0,
+    prefetch_workers: int = 2,
+    async_ingestion: bool = False,
+    weight_broadcast: WeightBroadcast = None,
+    max_staleness: int = 0,
     lock=threading.Lock(),
 ) -> None:
-    """Update the neural network, dynamically adjust resignation threshold if required."""
+    """Update the neural network, dynamically adjust resignation threshold if required.
+
+    If `game_buffer` is provided, the actors send the slot index of the game in the shared memory buffer,
+    instead of the entire game.
+
+    If `prefetch_batches` is greater than 0, the training batches are sampled and prepared by `prefetch_workers`
+    background threads, which keep up to `prefetch_batches` batches ready while the current batch is trained.
+
+    If `async_ingestion` is True, a separate thread keeps pulling games from the `data_queue` into the replay,
+    and adjusting the resignation threshold, while the network is trained on this thread.
+    The actors are not paused while training, and keep playing with the latest checkpoint.
+
+    If `weight_broadcast` is provided, the new weights are published to the actors through shared memory
+    right after training, and the checkpoint file is written by a background thread.
+
+    The games played by the latest checkpoint, or up to `max_staleness` checkpoints before it, are added to the replay,
+    older games are dropped. The number of accepted, stale (accepted but not from the latest checkpoint),
+    and dropped games are logged in the training.csv file.
+    """
     assert min_games >= 1000
     assert init_resign_threshold < -0.5
     assert target_fp_rate <= 0.05
@@ -428,6 +1163,7 @@ def run_learner_loop(  # noqa: C901
     assert log_interval >= 100
     assert save_replay_interval >= 0
     assert max_training_steps > 0
+    assert max_staleness >= 0
     assert ckpt_dir is not None and os.path.exists(ckpt_dir) and os.path.isdir(ckpt_dir)
 
     set_seed(int(seed))
@@ -442,8 +1178,10 @@ def run_learner_loop(  # noqa: C901
     if training_sample_ratio > 0.25:
         logger.warning(f'Training sample ratio {training_sample_ratio:.2f} might be too high')
 
+    replay_store = None
     if save_replay_interval > 0:
-        logger.warning(f'Saving replay state has been enabled, make you have at least 100GB of free space at "{ckpt_dir}"')
+        replay_store = ReplayStore(os.path.join(ckpt_dir, 'replay'))
+        logger.info(f'Saving replay state has been enabled, new samples are appended to "{replay_store.store_dir}"')
 
     if init_resign_threshold <= -1:
         with lock:
@@ -464,11 +1202,21 @@ def run_learner_loop(  # noqa: C901
         var_ckpt.value = _encode_bytes('')
         ckpt_event.clear()
 
-    if load_replay is not None and os.path.exists(load_replay):
+    if load_replay is not None and os.path.isdir(load_replay):
+        # Replay state saved by `ReplayStore`
+        num_loaded = ReplayStore(load_replay).load(replay)
+        logger.info(f'Learner loaded {num_loaded} samples from replay state "{load_replay}"')
+    elif load_replay is not None and os.path.exists(load_replay):
+        # Legacy replay state pickled into a single file
         replay_state = load_from_file(load_replay)
         replay.set_state(replay_state)
         logger.info(f'Learner loaded replay state from "{load_replay}"')
 
+    # Start over if the saved samples in the store do not belong to the current replay,
+    # the first save will then write all the samples in the replay
+    if replay_store is not None and replay_store.num_samples_added != replay.num_samples_added:
+        replay_store.clear()
+
     if load_ckpt is not None and os.path.exists(load_ckpt):
         loaded_state = torch.load(load_ckpt, map_location=device)
         network.load_state_dict(loaded_state['network'])
@@ -479,23 +1227,61 @@ def run_learner_loop(  # noqa: C901
 
     network.train()
 
-    while True:
-        try:
-            item = data_queue.get()
-            if not isinstance(item, Tuple):
-                continue
-
-            game_seq, stats = item
-
-            # Additional check to ensure that we collect equal amount of games from each checkpoint
-            if stats['training_steps'] != training_steps:
-                continue
+    train_timer = Timer()
+
+    # Protects the replay and the ingestion counters, as the games could be ingested by a separate thread
+    replay_lock = threading.Lock()
+
+    prefetcher = None
+    if prefetch_batches > 0:
+        prefetcher = BatchPrefetcher(
+            replay=replay,
+            batch_size=batch_size,
+            argumentation=argument_data,
+            pin_memory=device.type == 'cuda',
+            num_workers=prefetch_workers,
+            max_prefetch=prefetch_batches,
+            stop_event=stop_event,
+            replay_lock=replay_lock,
+        )
 
+    ready_to_train = threading.Event()
+    # Training steps of the latest `max_staleness + 1` checkpoints, the games played by any of them are accepted,
+    # along with the number of games accepted from each checkpoint
+    ckpt_window = OrderedDict([(training_steps, 0)])
+    accepted_games = stale_games = dropped_games = 0
+    blocked_time_que = deque(maxlen=2000)
+
+    def ingest_game(item: Any) -> None:
+        nonlocal last_ckpt_games, last_ckpt_samples, resign_count, last_resign_count, could_won_count
+        nonlocal accepted_games, stale_games, dropped_games
+
+        if not isinstance(item, Tuple):
+            return
+
+        # The game is either a list of transitions, or the slot index in the shared memory buffer
+        game, stats = item
+
+        # Copy the game out of the shared memory buffer before taking the lock, this also releases the slot
+        game_seq = game_buffer.read_game(game, stats['num_samples']) if game_buffer is not None else game
+
+        with replay_lock:
+            # Only accept games played by the checkpoints in the window, so the training data is not too far off-policy.
+            # The window is checked and updated under the same lock, as the learner may evict checkpoints at any time
+            if stats['training_steps'] not in ckpt_window:
+                dropped_games += 1
+                return
+
+            accepted_games += 1
+            if stats['training_steps'] != next(reversed(ckpt_window)):
+                stale_games += 1
+            ckpt_window[stats['training_steps']] += 1
             last_ckpt_games += 1
-            last_ckpt_samples += stats['game_length']
+            last_ckpt_samples += stats['num_samples']
             replay.add_game(game_seq)
             game_time_que.append(stats['time_per_game'])
             game_length_que.append(stats['game_length'])
+            blocked_time_que.append(stats.get('blocked_time', 0))
 
             # Logging
             if replay.num_games_added % 10000 == 0:
@@ -509,10 +1295,10 @@ def run_learner_loop(  # noqa: C901
                 )
 
             # Save replay buffer state periodically to avoid starting from zero.
-            if save_replay_interval > 0 and replay.num_games_added % save_replay_interval == 0:
-                replay_file = os.path.join(ckpt_dir, 'replay_state.ckpt')
-                save_to_file(replay.get_state(), replay_file)
-                logger.debug(f'Replay buffer state saved at "{replay_file}"')
+            # Only the samples added since last save are written to disk.
+            if replay_store is not None and replay.num_games_added % save_replay_interval == 0:
+                num_saved = replay_store.save(replay)
+                logger.debug(f'Replay buffer state saved at "{replay_store.store_dir}", {num_saved} new samples')
 
             # Adjust resignation threshold
             if init_resign_threshold > -1.0 and replay.num_games_added >= no_resign_games:
@@ -551,73 +1337,160 @@ def run_learner_loop(  # noqa: C901
                         with lock:
                             var_resign_threshold.value = new_threshold
 
-            # Perform network parameters update
             if replay.num_games_added == min_games or (
                 replay.num_games_added >= min_games and last_ckpt_games >= games_per_ckpt
             ):
-                logger.debug(
-                    f'Collected {last_ckpt_games} games, {last_ckpt_samples} samples from last checkpoint (training steps {training_steps})'
-                )
+                ready_to_train.set()
 
-                with lock:
-                    ckpt_event.set()
-
-                network.train()
-
-                target_t = training_steps + ckpt_interval
-
-                while training_steps < target_t:
-                    transitions = replay.sample(batch_size)
-                    if transitions is None:
-                        continue
-
-                    optimizer.zero_grad()
-                    pi_loss, v_loss = compute_losses(network, device, transitions, argument_data)
-                    loss = pi_loss + v_loss
-                    loss.backward()
-                    optimizer.step()
-                    lr_scheduler.step()
-                    training_steps += 1
-
-                    # Logging statistics
-                    if training_steps % log_interval == 0 or training_steps % ckpt_interval == 0:
-                        stats = {
-                            'datetime': get_time_stamp(),
-                            'training_steps': training_steps,
-                            'policy_loss': pi_loss.detach().item(),
-                            'value_loss': v_loss.detach().item(),
-                            'learning_rate': lr_scheduler.get_last_lr()[0],
-                            'total_games': replay.num_games_added,
-                            'total_samples': replay.num_samples_added,
-                        }
-                        writer.write(OrderedDict((n, v) for n, v in stats.items()))
-
-                # Create checkpoint
-                ckpt_file = os.path.join(ckpt_dir, f'training_steps_{training_steps}.ckpt')
-                torch.save(
-                    {
-                        'network': network.state_dict(),
-                        'optimizer': optimizer.state_dict(),
-                        'lr_scheduler': lr_scheduler.state_dict(),
-                        'training_steps': training_steps,
-                    },
-                    ckpt_file,
-                )
+    # Background thread for writing the checkpoint file when the weights are published through shared memory
+    ckpt_thread = None
+
+    def save_checkpoint(state: Mapping[Text, Any], ckpt_file: str) -> None:
+        torch.save(state, ckpt_file)
+        with lock:
+            var_ckpt.value = _encode_bytes(ckpt_file)
+        logger.debug(f'New checkpoint for training steps {state["training_steps"]} is created at "{ckpt_file}"')
 
-                with lock:
-                    var_ckpt.value = _encode_bytes(ckpt_file)
-                    ckpt_event.clear()
+    def train_and_checkpoint() -> None:
+        nonlocal training_steps, last_ckpt_games, last_ckpt_samples, ckpt_thread
 
-                logger.debug(f'New checkpoint for training steps {training_steps} is created at "{ckpt_file}"')
+        with replay_lock:
+            logger.debug(
+                f'Collected {last_ckpt_games} games, {last_ckpt_samples} samples from last checkpoint (training steps {training_steps}), '
+                f'games accepted from each checkpoint in the window {dict(ckpt_window)}'
+            )
+            # Games ingested while training count towards the next checkpoint
+            last_ckpt_games = 0
+            last_ckpt_samples = 0
+            ready_to_train.clear()
 
-                last_ckpt_games = 0
-                last_ckpt_samples = 0
+        # With asynchronous ingestion, the actors keep playing with the latest checkpoint while the learner trains
+        if not async_ingestion:
+            with lock:
+                ckpt_event.set()
 
-            if training_steps >= max_training_steps:
-                break
+        network.train()
+
+        # The batches are sampled while holding the replay lock, as the replay could be modified by ingestion thread
+        if prefetcher is not None:
+            batches = prefetcher.batches(ckpt_interval)
+        else:
+            batches = sample_batches(replay, batch_size, ckpt_interval, replay_lock)
+
+        with train_timer:
+            for transitions in batches:
+                optimizer.zero_grad()
+                # The prefetched batches already had random transformation applied
+                pi_loss, v_loss = compute_losses(network, device, transitions, argument_data and prefetcher is None)
+                loss = pi_loss + v_loss
+                loss.backward()
+                optimizer.step()
+                lr_scheduler.step()
+                training_steps += 1
+
+                # Logging statistics
+                if training_steps % log_interval == 0 or training_steps % ckpt_interval == 0:
+                    stats = {
+                        'datetime': get_time_stamp(),
+                        'training_steps': training_steps,
+                        'policy_loss': pi_loss.detach().item(),
+                        'value_loss': v_loss.detach().item(),
+                        'learning_rate': lr_scheduler.get_last_lr()[0],
+                        'total_games': replay.num_games_added,
+                        'total_samples': replay.num_samples_added,
+                        'data_queue_size': get_queue_size(data_queue),
+                        'actor_blocked_time': round_it(np.mean(blocked_time_que)) if blocked_time_que else 0,
+                        'accepted_games': accepted_games,
+                        'stale_games': stale_games,
+                        'dropped_games': dropped_games,
+                    }
+                    writer.write(OrderedDict((n, v) for n, v in stats.items()))
+
+        logger.debug(f'Learner trained at {ckpt_interval / train_timer.last_time():.1f} steps/second')
+
+        # Create checkpoint
+        ckpt_file = os.path.join(ckpt_dir, f'training_steps_{training_steps}.ckpt')
+        if weight_broadcast is not None:
+            # The actors only need the new weights, so writing the checkpoint file is taken off the critical path,
+            # the state is copied first, as the network and optimizer are updated again in the next round of training
+            state = {
+                'network': {k: v.detach().to('cpu', copy=True) for k, v in network.state_dict().items()},
+                'optimizer': deepcopy(optimizer.state_dict()),
+                'lr_scheduler': lr_scheduler.state_dict(),
+                'training_steps': training_steps,
+            }
+            weight_broadcast.publish(network, training_steps)
+            with lock:
+                ckpt_event.clear()
+
+            if ckpt_thread is not None:
+                ckpt_thread.join()
+            ckpt_thread = threading.Thread(target=save_checkpoint, args=(state, ckpt_file))
+            ckpt_thread.start()
+        else:
+            save_checkpoint(
+                {
+                    'network': network.state_dict(),
+                    'optimizer': optimizer.state_dict(),
+                    'lr_scheduler': lr_scheduler.state_dict(),
+                    'training_steps': training_steps,
+                },
+                ckpt_file,
+            )
+            with lock:
+                ckpt_event.clear()
+
+        with replay_lock:
+            ckpt_window[training_steps] = 0
+            while len(ckpt_window) > max_staleness + 1:
+                ckpt_window.popitem(last=False)
+
+    if async_ingestion:
+        # Keep pulling games into replay in a separate thread, while the optimizer loop runs on this thread
+        ingestion_done = threading.Event()
+        ingestion_error = None
+
+        def run_ingestion_loop() -> None:
+            nonlocal ingestion_error
+            while not ingestion_done.is_set():
+                try:
+                    item = data_queue.get(timeout=1)
+                except (queue.Empty, EOFError):
+                    continue
+                try:
+                    ingest_game(item)
+                except Exception as error:
+                    logger.exception('Learner ingestion thread failed to ingest self-play game')
+                    ingestion_error = error
+                    return
+
+        ingestion_thread = threading.Thread(target=run_ingestion_loop, daemon=True)
+        ingestion_thread.start()
+
+        while training_steps < max_training_steps:
+            if not ready_to_train.wait(timeout=1):
+                if not ingestion_thread.is_alive():
+                    raise RuntimeError('Learner ingestion thread stopped unexpectedly') from ingestion_error
+                continue
+            train_and_checkpoint()
 
-        except (queue.Empty, EOFError) as error:  # noqa: F841
-            pass
+        ingestion_done.set()
+        ingestion_thread.join()
+    else:
+        while training_steps < max_training_steps:
+            try:
+                item = data_queue.get()
+            except (queue.Empty, EOFError):
+                continue
+
+            ingest_game(item)
+
+            # Perform network parameters update
+            if ready_to_train.is_set():
+                train_and_checkpoint()
+
+    if ckpt_thread is not None:
+        ckpt_thread.join()
 
     writer.close()
     time.sleep(30)
@@ -632,11 +1505,12 @@ def run_learner_loop(  # noqa: C901
 
 def compute_losses(network, device, transitions, argumentation=False) -> Tuple[torch.Tensor, torch.Tensor]:
     # [B, C, N, N]
-    state = torch.from_numpy(transitions.state).to(device=device, dtype=torch.float32, non_blocking=True)
+    # The transitions are either numpy arrays sampled from replay, or tensors prepared by the `BatchPrefetcher`
+    state = torch.as_tensor(transitions.state).to(device=device, dtype=torch.float32, non_blocking=True)
     # [B, num_actions]
-    target_pi = torch.from_numpy(transitions.pi_prob).to(device=device, dtype=torch.float32, non_blocking=True)
+    target_pi = torch.as_tensor(transitions.pi_prob).to(device=device, dtype=torch.float32, non_blocking=True)
     # [B, ]
-    target_v = torch.from_numpy(transitions.value).to(device=device, dtype=torch.float32, non_blocking=True)
+    target_v = torch.as_tensor(transitions.value).to(device=device, dtype=torch.float32, non_blocking=True)
 
     if argumentation:
         state, target_pi, target_v = apply_random_transformation(state, target_pi, target_v)
@@ -692,15 +1566,49 @@ def run_evaluator_loop(
     log_level: str,
     var_ckpt: mp.Value,
     stop_event: mp.Event,
+    transposition_table_mb: float = 0,
+    weight_broadcast: WeightBroadcast = None,
+    num_workers: int = 1,
+    max_games: int = 1,
+    opening_steps: int = 0,
+    sprt_elo_margin: float = 35,
 ) -> None:
     """Evaluate the latest neural network by paying against network from last checkpoint.
     Also compute the prediction accuracy on human games if applicable.
+
+    The games are played by `num_workers` processes at the same time, with alternating colors,
+    the first `opening_steps` moves are sampled from the search policy, so the games are different from each other.
+    The match stops once the `SPRTGate` decides the new checkpoint is stronger, weaker or equal to the previous
+    checkpoint by `sprt_elo_margin`, or after `max_games` games.
+
+    If `transposition_table_mb` is positive, each player caches the evaluation results in a transposition table
+    with the given memory budget, since the search always starts from scratch for every move.
+
+    If `weight_broadcast` is provided, wait for the learner to publish new weights through shared memory,
+    instead of polling for new checkpoint file.
     """
     assert num_simulations > 1
+    assert max_games >= 1
+    assert opening_steps >= 0
 
     set_seed(int(seed))
     logger = create_logger(log_level)  # noqa: F841
 
+    # The workers have their own copy of the networks, the weights are sent at the start of each match
+    match_pool = MatchWorkerPool(
+        num_workers=num_workers,
+        seed=seed,
+        network=network,
+        device=device,
+        env=env,
+        num_simulations=num_simulations,
+        num_parallel=num_parallel,
+        c_puct_base=c_puct_base,
+        c_puct_init=c_puct_init,
+        opening_steps=opening_steps,
+        transposition_table_mb=transposition_table_mb,
+    )
+
     network = network.to(device=device)
     disable_auto_grad(network)
 
@@ -708,6 +1616,7 @@ def run_evaluator_loop(
 
     last_ckpt = None
     last_ckpt_step = 0
+    last_version = 0
 
     if load_ckpt is not None and os.path.exists(load_ckpt):
         loaded_state = torch.load(load_ckpt, map_location=device)
@@ -721,52 +1630,51 @@ def run_evaluator_loop(
     network.eval()
     prev_ckpt_network.eval()
 
-    dataloader = None
+    eval_dataset = None
     if eval_games_dir is not None and eval_games_dir != '' and os.path.exists(eval_games_dir):
-        eval_dataset = build_eval_dataset(eval_games_dir, env.num_stack, logger)
-        dataloader = DataLoader(eval_dataset, batch_size=1024, pin_memory=True, shuffle=False, drop_last=False)
+        eval_dataset = build_eval_dataset(eval_games_dir, env.board_size, env.num_stack, logger)
 
-    # Create MCTS players for both players, note black always uses the latest checkpoint,
-    # and white always uses the previous checkpoint
-    black_elo = EloRating(rating=default_rating)
-    white_elo = EloRating(rating=default_rating)
+    # Note black always refers to the latest checkpoint, and white always refers to the previous checkpoint,
+    # regardless of the colors played in the games
+    prev_ckpt_rating = default_rating
 
-    black_player = create_mcts_player(
-        network=network,
-        device=device,
-        num_simulations=num_simulations,
-        num_parallel=num_parallel,
-        root_noise=False,
-        deterministic=True,
-    )
+    while not stop_event.is_set():
+        if weight_broadcast is not None:
+            if not weight_broadcast.wait(last_version, timeout=30):
+                continue
 
-    white_player = create_mcts_player(
-        network=prev_ckpt_network,
-        device=device,
-        num_simulations=num_simulations,
-        num_parallel=num_parallel,
-        root_noise=False,
-        deterministic=True,
-    )
+            # Copy the new weights in place
+            last_version, training_steps = weight_broadcast.load(network)
+        else:
+            ckpt_file = _decode_bytes(var_ckpt.value)
+            if ckpt_file == '' or ckpt_file == last_ckpt or not os.path.exists(ckpt_file):
+                time.sleep(30)
+                continue
 
-    while not stop_event.is_set():
-        ckpt_file = _decode_bytes(var_ckpt.value)
-        if ckpt_file == '' or ckpt_file == last_ckpt or not os.path.exists(ckpt_file):
-            time.sleep(30)
-            continue
+            # Load states from checkpoint file
+            loaded_state = torch.load(ckpt_file, map_location=torch.device(device))
+            training_steps = loaded_state['training_steps']
+            network.load_state_dict(loaded_state['network'])
+            last_ckpt = ckpt_file
 
-        # Load states from checkpoint file
-        loaded_state = torch.load(ckpt_file, map_location=torch.device(device))
-        training_steps = loaded_state['training_steps']
-        network.load_state_dict(loaded_state['network'])
         network.eval()
-        last_ckpt = ckpt_file
 
-        selfplay_game_stats = eval_against_prev_ckpt(
-            env, black_player, white_player, black_elo, white_elo, c_puct_base, c_puct_init
+        gate = SPRTGate(elo_margin=sprt_elo_margin)
+        start_time = time.time()
+        game_results = match_pool.play(network, prev_ckpt_network, gate, max_games, stop_event)
+        if not game_results:
+            break
+
+        selfplay_game_stats = summarize_match_games(game_results, gate, prev_ckpt_rating)
+        selfplay_game_stats['eval_time'] = round_it(time.time() - start_time)
+        logger.info(
+            f'Evaluated checkpoint for training steps {training_steps} against previous checkpoint over '
+            f'{len(game_results)} games, SPRT decision is {selfplay_game_stats["sprt_decision"]}, '
+            f'Elo difference {selfplay_game_stats["elo_diff"]} '
+            f'[{selfplay_game_stats["elo_diff_lower"]}, {selfplay_game_stats["elo_diff_upper"]}]'
         )
 
-        pro_game_stats = eval_on_pro_games(network, device, dataloader)
+        pro_game_stats = eval_on_pro_games(network, device, eval_dataset)
 
         stats = {
             'datetime': get_time_stamp(),
@@ -777,50 +1685,99 @@ def run_evaluator_loop(
 
         writer.write(OrderedDict((n, v) for n, v in stats.items()))
 
-        # Save the game in sgf format
+        # Save the first game in sgf format
         if save_sgf_dir is not None and os.path.isdir(save_sgf_dir) and os.path.exists(save_sgf_dir):
-            sgf_content = env.to_sgf()
+            sgf_content = game_results[0]['sgf']
             sgf_file = os.path.join(save_sgf_dir, f'eval_training_steps_{training_steps}_vs_{last_ckpt_step}.sgf')
             with open(sgf_file, 'w') as f:
                 f.write(sgf_content)
                 f.close()
 
         # Switching to new model
-        prev_ckpt_network.load_state_dict(loaded_state['network'])
+        prev_ckpt_network.load_state_dict(network.state_dict())
         prev_ckpt_network.eval()
-        # We assume the new model will be the same level as previous model, since they are pretty close
-        white_elo = deepcopy(black_elo)
+        prev_ckpt_rating = selfplay_game_stats['black_elo_rating']
         last_ckpt_step = training_steps
 
+    match_pool.close()
     writer.close()
 
 
-@torch.no_grad()
-def eval_against_prev_ckpt(
-    env,
-    black_player,
-    white_player,
-    black_elo,
-    white_elo,
-    c_puct_base,
-    c_puct_init,
+def summarize_match_games(
+    game_results: Iterable[Mapping[Text, Any]], gate: SPRTGate, prev_ckpt_rating: float
 ) -> Mapping[Text, Any]:
+    """Returns the statistics for the match, where black is the latest checkpoint and white is the previous checkpoint.
+
+    The rating of the latest checkpoint is fitted on all the games of the match at once using the Bradley-Terry model,
+    relative to the fixed rating of the previous checkpoint.
+    """
+    scores = [result['score'] for result in game_results]
+    score_matrix = np.array([[0, sum(scores)], [len(scores) - sum(scores), 0]])
+    black_rating = prev_ckpt_rating + float(fit_bradley_terry(score_matrix, anchor=1)[0])
+
+    elo_diff, elo_diff_lower, elo_diff_upper = gate.elo_confidence_interval()
+    stats = {
+        'eval_games': len(game_results),
+        'new_ckpt_wins': scores.count(1.0),
+        'new_ckpt_draws': scores.count(0.5),
+        'new_ckpt_losses': scores.count(0.0),
+        'elo_diff': round_it(elo_diff, 1),
+        'elo_diff_lower': round_it(elo_diff_lower, 1),
+        'elo_diff_upper': round_it(elo_diff_upper, 1),
+        'sprt_decision': gate.decision if gate.decision is not None else 'inconclusive',
+        'game_length': round_it(np.mean([result['game_length'] for result in game_results])),
+        'game_result': game_results[0]['game_result'],
+    }
+
+    if 'num_passes' in game_results[0]:
+        stats['num_passes'] = round_it(np.mean([result['num_passes'] for result in game_results]))
+
+    stats['black_elo_rating'] = round_it(black_rating, 1)
+    stats['white_elo_rating'] = round_it(prev_ckpt_rating, 1)
+    return stats
+
+
+@torch.no_grad()
+def play_match_game(
+    env: BoardGameEnv,
+    new_players: Tuple[Callable, Callable],
+    prev_players: Tuple[Callable, Callable],
+    new_is_black: bool,
+    opening_steps: int,
+    c_puct_base: float,
+    c_puct_init: float,
+    should_cancel: Callable[[], bool] = None,
+) -> Optional[Mapping[Text, Any]]:
+    """Play one evaluation game between the new and previous checkpoints.
+
+    Each side has a pair of MCTS players, the first one samples the move from the search policy,
+    and is only used for the first `opening_steps` moves, the second one always plays the move with most visits.
+
+    If `should_cancel` is provided, it is checked before every move, and the game is abandoned once it returns true.
+
+    Returns:
+        the game statistics, where `score` is the result for the new checkpoint, 1 for win, 0.5 for draw, and 0 for loss,
+        or None if the game is cancelled.
+    """
     _ = env.reset()
-    mcts_player = None
     done = False
     num_passes = 0
 
+    black_players, white_players = (new_players, prev_players) if new_is_black else (prev_players, new_players)
+
     while not done:
-        if env.to_play == env.black_player:
-            mcts_player = black_player
-        else:
-            mcts_player = white_player
+        if should_cancel is not None and should_cancel():
+            return None
+
+        players = black_players if env.to_play == env.black_player else white_players
+        is_opening = env.steps < opening_steps
+        mcts_player = players[0] if is_opening else players[1]
         move, *_ = mcts_player(
             env=env,
             root_node=None,
             c_puct_base=c_puct_base,
             c_puct_init=c_puct_init,
-            warm_up=False,
+            warm_up=is_opening,
         )
 
         _, _, done, _ = env.step(move)
@@ -828,48 +1785,264 @@ def eval_against_prev_ckpt(
         if env.has_pass_move and move == env.pass_move:
             num_passes += 1
 
+    score = 0.5
+    if env.winner is not None:
+        score = 1.0 if env.winner == (env.black_player if new_is_black else env.white_player) else 0.0
+
     stats = {
         'game_length': env.steps,
         'game_result': env.get_result_string(),
+        'new_is_black': new_is_black,
+        'score': score,
     }
 
     if env.has_pass_move:
         stats['num_passes'] = num_passes
 
-    # Update elo rating for both players
-    if env.winner is not None:
-        if env.winner == env.black_player:
-            winner, loser = black_elo, white_elo
-        elif env.winner == env.white_player:
-            winner, loser = white_elo, black_elo
+    return stats
 
-        winner.update_rating(loser.rating, 1)
-        loser.update_rating(winner.rating, 0)
 
-    stats['black_elo_rating'] = black_elo.rating
-    stats['white_elo_rating'] = white_elo.rating
-    return stats
+@torch.no_grad()
+def run_match_worker_loop(
+    seed: int,
+    rank: int,
+    network: torch.nn.Module,
+    device: torch.device,
+    env: BoardGameEnv,
+    num_simulations: int,
+    num_parallel: int,
+    c_puct_base: float,
+    c_puct_init: float,
+    opening_steps: int,
+    transposition_table_mb: float,
+    task_queue: mp.Queue,
+    result_queue: mp.Queue,
+    active_match: mp.Value,
+) -> None:
+    """Play evaluation games between the new and previous checkpoints for the `MatchWorkerPool`.
+
+    Each task is a tuple of (match_id, game_index, weights), where weights is a pair of state dicts for the new and
+    previous checkpoints, or None if the weights for the match have already been sent to this worker.
+    The new checkpoint plays black for even game index, and white for odd game index.
+    The game is cancelled between moves once `active_match` no longer holds its match id, and no result is sent.
+    """
+    set_seed(int(seed + rank))
+
+    network = network.to(device=device)
+    disable_auto_grad(network)
+    networks = (network, deepcopy(network))
+
+    tables = (None, None)
+    if transposition_table_mb > 0:
+        tables = tuple(
+            TranspositionTable(
+                state_shape=env.observation_space.shape,
+                num_actions=env.action_space.n,
+                max_memory_mb=transposition_table_mb,
+            )
+            for _ in range(2)
+        )
+
+    # For each network, the first player samples the opening moves, the second player always plays the best move
+    players = [
+        tuple(
+            create_mcts_player(
+                network=net,
+                device=device,
+                num_simulations=num_simulations,
+                num_parallel=num_parallel,
+                root_noise=False,
+                deterministic=deterministic,
+                transposition_table=table,
+            )
+            for deterministic in (False, True)
+        )
+        for net, table in zip(networks, tables)
+    ]
+
+    while True:
+        task = task_queue.get()
+        if task is None:
+            break
+
+        match_id, game_index, weights = task
+        if weights is not None:
+            for net, state_dict, table in zip(networks, weights, tables):
+                net.load_state_dict({k: torch.from_numpy(v) for k, v in state_dict.items()})
+                net.eval()
+                if table is not None:
+                    table.clear()
+
+        stats = play_match_game(
+            env,
+            players[0],
+            players[1],
+            game_index % 2 == 0,
+            opening_steps,
+            c_puct_base,
+            c_puct_init,
+            should_cancel=lambda: active_match.value != match_id,
+        )
+        if stats is None:
+            continue
+
+        stats['sgf'] = env.to_sgf()
+        result_queue.put((rank, match_id, game_index, stats))
+
+
+class MatchWorkerPool:
+    """A pool of processes which play evaluation games between the new and previous checkpoints at the same time."""
+
+    def __init__(
+        self,
+        num_workers: int,
+        seed: int,
+        network: torch.nn.Module,
+        device: torch.device,
+        env: BoardGameEnv,
+        num_simulations: int,
+        num_parallel: int,
+        c_puct_base: float,
+        c_puct_init: float,
+        opening_steps: int,
+        transposition_table_mb: float,
+    ) -> None:
+        """
+        Args:
+            num_workers: number of worker processes.
+            seed: the seed for the workers, each worker uses `seed + rank`.
+            network: the neural network, only used to create the networks for the workers.
+            see `run_match_worker_loop` for the other arguments.
+
+        Raises:
+            ValueError:
+                if num_workers is less than 1.
+        """
+        if num_workers < 1:
+            raise ValueError(f'Expect num_workers to be at least 1, got {num_workers}')
+
+        self.match_id = 0
+        # The id of the match being played, 0 when no match is being played, the workers cancel the games from other matches
+        self.active_match = mp.Value('i', 0)
+        self.result_queue = mp.Queue()
+        self.task_queues = [mp.Queue() for _ in range(num_workers)]
+        self.workers = [
+            mp.Process(
+                target=run_match_worker_loop,
+                args=(
+                    seed,
+                    rank,
+                    network,
+                    device,
+                    env,
+                    num_simulations,
+                    num_parallel,
+                    c_puct_base,
+                    c_puct_init,
+                    opening_steps,
+                    transposition_table_mb,
+                    self.task_queues[rank],
+                    self.result_queue,
+                    self.active_match,
+                ),
+                daemon=True,
+            )
+            for rank in range(num_workers)
+        ]
+        for worker in self.workers:
+            worker.start()
+
+    def play(
+        self,
+        network: torch.nn.Module,
+        prev_network: torch.nn.Module,
+        gate: SPRTGate,
+        max_games: int,
+        stop_event: mp.Event,
+    ) -> List[Mapping[Text, Any]]:
+        """Play up to `max_games` games between the two networks with alternating colors,
+        and stop as soon as the gate makes a decision, the unfinished games are cancelled before their next move,
+        so the workers are free for the next match.
+
+        Returns:
+            the statistics of the finished games in the order they finished, see `play_match_game`.
+        """
+        self.match_id += 1
+        self.active_match.value = self.match_id
+        # Copy the weights, as the networks could be updated before the weights are actually sent
+        weights = tuple(
+            {k: v.detach().to('cpu', copy=True).numpy() for k, v in net.state_dict().items()}
+            for net in (network, prev_network)
+        )
+        weights_sent = set()
+        num_started = num_pending = 0
+        game_results = []
+
+        def start_game(rank: int) -> None:
+            nonlocal num_started, num_pending
+            self.task_queues[rank].put((self.match_id, num_started, weights if rank not in weights_sent else None))
+            weights_sent.add(rank)
+            num_started += 1
+            num_pending += 1
+
+        for rank in range(min(len(self.workers), max_games)):
+            start_game(rank)
+
+        while num_pending > 0 and not stop_event.is_set():
+            try:
+                rank, match_id, _, stats = self.result_queue.get(timeout=1)
+            except queue.Empty:
+                if not all(worker.is_alive() for worker in self.workers):
+                    raise RuntimeError('Evaluation match worker stopped unexpectedly')
+                continue
+
+            # The game was still in progress when the previous match stopped early
+            if match_id != self.match_id:
+                continue
+
+            num_pending -= 1
+            game_results.append(stats)
+            gate.update(stats['score'])
+            if gate.decision is not None:
+                break
+            if num_started < max_games:
+                start_game(rank)
+
+        # Cancel the unfinished games
+        self.active_match.value = 0
+        return game_results
+
+    def close(self) -> None:
+        """Stop all the workers, the workers still in the middle of a game are terminated after a short timeout."""
+        for task_queue in self.task_queues:
+            task_queue.put(None)
+        for worker in self.workers:
+            worker.join(timeout=10)
+            if worker.is_alive():
+                worker.terminate()
 
 
 @torch.no_grad()
 def eval_on_pro_games(
     network,
     device,
-    dataloader,
+    eval_dataset,
+    batch_size=1024,
     k_list=(1, 3, 5),
 ) -> Mapping[Text, Any]:
     assert min(k_list) >= 1
 
-    if dataloader is None or not isinstance(dataloader, DataLoader):
+    if eval_dataset is None or len(eval_dataset) == 0:
         return {}
 
     total_correct = {k: 0 for k in k_list}
     total_entropy = 0.0
     total_mse_loss = 0
     total_examples = 0
-    for states, target_pi, target_v in dataloader:
+    # The bit-packed states are unpacked one batch at a time
+    for states, target_indices, target_v in eval_dataset.batches(batch_size):
         states = states.to(device=device, non_blocking=True)
-        target_pi = target_pi.to(device=device, non_blocking=True)
+        target_indices = target_indices.to(device=device, non_blocking=True)
         target_v = target_v.to(device=device, non_blocking=True)
         # Forward pass to get model predictions
         policy_logits_pred, value_pred = network(states)
@@ -878,22 +2051,21 @@ def eval_on_pro_games(
         value_pred = value_pred.squeeze(-1)
 
         assert value_pred.shape == target_v.shape
-        assert policy_pred.shape == target_pi.shape
+        assert policy_pred.shape[0] == target_indices.shape[0]
 
         # Compute the number of correct predictions for each value of k
-        # Note here the target is a one-hot vector,
+        # Note here the target is the index of the human move,
         # so we only check if the indices of top k prediction contains the index of the actual human move
-        batch_size = states.size(0)
+        num_states = states.size(0)
         _, pred = torch.topk(policy_pred, max(k_list), dim=1)
-        target_indices = torch.argmax(target_pi, dim=1)  # Get the index of the actual human move
 
-        # for i in range(batch_size):
+        # for i in range(num_states):
         #     for k in k_list:
         #         if target_indices[i] in pred[i, :k]:
         #             total_correct[k] += 1
 
         # This does the above counting, but much faster
-        expanded_target_indices = target_indices.unsqueeze(1).expand(batch_size, max(k_list))
+        expanded_target_indices = target_indices.unsqueeze(1).expand(num_states, max(k_list))
         matches = pred.eq(expanded_target_indices)
         for i, k in enumerate(k_list):
             total_correct[k] += matches[:, :k].any(dim=1).sum().item()
@@ -906,7 +2078,7 @@ def eval_on_pro_games(
         total_mse_loss += F.mse_loss(value_pred, target_v, reduction='sum').item()
 
         # Update the total number of examples
-        total_examples += batch_size
+        total_examples += num_states
 
     # Compute the top-k accuracies and entropy for the dataset
     policy_accuracies = {k: total_correct[k] / total_examples for k in k_list}
@@ -0,0 +1,175 @@
+# Copyright (c) 2023 Michael Hu.
+# This code is part of the book "The Art of Reinforcement Learning: Fundamentals, Mathematics, and Implementation with Python.".
+# See the accompanying LICENSE file for details.
+
+
+"""Components to prepare the training batches for the learner in background threads.
+
+By default, the learner samples a batch from replay, converts it into tensors, and applies random transformation
+right before each training step, so all of that work sits on the critical path of the optimizer step.
+
+The `BatchPrefetcher` runs the sampling, decompression, augmentation and memory pinning in a few worker threads,
+and keeps the next batches in a bounded queue, while the learner trains on the current batch.
+Threads are used instead of processes, because the replay lives in the learner process,
+and the heavy parts (decompression, numpy and torch operations) release the GIL.
+"""
+
+from typing import Iterator, Union
+import contextlib
+import queue
+import threading
+import multiprocessing as mp
+import torch
+
+from replay import PackedUniformReplay, Transition, UniformReplay
+from transformation import apply_random_transformation
+
+
+def sample_batches(
+    replay: Union[UniformReplay, PackedUniformReplay],
+    batch_size: int,
+    num_batches: int,
+    replay_lock: threading.Lock = None,
+) -> Iterator[Transition]:
+    """Yields `num_batches` batches sampled from replay, on the calling thread.
+
+    If `replay_lock` is provided, it is held while sampling each batch.
+    """
+    replay_lock = replay_lock if replay_lock is not None else contextlib.nullcontext()
+    count = 0
+    while count < num_batches:
+        with replay_lock:
+            transitions = replay.sample(batch_size)
+        if transitions is None:
+            continue
+        count += 1
+        yield transitions
+
+
+class BatchPrefetcher:
+    """Samples and prepares the training batches in background threads."""
+
+    def __init__(
+        self,
+        replay: Union[UniformReplay, PackedUniformReplay],
+        batch_size: int,
+        argumentation: bool,
+        pin_memory: bool,
+        num_workers: int,
+        max_prefetch: int,
+        stop_event: mp.Event,
+        replay_lock: threading.Lock = None,
+    ) -> None:
+        """
+        Args:
+            replay: the replay to sample from.
+            batch_size: sample batch size.
+            argumentation: apply random rotation and mirroring to the batches.
+            pin_memory: copy the batches into pinned memory, for faster transfer to GPU.
+            num_workers: number of worker threads.
+            max_prefetch: maximum number of batches waiting in the queue.
+            stop_event: stop generating batches once it is set.
+            replay_lock: if provided, it is held while sampling from replay, in case the replay is modified by other threads.
+
+        Raises:
+            ValueError:
+                if `num_workers` or `max_prefetch` is not a positive integer.
+        """
+        if num_workers < 1:
+            raise ValueError(f'Expect `num_workers` to be a positive integer, got {num_workers}')
+        if max_prefetch < 1:
+            raise ValueError(f'Expect `max_prefetch` to be a positive integer, got {max_prefetch}')
+
+        self.replay = replay
+        self.batch_size = batch_size
+        self.argumentation = argumentation
+        self.pin_memory = pin_memory
+        self.num_workers = num_workers
+        self.max_prefetch = max_prefetch
+        self.stop_event = stop_event
+        self.replay_lock = replay_lock if replay_lock is not None else contextlib.nullcontext()
+
+    def prepare_batch(self, transitions: Transition) -> Transition:
+        """Converts the sampled batch into float32 tensors, and optionally applies random transformation."""
+        states = torch.from_numpy(transitions.state)
+        pi_probs = torch.from_numpy(transitions.pi_prob).to(dtype=torch.float32)
+        values = torch.from_numpy(transitions.value).to(dtype=torch.float32)
+
+        # Transform the states before the conversion, as the binary planes are much smaller than float32
+        if self.argumentation:
+            states, pi_probs, values = apply_random_transformation(states, pi_probs, values)
+        states = states.to(dtype=torch.float32)
+
+        if self.pin_memory:
+            states, pi_probs, values = states.pin_memory(), pi_probs.pin_memory(), values.pin_memory()
+
+        return Transition(state=states, pi_prob=pi_probs, value=values)
+
+    def batches(self, num_batches: int) -> Iterator[Transition]:
+        """Yields `num_batches` prepared batches, or less if `stop_event` is set.
+
+        The worker threads are started on the first call to `next`, and are always joined before returning,
+        also when the consumer stops iterating early.
+        """
+        batch_queue = queue.Queue(maxsize=self.max_prefetch)
+        done_event = threading.Event()
+        lock = threading.Lock()
+        remaining = [num_batches]
+
+        def should_stop():
+            return done_event.is_set() or self.stop_event.is_set()
+
+        def run_worker():
+            try:
+                while not should_stop():
+                    # Claim a batch, so the workers produce exactly `num_batches` batches in total
+                    with lock:
+                        if remaining[0] <= 0:
+                            return
+                        remaining[0] -= 1
+
+                    with self.replay_lock:
+                        transitions = self.replay.sample(self.batch_size)
+                    while transitions is None and not should_stop():
+                        with self.replay_lock:
+                            transitions = self.replay.sample(self.batch_size)
+                    if transitions is None:
+                        return
+
+                    batch = self.prepare_batch(transitions)
+                    while not should_stop():
+                        try:
+                            batch_queue.put(batch, timeout=0.1)
+                            break
+                        except queue.Full:
+                            pass
+            except Exception as error:
+                # Pass the error to the consumer
+                done_event.set()
+                batch_queue.put(error)
+
+        workers = [threading.Thread(target=run_worker, daemon=True) for _ in range(self.num_workers)]
+        for worker in workers:
+            worker.start()
+
+        try:
+            count = 0
+            while count < num_batches and not self.stop_event.is_set():
+                try:
+                    batch = batch_queue.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                if isinstance(batch, Exception):
+                    raise batch
+                count += 1
+                yield batch
+        finally:
+            done_event.set()
+            # Unblock the workers waiting to put a batch
+            while any(worker.is_alive() for worker in workers):
+                try:
+                    batch_queue.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            for worker in workers:
+                worker.join()
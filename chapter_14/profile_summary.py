@@ -0,0 +1,124 @@
+# Copyright (c) 2023 Michael Hu.
+# This code is part of the book "The Art of Reinforcement Learning: Fundamentals, Mathematics, and Implementation with Python.".
+# See the accompanying LICENSE file for details.
+
+
+"""Summarize and compare the MCTS search profiles from the actor csv log files of one or more training runs.
+
+The self-play actors only write the profiles when the training driver program runs with `--profile_search`,
+see `search_profiler.py`. For every run, the aggregates of all the games from all the actors are reported side by side,
+where the time per phase is in microseconds per simulation, so runs with different number of simulations can be compared.
+
+Example usage:
+```
+python3 -m profile_summary --logs_dirs=./logs/go/9x9_baseline,./logs/go/9x9_array_tree
+python3 -m profile_summary --logs_dirs=./logs/gomoku/13x13 --names=gomoku
+```
+"""
+from absl import app, flags
+from collections import OrderedDict
+from typing import Any, List, Mapping, Text
+import csv
+import logging
+import os
+
+from search_profiler import PHASES
+
+FLAGS = flags.FLAGS
+flags.DEFINE_list('logs_dirs', ['./logs/go/9x9'], 'Comma separated list of log directories, one for each run.')
+flags.DEFINE_list('names', [], 'Optional comma separated list of names for the runs, default uses the log directories.')
+
+
+def load_profile_rows(logs_dir: str) -> List[Mapping[Text, str]]:
+    """Returns the rows with search profiles from all the actor csv log files under the log directory."""
+    rows = []
+    if not os.path.exists(logs_dir):
+        return rows
+
+    for root, _, filenames in os.walk(logs_dir):
+        for f in sorted(filenames):
+            if f.startswith('actor') and f.endswith('.csv'):
+                with open(os.path.join(root, f), 'r') as csv_file:
+                    rows.extend(row for row in csv.DictReader(csv_file) if row.get('prof_simulations'))
+    return rows
+
+
+def summarize_profile(rows: List[Mapping[Text, Any]]) -> Mapping[Text, float]:
+    """Aggregates the search profiles of the games.
+
+    Args:
+        rows: the search profiles, one for each game, as written by the actors.
+
+    Returns:
+        a ordered dict of the aggregated statistics.
+
+    Raises:
+        ValueError:
+            if rows is empty.
+    """
+    if not rows:
+        raise ValueError('Expect rows to be non-empty')
+
+    def total(key):
+        return sum(float(row[key]) for row in rows)
+
+    def ratio(a, b):
+        return a / b if b > 0 else 0.0
+
+    num_searches = total('prof_searches')
+    num_simulations = total('prof_simulations')
+    phase_times = {phase: total(f'prof_{phase}_time') for phase in PHASES}
+    total_time = sum(phase_times.values())
+
+    summary = OrderedDict()
+    summary['games'] = len(rows)
+    summary['searches'] = num_searches
+    summary['simulations_per_search'] = ratio(num_simulations, num_searches)
+    summary['nodes_created_per_search'] = ratio(total('prof_nodes_created'), num_searches)
+    summary['mean_depth'] = ratio(total('prof_total_depth'), num_simulations)
+    summary['max_depth'] = max(float(row['prof_max_depth']) for row in rows)
+    summary['collision_rate'] = ratio(total('prof_collisions'), total('prof_leaves'))
+    summary['mean_batch_size'] = ratio(total('prof_positions'), total('prof_batches'))
+    summary['max_batch_size'] = max(float(row['prof_max_batch_size']) for row in rows)
+    summary['simulations_per_second'] = ratio(num_simulations, total_time)
+    for phase in PHASES:
+        summary[f'{phase}_us_per_simulation'] = ratio(phase_times[phase], num_simulations) * 1e6
+    for phase in PHASES:
+        summary[f'{phase}_share'] = ratio(phase_times[phase], total_time)
+    return summary
+
+
+def format_table(names: List[str], summaries: List[Mapping[Text, float]]) -> str:
+    """Returns a text table with one row per statistic and one column per run."""
+    keys = list(summaries[0].keys())
+    key_width = max(len(k) for k in keys)
+    col_widths = [max(12, len(n)) for n in names]
+
+    lines = [' ' * key_width + ''.join(f'  {n:>{w}}' for n, w in zip(names, col_widths))]
+    for k in keys:
+        lines.append(f'{k:<{key_width}}' + ''.join(f'  {s[k]:>{w}.4g}' for s, w in zip(summaries, col_widths)))
+    return '\n'.join(lines)
+
+
+def main(argv):
+    """Prints the summary of the search profiles for all the runs."""
+    names = FLAGS.names if FLAGS.names else FLAGS.logs_dirs
+    if len(names) != len(FLAGS.logs_dirs):
+        raise ValueError(f'Expect names to have the same length as logs_dirs, got {len(names)} and {len(FLAGS.logs_dirs)}')
+
+    valid_names = []
+    summaries = []
+    for name, logs_dir in zip(names, FLAGS.logs_dirs):
+        rows = load_profile_rows(logs_dir)
+        if not rows:
+            logging.warning(f'No search profiles have been found at "{logs_dir}", make sure the run used --profile_search')
+            continue
+        valid_names.append(name)
+        summaries.append(summarize_profile(rows))
+
+    if summaries:
+        print(format_table(valid_names, summaries))
+
+
+if __name__ == '__main__':
+    app.run(main)
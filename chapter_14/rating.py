@@ -4,8 +4,9 @@
 
 
 """Implements code for the Elo rating system."""
-from typing import Iterable
+from typing import Iterable, Optional, Tuple
 import math
+import numpy as np
 
 
 def get_k_factor(player_ratings: Iterable[float]) -> int:
@@ -65,3 +66,219 @@ class EloRating:
 
         k_factor = get_k_factor((self.rating, opponent_rating))
         self.rating += k_factor * (actual_score - expected_score)
+
+
+def elo_to_score(elo_diff: float) -> float:
+    """Returns the expected score for a player who is `elo_diff` stronger than the opponent."""
+    return 1 / (1 + math.pow(10, -elo_diff / 400))
+
+
+def score_to_elo(score: float) -> float:
+    """Returns the Elo difference which gives the expected score, the score is clipped to (0, 1)."""
+    score = min(max(score, 1e-6), 1 - 1e-6)
+    return -400 * math.log10(1 / score - 1)
+
+
+def fit_bradley_terry(
+    scores: np.ndarray, prior_draws: float = 1.0, anchor: Optional[int] = None, max_iters: int = 10000, tol: float = 1e-9
+) -> np.ndarray:
+    """
+    Fits the Bradley-Terry model to all the game results at once, and returns the Elo ratings for the players.
+
+    Unlike the per-game updates of `EloRating`, the ratings do not depend on the order of the games.
+    The model is fitted with the minorization-maximization (MM) algorithm, where each iteration updates
+    all the players together. Every pair of players who played each other gets `prior_draws` virtual draws,
+    so the ratings are still finite for players who won or lost all their games.
+
+    Args:
+        scores: a square matrix, where scores[i, j] is the total score of player i against player j,
+            with 1 for win, 0.5 for draw, and 0 for loss.
+        prior_draws: number of virtual draws added to each pair of players who played each other.
+        anchor: the player whose rating is fixed to 0, default None means the average rating is 0.
+        max_iters: maximum number of iterations.
+        tol: stop when the largest change of the log-strengths is smaller than this value.
+
+    Returns:
+        the Elo ratings for the players, players without any games are rated 0.
+
+    Raises:
+        ValueError:
+            if scores is not a square matrix, or contains negative values.
+            if prior_draws is not positive.
+    """
+    scores = np.asarray(scores, dtype=np.float64)
+    if scores.ndim != 2 or scores.shape[0] != scores.shape[1]:
+        raise ValueError(f'Expect scores to be a square matrix, got shape {scores.shape}')
+    if np.any(scores < 0):
+        raise ValueError('Expect scores to be non-negative')
+    if prior_draws <= 0:
+        raise ValueError(f'Expect prior_draws to be positive, got {prior_draws}')
+
+    num_players = scores.shape[0]
+    scores = scores.copy()
+    np.fill_diagonal(scores, 0)
+    games = scores + scores.T
+    played = games > 0
+    games = games + prior_draws * played
+    wins = (scores + 0.5 * prior_draws * played).sum(axis=1)
+
+    active = played.any(axis=1)
+    log_p = np.zeros(num_players)
+    games = games[active][:, active]
+    wins = wins[active]
+
+    if len(wins) > 0:
+        p = np.ones(len(wins))
+        for _ in range(max_iters):
+            new_p = wins / (games / (p[:, None] + p[None, :])).sum(axis=1)
+            # The model only depends on the ratio of strengths, normalize to keep the numbers in a sane range
+            new_p /= np.exp(np.mean(np.log(new_p)))
+            delta = np.max(np.abs(np.log(new_p) - np.log(p)))
+            p = new_p
+            if delta < tol:
+                break
+        log_p[active] = np.log(p)
+
+    ratings = 400 * log_p / math.log(10)
+    offset = ratings[anchor] if anchor is not None else ratings[active].mean() if active.any() else 0
+    ratings[active] -= offset
+    return ratings
+
+
+class SPRT:
+    """
+    Sequential probability ratio test for the Elo difference between two players,
+    where H0 is the Elo difference equals to `elo0`, and H1 is the Elo difference equals to `elo1`.
+
+    The log-likelihood ratio uses the normal approximation of the game scores (win=1, draw=0.5, loss=0),
+    which is also used by chess engine testing frameworks like Fishtest.
+
+    Usage example:
+    ```
+    sprt = SPRT(elo0=0, elo1=35)
+    while sprt.status is None:
+        score = play_one_game()
+        sprt.update(score)
+    ```
+
+    """
+
+    def __init__(self, elo0: float, elo1: float, alpha: float = 0.05, beta: float = 0.05) -> None:
+        """
+        Args:
+            elo0: the Elo difference under H0.
+            elo1: the Elo difference under H1.
+            alpha: the probability of accepting H1 while H0 is true.
+            beta: the probability of accepting H0 while H1 is true.
+
+        Raises:
+            ValueError:
+                if elo0 equals to elo1, or alpha, beta not in the range (0, 0.5).
+        """
+        if elo0 == elo1:
+            raise ValueError(f'Expect elo0 and elo1 to be different, got {elo0} and {elo1}')
+        if not 0 < alpha < 0.5 or not 0 < beta < 0.5:
+            raise ValueError(f'Expect alpha and beta to be in the range (0, 0.5), got {alpha} and {beta}')
+
+        self.score0 = elo_to_score(elo0)
+        self.score1 = elo_to_score(elo1)
+        self.lower_bound = math.log(beta / (1 - alpha))
+        self.upper_bound = math.log((1 - beta) / alpha)
+
+        self.wins = self.draws = self.losses = 0
+
+    @property
+    def num_games(self) -> int:
+        return self.wins + self.draws + self.losses
+
+    def update(self, score: float) -> None:
+        """Records the result of one game, where the score is 1 for win, 0.5 for draw, and 0 for loss."""
+        if score == 1:
+            self.wins += 1
+        elif score == 0:
+            self.losses += 1
+        else:
+            self.draws += 1
+
+    def _score_stats(self) -> Tuple[float, float, float]:
+        # Half a win and half a loss are added to the counts, so the variance is never zero with very few games
+        wins, draws, losses = self.wins + 0.5, self.draws, self.losses + 0.5
+        n = wins + draws + losses
+        mean = (wins + 0.5 * draws) / n
+        var = (wins * (1 - mean) ** 2 + draws * (0.5 - mean) ** 2 + losses * mean**2) / n
+        return n, mean, var
+
+    @property
+    def llr(self) -> float:
+        """The log-likelihood ratio of H1 over H0."""
+        if self.num_games == 0:
+            return 0.0
+        n, mean, var = self._score_stats()
+        return n * (self.score1 - self.score0) * (2 * mean - self.score0 - self.score1) / (2 * var)
+
+    @property
+    def status(self) -> Optional[str]:
+        """Returns 'H1' or 'H0' once the hypothesis is accepted, or None if more games are needed."""
+        llr = self.llr
+        if llr >= self.upper_bound:
+            return 'H1'
+        if llr <= self.lower_bound:
+            return 'H0'
+        return None
+
+    def elo_confidence_interval(self, z: float = 1.96) -> Tuple[float, float, float]:
+        """Returns the estimated Elo difference, and the lower and upper bounds of the confidence interval,
+        default z=1.96 gives the 95% confidence interval."""
+        n, mean, var = self._score_stats()
+        std = math.sqrt(var / n)
+        return score_to_elo(mean), score_to_elo(mean - z * std), score_to_elo(mean + z * std)
+
+
+class SPRTGate:
+    """
+    Decides if the new player is stronger, weaker or equal to the opponent, using two SPRTs on the same games,
+    one for the Elo difference of 0 against `elo_margin`, and the other for 0 against `-elo_margin`.
+    """
+
+    def __init__(self, elo_margin: float, alpha: float = 0.05, beta: float = 0.05) -> None:
+        """
+        Args:
+            elo_margin: the Elo difference to be considered as stronger or weaker.
+            alpha: the probability of falsely deciding the new player is stronger or weaker.
+            beta: the probability of missing a new player which is stronger or weaker by `elo_margin`.
+
+        Raises:
+            ValueError:
+                if elo_margin is not positive.
+        """
+        if elo_margin <= 0:
+            raise ValueError(f'Expect elo_margin to be positive, got {elo_margin}')
+
+        self.stronger_test = SPRT(0, elo_margin, alpha, beta)
+        self.weaker_test = SPRT(0, -elo_margin, alpha, beta)
+
+    @property
+    def num_games(self) -> int:
+        return self.stronger_test.num_games
+
+    def update(self, score: float) -> None:
+        """Records the result of one game for the new player, 1 for win, 0.5 for draw, and 0 for loss."""
+        self.stronger_test.update(score)
+        self.weaker_test.update(score)
+
+    @property
+    def decision(self) -> Optional[str]:
+        """Returns one of 'stronger', 'weaker', 'equal', or None if more games are needed."""
+        stronger_status = self.stronger_test.status
+        weaker_status = self.weaker_test.status
+        if stronger_status == 'H1':
+            return 'stronger'
+        if weaker_status == 'H1':
+            return 'weaker'
+        if stronger_status == 'H0' and weaker_status == 'H0':
+            return 'equal'
+        return None
+
+    def elo_confidence_interval(self, z: float = 1.96) -> Tuple[float, float, float]:
+        """Returns the estimated Elo difference, and the lower and upper bounds of the confidence interval."""
+        return self.stronger_test.elo_confidence_interval(z)
@@ -5,7 +5,7 @@
 
 """Replay components for training agents."""
 
-from typing import Mapping, Text, Any, NamedTuple, Optional, Sequence
+from typing import Mapping, Text, Any, NamedTuple, Optional, Sequence, Tuple
 import numpy as np
 import snappy
 
@@ -31,6 +31,31 @@ def uncompress_array(compressed):
     return np.frombuffer(byte_string, dtype=dtype).reshape(shape)
 
 
+def pack_states(states: np.ndarray) -> np.ndarray:
+    """Packs a batch of binary states [B, C, H, W] into bits [B, ceil(C*H*W/8)]."""
+    return np.packbits(states.reshape(len(states), -1), axis=1)
+
+
+def unpack_states(packed_states: np.ndarray, state_shape: Tuple[int, int, int]) -> np.ndarray:
+    """Unpacks a batch of bit-packed states into int8 states [B, C, H, W]."""
+    states = np.unpackbits(packed_states, axis=1, count=int(np.prod(state_shape)))
+    return states.view(np.int8).reshape(len(packed_states), *state_shape)
+
+
+def check_samples_range(replay: Any, start: int, end: int) -> None:
+    """Checks the samples [start, end), counted over all added samples, are still in the replay.
+
+    Raises:
+        ValueError:
+            if some of the samples are not in the replay.
+    """
+    if not replay.num_samples_added - replay.size <= start <= end <= replay.num_samples_added:
+        raise ValueError(
+            f'Expect samples range to be within [{replay.num_samples_added - replay.size}, {replay.num_samples_added}], '
+            f'got [{start}, {end})'
+        )
+
+
 class UniformReplay:
     """Uniform replay, with circular buffer storage for flat named tuples."""
 
@@ -105,6 +130,184 @@ class UniformReplay:
         self.num_samples_added = state['num_samples_added']
         self.storage = state['storage']
 
+    @property
+    def state_shape(self) -> Optional[Tuple[int, ...]]:
+        """Shape of a single state, None if replay is empty."""
+        if self.size == 0:
+            return None
+        return tuple(self.decoder(self.storage[0]).state.shape)
+
+    def export_samples(self, start: int, end: int) -> Transition:
+        """Returns the samples [start, end), counted over all added samples, with bit-packed states."""
+        check_samples_range(self, start, end)
+        transitions = [self.decoder(self.storage[i % self.capacity]) for i in range(start, end)]
+        return Transition(
+            state=pack_states(np.stack([t.state for t in transitions], axis=0)),
+            pi_prob=np.stack([t.pi_prob for t in transitions], axis=0).astype(np.float32),
+            value=np.array([t.value for t in transitions], dtype=np.float32),
+        )
+
+    def import_samples(self, start: int, samples: Transition, state_shape: Tuple[int, int, int]) -> None:
+        """Writes the samples with bit-packed states, starting at `start` counted over all added samples.
+
+        This does not update the number of samples added, which is up to the caller.
+        """
+        states = unpack_states(np.asarray(samples.state), state_shape)
+        for i, (state, pi_prob, value) in enumerate(zip(states, samples.pi_prob, samples.value)):
+            transition = Transition(state=state, pi_prob=np.array(pi_prob), value=float(value))
+            self.storage[(start + i) % self.capacity] = self.encoder(transition)
+
+    @property
+    def size(self) -> int:
+        """Number of items currently contained in replay."""
+        return min(self.num_samples_added, self.capacity)
+
+
+class PackedUniformReplay:
+    """Uniform replay, with preallocated array storage, where the states are bit-packed.
+
+    The states only contain binary feature planes, so each state is flattened and packed into bits,
+    which takes 1/8 of the memory of the int8 state. The policies and values are stored in their own arrays.
+
+    Samples a batch with a single gather on each array, instead of decoding and stacking the transitions one by one.
+    """
+
+    def __init__(
+        self,
+        capacity: int,
+        random_state: np.random.RandomState,  # pylint: disable=no-member
+        state_shape: Tuple[int, int, int],
+        num_actions: int,
+    ):
+        """
+        Args:
+            capacity: maximum number of transitions in replay.
+            random_state: used to sample the transitions.
+            state_shape: the shape of a single state, in the format of [C, H, W].
+            num_actions: number of total actions, including illegal move.
+
+        Raises:
+            ValueError:
+                if `capacity` is not a positive integer.
+        """
+        if capacity <= 0:
+            raise ValueError(f'Expect capacity to be a positive integer, got {capacity}')
+        self.structure = TransitionStructure
+        self.capacity = capacity
+        self.random_state = random_state
+        self.state_shape = tuple(state_shape)
+        self.num_actions = num_actions
+        self.state_size = int(np.prod(self.state_shape))
+
+        self.states = np.zeros((capacity, (self.state_size + 7) // 8), dtype=np.uint8)
+        self.pi_probs = np.zeros((capacity, num_actions), dtype=np.float32)
+        self.values = np.zeros((capacity,), dtype=np.float32)
+
+        self.num_games_added = 0
+        self.num_samples_added = 0
+
+    def add_game(self, game_seq: Sequence[Transition]) -> None:
+        """Add an entire game to replay."""
+        if len(game_seq) == 0:
+            return
+
+        # Only write the last `capacity` transitions if the game is longer than the replay
+        game_length = len(game_seq)
+        start = max(0, game_length - self.capacity)
+        game_seq = game_seq[start:]
+        indices = np.arange(self.num_samples_added + start, self.num_samples_added + game_length) % self.capacity
+
+        states = np.stack([transition.state for transition in game_seq], axis=0)
+        self.states[indices] = pack_states(states)
+        self.pi_probs[indices] = np.stack([transition.pi_prob for transition in game_seq], axis=0)
+        self.values[indices] = [transition.value for transition in game_seq]
+
+        self.num_samples_added += game_length
+        self.num_games_added += 1
+
+    def add(self, transition: Transition) -> None:
+        """Adds single transition to replay."""
+        index = self.num_samples_added % self.capacity
+        self.states[index] = pack_states(transition.state[None, ...])[0]
+        self.pi_probs[index] = transition.pi_prob
+        self.values[index] = transition.value
+        self.num_samples_added += 1
+
+    def get(self, indices: Sequence[int]) -> Transition:
+        """Retrieves items by indices, stacked on the batch dimension."""
+        indices = np.asarray(indices)
+        return Transition(
+            state=unpack_states(self.states[indices], self.state_shape),
+            pi_prob=self.pi_probs[indices],
+            value=self.values[indices],
+        )
+
+    def sample(self, batch_size: int) -> Transition:
+        """Samples batch of items from replay uniformly, with replacement."""
+        if self.size < batch_size:
+            return
+
+        indices = self.random_state.randint(low=0, high=self.size, size=batch_size)
+        return self.get(indices)
+
+    def export_samples(self, start: int, end: int) -> Transition:
+        """Returns the samples [start, end), counted over all added samples, with bit-packed states."""
+        check_samples_range(self, start, end)
+        indices = np.arange(start, end) % self.capacity
+        return Transition(state=self.states[indices], pi_prob=self.pi_probs[indices], value=self.values[indices])
+
+    def import_samples(self, start: int, samples: Transition, state_shape: Tuple[int, int, int]) -> None:
+        """Writes the samples with bit-packed states, starting at `start` counted over all added samples.
+
+        This does not update the number of samples added, which is up to the caller.
+
+        Raises:
+            ValueError:
+                if `state_shape` does not match the replay.
+        """
+        if tuple(state_shape) != self.state_shape:
+            raise ValueError(f'Expect state shape {self.state_shape}, got {tuple(state_shape)}')
+        indices = np.arange(start, start + len(samples.value)) % self.capacity
+        self.states[indices] = samples.state
+        self.pi_probs[indices] = samples.pi_prob
+        self.values[indices] = samples.value
+
+    def get_state(self) -> Mapping[Text, Any]:
+        """Retrieves replay state as a dictionary (e.g. for serialization)."""
+        size = self.size
+        return {
+            'num_games_added': self.num_games_added,
+            'num_samples_added': self.num_samples_added,
+            'states': self.states[:size],
+            'pi_probs': self.pi_probs[:size],
+            'values': self.values[:size],
+        }
+
+    def set_state(self, state: Mapping[Text, Any]) -> None:
+        """Sets replay state from a (potentially de-serialized) dictionary.
+
+        Raises:
+            ValueError:
+                if the stored transitions do not match the capacity or the shape of the replay.
+        """
+        size = len(state['states'])
+        if size != min(state['num_samples_added'], self.capacity):
+            raise ValueError(
+                f'Expect {min(state["num_samples_added"], self.capacity)} transitions in replay state, got {size}'
+            )
+        if state['states'].shape[1:] != self.states.shape[1:] or state['pi_probs'].shape[1:] != self.pi_probs.shape[1:]:
+            raise ValueError(
+                f'Expect replay state with packed states of shape {self.states.shape[1:]} '
+                f'and policies of shape {self.pi_probs.shape[1:]}, '
+                f'got {state["states"].shape[1:]} and {state["pi_probs"].shape[1:]}'
+            )
+
+        self.num_games_added = state['num_games_added']
+        self.num_samples_added = state['num_samples_added']
+        self.states[:size] = state['states']
+        self.pi_probs[:size] = state['pi_probs']
+        self.values[:size] = state['values']
+
     @property
     def size(self) -> int:
         """Number of items currently contained in replay."""
@@ -0,0 +1,147 @@
+# Copyright (c) 2023 Michael Hu.
+# This code is part of the book "The Art of Reinforcement Learning: Fundamentals, Mathematics, and Implementation with Python.".
+# See the accompanying LICENSE file for details.
+
+
+"""Incremental on-disk storage for the replay, so we can resume training without starting from zero.
+
+Instead of pickling the entire replay into a single file on every save, the `ReplayStore` only appends the samples
+added since the last save as a new chunk, where each chunk is a set of `.npy` files for the bit-packed states,
+policies, and values. The `index.json` file is the header, which records the number of games and samples added,
+and the position of each chunk, it is replaced atomically after the chunk files are written.
+
+Chunks which only contain samples that are no longer in the replay are deleted, so the disk usage is bounded by the
+replay capacity. When loading, the chunk files are memory-mapped, and only the samples still fit in the replay are read.
+"""
+
+from typing import Any, List, Mapping, Text
+import json
+import os
+import numpy as np
+
+from replay import Transition
+
+
+INDEX_FILE = 'index.json'
+ARRAY_NAMES = ('states', 'pi_probs', 'values')
+
+
+class ReplayStore:
+    """Append-only chunk files plus an index, which mirrors the samples in a replay."""
+
+    def __init__(self, store_dir: str) -> None:
+        """
+        Args:
+            store_dir: the directory to store the index and chunk files, created if not exists.
+        """
+        self.store_dir = store_dir
+        os.makedirs(store_dir, exist_ok=True)
+
+        self.header = self._read_index()
+
+    @property
+    def num_samples_added(self) -> int:
+        """Number of samples added to the replay at the time of the last save."""
+        return self.header['num_samples_added']
+
+    @property
+    def num_games_added(self) -> int:
+        """Number of games added to the replay at the time of the last save."""
+        return self.header['num_games_added']
+
+    def _read_index(self) -> Mapping[Text, Any]:
+        index_file = os.path.join(self.store_dir, INDEX_FILE)
+        if not os.path.exists(index_file):
+            return {'num_games_added': 0, 'num_samples_added': 0, 'state_shape': None, 'chunks': []}
+
+        with open(index_file, 'r') as f:
+            return json.load(f)
+
+    def _write_index(self) -> None:
+        # Write to a temporary file first, so a crash in the middle never leaves a broken index
+        index_file = os.path.join(self.store_dir, INDEX_FILE)
+        tmp_file = index_file + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(self.header, f)
+        os.replace(tmp_file, index_file)
+
+    def _chunk_files(self, chunk: Mapping[Text, Any]) -> List[str]:
+        return [os.path.join(self.store_dir, f'{chunk["name"]}_{name}.npy') for name in ARRAY_NAMES]
+
+    def save(self, replay: Any) -> int:
+        """Appends the samples added to the replay since the last save, returns the number of samples written.
+
+        Args:
+            replay: an instance of `UniformReplay` or `PackedUniformReplay`.
+
+        Raises:
+            ValueError:
+                if the replay has less samples than the last save, or the state shape does not match the store.
+        """
+        if replay.size == 0:
+            return 0
+
+        state_shape = list(replay.state_shape)
+        if self.header['state_shape'] is not None and self.header['state_shape'] != state_shape:
+            raise ValueError(f'Expect state shape {self.header["state_shape"]}, got {state_shape}')
+        if replay.num_samples_added < self.num_samples_added:
+            raise ValueError(
+                f'Expect replay to have at least {self.num_samples_added} samples added, got {replay.num_samples_added}'
+            )
+
+        # Samples which have been overwritten in the replay since last save are skipped
+        start = max(self.num_samples_added, replay.num_samples_added - replay.size)
+        end = replay.num_samples_added
+
+        if end > start:
+            samples = replay.export_samples(start, end)
+            chunk = {'name': f'chunk_{start:012d}', 'start': start, 'length': end - start}
+            for file, array in zip(self._chunk_files(chunk), samples):
+                np.save(file, np.ascontiguousarray(array))
+            self.header['chunks'].append(chunk)
+
+        self.header['state_shape'] = state_shape
+        self.header['num_games_added'] = replay.num_games_added
+        self.header['num_samples_added'] = replay.num_samples_added
+
+        # Drop the chunks which are no longer in the replay
+        min_start = replay.num_samples_added - replay.size
+        stale_chunks = [c for c in self.header['chunks'] if c['start'] + c['length'] <= min_start]
+        self.header['chunks'] = [c for c in self.header['chunks'] if c['start'] + c['length'] > min_start]
+        self._write_index()
+
+        for chunk in stale_chunks:
+            for file in self._chunk_files(chunk):
+                os.remove(file)
+
+        return end - start
+
+    def load(self, replay: Any) -> int:
+        """Loads the saved samples into the replay, returns the number of samples loaded.
+
+        The chunk files are memory-mapped, so only the samples which still fit in the replay are read from disk.
+        """
+        num_samples_added = self.num_samples_added
+        min_start = num_samples_added - min(num_samples_added, replay.capacity)
+        num_loaded = 0
+
+        for chunk in self.header['chunks']:
+            offset = max(0, min_start - chunk['start'])
+            if offset >= chunk['length']:
+                continue
+            arrays = [np.load(file, mmap_mode='r')[offset:] for file in self._chunk_files(chunk)]
+            replay.import_samples(chunk['start'] + offset, Transition(*arrays), tuple(self.header['state_shape']))
+            num_loaded += chunk['length'] - offset
+
+        replay.num_games_added = self.num_games_added
+        replay.num_samples_added = num_samples_added
+        return num_loaded
+
+    def clear(self) -> None:
+        """Deletes all the saved samples."""
+        for chunk in self.header['chunks']:
+            for file in self._chunk_files(chunk):
+                if os.path.exists(file):
+                    os.remove(file)
+        self.header = {'num_games_added': 0, 'num_samples_added': 0, 'state_shape': None, 'chunks': []}
+        self._write_index()
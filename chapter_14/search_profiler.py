@@ -0,0 +1,131 @@
+# Copyright (c) 2023 Michael Hu.
+# This code is part of the book "The Art of Reinforcement Learning: Fundamentals, Mathematics, and Implementation with Python.".
+# See the accompanying LICENSE file for details.
+
+
+"""Per-phase profiling for the MCTS search and the evaluation function.
+
+The search functions in `mcts_v2.py` and `mcts_v3.py` accept an optional `profiler` argument,
+when it's None (the default), the only cost is a few `is not None` checks per simulation.
+Otherwise the search accumulates the time spent in each phase:
+
+    copy_env      copying the environment once per search, and restoring the root snapshot for every simulation
+    best_child    selecting the child nodes, including creating the child nodes on demand
+    env_step      stepping the simulation environment, and writing the observation of the leaf
+    expand        expanding the leaf nodes with the prior probabilities
+    backup        updating the statistics along the path, including adding and reverting virtual losses
+
+And the time spent in the evaluation function is recorded by wrapping it with `SearchProfiler.wrap`.
+Note the time for the network evaluation is the time for the wrapped function, so if the wrapped function is
+the `inference_server.InferenceClient`, it also includes the time waiting for the server.
+
+The counters include the number of simulations, the nodes created (expanded with the prior probabilities),
+the depth of the simulations, the leaf collisions in the parallel search (leaves which were selected more than once
+in the same batch, despite the virtual losses), and the batch sizes of the evaluation function.
+
+Usage example:
+```
+profiler = SearchProfiler()
+eval_func = profiler.wrap(eval_func)
+move, *_ = mcts_v2.uct_search(env, eval_func, None, 19652, 1.25, profiler=profiler)
+print(profiler.stats())
+profiler.reset_stats()
+```
+
+"""
+
+from typing import Callable, Iterable, Mapping, Text, Tuple
+import timeit
+import numpy as np
+
+
+PHASES = ('copy_env', 'best_child', 'env_step', 'evaluate', 'expand', 'backup')
+
+
+class SearchProfiler:
+    """Accumulates the time per phase and the counters for the MCTS search, until `reset_stats` is called."""
+
+    def __init__(self) -> None:
+        self.timer = timeit.default_timer
+        self.reset_stats()
+
+    def reset_stats(self) -> None:
+        self.phase_times = dict.fromkeys(PHASES, 0.0)
+        self.num_searches = 0
+        self.num_simulations = 0
+        self.nodes_created = 0
+        self.total_depth = 0
+        self.max_depth = 0
+        self.num_leaves = 0
+        self.num_collisions = 0
+        self.num_batches = 0
+        self.num_positions = 0
+        self.max_batch_size = 0
+
+    def lap(self, phase: str, start: float) -> float:
+        """Adds the time since `start` to the phase, and returns the current time as the start of the next phase."""
+        now = self.timer()
+        self.phase_times[phase] += now - start
+        return now
+
+    def add_simulation(self, depth: int) -> None:
+        """Records a simulation which reached the leaf at `depth` moves from the root node."""
+        self.num_simulations += 1
+        self.total_depth += depth
+        if depth > self.max_depth:
+            self.max_depth = depth
+
+    def add_leaves(self, num_leaves: int, num_collisions: int) -> None:
+        """Records a batch of leaves in the parallel search, where `num_collisions` leaves were already expanded."""
+        self.num_leaves += num_leaves
+        self.num_collisions += num_collisions
+
+    def add_batch(self, batch_size: int, elapsed: float) -> None:
+        """Records a call to the evaluation function."""
+        self.phase_times['evaluate'] += elapsed
+        self.num_batches += 1
+        self.num_positions += batch_size
+        if batch_size > self.max_batch_size:
+            self.max_batch_size = batch_size
+
+    def wrap(
+        self,
+        eval_func: Callable[[np.ndarray, bool], Tuple[Iterable[np.ndarray], Iterable[float]]],
+    ) -> Callable[[np.ndarray, bool], Tuple[Iterable[np.ndarray], Iterable[float]]]:
+        """Returns a new evaluation function which records the time and batch size of every call to `eval_func`."""
+
+        def profiled_eval_func(state: np.ndarray, batched: bool = False) -> Tuple[Iterable[np.ndarray], Iterable[float]]:
+            start = self.timer()
+            results = eval_func(state, batched)
+            self.add_batch(state.shape[0] if batched else 1, self.timer() - start)
+            return results
+
+        return profiled_eval_func
+
+    def stats(self) -> Mapping[Text, float]:
+        """Returns the aggregated statistics since last `reset_stats`, the times are in seconds."""
+        total_time = sum(self.phase_times.values())
+        stats = {}
+        for phase, t in self.phase_times.items():
+            stats[f'prof_{phase}_time'] = round(t, 4)
+        for phase, t in self.phase_times.items():
+            stats[f'prof_{phase}_share'] = round(t / total_time, 4) if total_time > 0 else 0.0
+
+        stats.update(
+            {
+                'prof_searches': self.num_searches,
+                'prof_simulations': self.num_simulations,
+                'prof_nodes_created': self.nodes_created,
+                'prof_total_depth': self.total_depth,
+                'prof_mean_depth': round(self.total_depth / self.num_simulations, 4) if self.num_simulations > 0 else 0.0,
+                'prof_max_depth': self.max_depth,
+                'prof_leaves': self.num_leaves,
+                'prof_collisions': self.num_collisions,
+                'prof_collision_rate': round(self.num_collisions / self.num_leaves, 4) if self.num_leaves > 0 else 0.0,
+                'prof_batches': self.num_batches,
+                'prof_positions': self.num_positions,
+                'prof_mean_batch_size': round(self.num_positions / self.num_batches, 4) if self.num_batches > 0 else 0.0,
+                'prof_max_batch_size': self.max_batch_size,
+            }
+        )
+        return stats
@@ -0,0 +1,274 @@
+# Copyright (c) 2023 Michael Hu.
+# This code is part of the book "The Art of Reinforcement Learning: Fundamentals, Mathematics, and Implementation with Python.".
+# See the accompanying LICENSE file for details.
+
+
+"""Implements the code to play tournaments between many checkpoints using a pool of long-lived worker processes."""
+from collections import OrderedDict
+from typing import Any, Iterator, List, Mapping, NamedTuple, Text, Tuple
+import logging
+import multiprocessing as mp
+import os
+import queue
+import numpy as np
+import torch
+
+from envs.base import BoardGameEnv
+from network import AlphaZeroNet
+from pipeline import create_mcts_player, disable_auto_grad, set_seed
+
+
+SCHEDULES = ('round_robin', 'gauntlet')
+
+
+class PlayerSpec(NamedTuple):
+    """The checkpoint file and the neural network architecture of a tournament player."""
+
+    name: str
+    ckpt_file: str
+    num_res_blocks: int
+    num_filters: int
+    num_fc_units: int
+    gomoku: bool = False
+
+
+def create_schedule(num_players: int, games_per_pair: int, schedule: str = 'round_robin') -> List[Tuple[int, int]]:
+    """Returns the list of games as (black, white) player indices.
+
+    For 'round_robin', every player plays against every other player,
+    for 'gauntlet', the first player plays against every other player.
+    Each pair of players plays `games_per_pair` games with alternating colors,
+    and the games of the same pair are next to each other, so the workers only need a few networks at a time.
+
+    Raises:
+        ValueError:
+            if num_players is less than 2, games_per_pair is less than 1, or schedule is unknown.
+    """
+    if num_players < 2:
+        raise ValueError(f'Expect num_players to be at least 2, got {num_players}')
+    if games_per_pair < 1:
+        raise ValueError(f'Expect games_per_pair to be at least 1, got {games_per_pair}')
+    if schedule not in SCHEDULES:
+        raise ValueError(f'Expect schedule to be one of {SCHEDULES}, got "{schedule}"')
+
+    if schedule == 'round_robin':
+        pairs = [(i, j) for i in range(num_players) for j in range(i + 1, num_players)]
+    else:
+        pairs = [(0, j) for j in range(1, num_players)]
+
+    return [(i, j) if k % 2 == 0 else (j, i) for i, j in pairs for k in range(games_per_pair)]
+
+
+def load_network(spec: PlayerSpec, env: BoardGameEnv, device: torch.device) -> torch.nn.Module:
+    """Creates the neural network for the player and loads the weights from the checkpoint file."""
+    network = AlphaZeroNet(
+        env.observation_space.shape,
+        env.action_space.n,
+        spec.num_res_blocks,
+        spec.num_filters,
+        spec.num_fc_units,
+        spec.gomoku,
+    ).to(device=device)
+    disable_auto_grad(network)
+
+    if spec.ckpt_file and os.path.isfile(spec.ckpt_file):
+        loaded_state = torch.load(spec.ckpt_file, map_location=torch.device(device))
+        network.load_state_dict(loaded_state['network'])
+    else:
+        logging.warning(f'Invalid checkpoint file "{spec.ckpt_file}"')
+
+    network.eval()
+    return network
+
+
+@torch.no_grad()
+def play_tournament_game(
+    env: BoardGameEnv, black_player: Any, white_player: Any, c_puct_base: float, c_puct_init: float
+) -> Mapping[Text, Any]:
+    """Play one game between the two MCTS players.
+
+    Returns:
+        the game statistics, where `black_score` is 1 for black win, 0.5 for draw, and 0 for white win.
+    """
+    _ = env.reset()
+    done = False
+    while not done:
+        mcts_player = black_player if env.to_play == env.black_player else white_player
+        move, *_ = mcts_player(env, None, c_puct_base, c_puct_init)
+        _, _, done, _ = env.step(move)
+
+    black_score = 0.5
+    if env.winner is not None:
+        black_score = 1.0 if env.winner == env.black_player else 0.0
+
+    return {
+        'game_result': env.get_result_string(),
+        'game_length': env.steps,
+        'black_score': black_score,
+        'sgf': env.to_sgf(),
+    }
+
+
+@torch.no_grad()
+def run_tournament_worker_loop(
+    seed: int,
+    rank: int,
+    players: List[PlayerSpec],
+    env: BoardGameEnv,
+    device: torch.device,
+    num_simulations: int,
+    num_parallel: int,
+    c_puct_base: float,
+    c_puct_init: float,
+    max_cached_networks: int,
+    eval_symmetry: str,
+    task_queue: mp.Queue,
+    result_queue: mp.Queue,
+) -> None:
+    """Play tournament games until receiving None from the task queue.
+
+    Each task is a tuple of (game_id, black, white) player indices, the networks are only loaded
+    the first time a player is needed, and the `max_cached_networks` most recently used ones are kept.
+    """
+    set_seed(int(seed + rank))
+    mcts_players = OrderedDict()
+
+    def get_mcts_player(index: int) -> Any:
+        if index in mcts_players:
+            mcts_players.move_to_end(index)
+        else:
+            while len(mcts_players) >= max_cached_networks:
+                mcts_players.popitem(last=False)
+            mcts_players[index] = create_mcts_player(
+                network=load_network(players[index], env, device),
+                device=device,
+                num_simulations=num_simulations,
+                num_parallel=num_parallel,
+                root_noise=False,
+                deterministic=False,
+                eval_symmetry=eval_symmetry,
+            )
+        return mcts_players[index]
+
+    while True:
+        task = task_queue.get()
+        if task is None:
+            break
+
+        game_id, black, white = task
+        # Get both players before playing, so the LRU cache never evicts one of the two players of the game
+        black_player, white_player = get_mcts_player(black), get_mcts_player(white)
+        stats = play_tournament_game(env, black_player, white_player, c_puct_base, c_puct_init)
+        result_queue.put((game_id, stats))
+
+
+def play_tournament(
+    players: List[PlayerSpec],
+    schedule: List[Tuple[int, int]],
+    env: BoardGameEnv,
+    device: torch.device,
+    num_workers: int,
+    num_simulations: int,
+    num_parallel: int,
+    c_puct_base: float,
+    c_puct_init: float,
+    seed: int = 1,
+    max_cached_networks: int = 8,
+    eval_symmetry: str = 'none',
+) -> Iterator[Mapping[Text, Any]]:
+    """Play the scheduled games using a pool of long-lived worker processes,
+    and yields the results as soon as each game finishes, in the order they finished.
+
+    Args:
+        players: the tournament players.
+        schedule: the list of games as (black, white) player indices, see `create_schedule`.
+        env: the game environment, each worker gets its own copy.
+        device: the device for the neural networks.
+        num_workers: number of worker processes.
+        num_simulations: number of iterations per MCTS search.
+        num_parallel: number of leaves to collect before evaluating them with the neural network.
+        c_puct_base: exploration constants balancing priors vs. search values.
+        c_puct_init: exploration constants balancing priors vs. search values.
+        seed: the seed for the workers, each worker uses `seed + rank`.
+        max_cached_networks: maximum number of networks kept in each worker.
+        eval_symmetry: evaluate the positions on the board symmetries, see `pipeline.create_eval_func`.
+
+    Yields:
+        the game statistics with the `game` id, and `black`, `white` player indices, see `play_tournament_game`.
+
+    Raises:
+        ValueError:
+            if num_workers is less than 1, or max_cached_networks is less than 2.
+            if the schedule has invalid player index.
+        RuntimeError:
+            if any worker process stopped unexpectedly.
+    """
+    if num_workers < 1:
+        raise ValueError(f'Expect num_workers to be at least 1, got {num_workers}')
+    if max_cached_networks < 2:
+        raise ValueError(f'Expect max_cached_networks to be at least 2, got {max_cached_networks}')
+    if any(not 0 <= i < len(players) for game in schedule for i in game):
+        raise ValueError(f'Expect player index in the range [0, {len(players)}) for the schedule')
+
+    task_queue = mp.Queue()
+    result_queue = mp.Queue()
+    for game_id, (black, white) in enumerate(schedule):
+        task_queue.put((game_id, black, white))
+
+    num_workers = min(num_workers, len(schedule))
+    for _ in range(num_workers):
+        task_queue.put(None)
+
+    workers = [
+        mp.Process(
+            target=run_tournament_worker_loop,
+            args=(
+                seed,
+                rank,
+                players,
+                env,
+                device,
+                num_simulations,
+                num_parallel,
+                c_puct_base,
+                c_puct_init,
+                max_cached_networks,
+                eval_symmetry,
+                task_queue,
+                result_queue,
+            ),
+            daemon=True,
+        )
+        for rank in range(num_workers)
+    ]
+    for worker in workers:
+        worker.start()
+
+    try:
+        num_finished = 0
+        while num_finished < len(schedule):
+            try:
+                game_id, stats = result_queue.get(timeout=1)
+            except queue.Empty:
+                # The workers exit after the last task, so only check if the results are still missing
+                if not any(worker.is_alive() for worker in workers) and result_queue.empty():
+                    raise RuntimeError('Tournament worker stopped unexpectedly')
+                continue
+
+            num_finished += 1
+            black, white = schedule[game_id]
+            yield {'game': game_id, 'black': black, 'white': white, **stats}
+    finally:
+        for worker in workers:
+            worker.join(timeout=10)
+            if worker.is_alive():
+                worker.terminate()
+
+
+def get_score_matrix(num_players: int, game_results: List[Mapping[Text, Any]]) -> np.ndarray:
+    """Returns the matrix where [i, j] is the total score of player i against player j, see `rating.fit_bradley_terry`."""
+    scores = np.zeros((num_players, num_players), dtype=np.float64)
+    for result in game_results:
+        scores[result['black'], result['white']] += result['black_score']
+        scores[result['white'], result['black']] += 1 - result['black_score']
+    return scores
@@ -30,6 +30,7 @@ FLAGS = flags.FLAGS
 flags.DEFINE_integer('board_size', 9, 'Board size for Go.')
 flags.DEFINE_float('komi', 7.5, 'Komi rule for Go.')
 flags.DEFINE_integer('num_stack', 8, 'Stack N previous states, the state is an image of N x 2 + 1 binary planes.')
+flags.DEFINE_string('go_engine', 'minigo', 'Implementation of the Go rules, one of [minigo, bitboard].')
 
 # # 12b64 version uses these configurations
 # flags.DEFINE_integer('num_res_blocks', 11, 'Number of residual blocks in the neural network.')
@@ -61,6 +62,24 @@ flags.DEFINE_integer(
 
 flags.DEFINE_bool('argument_data', True, 'Apply random rotation and mirroring to the training data, default on.')
 flags.DEFINE_bool('compress_data', False, 'Compress state when saving in replay buffer, default off.')
+flags.DEFINE_bool(
+    'packed_replay',
+    False,
+    'Store bit-packed states in a preallocated array in replay buffer, and sample batch without per-item decoding, '
+    'this ignores compress_data, default off.',
+)
+flags.DEFINE_integer(
+    'prefetch_batches',
+    0,
+    'Number of training batches to sample and prepare ahead of time in background threads, 0 means no prefetching.',
+)
+flags.DEFINE_integer('prefetch_workers', 2, 'Number of background threads used to prefetch the training batches.')
+flags.DEFINE_bool(
+    'async_ingestion',
+    False,
+    'Keep pulling self-play games into replay in a separate learner thread while training, '
+    'instead of pausing the actors during training, default off.',
+)
 
 flags.DEFINE_float('init_lr', 0.01, 'Initial learning rate.')
 flags.DEFINE_float('lr_decay', 0.1, 'Learning rate decay rate.')
@@ -87,6 +106,84 @@ flags.DEFINE_integer(
 )
 flags.DEFINE_float('c_puct_base', 19652, 'Exploration constants balancing priors vs. search values. Original paper use 19652')
 flags.DEFINE_float('c_puct_init', 1.25, 'Exploration constants balancing priors vs. search values. Original paper use 1.25')
+flags.DEFINE_bool(
+    'use_inference_server',
+    False,
+    'Evaluate positions for all self-play actors in a single inference server process, '
+    'instead of having a copy of the neural network in each actor, default off.',
+)
+flags.DEFINE_integer('inference_batch_size', 128, 'Maximum number of positions in a single batch for the inference server.')
+flags.DEFINE_float(
+    'inference_timeout_ms', 2.0, 'Maximum milliseconds the inference server waits for more requests before evaluating a batch.'
+)
+flags.DEFINE_integer('inference_threads', 4, 'Number of threads used by the inference server when running on CPU.')
+flags.DEFINE_float(
+    'transposition_table_mb',
+    0,
+    'Memory budget in MB for caching the neural network evaluation results in each self-play actor and evaluation player, '
+    '0 means no cache.',
+)
+flags.DEFINE_integer(
+    'num_concurrent_games',
+    1,
+    'Number of self-play games played at the same time in each actor, '
+    'where the leaves from all games are evaluated by the neural network in a single batch.',
+)
+flags.DEFINE_bool(
+    'shared_memory_transport',
+    False,
+    'Send self-play games from actors to learner through shared memory, instead of pickling them over the queue.',
+)
+flags.DEFINE_integer(
+    'transport_slots_per_actor',
+    2,
+    'Number of shared memory slots per actor, each slot holds one complete game, only used with shared_memory_transport.',
+)
+flags.DEFINE_bool(
+    'weight_broadcast',
+    False,
+    'Publish the new network weights to actors and evaluator through shared memory after training, '
+    'instead of having each process load the checkpoint file, the checkpoint file is written in the background.',
+)
+flags.DEFINE_enum(
+    'inference_backend',
+    'eager',
+    ['eager', 'torchscript', 'torchscript_int8'],
+    'Run the neural network for the self-play actors on CPU in eager PyTorch, or as a TorchScript model '
+    'with batch normalization folded into the convolutions, optionally with int8 dynamic quantization for the linear layers, '
+    'this is ignored for actors on GPU or when using the inference server.',
+)
+flags.DEFINE_bool(
+    'profile_search',
+    False,
+    'Record the time per MCTS search phase, the search statistics and the evaluation batch sizes for the self-play actors, '
+    'the aggregates are written to the actor CSV log files, use `profile_summary.py` to compare runs.',
+)
+flags.DEFINE_enum(
+    'root_search',
+    'puct',
+    ['puct', 'gumbel'],
+    'Root node selection for the self-play actors, PUCT with dirichlet noise, or Gumbel-top-k sampling with sequential halving, '
+    'which trains with the improved policy from the completed Q values, and works with much fewer simulations, '
+    'for example 16 to 64. The gumbel search evaluates one leaf at a time, so num_parallel is not used by the actors.',
+)
+flags.DEFINE_integer('gumbel_considered_actions', 16, 'Number of actions sampled at the root node for the gumbel root search.')
+flags.DEFINE_float(
+    'full_search_prob',
+    1.0,
+    'Playout cap randomization, the probability of a move using the full search with num_simulations, '
+    'only these moves are recorded as training samples. The other moves use a fast search with fast_search_simulations, '
+    'without root noise. Default 1.0 always uses the full search.',
+)
+flags.DEFINE_integer(
+    'fast_search_simulations', 32, 'Number of simulations for the fast search moves, only used if full_search_prob < 1.'
+)
+flags.DEFINE_integer(
+    'max_staleness',
+    0,
+    'Accept self-play games played by up to this number of checkpoints before the latest one, '
+    '0 means only accept games played by the latest checkpoint.',
+)
 
 flags.DEFINE_integer(
     'warm_up_steps',
@@ -133,6 +230,24 @@ flags.DEFINE_float(
     0,
     'Default elo rating, change to the rating (for black) from last checkpoint when resume training.',
 )
+flags.DEFINE_integer('eval_workers', 2, 'Number of processes to play the evaluation games at the same time.')
+flags.DEFINE_integer(
+    'eval_max_games',
+    100,
+    'Maximum number of evaluation games between the new and previous checkpoints, '
+    'the evaluation stops early once the sequential probability ratio test (SPRT) makes a decision.',
+)
+flags.DEFINE_integer(
+    'eval_opening_steps',
+    4,
+    'Number of moves at the beginning of the evaluation game which are sampled from the search policy, '
+    'so the games are different from each other.',
+)
+flags.DEFINE_float(
+    'sprt_elo_margin',
+    35,
+    'The Elo difference for the SPRT to decide the new checkpoint is stronger or weaker than the previous checkpoint.',
+)
 flags.DEFINE_integer('ckpt_interval', 1000, 'The frequency (in training step) to create new checkpoint.')
 flags.DEFINE_integer('log_interval', 200, 'The frequency (in training step) to log training statistics.')
 flags.DEFINE_string('ckpt_dir', './checkpoints/go/9x9', 'Path for checkpoint file.')
@@ -146,16 +261,38 @@ flags.DEFINE_integer(
     0,
     'The frequency (in number of self-play games) to save the replay buffer state.'
     'So we can resume training without staring from zero. 0 means do not save replay state.'
-    'If you set this to a non-zero value, you should make sure the path specified by "FLAGS.ckpt_dir" have at least 100GB of free space.',
+    'Only the new samples are appended to "FLAGS.ckpt_dir/replay", and the disk usage is bounded by the replay capacity.',
 )
 flags.DEFINE_string('load_ckpt', '', 'Resume training by starting from last checkpoint.')
-flags.DEFINE_string('load_replay', '', 'Resume training by loading saved replay buffer state.')
+flags.DEFINE_string(
+    'load_replay',
+    '',
+    'Resume training by loading saved replay buffer state, either the replay directory or a legacy pickle file.',
+)
 
 flags.DEFINE_string('log_level', 'INFO', '')
 flags.DEFINE_integer('seed', 1, 'Seed the runtime.')
 
 flags.register_validator('num_simulations', lambda x: x > 1)
+flags.register_validator('gumbel_considered_actions', lambda x: x >= 1)
+flags.register_validator('full_search_prob', lambda x: 0 < x <= 1)
+flags.register_validator('fast_search_simulations', lambda x: x >= 1)
+flags.register_validator('num_concurrent_games', lambda x: x >= 1)
+flags.register_validator('transport_slots_per_actor', lambda x: x >= 1)
+flags.register_validator('max_staleness', lambda x: x >= 0)
+flags.register_validator('eval_workers', lambda x: x >= 1)
+flags.register_validator('eval_max_games', lambda x: x >= 1)
+flags.register_validator('eval_opening_steps', lambda x: x >= 0)
+flags.register_validator('sprt_elo_margin', lambda x: x > 0)
+flags.register_validator('prefetch_batches', lambda x: x >= 0)
+flags.register_validator('prefetch_workers', lambda x: x >= 1)
+flags.register_validator('go_engine', lambda x: x in ['minigo', 'bitboard'])
 flags.register_validator('log_level', lambda x: x in ['INFO', 'DEBUG'])
+flags.register_multi_flags_validator(
+    ['full_search_prob', 'fast_search_simulations', 'num_simulations'],
+    lambda flags: flags['full_search_prob'] == 1 or flags['fast_search_simulations'] < flags['num_simulations'],
+    'Expect fast_search_simulations to be less than num_simulations when full_search_prob < 1',
+)
 flags.register_multi_flags_validator(
     ['num_parallel', 'c_puct_base'], lambda flags: flags['c_puct_base'] >= 19652 * (flags['num_parallel'] / 800), ''
 )
@@ -164,18 +301,20 @@ flags.register_multi_flags_validator(
 # Initialize flags
 FLAGS(sys.argv)
 
-os.environ['BOARD_SIZE'] = str(FLAGS.board_size)
-
 from envs.go import GoEnv
 from pipeline import (
     run_learner_loop,
     run_evaluator_loop,
     run_selfplay_actor_loop,
+    run_inference_server_loop,
     set_seed,
     maybe_create_dir,
 )
 from network import AlphaZeroNet
-from replay import UniformReplay
+from inference_server import InferenceChannels
+from replay import UniformReplay, PackedUniformReplay
+from game_transport import SharedGameBuffer
+from weight_broadcast import WeightBroadcast
 from util import extract_args_from_flags_dict, create_logger
 
 
@@ -208,7 +347,7 @@ def main():
         actor_devices = [torch.device(f'cuda:{i % num_gpus}') for i in range(FLAGS.num_actors)]
 
     def env_builder():
-        return GoEnv(komi=FLAGS.komi, num_stack=FLAGS.num_stack)
+        return GoEnv(board_size=FLAGS.board_size, komi=FLAGS.komi, num_stack=FLAGS.num_stack, engine=FLAGS.go_engine)
 
     eval_env = env_builder()
 
@@ -229,16 +368,36 @@ def main():
     ckpt_event = mp.Event()
     # Transfer samples from self-play process to training process.
     data_queue = mp.Queue(maxsize=FLAGS.num_actors)
+    # Optionally transfer the content of the games through shared memory, so only the slot index is sent over the queue.
+    game_buffer = None
+    if FLAGS.shared_memory_transport:
+        game_buffer = SharedGameBuffer(
+            num_slots=FLAGS.num_actors * FLAGS.transport_slots_per_actor,
+            max_game_length=eval_env.max_steps,
+            state_shape=input_shape,
+            num_actions=num_actions,
+        )
+
+    # Optionally publish the new weights through shared memory, instead of loading checkpoint files in every process.
+    weight_broadcast = WeightBroadcast(network) if FLAGS.weight_broadcast else None
 
     with mp.Manager() as manager:
         var_ckpt = manager.Value('s', b'')
         var_resign_threshold = manager.Value('d', FLAGS.init_resign_threshold)
 
-        replay = UniformReplay(
-            capacity=FLAGS.replay_capacity,
-            random_state=np.random.RandomState(),
-            compress_data=FLAGS.compress_data,
-        )
+        if FLAGS.packed_replay:
+            replay = PackedUniformReplay(
+                capacity=FLAGS.replay_capacity,
+                random_state=np.random.RandomState(),
+                state_shape=input_shape,
+                num_actions=num_actions,
+            )
+        else:
+            replay = UniformReplay(
+                capacity=FLAGS.replay_capacity,
+                random_state=np.random.RandomState(),
+                compress_data=FLAGS.compress_data,
+            )
 
         # Start evaluator
         evaluator = mp.Process(
@@ -260,11 +419,47 @@ def main():
                 FLAGS.log_level,
                 var_ckpt,
                 stop_event,
+                FLAGS.transposition_table_mb,
+                weight_broadcast,
+                FLAGS.eval_workers,
+                FLAGS.eval_max_games,
+                FLAGS.eval_opening_steps,
+                FLAGS.sprt_elo_margin,
             ),
         )
 
         evaluator.start()
 
+        # Start inference server, which evaluates positions for all self-play actors
+        inference_channels = inference_server = None
+        if FLAGS.use_inference_server:
+            # Each actor evaluates the leaves from all of its concurrent games in a single request
+            inference_channels = InferenceChannels(
+                num_clients=FLAGS.num_actors,
+                max_positions_per_request=FLAGS.num_parallel * FLAGS.num_concurrent_games,
+                state_shape=input_shape,
+                num_actions=num_actions,
+            )
+            inference_server = mp.Process(
+                target=run_inference_server_loop,
+                args=(
+                    network_builder(),
+                    actor_devices[0],
+                    inference_channels,
+                    FLAGS.inference_batch_size,
+                    FLAGS.inference_timeout_ms / 1000,
+                    FLAGS.inference_threads,
+                    60,
+                    FLAGS.logs_dir,
+                    FLAGS.load_ckpt,
+                    FLAGS.log_level,
+                    var_ckpt,
+                    stop_event,
+                    weight_broadcast,
+                ),
+            )
+            inference_server.start()
+
         # Start self-play actors
         actors = []
         for i in range(FLAGS.num_actors):
@@ -273,7 +468,7 @@ def main():
                 args=(
                     FLAGS.seed,
                     i,
-                    network_builder(),
+                    network_builder() if inference_channels is None else None,
                     actor_devices[i],
                     data_queue,
                     env_builder(),
@@ -293,6 +488,18 @@ def main():
                     var_resign_threshold,
                     ckpt_event,
                     stop_event,
+                    inference_channels.client(i, stop_event) if inference_channels is not None else None,
+                    FLAGS.transposition_table_mb,
+                    FLAGS.num_concurrent_games,
+                    game_buffer,
+                    weight_broadcast,
+                    FLAGS.max_staleness,
+                    FLAGS.inference_backend if actor_devices[i].type == 'cpu' else 'eager',
+                    FLAGS.profile_search,
+                    FLAGS.root_search,
+                    FLAGS.gumbel_considered_actions,
+                    FLAGS.full_search_prob,
+                    FLAGS.fast_search_simulations if FLAGS.full_search_prob < 1 else 0,
                 ),
             )
             actor.start()
@@ -330,6 +537,12 @@ def main():
             var_resign_threshold=var_resign_threshold,
             ckpt_event=ckpt_event,
             stop_event=stop_event,
+            game_buffer=game_buffer,
+            prefetch_batches=FLAGS.prefetch_batches,
+            prefetch_workers=FLAGS.prefetch_workers,
+            async_ingestion=FLAGS.async_ingestion,
+            weight_broadcast=weight_broadcast,
+            max_staleness=FLAGS.max_staleness,
         )
 
         # Wait for all actors to finish
@@ -339,6 +552,12 @@ def main():
 
         evaluator.join()
 
+        if inference_server is not None:
+            inference_server.join()
+
+        if game_buffer is not None:
+            game_buffer.close(unlink=True)
+
 
 if __name__ == '__main__':
     # Set multiprocessing start mode
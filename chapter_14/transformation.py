@@ -3,10 +3,23 @@
 # See the accompanying LICENSE file for details.
 
 
+"""Implements the 8 symmetries of the square board (rotations and mirroring) for data augmentation and inference.
+
+Each symmetry is a permutation of the board points, so instead of rotating and flipping the tensors,
+we precompute a gather-index table for every symmetry once per board size, where the transformed
+tensor is `x[..., table[s]]` for the flattened board. The tables for the action probabilities
+also keep the pass move (if any) at the last position, so a whole batch can be transformed with
+a single `torch.gather`, and each sample in the batch can use a different symmetry.
+"""
+
 from typing import Tuple
-import random
+import functools
 import torch
-from torchvision.transforms.functional import rotate, hflip, vflip
+
+
+# The index of the symmetry in the gather-index tables
+SYMMETRIES = ('identity', 'rotate90', 'rotate180', 'rotate270', 'h_flip', 'v_flip', 'transpose', 'anti_transpose')
+NUM_SYMMETRIES = len(SYMMETRIES)
 
 
 def probs_to_3d(x, board_size):
@@ -17,150 +30,123 @@ def flatten_probs(x, board_size):
     return torch.reshape(x, (-1, board_size * board_size))
 
 
-def extract_pi_probs(pi_probs, board_size):
-    has_pass_move = pi_probs.shape[-1] == (board_size**2) + 1
-    pass_move_prob = None
-
-    if has_pass_move:
-        pass_move_prob = pi_probs[..., -1:]  # Extract pass move probability
-        pi_probs_3d = torch.reshape(pi_probs[..., :-1], (-1, 1, board_size, board_size))
-    else:
-        pi_probs_3d = torch.reshape(pi_probs, (-1, 1, board_size, board_size))
-
-    return pi_probs_3d, pass_move_prob
-
-
-def apply_horizontal_flip(states: torch.Tensor, pi_probs: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
-    """Returns horizontal flipped 'mirror' of state and action probabilities."""
+_BOARD_TRANSFORMS = {
+    'identity': lambda x: x,
+    'rotate90': lambda x: torch.rot90(x, k=1, dims=[-2, -1]),
+    'rotate180': lambda x: torch.rot90(x, k=2, dims=[-2, -1]),
+    'rotate270': lambda x: torch.rot90(x, k=3, dims=[-2, -1]),
+    'h_flip': lambda x: torch.flip(x, dims=[-1]),
+    'v_flip': lambda x: torch.flip(x, dims=[-2]),
+    'transpose': lambda x: torch.transpose(x, -2, -1),
+    'anti_transpose': lambda x: torch.rot90(torch.transpose(x, -2, -1), k=2, dims=[-2, -1]),
+}
 
-    if not isinstance(states, torch.Tensor) or len(states.shape) != 4:
-        raise ValueError(f'Expect states to be a 4D torch.Tensor, got {states}')
-    if not isinstance(pi_probs, torch.Tensor) or len(pi_probs.shape) != 2:
-        raise ValueError(f'Expect pi_probs to be a 2D torch.Tensor, got {pi_probs}')
 
-    states = torch.clone(states)  # [B, C, H, W]
-    pi_probs = torch.clone(pi_probs)  # [B, H*W] or [B, H*W+1]
-    board_size = states.shape[-1]
+@functools.lru_cache(maxsize=None)
+def get_symmetry_tables(
+    board_size: int, num_actions: int, device: torch.device = torch.device('cpu')
+) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+    """Returns the gather-index tables for all the symmetries.
 
-    states = hflip(states)
+    Args:
+        board_size: the size of the square board.
+        num_actions: the size of the action probabilities, either board_size**2 or board_size**2 + 1 with pass move.
+        device: the device for the tables.
 
-    pi_probs_3d, pass_move_prob = extract_pi_probs(pi_probs, board_size)
+    Returns:
+        a tuple of int64 tensors (board_table, action_table, inverse_action_table), with shape [8, board_size**2],
+        [8, num_actions], and [8, num_actions], where the inverse table maps the transformed action
+        probabilities back to the original board.
 
-    pi_probs_3d = hflip(pi_probs_3d)
-    pi_probs = flatten_probs(pi_probs_3d, board_size)
+    Raises:
+        ValueError:
+            if num_actions is not board_size**2 or board_size**2 + 1.
+    """
+    num_points = board_size * board_size
+    if num_actions not in (num_points, num_points + 1):
+        raise ValueError(f'Expect num_actions to be {num_points} or {num_points + 1}, got {num_actions}')
 
-    if pass_move_prob is not None:
-        pi_probs = torch.cat((pi_probs, pass_move_prob), dim=-1)
+    points = torch.arange(num_points).reshape(board_size, board_size)
+    board_table = torch.stack([_BOARD_TRANSFORMS[name](points).reshape(-1) for name in SYMMETRIES])
 
-    return states, pi_probs
+    # The pass move is not affected by the symmetries
+    action_table = board_table
+    if num_actions > num_points:
+        action_table = torch.cat([board_table, torch.full((NUM_SYMMETRIES, 1), num_points)], dim=1)
+    inverse_action_table = torch.argsort(action_table, dim=1)
 
+    return board_table.to(device), action_table.to(device), inverse_action_table.to(device)
 
-def apply_vertical_flip(states: torch.Tensor, pi_probs: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
-    """Returns vertical flipped 'mirror' of state and action probabilities."""
 
+def _check_inputs(states: torch.Tensor, pi_probs: torch.Tensor) -> None:
     if not isinstance(states, torch.Tensor) or len(states.shape) != 4:
         raise ValueError(f'Expect states to be a 4D torch.Tensor, got {states}')
     if not isinstance(pi_probs, torch.Tensor) or len(pi_probs.shape) != 2:
         raise ValueError(f'Expect pi_probs to be a 2D torch.Tensor, got {pi_probs}')
 
-    states = torch.clone(states)  # [B, C, H, W]
-    pi_probs = torch.clone(pi_probs)  # [B, H*W] or [B, H*W+1]
-    board_size = states.shape[-1]
-
-    states = vflip(states)
-
-    pi_probs_3d, pass_move_prob = extract_pi_probs(pi_probs, board_size)
-
-    pi_probs_3d = vflip(pi_probs_3d)
-    pi_probs = flatten_probs(pi_probs_3d, board_size)
-
-    if pass_move_prob is not None:
-        pi_probs = torch.cat((pi_probs, pass_move_prob), dim=-1)
-
-    return states, pi_probs
 
+def transform_states(states: torch.Tensor, symmetries: torch.Tensor) -> torch.Tensor:
+    """Returns the transformed states [B, C, H, W], where symmetries [B] is the symmetry index for each state."""
+    B, C, H, W = states.shape
+    board_table, *_ = get_symmetry_tables(W, W * W, states.device)
+    index = board_table[symmetries].unsqueeze(1).expand(B, C, H * W)
+    return torch.gather(states.reshape(B, C, H * W), 2, index).reshape(B, C, H, W)
 
-def apply_rotation(states: torch.Tensor, pi_probs: torch.Tensor, angle: int) -> Tuple[torch.Tensor, torch.Tensor]:
-    """Returns rotated state and action probabilities."""
 
-    if not isinstance(states, torch.Tensor) or len(states.shape) != 4:
-        raise ValueError(f'Expect states to be a 4D torch.Tensor, got {states}')
-    if not isinstance(pi_probs, torch.Tensor) or len(pi_probs.shape) != 2:
-        raise ValueError(f'Expect pi_probs to be a 2D torch.Tensor, got {pi_probs}')
-    if angle not in [90, 180, 270]:
-        raise ValueError(f'Expect angle to be one of [90, 180, 270], got {angle}')
+def transform_pi_probs(pi_probs: torch.Tensor, symmetries: torch.Tensor, board_size: int) -> torch.Tensor:
+    """Returns the transformed action probabilities [B, num_actions], where symmetries [B] is the symmetry index."""
+    _, action_table, _ = get_symmetry_tables(board_size, pi_probs.shape[-1], pi_probs.device)
+    return torch.gather(pi_probs, 1, action_table[symmetries])
 
-    states = torch.clone(states)  # [B, C, H, W]
-    pi_probs = torch.clone(pi_probs)  # [B, H*W] or [B, H*W+1]
-    board_size = states.shape[-1]
 
-    # Rotate the state tensor
-    states = rotate(states, angle)
+def inverse_transform_pi_probs(pi_probs: torch.Tensor, symmetries: torch.Tensor, board_size: int) -> torch.Tensor:
+    """Maps the action probabilities predicted on the transformed states back to the original board."""
+    *_, inverse_action_table = get_symmetry_tables(board_size, pi_probs.shape[-1], pi_probs.device)
+    return torch.gather(pi_probs, 1, inverse_action_table[symmetries])
 
-    # Rotate the action probabilities, using the same angle.
-    pi_probs_3d, pass_move_prob = extract_pi_probs(pi_probs, board_size)
 
-    pi_probs_3d = rotate(pi_probs_3d, angle)
-    pi_probs = flatten_probs(pi_probs_3d, board_size)
+def apply_symmetries(
+    states: torch.Tensor, pi_probs: torch.Tensor, symmetries: torch.Tensor
+) -> Tuple[torch.Tensor, torch.Tensor]:
+    """Returns the transformed states and action probabilities, where symmetries [B] is the symmetry index
+    for each sample, see `SYMMETRIES`."""
+    _check_inputs(states, pi_probs)
+    symmetries = torch.as_tensor(symmetries, dtype=torch.int64, device=states.device)
+    return transform_states(states, symmetries), transform_pi_probs(pi_probs, symmetries, states.shape[-1])
 
-    if pass_move_prob is not None:
-        pi_probs = torch.cat((pi_probs, pass_move_prob), dim=-1)
 
+def _apply_one_symmetry(states: torch.Tensor, pi_probs: torch.Tensor, name: str) -> Tuple[torch.Tensor, torch.Tensor]:
+    _check_inputs(states, pi_probs)
+    symmetry = SYMMETRIES.index(name)
+    states = transform_states(states, torch.full((states.shape[0],), symmetry, device=states.device))
+    pi_probs = transform_pi_probs(
+        pi_probs, torch.full((pi_probs.shape[0],), symmetry, device=pi_probs.device), states.shape[-1]
+    )
     return states, pi_probs
 
 
-def rotate_90(
-    states: torch.Tensor, pi_probs: torch.Tensor, values: torch.Tensor
-) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
-    states, pi_probs = apply_rotation(states, pi_probs, 90)
-    return states, pi_probs, values
-
-
-def rotate_180(
-    states: torch.Tensor, pi_probs: torch.Tensor, values: torch.Tensor
-) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
-    states, pi_probs = apply_rotation(states, pi_probs, 180)
-    return states, pi_probs, values
-
-
-def rotate_270(
-    states: torch.Tensor, pi_probs: torch.Tensor, values: torch.Tensor
-) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
-    states, pi_probs = apply_rotation(states, pi_probs, 270)
-    return states, pi_probs, values
-
-
-def v_flip(
-    states: torch.Tensor, pi_probs: torch.Tensor, values: torch.Tensor
-) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
-    states, pi_probs = apply_vertical_flip(states, pi_probs)
-    return states, pi_probs, values
-
+def apply_horizontal_flip(states: torch.Tensor, pi_probs: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+    """Returns horizontal flipped 'mirror' of state and action probabilities."""
+    return _apply_one_symmetry(states, pi_probs, 'h_flip')
 
-def h_flip(
-    states: torch.Tensor, pi_probs: torch.Tensor, values: torch.Tensor
-) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
-    states, pi_probs = apply_horizontal_flip(states, pi_probs)
-    return states, pi_probs, values
 
+def apply_vertical_flip(states: torch.Tensor, pi_probs: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+    """Returns vertical flipped 'mirror' of state and action probabilities."""
+    return _apply_one_symmetry(states, pi_probs, 'v_flip')
 
-SUPPORTED_TRANSFORMATIONS = {
-    # 'identity': lambda x, y, z: (x, y, z),
-    'h_flip': h_flip,
-    'v_flip': v_flip,
-    'rotate90': rotate_90,
-    'rotate180': rotate_180,
-    'rotate270': rotate_270,
-}
 
-TRANSFORMATIONS = list(SUPPORTED_TRANSFORMATIONS.keys())
+def apply_rotation(states: torch.Tensor, pi_probs: torch.Tensor, angle: int) -> Tuple[torch.Tensor, torch.Tensor]:
+    """Returns counter-clockwise rotated state and action probabilities."""
+    if angle not in [90, 180, 270]:
+        raise ValueError(f'Expect angle to be one of [90, 180, 270], got {angle}')
+    return _apply_one_symmetry(states, pi_probs, f'rotate{angle}')
 
 
 def apply_random_transformation(
     states: torch.Tensor, pi_probs: torch.Tensor, values: torch.Tensor
 ) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
-    if random.random() > 0.5:
-        transformation = random.choice(TRANSFORMATIONS)
-        states, pi_probs, values = SUPPORTED_TRANSFORMATIONS[transformation](states, pi_probs, values)
-
+    """Applies a random symmetry (including the identity) to each sample in the batch independently,
+    the values are not affected by the symmetries."""
+    symmetries = torch.randint(0, NUM_SYMMETRIES, (states.shape[0],), device=states.device)
+    states, pi_probs = apply_symmetries(states, pi_probs, symmetries)
     return states, pi_probs, values
@@ -0,0 +1,156 @@
+# Copyright (c) 2023 Michael Hu.
+# This code is part of the book "The Art of Reinforcement Learning: Fundamentals, Mathematics, and Implementation with Python.".
+# See the accompanying LICENSE file for details.
+
+
+"""Transposition table to cache the neural network evaluation results of board positions.
+
+The same position is often evaluated multiple times, for example transpositions within a single search,
+common openings across self-play games, or the evaluator which starts every search from scratch.
+The cache is keyed by a Zobrist hash of the observation planes, since the output of the neural network
+only depends on the observation. Note the color to play plane is part of the observation,
+so the same board with different player to move have different keys.
+
+The cache must be cleared once the neural network weights changed.
+"""
+
+from collections import OrderedDict
+from typing import Callable, Iterable, List, Mapping, Optional, Text, Tuple, Union
+import numpy as np
+
+# Rough estimation of the memory used by Python objects for each entry, excluding the prior probabilities array
+_ENTRY_OVERHEAD_BYTES = 256
+
+
+class TranspositionTable:
+    """Least recently used (LRU) cache for (pi, v) evaluation results."""
+
+    def __init__(
+        self,
+        state_shape: Tuple[int, int, int],
+        num_actions: int,
+        max_memory_mb: float = 64,
+        random_state: np.random.RandomState = None,
+    ) -> None:
+        """
+        Args:
+            state_shape: the shape of a single state, in the format of [C, H, W].
+            num_actions: number of total actions, including illegal move.
+            max_memory_mb: the memory budget in MB, which determines the maximum number of entries.
+            random_state: used to generate the Zobrist keys.
+
+        Raises:
+            ValueError:
+                if `max_memory_mb` is not positive, or too small to hold a single entry.
+        """
+        if max_memory_mb <= 0:
+            raise ValueError(f'Expect `max_memory_mb` to be positive, got {max_memory_mb}')
+
+        self.entry_bytes = num_actions * np.dtype(np.float32).itemsize + _ENTRY_OVERHEAD_BYTES
+        self.capacity = int(max_memory_mb * 1024**2) // self.entry_bytes
+        if self.capacity < 1:
+            raise ValueError(
+                f'Expect `max_memory_mb` to hold at least one entry of {self.entry_bytes} bytes, got {max_memory_mb}'
+            )
+
+        if random_state is None:
+            random_state = np.random.RandomState()
+
+        # One random key for each binary feature
+        self.zobrist_keys = random_state.randint(
+            np.iinfo(np.int64).min, np.iinfo(np.int64).max, size=int(np.prod(state_shape)), dtype=np.int64
+        )
+
+        self.entries = OrderedDict()
+        self.hits = self.misses = self.evictions = 0
+
+    def hash(self, state: np.ndarray, batched: bool = False) -> Union[int, List[int]]:
+        """Compute the Zobrist hash by XOR the keys of all non-zero features.
+
+        Returns a integer for a single state, or a list of integers for batched states.
+        """
+        if not batched:
+            state = state[None, ...]
+
+        mask = state.reshape(state.shape[0], -1) != 0
+        keys = np.bitwise_xor.reduce(np.where(mask, self.zobrist_keys, 0), axis=1)
+
+        keys = keys.tolist()
+        if not batched:
+            return keys[0]
+        return keys
+
+    def lookup(self, key: int) -> Optional[Tuple[np.ndarray, float]]:
+        """Returns the cached (pi, v) for the given key, or None if not found."""
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def insert(self, key: int, pi: np.ndarray, v: float) -> Tuple[np.ndarray, float]:
+        """Add the (pi, v) to cache, evict the least recently used entry if the table is full.
+        Returns the cached entry."""
+        # The cached array is shared between callers, so make sure no one modifies it
+        pi = np.array(pi, dtype=np.float32)
+        pi.setflags(write=False)
+
+        entry = (pi, v)
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+        return entry
+
+    def clear(self) -> None:
+        """Remove all entries, this should be called when the neural network weights changed."""
+        self.entries.clear()
+
+    def reset_stats(self) -> None:
+        self.hits = self.misses = self.evictions = 0
+
+    def stats(self) -> Mapping[Text, float]:
+        total = self.hits + self.misses
+        return {
+            'tt_hits': self.hits,
+            'tt_misses': self.misses,
+            'tt_hit_rate': round(self.hits / total, 4) if total > 0 else 0.0,
+            'tt_evictions': self.evictions,
+            'tt_size': len(self.entries),
+        }
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def wrap(
+        self,
+        eval_func: Callable[[np.ndarray, bool], Tuple[Iterable[np.ndarray], Iterable[float]]],
+    ) -> Callable[[np.ndarray, bool], Tuple[Iterable[np.ndarray], Iterable[float]]]:
+        """Returns a new evaluation function which only calls `eval_func` for positions not in the cache."""
+
+        def cached_eval_func(state: np.ndarray, batched: bool = False) -> Tuple[Iterable[np.ndarray], Iterable[float]]:
+            if not batched:
+                key = self.hash(state)
+                entry = self.lookup(key)
+                if entry is None:
+                    pi, v = eval_func(state, False)
+                    entry = self.insert(key, pi, v)
+                return entry
+
+            keys = self.hash(state, batched=True)
+            entries = [self.lookup(key) for key in keys]
+            missing = [i for i, entry in enumerate(entries) if entry is None]
+
+            if missing:
+                pis, vs = eval_func(state[missing], True)
+                for i, pi, v in zip(missing, pis, vs):
+                    entries[i] = self.insert(keys[i], pi, v)
+
+            pis, vs = zip(*entries)
+            return list(pis), list(vs)
+
+        return cached_eval_func
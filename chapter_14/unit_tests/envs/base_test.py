@@ -172,6 +172,28 @@ class StackHistoryTest(parameterized.TestCase):
 
         self.assertTrue(np.array_equal(obs, expected))
 
+    def test_env_stacked_state_more_moves_than_num_stack(self):
+        env = BoardGameEnv(board_size=3, num_stack=2)
+        env.reset()
+
+        for move in [0, 4, 8, 2, 6]:
+            obs, _, _, _ = env.step(move)
+
+        # Only last two boards, white to play.
+        expected = np.zeros((5, 3, 3), dtype=np.int8)
+        expected[0].flat[[4, 2]] = 1  # White stones after last move
+        expected[1].flat[[0, 8, 6]] = 1  # Black stones after last move
+        expected[2].flat[[4, 2]] = 1  # White stones before last move
+        expected[3].flat[[0, 8]] = 1  # Black stones before last move
+        np.testing.assert_equal(obs, expected)
+
+        # Write into a preallocated buffer
+        out = np.ones((2, 5, 3, 3), dtype=np.int8)
+        result = env.observation(out=out[1])
+        self.assertIs(result.base, out)
+        np.testing.assert_equal(out[1], expected)
+        np.testing.assert_equal(out[0], 1)
+
 
 if __name__ == '__main__':
     absltest.main()
@@ -0,0 +1,92 @@
+# Copyright (c) 2023 Michael Hu.
+# This code is part of the book "The Art of Reinforcement Learning: Fundamentals, Mathematics, and Implementation with Python.".
+# See the accompanying LICENSE file for details.
+
+
+"""Tests for go_engine_bitboard.py, by comparing against go_engine.py."""
+
+from absl.testing import absltest
+import copy
+import numpy as np
+
+import envs.go_engine as go
+import envs.go_engine_bitboard as go_bitboard
+from envs.go import GoEnv
+
+
+BOARD_SIZE = 9
+
+
+class BitboardPositionTest(absltest.TestCase):
+    def assertSamePosition(self, position, bitboard_position):
+        np.testing.assert_array_equal(position.board, bitboard_position.board)
+        np.testing.assert_array_equal(position.all_legal_moves(), bitboard_position.all_legal_moves())
+        self.assertEqual(position.ko, bitboard_position.ko)
+        self.assertEqual(position.caps, bitboard_position.caps)
+        self.assertEqual(position.to_play, bitboard_position.to_play)
+        self.assertEqual(position.recent, bitboard_position.recent)
+        self.assertEqual(position.score(), bitboard_position.score())
+
+    def test_same_as_minigo_engine_on_random_games(self):
+        rs = np.random.RandomState(1)
+
+        for _ in range(5):
+            position = go.Position(board_size=BOARD_SIZE)
+            bitboard_position = go_bitboard.Position(board_size=BOARD_SIZE)
+
+            for _ in range(BOARD_SIZE * BOARD_SIZE * 2):
+                self.assertSamePosition(position, bitboard_position)
+
+                legal_moves = np.flatnonzero(position.all_legal_moves())
+                # Rarely pass, so the board gets crowded and there're lots of captures and ko
+                if len(legal_moves) > 1 and rs.rand() > 0.02:
+                    move = divmod(int(rs.choice(legal_moves[:-1])), BOARD_SIZE)
+                else:
+                    move = None
+
+                position = position.play_move(move, mutate=True)
+                bitboard_position = bitboard_position.play_move(move, mutate=True)
+
+            np.testing.assert_array_equal(position.get_liberties(), bitboard_position.get_liberties())
+            self.assertEqual(position.result_string(), bitboard_position.result_string())
+
+    def test_ko_and_suicide(self):
+        position = go_bitboard.Position(board_size=BOARD_SIZE)
+        black_moves = ['A4', 'B4', 'C3', 'C1', 'D2']
+        white_moves = ['A2', 'A3', 'B1', 'B3', 'C2']
+        for b_move, w_move in zip(black_moves, white_moves):
+            position = position.play_move(position_coords(b_move))
+            position = position.play_move(position_coords(w_move))
+
+        # Black captures the white stone at C2
+        position = position.play_move(position_coords('B2'))
+        self.assertEqual(position.caps, (1, 0))
+        self.assertEqual(position.ko, position_coords('C2'))
+        self.assertFalse(position.is_move_legal(position_coords('C2')))
+        with self.assertRaises(go.IllegalMove):
+            position.play_move(position_coords('C2'))
+
+        # White stones around A1 have no other liberties, so connecting them at A1 is suicide
+        self.assertTrue(position.is_move_suicidal(position_coords('A1')))
+
+    def test_deepcopy_does_not_share_board(self):
+        position = go_bitboard.Position(board_size=BOARD_SIZE)
+        position.play_move(position_coords('E5'), mutate=True)
+        copied = copy.deepcopy(position)
+        copied.play_move(position_coords('D5'), mutate=True)
+
+        self.assertEqual(np.count_nonzero(position.board), 1)
+        self.assertEqual(np.count_nonzero(copied.board), 2)
+        self.assertNotEqual(position.white, copied.white)
+
+    def test_invalid_engine(self):
+        with self.assertRaisesRegex(ValueError, 'engine'):
+            GoEnv(engine='unknown')
+
+
+def position_coords(gtpc):
+    return go.get_board_tables(BOARD_SIZE).cc.from_gtp(gtpc)
+
+
+if __name__ == '__main__':
+    absltest.main()
@@ -9,18 +9,17 @@ from absl.testing import absltest
 from absl.testing import parameterized
 import numpy as np
 
-import os
+from envs.go import GoEnv
+import envs.go_engine as go
+
 
 BOARD_SIZE = 19
 STACK_HISTORY = 8
-os.environ['BOARD_SIZE'] = str(BOARD_SIZE)
-
-
-from envs.go import GoEnv
-import envs.go_engine as go
 
 
 class RunGoEnvTest(parameterized.TestCase):
+    engine = 'minigo'
+
     def setUp(self):
         self.expected_board_size = BOARD_SIZE
         self.expected_action_dim = self.expected_board_size**2 + 1
@@ -30,7 +29,7 @@ class RunGoEnvTest(parameterized.TestCase):
         return super().setUp()
 
     def test_can_set_board_size(self):
-        env = GoEnv(num_stack=STACK_HISTORY)
+        env = GoEnv(board_size=BOARD_SIZE, engine=self.engine, num_stack=STACK_HISTORY)
         obs = env.reset()
 
         self.assertEqual(env.action_space.n, self.expected_action_dim)
@@ -50,14 +49,14 @@ class RunGoEnvTest(parameterized.TestCase):
         ('action_PASS', 'PASS', BOARD_SIZE**2),
     )
     def test_gtp_to_action(self, gtpc, expected):
-        env = GoEnv(num_stack=STACK_HISTORY)
+        env = GoEnv(board_size=BOARD_SIZE, engine=self.engine, num_stack=STACK_HISTORY)
         action = env.gtp_to_action(gtpc)
 
         self.assertEqual(action, expected)
 
     @parameterized.named_parameters(('action_500', 500), ('action_plus2', BOARD_SIZE**2 + 2), ('action_999', 999))
     def test_illegal_move_out_of_action_space(self, action):
-        env = GoEnv(num_stack=STACK_HISTORY)
+        env = GoEnv(board_size=BOARD_SIZE, engine=self.engine, num_stack=STACK_HISTORY)
         env.reset()
 
         with self.assertRaisesRegex(ValueError, 'Invalid action'):
@@ -65,7 +64,7 @@ class RunGoEnvTest(parameterized.TestCase):
 
     @parameterized.named_parameters(('action_A1', 'A1'), ('action_C7', 'C7'))
     def test_illegal_move_already_taken(self, gtpc):
-        env = GoEnv(num_stack=STACK_HISTORY)
+        env = GoEnv(board_size=BOARD_SIZE, engine=self.engine, num_stack=STACK_HISTORY)
         env.reset()
 
         env.step(env.gtp_to_action(gtpc, check_illegal=False))
@@ -77,7 +76,7 @@ class RunGoEnvTest(parameterized.TestCase):
         ('action_F4', ('D3', 'A1', 'D4', 'A2', 'D5', 'A3', 'E3', 'A4', 'E5', 'A5', 'F3', 'A6', 'F5', 'E4', 'G4'), 'F4'),
     )
     def test_illegal_move_suicidal(self, moves, illegal_move):
-        env = GoEnv(num_stack=STACK_HISTORY)
+        env = GoEnv(board_size=BOARD_SIZE, engine=self.engine, num_stack=STACK_HISTORY)
         env.reset()
 
         for gtpc in moves:
@@ -87,7 +86,7 @@ class RunGoEnvTest(parameterized.TestCase):
             env.step(env.gtp_to_action(illegal_move, check_illegal=False))
 
     def test_illegal_move_ko(self):
-        env = GoEnv(num_stack=STACK_HISTORY)
+        env = GoEnv(board_size=BOARD_SIZE, engine=self.engine, num_stack=STACK_HISTORY)
         env.reset()
 
         black_moves = ['A4', 'B4', 'C3', 'C1', 'D2']
@@ -102,7 +101,7 @@ class RunGoEnvTest(parameterized.TestCase):
             env.step(env.gtp_to_action('C2', check_illegal=False))
 
     def test_game_over_by_resign(self):
-        env = GoEnv(num_stack=STACK_HISTORY)
+        env = GoEnv(board_size=BOARD_SIZE, engine=self.engine, num_stack=STACK_HISTORY)
         env.reset()
 
         for i in range(4):
@@ -113,7 +112,7 @@ class RunGoEnvTest(parameterized.TestCase):
             env.step(6)
 
     def test_game_over_by_pass(self):
-        env = GoEnv(num_stack=STACK_HISTORY)
+        env = GoEnv(board_size=BOARD_SIZE, engine=self.engine, num_stack=STACK_HISTORY)
         env.reset()
 
         for i in range(4):
@@ -126,7 +125,7 @@ class RunGoEnvTest(parameterized.TestCase):
             env.step(6)
 
     def test_pass_move_steps(self):
-        env = GoEnv(num_stack=STACK_HISTORY)
+        env = GoEnv(board_size=BOARD_SIZE, engine=self.engine, num_stack=STACK_HISTORY)
         env.reset()
 
         for i in range(4):
@@ -138,7 +137,7 @@ class RunGoEnvTest(parameterized.TestCase):
 
     @parameterized.named_parameters(('steps_31', 31), ('stack_101', 101))
     def test_pass_game_over_max_steps(self, max_steps):
-        env = GoEnv(max_steps=max_steps)
+        env = GoEnv(board_size=BOARD_SIZE, engine=self.engine, max_steps=max_steps)
         env.reset()
 
         for i in range(max_steps):
@@ -152,7 +151,7 @@ class RunGoEnvTest(parameterized.TestCase):
         ('WHITE_won', ('A1', 'D2', 'A2', 'C3', 'A3', 'C4', 'B1', 'D5', 'D3', 'E4', 'D4', 'E3', 'PASS', 'PASS'), go.WHITE, 1.0),
     )
     def test_score_basic(self, moves, expected_winner, expected_reward):
-        env = GoEnv(num_stack=STACK_HISTORY)
+        env = GoEnv(board_size=BOARD_SIZE, engine=self.engine, num_stack=STACK_HISTORY)
         env.reset()
 
         for gtpc in moves:
@@ -165,7 +164,7 @@ class RunGoEnvTest(parameterized.TestCase):
 
     @parameterized.named_parameters(('white_won', 6, go.WHITE), ('black_won', 9, go.BLACK))
     def test_won_by_resign(self, num_steps, expected_winner):
-        env = GoEnv(num_stack=STACK_HISTORY)
+        env = GoEnv(board_size=BOARD_SIZE, engine=self.engine, num_stack=STACK_HISTORY)
         env.reset()
 
         for i in range(num_steps):
@@ -176,7 +175,7 @@ class RunGoEnvTest(parameterized.TestCase):
 
     @parameterized.named_parameters(('stack_4', 4), ('stack_8', 8))
     def test_stacked_env_state_empty(self, num_stack):
-        env = GoEnv(num_stack=num_stack)
+        env = GoEnv(board_size=BOARD_SIZE, engine=self.engine, num_stack=num_stack)
         obs = env.reset()
 
         zero_planes = np.zeros((num_stack * 2, self.expected_board_size, self.expected_board_size), dtype=np.uint8)
@@ -186,7 +185,7 @@ class RunGoEnvTest(parameterized.TestCase):
         np.testing.assert_equal(obs, expected)
 
     def test_stacked_env_state(self):
-        env = GoEnv(num_stack=8)
+        env = GoEnv(board_size=BOARD_SIZE, engine=self.engine, num_stack=8)
         obs = env.reset()
 
         empty_board = np.copy(env.board)
@@ -236,6 +235,93 @@ class RunGoEnvTest(parameterized.TestCase):
         #         print(pred)
         #         print("\n")
 
+    def test_multiple_board_sizes(self):
+        env_9x9 = GoEnv(board_size=9, engine=self.engine, num_stack=STACK_HISTORY)
+        env_19x19 = GoEnv(board_size=19, engine=self.engine, num_stack=STACK_HISTORY)
+
+        for env, board_size in ((env_9x9, 9), (env_19x19, 19)):
+            obs = env.reset()
+            self.assertEqual(obs.shape, (STACK_HISTORY * 2 + 1, board_size, board_size))
+            self.assertEqual(env.action_space.n, board_size**2 + 1)
+            self.assertEqual(env.max_steps, board_size**2 * 2)
+
+        # Black captures the white stone at the lower-right corner of each board
+        for env, corner, moves in ((env_9x9, 'J1', ('H1', 'J1', 'J2')), (env_19x19, 'T1', ('S1', 'T1', 'T2'))):
+            for gtpc in moves:
+                env.step(env.gtp_to_action(gtpc))
+            self.assertEqual(env.get_captures()[env.black_player], 1)
+            self.assertEqual(env.board[env.cc.from_gtp(corner)], 0)
+            self.assertEqual(np.count_nonzero(env.board), 2)
+
+    def test_snapshot_restore(self):
+        env = GoEnv(board_size=BOARD_SIZE, engine=self.engine, num_stack=STACK_HISTORY)
+        env.reset()
+
+        for gtpc in ('A3', 'A2', 'B2', 'D4', 'C1'):
+            env.step(env.gtp_to_action(gtpc))
+
+        expected_obs = env.observation()
+        expected_legal_actions = np.copy(env.legal_actions)
+        expected_history = list(env.history)
+        expected_to_play = env.to_play
+        expected_steps = env.steps
+
+        snapshot = env.snapshot()
+
+        # Restore the same snapshot multiple times, including capture and game over by passes
+        for moves in (('B1', 'A1'), ('PASS', 'PASS')):
+            for gtpc in moves:
+                env.step(env.gtp_to_action(gtpc))
+
+            env.restore(snapshot)
+
+            np.testing.assert_equal(env.observation(), expected_obs)
+            np.testing.assert_equal(env.legal_actions, expected_legal_actions)
+            np.testing.assert_equal(env.board, env.position.board)
+            self.assertEqual(env.history, expected_history)
+            self.assertEqual(env.to_play, expected_to_play)
+            self.assertEqual(env.position.to_play, expected_to_play)
+            self.assertEqual(env.steps, expected_steps)
+            self.assertIsNone(env.winner)
+            self.assertFalse(env.is_game_over())
+
+    def test_restore_matches_replayed_game(self):
+        env = GoEnv(board_size=BOARD_SIZE, engine=self.engine, num_stack=STACK_HISTORY)
+        env.reset()
+        for gtpc in ('A3', 'A2', 'B2', 'D4'):
+            env.step(env.gtp_to_action(gtpc))
+
+        snapshot = env.snapshot()
+        position = env.position
+
+        # Capture the A2 stone after restoring, so the liberty tracker must be restored correctly
+        for moves in (('A1',), ('C1', 'E5', 'A1')):
+            for gtpc in moves:
+                env.step(env.gtp_to_action(gtpc))
+            env.restore(snapshot)
+
+        if self.engine == 'minigo':
+            # The position is restored in place
+            self.assertIs(env.position, position)
+
+        expected_env = GoEnv(board_size=BOARD_SIZE, engine=self.engine, num_stack=STACK_HISTORY)
+        expected_env.reset()
+        for gtpc in ('A3', 'A2', 'B2', 'D4', 'C1', 'E5', 'A1'):
+            expected_env.step(expected_env.gtp_to_action(gtpc))
+        for gtpc in ('C1', 'E5', 'A1'):
+            env.step(env.gtp_to_action(gtpc))
+
+        np.testing.assert_equal(env.board, expected_env.board)
+        np.testing.assert_equal(env.legal_actions, expected_env.legal_actions)
+        self.assertEqual(env.get_captures(), expected_env.get_captures())
+        self.assertEqual(env.get_captures()[env.black_player], 1)
+        self.assertEqual(env.position.n, expected_env.position.n)
+        self.assertEqual(env.position.recent, expected_env.position.recent)
+
+
+class RunBitboardGoEnvTest(RunGoEnvTest):
+    engine = 'bitboard'
+
 
 if __name__ == '__main__':
     absltest.main()
@@ -8,7 +8,7 @@ from absl.testing import absltest
 from absl.testing import parameterized
 import numpy as np
 
-from envs.gomoku import GomokuEnv
+from envs.gomoku import GomokuEnv, count_sequence_length_on_dir
 
 
 class GomokuEnvTest(parameterized.TestCase):
@@ -159,6 +159,87 @@ class GomokuEnvTest(parameterized.TestCase):
         self.assertEqual(env.winner, winner_id)
         self.assertEqual(reward, 1.0)
 
+    def test_snapshot_restore(self):
+        env = GomokuEnv(board_size=7)
+        env.reset()
+
+        for action in (0, 7, 1, 8, 2, 9):
+            env.step(action)
+
+        expected_obs = env.observation()
+        expected_legal_actions = np.copy(env.legal_actions)
+        snapshot = env.snapshot()
+
+        # Black wins the game
+        env.step(3)
+        env.step(10)
+        _, reward, done, _ = env.step(4)
+        self.assertTrue(done)
+        self.assertEqual(reward, 1.0)
+
+        env.restore(snapshot)
+
+        np.testing.assert_equal(env.observation(), expected_obs)
+        np.testing.assert_equal(env.legal_actions, expected_legal_actions)
+        self.assertEqual(len(env.history), 6)
+        self.assertEqual(env.steps, 6)
+        self.assertEqual(env.to_play, env.black_player)
+        self.assertIsNone(env.winner)
+        self.assertFalse(env.is_game_over())
+
+    def test_board_full_is_draw(self):
+        env = GomokuEnv(board_size=3, num_to_win=4)
+        env.reset()
+        done = False
+        for action in range(9):
+            self.assertFalse(done)
+            self.assertFalse(env.is_board_full())
+            _, reward, done, _ = env.step(action)
+            self.assertEqual(reward, 0.0)
+
+        self.assertTrue(done)
+        self.assertTrue(env.is_board_full())
+        self.assertIsNone(env.winner)
+        self.assertEqual(env.get_result_string(), 'DRAW')
+
+    @parameterized.named_parameters(('board_7_win_3', 7, 3), ('board_9_win_5', 9, 5), ('board_15_win_5', 15, 5))
+    def test_same_winner_as_full_scan(self, board_size, num_to_win):
+        rs = np.random.RandomState(1)
+        env = GomokuEnv(board_size=board_size, num_to_win=num_to_win)
+        line_dirs = (((0, -1), (0, 1)), ((-1, 0), (1, 0)), ((-1, -1), (1, 1)), ((-1, 1), (1, -1)))
+
+        for _ in range(50):
+            env.reset()
+            done = False
+            snapshot = None
+            while not done:
+                if snapshot is None and env.steps == 10:
+                    snapshot = env.snapshot()
+                action = int(rs.choice(np.flatnonzero(env.legal_actions)))
+                color = env.to_play
+                _, reward, done, _ = env.step(action)
+
+                x, y = env.action_to_coords(action)
+                expected_won = any(
+                    count_sequence_length_on_dir(env.board, x, y, color, dirs) >= num_to_win for dirs in line_dirs
+                )
+                self.assertEqual(reward == 1.0, expected_won)
+                self.assertEqual(env.is_board_full(), np.all(env.board != 0))
+                self.assertEqual(done, expected_won or np.all(env.board != 0))
+
+            # The tracked lines are restored together with the board
+            if snapshot is not None:
+                env.restore(snapshot)
+                expected_winner = None
+                while expected_winner is None and not env.is_game_over():
+                    action = int(rs.choice(np.flatnonzero(env.legal_actions)))
+                    color = env.to_play
+                    env.step(action)
+                    x, y = env.action_to_coords(action)
+                    if any(count_sequence_length_on_dir(env.board, x, y, color, d) >= num_to_win for d in line_dirs):
+                        expected_winner = color
+                self.assertEqual(env.winner, expected_winner)
+
 
 if __name__ == '__main__':
     absltest.main()
@@ -3,13 +3,86 @@
 # See the accompanying LICENSE file for details.
 
 
+"""Tests for eval_dataset.py."""
+from absl.testing import absltest, parameterized
+from unittest import mock
+import multiprocessing as mp
 import os
+import shutil
+import numpy as np
 
-os.environ['BOARD_SIZE'] = str(9)
-from eval_dataset import build_eval_dataset
+import eval_dataset
+from eval_dataset import build_eval_dataset, get_sgf_files, replay_sgf
 from util import create_logger
 
+
+GAMES_DIR = './pro_games/go/9x9'
+NUM_GAMES = 50
+
+
+class BuildEvalDatasetTest(parameterized.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.logger = create_logger('INFO')
+        self.games_dir = self.create_tempdir().full_path
+        self.sgf_files = sorted(get_sgf_files(GAMES_DIR))[:NUM_GAMES]
+        for sgf_file in self.sgf_files:
+            shutil.copy(sgf_file, self.games_dir)
+
+    def build(self, num_workers=1):
+        return build_eval_dataset(self.games_dir, board_size=9, num_stack=8, logger=self.logger, num_workers=num_workers)
+
+    @parameterized.named_parameters(('serial', 1), ('process_pool', 2))
+    def test_same_as_replay_sgf(self, num_workers):
+        eval_dataset.MATCHES.clear()
+        eval_dataset.GAME_COUNTS.clear()
+        expected = []
+        for sgf_file in sorted(get_sgf_files(self.games_dir)):
+            history = replay_sgf(sgf_file, 9, 8, self.logger)
+            if history is not None:
+                expected.extend(history)
+
+        dataset = self.build(num_workers)
+        self.assertLen(dataset, len(expected))
+
+        states, moves, values = next(dataset.batches(len(dataset)))
+        np.testing.assert_array_equal(states.numpy(), np.stack([x[0] for x in expected]))
+        np.testing.assert_array_equal(moves.numpy(), [np.argmax(x[1]) for x in expected])
+        np.testing.assert_array_equal(values.numpy(), [x[2] for x in expected])
+
+    def test_batches(self):
+        dataset = self.build()
+        batches = list(dataset.batches(100))
+
+        self.assertLen(batches, (len(dataset) + 99) // 100)
+        self.assertEqual(batches[0][0].shape, (100, 17, 9, 9))
+        self.assertEqual(sum(len(batch[1]) for batch in batches), len(dataset))
+
+    def test_duplicates_are_skipped(self):
+        num_positions = len(self.build())
+        shutil.copy(self.sgf_files[0], os.path.join(self.games_dir, 'duplicate.sgf'))
+        self.assertLen(self.build(), num_positions)
+
+    def test_cache(self):
+        dataset = self.build()
+        cache_dir = os.path.join(self.games_dir, '.cache')
+        self.assertLen(os.listdir(cache_dir), 1)
+
+        # The second build is loaded from cache, which has the same content
+        with mock.patch.object(eval_dataset, 'parse_sgf') as mock_parse_sgf:
+            cached_dataset = self.build()
+            mock_parse_sgf.assert_not_called()
+        np.testing.assert_array_equal(dataset.states, cached_dataset.states)
+        np.testing.assert_array_equal(dataset.moves, cached_dataset.moves)
+        np.testing.assert_array_equal(dataset.values, cached_dataset.values)
+
+        # The cache is rebuilt when the games or settings change
+        os.remove(os.path.join(self.games_dir, os.path.basename(self.sgf_files[0])))
+        self.assertLess(len(self.build()), len(dataset))
+        build_eval_dataset(self.games_dir, board_size=9, num_stack=4, logger=self.logger, num_workers=1)
+        self.assertLen(os.listdir(cache_dir), 3)
+
+
 if __name__ == '__main__':
-    logger = create_logger('DEBUG')
-    eval_dataset = build_eval_dataset('./pro_games/go/9x9', num_stack=8, logger=logger)
-    # eval_dataset = build_eval_dataset('./9x9_matches', num_stack=8, logger=logger)
+    mp.set_start_method('spawn')
+    absltest.main()
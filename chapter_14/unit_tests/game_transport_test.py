@@ -0,0 +1,102 @@
+# Copyright (c) 2023 Michael Hu.
+# This code is part of the book "The Art of Reinforcement Learning: Fundamentals, Mathematics, and Implementation with Python.".
+# See the accompanying LICENSE file for details.
+
+
+"""Tests for game_transport.py."""
+from absl.testing import absltest
+import multiprocessing as mp
+import numpy as np
+
+from game_transport import SharedGameBuffer
+from replay import Transition
+
+
+STATE_SHAPE = (5, 7, 7)
+NUM_ACTIONS = 49
+
+
+def make_game(length, seed):
+    rs = np.random.RandomState(seed)
+    game_seq = []
+    for _ in range(length):
+        pi_prob = rs.rand(NUM_ACTIONS)
+        game_seq.append(
+            Transition(
+                state=rs.randint(0, 2, size=STATE_SHAPE).astype(np.int8),
+                pi_prob=pi_prob / pi_prob.sum(),
+                value=float(rs.choice([-1.0, 0.0, 1.0])),
+            )
+        )
+    return game_seq
+
+
+def write_game_in_child_process(game_buffer, data_queue, length, seed):
+    slot = game_buffer.write_game(make_game(length, seed), mp.Event())
+    data_queue.put(slot)
+    game_buffer.close()
+
+
+class SharedGameBufferTest(absltest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.game_buffer = SharedGameBuffer(num_slots=2, max_game_length=10, state_shape=STATE_SHAPE, num_actions=NUM_ACTIONS)
+
+    def tearDown(self):
+        self.game_buffer.close(unlink=True)
+        super().tearDown()
+
+    def assertSameGame(self, expected, actual):
+        self.assertEqual(len(expected), len(actual))
+        for a, b in zip(expected, actual):
+            np.testing.assert_array_equal(a.state, b.state)
+            np.testing.assert_allclose(a.pi_prob, b.pi_prob, rtol=1e-6)
+            self.assertEqual(a.value, b.value)
+
+    def test_write_and_read_game(self):
+        game_seq = make_game(7, 1)
+        slot = self.game_buffer.write_game(game_seq, mp.Event())
+        self.assertSameGame(game_seq, self.game_buffer.read_game(slot, len(game_seq)))
+
+    def test_read_game_releases_slot(self):
+        for i in range(5):
+            game_seq = make_game(3 + i, i)
+            slot = self.game_buffer.write_game(game_seq, mp.Event())
+            self.assertSameGame(game_seq, self.game_buffer.read_game(slot, len(game_seq)))
+
+    def test_game_is_copied_out_of_slot(self):
+        game_seq = make_game(4, 1)
+        slot = self.game_buffer.write_game(game_seq, mp.Event())
+        read_seq = self.game_buffer.read_game(slot, len(game_seq))
+
+        # The slot is reused by the next game, which should not change the game already read
+        self.game_buffer.write_game(make_game(4, 2), mp.Event())
+        self.game_buffer.write_game(make_game(4, 3), mp.Event())
+        self.assertSameGame(game_seq, read_seq)
+
+    def test_game_too_long(self):
+        with self.assertRaisesRegex(ValueError, 'game length'):
+            self.game_buffer.write_game(make_game(11, 1), mp.Event())
+
+    def test_stop_while_waiting_for_free_slot(self):
+        self.game_buffer.write_game(make_game(2, 1), mp.Event())
+        self.game_buffer.write_game(make_game(2, 2), mp.Event())
+
+        stop_event = mp.Event()
+        stop_event.set()
+        self.assertIsNone(self.game_buffer.write_game(make_game(2, 3), stop_event))
+
+    def test_write_game_in_another_process(self):
+        data_queue = mp.Queue()
+        process = mp.Process(target=write_game_in_child_process, args=(self.game_buffer, data_queue, 9, 1))
+        process.start()
+        slot = data_queue.get(timeout=60)
+        process.join()
+
+        self.assertSameGame(make_game(9, 1), self.game_buffer.read_game(slot, 9))
+
+
+if __name__ == '__main__':
+    # Same start mode as the training scripts, so the buffer is pickled when passed to the child process
+    mp.set_start_method('spawn')
+    absltest.main()
@@ -0,0 +1,115 @@
+# Copyright (c) 2023 Michael Hu.
+# This code is part of the book "The Art of Reinforcement Learning: Fundamentals, Mathematics, and Implementation with Python.".
+# See the accompanying LICENSE file for details.
+
+
+"""Tests for inference_backend.py."""
+from absl.testing import absltest, parameterized
+from unittest import mock
+import torch
+from torch import nn
+
+from inference_backend import InferenceModel, export_network, fold_batch_norm
+from network import AlphaZeroNet
+from weight_broadcast import WeightBroadcast
+
+
+STATE_SHAPE = (5, 7, 7)
+NUM_ACTIONS = 50
+
+
+def create_network(seed):
+    """Returns a network with non-trivial batch normalization statistics."""
+    torch.manual_seed(seed)
+    network = AlphaZeroNet(STATE_SHAPE, NUM_ACTIONS, 2, 8, 16)
+    network.train()
+    with torch.no_grad():
+        for _ in range(5):
+            network(torch.rand(16, *STATE_SHAPE) * 3)
+    return network.eval()
+
+
+class FoldBatchNormTest(absltest.TestCase):
+    def test_same_outputs(self):
+        network = create_network(1)
+        folded = fold_batch_norm(network)
+        self.assertFalse(any(isinstance(m, nn.BatchNorm2d) for m in folded.modules()))
+        # The original network is not changed
+        self.assertTrue(any(isinstance(m, nn.BatchNorm2d) for m in network.modules()))
+
+        x = torch.rand(4, *STATE_SHAPE)
+        with torch.no_grad():
+            for output, expected in zip(folded(x), network(x)):
+                torch.testing.assert_close(output, expected, rtol=1e-4, atol=1e-5)
+
+
+class ExportNetworkTest(parameterized.TestCase):
+    def test_invalid_backend(self):
+        with self.assertRaisesRegex(ValueError, 'backend'):
+            export_network(create_network(1), torch.rand(1, *STATE_SHAPE), 'eager')
+        with self.assertRaisesRegex(ValueError, 'backend'):
+            InferenceModel(create_network(1), 'onnx')
+
+    @parameterized.named_parameters(('torchscript', 'torchscript', 1e-5), ('torchscript_int8', 'torchscript_int8', 0.1))
+    def test_close_to_eager(self, backend, atol):
+        network = create_network(1)
+        model = export_network(network, torch.rand(2, *STATE_SHAPE), backend)
+        self.assertIsInstance(model, torch.jit.ScriptModule)
+
+        # The batch size can be different from the example inputs
+        x = torch.rand(9, *STATE_SHAPE)
+        with torch.no_grad():
+            pi_logits, value = model(x)
+            expected_pi_logits, expected_value = network(x)
+        self.assertEqual(pi_logits.shape, (9, NUM_ACTIONS))
+        torch.testing.assert_close(
+            torch.softmax(pi_logits, dim=-1), torch.softmax(expected_pi_logits, dim=-1), rtol=0, atol=atol
+        )
+        torch.testing.assert_close(value, expected_value, rtol=0, atol=atol)
+
+
+class InferenceModelTest(absltest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.network = create_network(1)
+        self.model = InferenceModel(self.network, 'torchscript')
+        self.x = torch.rand(3, *STATE_SHAPE)
+
+    def assertSameAsNetwork(self):
+        with torch.no_grad():
+            for output, expected in zip(self.model(self.x), self.network(self.x)):
+                torch.testing.assert_close(output, expected, rtol=1e-4, atol=1e-5)
+
+    def test_export_once(self):
+        self.assertSameAsNetwork()
+        self.assertSameAsNetwork()
+        self.assertEqual(self.model.num_exports, 1)
+
+    def test_state_dict_is_not_rebuilt(self):
+        self.assertSameAsNetwork()
+        # Checking for new weights should not build the state dict for every forward pass
+        with mock.patch.object(type(self.network), 'state_dict', autospec=True) as state_dict:
+            self.model(torch.rand(4, *STATE_SHAPE))
+            state_dict.assert_not_called()
+        with torch.no_grad():
+            self.network.policy_head[-1].bias.add_(1.0)
+        self.assertSameAsNetwork()
+        self.assertEqual(self.model.num_exports, 2)
+
+    def test_export_again_after_load_state_dict(self):
+        self.assertSameAsNetwork()
+        self.network.load_state_dict(create_network(2).state_dict())
+        self.assertSameAsNetwork()
+        self.assertEqual(self.model.num_exports, 2)
+
+    def test_export_again_after_weight_broadcast(self):
+        self.assertSameAsNetwork()
+        weight_broadcast = WeightBroadcast(self.network)
+        weight_broadcast.publish(create_network(2), 1000)
+        weight_broadcast.load(self.network)
+        self.assertSameAsNetwork()
+        self.assertEqual(self.model.num_exports, 2)
+
+
+if __name__ == '__main__':
+    absltest.main()
@@ -0,0 +1,138 @@
+# Copyright (c) 2023 Michael Hu.
+# This code is part of the book "The Art of Reinforcement Learning: Fundamentals, Mathematics, and Implementation with Python.".
+# See the accompanying LICENSE file for details.
+
+
+"""Tests for inference_server.py."""
+from absl.testing import absltest
+import multiprocessing as mp
+import threading
+import types
+import numpy as np
+import torch
+
+from envs.gomoku import GomokuEnv
+from inference_server import InferenceChannels
+from network import AlphaZeroNet
+from pipeline import run_inference_server_loop
+from weight_broadcast import WeightBroadcast
+
+
+class InferenceServerTest(absltest.TestCase):
+    def setUp(self):
+        super().setUp()
+        torch.manual_seed(1)
+        self.env = GomokuEnv(board_size=7, num_stack=2)
+        self.network = AlphaZeroNet(self.env.observation_space.shape, self.env.action_space.n, 1, 8, 16, True)
+        self.network.eval()
+        self.channels = InferenceChannels(
+            num_clients=3,
+            max_positions_per_request=4,
+            state_shape=self.env.observation_space.shape,
+            num_actions=self.env.action_space.n,
+        )
+        self.stop_event = mp.Event()
+        self.weight_broadcast = WeightBroadcast(self.network)
+        self.server = threading.Thread(
+            target=run_inference_server_loop,
+            args=(
+                self.network,
+                torch.device('cpu'),
+                self.channels,
+                8,
+                0.01,
+                0,
+                60,
+                self.create_tempdir().full_path,
+                None,
+                'INFO',
+                types.SimpleNamespace(value=b''),
+                self.stop_event,
+                self.weight_broadcast,
+            ),
+        )
+        self.server.start()
+
+    def tearDown(self):
+        self.stop_event.set()
+        self.server.join()
+        super().tearDown()
+
+    def _random_states(self, num_states):
+        states = []
+        obs = self.env.reset()
+        for _ in range(num_states):
+            states.append(obs)
+            obs, _, done, _ = self.env.step(np.random.choice(np.flatnonzero(self.env.legal_actions)))
+            if done:
+                obs = self.env.reset()
+        return np.stack(states)
+
+    @torch.no_grad()
+    def _expected(self, states):
+        pi_logits, v = self.network(torch.from_numpy(states).to(dtype=torch.float32))
+        return torch.softmax(pi_logits, dim=-1).numpy(), v.squeeze(1).numpy()
+
+    def test_single_position(self):
+        client = self.channels.client(0, self.stop_event)
+        states = self._random_states(1)
+        pi, v = client(states[0], batched=False)
+        expected_pi, expected_v = self._expected(states)
+
+        self.assertIsInstance(v, float)
+        np.testing.assert_allclose(pi, expected_pi[0], rtol=1e-5, atol=1e-6)
+        self.assertAlmostEqual(v, expected_v[0], places=5)
+
+    def test_concurrent_clients(self):
+        states = [self._random_states(4) for _ in range(3)]
+        results = [None] * 3
+
+        def _run(client_id):
+            client = self.channels.client(client_id, self.stop_event)
+            results[client_id] = [client(states[client_id][: i + 1], batched=True) for i in range(4)]
+
+        threads = [threading.Thread(target=_run, args=(i,)) for i in range(3)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        for client_id in range(3):
+            expected_pi, expected_v = self._expected(states[client_id])
+            for i, (pi, v) in enumerate(results[client_id]):
+                self.assertLen(pi, i + 1)
+                np.testing.assert_allclose(np.stack(pi), expected_pi[: i + 1], rtol=1e-5, atol=1e-6)
+                np.testing.assert_allclose(v, expected_v[: i + 1], rtol=1e-5, atol=1e-6)
+
+    def test_response_training_steps(self):
+        client = self.channels.client(0, self.stop_event)
+        self.assertIsNone(client.response_training_steps)
+        states = self._random_states(2)
+        client(states, batched=True)
+        self.assertEqual(client.response_training_steps, 0)
+
+        new_network = AlphaZeroNet(self.env.observation_space.shape, self.env.action_space.n, 1, 8, 16, True)
+        self.weight_broadcast.publish(new_network, 100)
+        # The server picks up the new weights before the next batch it starts
+        for _ in range(10):
+            pi, v = client(states, batched=True)
+            if client.response_training_steps == 100:
+                break
+        self.assertEqual(client.response_training_steps, 100)
+        self.assertEqual(client.training_steps, 100)
+        expected_pi, expected_v = self._expected(states)
+        np.testing.assert_allclose(np.stack(pi), expected_pi, rtol=1e-5, atol=1e-6)
+        np.testing.assert_allclose(v, expected_v, rtol=1e-5, atol=1e-6)
+
+    def test_too_many_positions(self):
+        client = self.channels.client(0, self.stop_event)
+        with self.assertRaisesRegex(ValueError, 'at most 4 positions'):
+            client(self._random_states(5), batched=True)
+
+    def test_invalid_client_id(self):
+        with self.assertRaises(ValueError):
+            self.channels.client(3, self.stop_event)
+
+
+if __name__ == '__main__':
+    absltest.main()
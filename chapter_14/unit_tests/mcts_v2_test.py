@@ -0,0 +1,127 @@
+# Copyright (c) 2023 Michael Hu.
+# This code is part of the book "The Art of Reinforcement Learning: Fundamentals, Mathematics, and Implementation with Python.".
+# See the accompanying LICENSE file for details.
+
+
+"""Tests for the Gumbel root search in mcts_v2.py."""
+from absl.testing import absltest
+from absl.testing import parameterized
+import numpy as np
+
+from envs.gomoku import GomokuEnv
+import mcts_v2
+from search_profiler import SearchProfiler
+
+
+def _eval_func(obs, batched=False):
+    """Deterministic evaluation function, the outputs only depend on the input state."""
+
+    def _eval_one(x):
+        rs = np.random.RandomState(int(np.sum(x * np.arange(x.size).reshape(x.shape))) % 100000)
+        return rs.dirichlet(np.ones(49)).astype(np.float32), float(rs.uniform(-1, 1))
+
+    if not batched:
+        return _eval_one(obs)
+
+    pi, v = zip(*[_eval_one(x) for x in obs])
+    return list(pi), list(v)
+
+
+def _create_env(moves=()):
+    env = GomokuEnv(board_size=7, num_stack=2)
+    env.reset()
+    for move in moves:
+        env.step(move)
+    return env
+
+
+class GumbelSearchTest(parameterized.TestCase):
+    @parameterized.named_parameters(('16_simulations', 16, 4), ('50_simulations', 50, 16), ('few_simulations', 3, 16))
+    def test_number_of_simulations(self, num_simulations, num_considered_actions):
+        np.random.seed(1)
+        env = _create_env()
+        move, pi, _, _, next_root_node = mcts_v2.gumbel_search(
+            env, _eval_func, None, 19652, 1.25, num_simulations, num_considered_actions
+        )
+
+        self.assertEqual(env.legal_actions[move], 1)
+        self.assertAlmostEqual(float(np.sum(pi)), 1.0, places=5)
+        self.assertEqual(pi.dtype, np.float32)
+        self.assertGreater(next_root_node.N, 0)
+
+    def test_number_of_simulations_with_reused_tree(self):
+        np.random.seed(1)
+        env = _create_env()
+        root_node = mcts_v2.Node(to_play=env.to_play, num_actions=env.action_dim, parent=mcts_v2.DummyNode())
+        mcts_v2.expand(root_node, _eval_func(env.observation())[0])
+        mcts_v2.backup(root_node, 0.0)
+
+        mcts_v2.gumbel_search(env, _eval_func, root_node, 19652, 1.25, 20, 8)
+        # The root node was visited once before the search
+        self.assertEqual(root_node.N, 21)
+        self.assertEqual(np.sum(root_node.child_N), 20)
+
+    def test_illegal_actions_have_zero_probability(self):
+        np.random.seed(1)
+        env = _create_env([0, 8, 16])
+        _, pi, *_ = mcts_v2.gumbel_search(env, _eval_func, None, 19652, 1.25, 32, 16)
+
+        np.testing.assert_array_equal(pi[[0, 8, 16]], 0)
+
+    def test_sequential_halving_visits(self):
+        np.random.seed(1)
+        env = _create_env()
+        root_node = mcts_v2.Node(to_play=env.to_play, num_actions=env.action_dim, parent=mcts_v2.DummyNode())
+        mcts_v2.expand(root_node, _eval_func(env.observation())[0])
+        mcts_v2.backup(root_node, 0.0)
+
+        mcts_v2.gumbel_search(env, _eval_func, root_node, 19652, 1.25, 64, 8)
+        # 3 phases, 8 actions visited 64 // (3 * 8) = 2 times, then 4 actions visited 64 // (3 * 4) = 5 more times,
+        # and the last 2 actions split the remaining 28 visits
+        visits = np.sort(root_node.child_N)[::-1]
+        self.assertEqual(np.count_nonzero(visits), 8)
+        np.testing.assert_array_equal(visits[:8], [21, 21, 7, 7, 2, 2, 2, 2])
+
+    @parameterized.named_parameters(('deterministic', True), ('gumbel_noise', False))
+    def test_play_winning_move(self, deterministic):
+        np.random.seed(1)
+        # Black has four stones in a row, and it's black to move
+        env = _create_env([0, 7, 1, 8, 2, 9, 3, 20])
+        move, pi, *_ = mcts_v2.gumbel_search(
+            env, _eval_func, None, 19652, 1.25, 200, env.action_dim, deterministic=deterministic
+        )
+
+        self.assertEqual(move, 4)
+        self.assertEqual(np.argmax(pi), 4)
+
+    def test_deterministic(self):
+        env = _create_env([24])
+        results = []
+        for seed in (1, 2):
+            np.random.seed(seed)
+            results.append(mcts_v2.gumbel_search(env, _eval_func, None, 19652, 1.25, 32, 8, deterministic=True))
+
+        self.assertEqual(results[0][0], results[1][0])
+        np.testing.assert_allclose(results[0][1], results[1][1])
+
+    def test_profiler(self):
+        np.random.seed(1)
+        profiler = SearchProfiler()
+        mcts_v2.gumbel_search(_create_env(), profiler.wrap(_eval_func), None, 19652, 1.25, 32, 8, profiler=profiler)
+        stats = profiler.stats()
+
+        self.assertEqual(stats['prof_searches'], 1)
+        self.assertEqual(stats['prof_simulations'], 32)
+        self.assertEqual(stats['prof_batches'], 33)
+        self.assertGreaterEqual(stats['prof_mean_depth'], 1)
+
+    def test_invalid_arguments(self):
+        env = _create_env()
+        with self.assertRaisesRegex(ValueError, 'num_considered_actions'):
+            mcts_v2.gumbel_search(env, _eval_func, None, 19652, 1.25, 16, 0)
+        with self.assertRaisesRegex(ValueError, 'num_simulations'):
+            mcts_v2.gumbel_search(env, _eval_func, None, 19652, 1.25, 0)
+
+
+if __name__ == '__main__':
+    absltest.main()
@@ -0,0 +1,104 @@
+# Copyright (c) 2023 Michael Hu.
+# This code is part of the book "The Art of Reinforcement Learning: Fundamentals, Mathematics, and Implementation with Python.".
+# See the accompanying LICENSE file for details.
+
+
+"""Tests for mcts_v3.py."""
+from absl.testing import absltest
+from absl.testing import parameterized
+import numpy as np
+
+from envs.gomoku import GomokuEnv
+import mcts_v2
+import mcts_v3
+
+
+def _eval_func(obs, batched=False):
+    """Deterministic evaluation function, the outputs only depend on the input state."""
+
+    def _eval_one(x):
+        rs = np.random.RandomState(int(np.sum(x * np.arange(x.size).reshape(x.shape))) % 100000)
+        return rs.dirichlet(np.ones(49)).astype(np.float32), float(rs.uniform(-1, 1))
+
+    if not batched:
+        return _eval_one(obs)
+
+    pi, v = zip(*[_eval_one(x) for x in obs])
+    return list(pi), list(v)
+
+
+class Mctsv3Test(parameterized.TestCase):
+    def test_tree_grow_capacity(self):
+        tree = mcts_v3.Tree(num_actions=4, capacity=2)
+        root = tree.new_root(to_play=1)
+        nodes = [tree.new_node(to_play=2, parent=root, move=i) for i in range(4)]
+
+        self.assertGreaterEqual(tree.capacity, 6)
+        self.assertEqual(tree.num_nodes, 5)
+        np.testing.assert_equal(tree.children[root], nodes)
+
+    def test_reroot_releases_nodes(self):
+        tree = mcts_v3.Tree(num_actions=4)
+        root = tree.new_root(to_play=1)
+        child_0 = tree.new_node(to_play=2, parent=root, move=0)
+        child_1 = tree.new_node(to_play=2, parent=root, move=1)
+        tree.new_node(to_play=1, parent=child_0, move=2)
+        grand_child = tree.new_node(to_play=1, parent=child_1, move=3)
+
+        tree.child_N[root, 1] = 5
+        tree.child_W[root, 1] = 2
+
+        self.assertTrue(tree.reroot(1))
+        self.assertEqual(tree.root, child_1)
+        self.assertEqual(tree.num_nodes, 2)
+        self.assertEqual(tree.N, 5)
+        self.assertEqual(tree.W, 2)
+        self.assertEqual(tree.children[child_1, 3], grand_child)
+
+        # Released rows are reused
+        tree.new_node(to_play=1, parent=child_1, move=0)
+        self.assertEqual(tree.capacity, 1024)
+        self.assertEqual(tree.num_nodes, 3)
+
+    def test_reroot_missing_child(self):
+        tree = mcts_v3.Tree(num_actions=4)
+        root = tree.new_root(to_play=1)
+        self.assertFalse(tree.reroot(2))
+        self.assertEqual(tree.root, root)
+
+    @parameterized.named_parameters(('serial', 1), ('parallel_4', 4))
+    def test_same_results_as_mcts_v2(self, num_parallel):
+        results = []
+        for mcts in (mcts_v2, mcts_v3):
+            env = GomokuEnv(board_size=7, num_stack=2)
+            env.reset()
+            np.random.seed(1)
+            root_node = None
+            moves = []
+            pis = []
+            for _ in range(6):
+                kwargs = dict(
+                    env=env,
+                    eval_func=_eval_func,
+                    root_node=root_node,
+                    c_puct_base=19652,
+                    c_puct_init=1.25,
+                    num_simulations=50,
+                    root_noise=True,
+                    warm_up=True,
+                )
+                if num_parallel > 1:
+                    move, pi, _, _, root_node = mcts.parallel_uct_search(num_parallel=num_parallel, **kwargs)
+                else:
+                    move, pi, _, _, root_node = mcts.uct_search(**kwargs)
+                moves.append(move)
+                pis.append(pi)
+                env.step(move)
+            results.append((moves, np.stack(pis)))
+
+        self.assertEqual(results[0][0], results[1][0])
+        np.testing.assert_allclose(results[0][1], results[1][1])
+
+
+if __name__ == '__main__':
+    absltest.main()
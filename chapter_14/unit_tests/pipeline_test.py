@@ -0,0 +1,728 @@
+# Copyright (c) 2023 Michael Hu.
+# This code is part of the book "The Art of Reinforcement Learning: Fundamentals, Mathematics, and Implementation with Python.".
+# See the accompanying LICENSE file for details.
+
+
+"""Tests for pipeline.py."""
+from absl.testing import absltest
+from absl.testing import parameterized
+from unittest import mock
+import csv
+import logging
+import multiprocessing as mp
+import os
+import queue
+import threading
+import types
+import numpy as np
+import torch
+
+from envs.gomoku import GomokuEnv
+from inference_server import InferenceChannels
+from network import AlphaZeroNet
+import pipeline
+from pipeline import create_mcts_player, play_and_record_one_game, play_and_record_one_game_generator, play_concurrent_games
+from rating import SPRTGate
+from replay import PackedUniformReplay, Transition
+from transformation import NUM_SYMMETRIES, inverse_transform_pi_probs, transform_pi_probs, transform_states
+from weight_broadcast import WeightBroadcast
+
+
+class CountingEvalFunc:
+    """Deterministic evaluation function, which also records the batch size of each call."""
+
+    def __init__(self, num_actions):
+        self.num_actions = num_actions
+        self.batch_sizes = []
+
+    def _eval_one(self, x):
+        rs = np.random.RandomState(int(np.sum(x * np.arange(x.size).reshape(x.shape))) % 100000)
+        return rs.dirichlet(np.ones(self.num_actions)).astype(np.float32), float(rs.uniform(-1, 1))
+
+    def __call__(self, obs, batched=False):
+        if not batched:
+            self.batch_sizes.append(1)
+            return self._eval_one(obs)
+
+        self.batch_sizes.append(len(obs))
+        pi, v = zip(*[self._eval_one(x) for x in obs])
+        return list(pi), list(v)
+
+
+def _game_kwargs(env, mcts_player):
+    return dict(
+        env=env,
+        mcts_player=mcts_player,
+        resign_disabled=True,
+        c_puct_base=19652,
+        c_puct_init=1.25,
+        warm_up_steps=0,
+        check_resign_after_steps=0,
+        resign_threshold=-1,
+        logger=logging.getLogger(),
+    )
+
+
+class PlayConcurrentGamesTest(parameterized.TestCase):
+    @parameterized.named_parameters(('mcts_v2', False, 'puct'), ('mcts_v3', True, 'puct'), ('gumbel', False, 'gumbel'))
+    def test_same_games_as_sequential_play(self, array_tree, root_search):
+        num_games = 3
+        num_actions = 6 * 6
+        # Use different search budget for each game, so the games are different and finish at different time
+        num_simulations = [20, 30, 40]
+
+        expected = []
+        for i in range(num_games):
+            eval_func = CountingEvalFunc(num_actions)
+            mcts_player = create_mcts_player(
+                None,
+                None,
+                num_simulations[i],
+                2,
+                deterministic=True,
+                array_tree=array_tree,
+                eval_func=eval_func,
+                root_search=root_search,
+            )
+            expected.append(play_and_record_one_game(**_game_kwargs(GomokuEnv(board_size=6, num_stack=2), mcts_player)))
+
+        envs = [GomokuEnv(board_size=6, num_stack=2) for _ in range(num_games)]
+        mcts_players = [
+            create_mcts_player(
+                None,
+                None,
+                num_simulations[i],
+                2,
+                deterministic=True,
+                array_tree=array_tree,
+                as_generator=True,
+                root_search=root_search,
+            )
+            for i in range(num_games)
+        ]
+        eval_func = CountingEvalFunc(num_actions)
+        stop_event = threading.Event()
+        finished = {}
+
+        def new_game(i):
+            return play_and_record_one_game_generator(**_game_kwargs(envs[i], mcts_players[i]))
+
+        for i, result in play_concurrent_games(new_game, eval_func, num_games, stop_event):
+            finished.setdefault(i, result)
+            if len(finished) == num_games:
+                stop_event.set()
+
+        for i in range(num_games):
+            game_seq, stats = finished[i]
+            expected_seq, expected_stats = expected[i]
+            self.assertEqual(stats, expected_stats)
+            self.assertLen(game_seq, len(expected_seq))
+            for transition, expected_transition in zip(game_seq, expected_seq):
+                np.testing.assert_array_equal(transition.state, expected_transition.state)
+                np.testing.assert_allclose(transition.pi_prob, expected_transition.pi_prob)
+                self.assertEqual(transition.value, expected_transition.value)
+
+        # The leaves from all games are evaluated together
+        self.assertGreater(max(eval_func.batch_sizes), 2)
+
+    def test_returns_once_all_slots_are_empty(self):
+        num_games = 3
+        envs = [GomokuEnv(board_size=6, num_stack=2) for _ in range(num_games)]
+        mcts_players = [create_mcts_player(None, None, 8, 2, deterministic=True, as_generator=True) for _ in range(num_games)]
+        started = []
+
+        def new_game(i):
+            # Only start 5 games in total
+            if len(started) == 5:
+                return None
+            started.append(i)
+            return play_and_record_one_game_generator(**_game_kwargs(envs[i], mcts_players[i]))
+
+        finished = list(play_concurrent_games(new_game, CountingEvalFunc(36), num_games, threading.Event()))
+        self.assertLen(finished, 5)
+        self.assertCountEqual([i for i, _ in finished], started)
+
+
+class CreateMctsPlayerTest(absltest.TestCase):
+    def test_invalid_root_search(self):
+        with self.assertRaisesRegex(ValueError, 'root_search'):
+            create_mcts_player(None, None, 8, 1, eval_func=CountingEvalFunc(36), root_search='ucb')
+        with self.assertRaisesRegex(ValueError, 'array_tree'):
+            create_mcts_player(None, None, 8, 1, eval_func=CountingEvalFunc(36), array_tree=True, root_search='gumbel')
+
+    def test_gumbel_selfplay_game(self):
+        env = GomokuEnv(board_size=6, num_stack=2)
+        eval_func = CountingEvalFunc(env.action_dim)
+        mcts_player = create_mcts_player(
+            None, None, 16, 8, eval_func=eval_func, root_search='gumbel', num_considered_actions=4
+        )
+        game_seq, stats = play_and_record_one_game(**_game_kwargs(env, mcts_player))
+
+        self.assertEqual(stats['game_length'], len(game_seq))
+        for transition in game_seq:
+            self.assertAlmostEqual(float(np.sum(transition.pi_prob)), 1.0, places=5)
+        # The leaves are evaluated one at a time
+        self.assertEqual(max(eval_func.batch_sizes), 1)
+
+
+class PlayoutCapTest(parameterized.TestCase):
+    def create_players(self, eval_func, array_tree=False, as_generator=False):
+        kwargs = dict(deterministic=False, array_tree=array_tree, eval_func=eval_func, as_generator=as_generator)
+        return create_mcts_player(None, None, 32, 4, root_noise=True, **kwargs), create_mcts_player(None, None, 4, 2, **kwargs)
+
+    @parameterized.named_parameters(('mcts_v2', False), ('mcts_v3', True))
+    def test_only_full_searches_are_recorded(self, array_tree):
+        np.random.seed(1)
+        env = GomokuEnv(board_size=6, num_stack=2)
+        mcts_player, fast_mcts_player = self.create_players(CountingEvalFunc(env.action_dim), array_tree)
+        game_seq, stats = play_and_record_one_game(
+            **_game_kwargs(env, mcts_player), fast_mcts_player=fast_mcts_player, full_search_prob=0.25
+        )
+
+        self.assertEqual(stats['game_length'], env.steps)
+        self.assertEqual(stats['num_samples'], len(game_seq))
+        self.assertLess(len(game_seq), env.steps)
+        self.assertAlmostEqual(stats['full_search_ratio'], len(game_seq) / env.steps, places=4)
+
+        # The value targets are the game outcome from the recorded player's perspective
+        for transition in game_seq:
+            self.assertEqual(abs(transition.value), 0.0 if env.winner is None else 1.0)
+            to_play = env.black_player if np.all(transition.state[-1] == 1) else env.white_player
+            if env.winner is not None:
+                self.assertEqual(transition.value, 1.0 if to_play == env.winner else -1.0)
+
+    def test_full_search_prob_one(self):
+        np.random.seed(1)
+        env = GomokuEnv(board_size=6, num_stack=2)
+        mcts_player, fast_mcts_player = self.create_players(CountingEvalFunc(env.action_dim))
+        game_seq, stats = play_and_record_one_game(
+            **_game_kwargs(env, mcts_player), fast_mcts_player=fast_mcts_player, full_search_prob=1.0
+        )
+
+        self.assertLen(game_seq, env.steps)
+        self.assertEqual(stats['full_search_ratio'], 1.0)
+
+    def test_without_fast_player(self):
+        env = GomokuEnv(board_size=6, num_stack=2)
+        mcts_player, _ = self.create_players(CountingEvalFunc(env.action_dim))
+        game_seq, stats = play_and_record_one_game(**_game_kwargs(env, mcts_player))
+
+        self.assertLen(game_seq, env.steps)
+        self.assertNotIn('full_search_ratio', stats)
+
+    def test_generator_same_as_sequential_play(self):
+        env = GomokuEnv(board_size=6, num_stack=2)
+        eval_func = CountingEvalFunc(env.action_dim)
+
+        np.random.seed(1)
+        mcts_player, fast_mcts_player = self.create_players(eval_func)
+        expected_seq, expected_stats = play_and_record_one_game(
+            **_game_kwargs(env, mcts_player), fast_mcts_player=fast_mcts_player, full_search_prob=0.5
+        )
+
+        np.random.seed(1)
+        mcts_player, fast_mcts_player = self.create_players(None, as_generator=True)
+        generator = play_and_record_one_game_generator(
+            **_game_kwargs(env, mcts_player), fast_mcts_player=fast_mcts_player, full_search_prob=0.5
+        )
+        game_seq, stats = pipeline.run_with_eval_func(generator, eval_func)
+
+        self.assertEqual(stats, expected_stats)
+        self.assertLen(game_seq, len(expected_seq))
+        for transition, expected_transition in zip(game_seq, expected_seq):
+            np.testing.assert_array_equal(transition.state, expected_transition.state)
+
+
+class CreateEvalFuncTest(parameterized.TestCase):
+    def setUp(self):
+        super().setUp()
+        torch.manual_seed(1)
+        self.env = GomokuEnv(board_size=6, num_stack=2)
+        self.network = AlphaZeroNet(self.env.observation_space.shape, self.env.action_space.n, 1, 4, 8, True)
+        self.network.eval()
+        rs = np.random.RandomState(1)
+        self.states = rs.randint(0, 2, size=(4, *self.env.observation_space.shape)).astype(np.int8)
+
+    def test_invalid_symmetry(self):
+        with self.assertRaisesRegex(ValueError, 'symmetry'):
+            pipeline.create_eval_func(self.network, torch.device('cpu'), 'all')
+
+    def test_invalid_backend(self):
+        with self.assertRaisesRegex(ValueError, 'backend'):
+            pipeline.create_eval_func(self.network, torch.device('cpu'), backend='onnx')
+        with self.assertRaisesRegex(ValueError, 'CPU'):
+            pipeline.create_eval_func(self.network, torch.device('cuda'), backend='torchscript')
+
+    def test_torchscript_backend(self):
+        eval_func = pipeline.create_eval_func(self.network, torch.device('cpu'), backend='torchscript')
+        expected_pi, expected_v = pipeline.create_eval_func(self.network, torch.device('cpu'))(self.states, batched=True)
+        pi, v = eval_func(self.states, batched=True)
+        np.testing.assert_allclose(np.stack(pi), np.stack(expected_pi), rtol=1e-4, atol=1e-6)
+        np.testing.assert_allclose(v, expected_v, rtol=1e-4, atol=1e-6)
+
+    @parameterized.parameters('random', 'average')
+    def test_outputs(self, symmetry):
+        eval_func = pipeline.create_eval_func(self.network, torch.device('cpu'), symmetry)
+        pi, v = eval_func(self.states, batched=True)
+        self.assertLen(pi, 4)
+        self.assertLen(v, 4)
+        for p in pi:
+            self.assertEqual(p.shape, (self.env.action_space.n,))
+            self.assertAlmostEqual(float(p.sum()), 1.0, places=5)
+
+        pi, v = eval_func(self.states[0])
+        self.assertEqual(pi.shape, (self.env.action_space.n,))
+        self.assertIsInstance(v, float)
+
+    def test_average_is_invariant_to_symmetries(self):
+        eval_func = pipeline.create_eval_func(self.network, torch.device('cpu'), 'average')
+        pi, v = eval_func(self.states[0])
+        board_size = self.env.board_size
+        for symmetry in range(NUM_SYMMETRIES):
+            symmetries = torch.tensor([symmetry])
+            state = transform_states(torch.from_numpy(self.states[:1]), symmetries).numpy()
+            transformed_pi, transformed_v = eval_func(state[0])
+            # The predictions on the transformed board are the transformed predictions
+            expected_pi = transform_pi_probs(torch.from_numpy(pi[None, ...]), symmetries, board_size)[0].numpy()
+            np.testing.assert_allclose(transformed_pi, expected_pi, rtol=1e-4, atol=1e-6)
+            self.assertAlmostEqual(transformed_v, v, places=5)
+
+    def test_random_symmetry_maps_back_to_original_board(self):
+        eval_func = pipeline.create_eval_func(self.network, torch.device('cpu'), 'none')
+        random_eval_func = pipeline.create_eval_func(self.network, torch.device('cpu'), 'random')
+        board_size = self.env.board_size
+        for symmetry in range(NUM_SYMMETRIES):
+            with mock.patch.object(pipeline.torch, 'randint', return_value=torch.tensor([symmetry])):
+                pi, v = random_eval_func(self.states[0])
+            state = transform_states(torch.from_numpy(self.states[:1]), torch.tensor([symmetry])).numpy()
+            expected_pi, expected_v = eval_func(state[0])
+            expected_pi = inverse_transform_pi_probs(
+                torch.from_numpy(expected_pi[None, ...]), torch.tensor([symmetry]), board_size
+            )
+            np.testing.assert_allclose(pi, expected_pi[0].numpy(), rtol=1e-5, atol=1e-7)
+            self.assertAlmostEqual(v, expected_v, places=5)
+
+
+class RunLearnerLoopTest(parameterized.TestCase):
+    def setUp(self):
+        super().setUp()
+        torch.manual_seed(1)
+        self.state_shape = (3, 5, 5)
+        self.num_actions = 25
+        rs = np.random.RandomState(1)
+        self.game_seq = [
+            Transition(
+                state=rs.randint(0, 2, size=self.state_shape).astype(np.int8),
+                pi_prob=rs.dirichlet(np.ones(self.num_actions)),
+                value=1.0,
+            )
+            for _ in range(5)
+        ]
+
+    def run_learner(
+        self, data_queue, async_ingestion, weight_broadcast=None, network=None, max_staleness=0, max_training_steps=500
+    ):
+        if network is None:
+            network = AlphaZeroNet(self.state_shape, self.num_actions, 1, 4, 8, True)
+        optimizer = torch.optim.SGD(network.parameters(), lr=0.01)
+        replay = PackedUniformReplay(10000, np.random.RandomState(1), self.state_shape, self.num_actions)
+        ckpt_dir = self.create_tempdir().full_path
+        logs_dir = self.create_tempdir().full_path
+        self.var_ckpt = types.SimpleNamespace(value=b'')
+
+        with mock.patch.object(pipeline.time, 'sleep'):
+            pipeline.run_learner_loop(
+                seed=1,
+                network=network,
+                optimizer=optimizer,
+                lr_scheduler=torch.optim.lr_scheduler.MultiStepLR(optimizer, milestones=[1000]),
+                device=torch.device('cpu'),
+                replay=replay,
+                logger=logging.getLogger(),
+                argument_data=False,
+                batch_size=8,
+                disable_resign_ratio=0.1,
+                init_resign_threshold=-1,
+                target_fp_rate=0.05,
+                reset_fp_interval=1000,
+                no_resign_games=0,
+                min_games=1000,
+                games_per_ckpt=1000,
+                num_actors=1,
+                ckpt_interval=500,
+                log_interval=100,
+                save_replay_interval=0,
+                max_training_steps=max_training_steps,
+                ckpt_dir=ckpt_dir,
+                logs_dir=logs_dir,
+                load_ckpt=None,
+                load_replay=None,
+                data_queue=data_queue,
+                var_ckpt=self.var_ckpt,
+                var_resign_threshold=types.SimpleNamespace(value=-1),
+                ckpt_event=threading.Event(),
+                stop_event=threading.Event(),
+                async_ingestion=async_ingestion,
+                weight_broadcast=weight_broadcast,
+                max_staleness=max_staleness,
+            )
+
+        ckpt_file = os.path.join(ckpt_dir, f'training_steps_{max_training_steps}.ckpt')
+        self.assertTrue(os.path.exists(ckpt_file))
+        self.assertEqual(pipeline._decode_bytes(self.var_ckpt.value), ckpt_file)
+        with open(os.path.join(logs_dir, 'training.csv')) as f:
+            self.training_logs = list(csv.DictReader(f))
+        self.assertIn('data_queue_size', self.training_logs[0])
+        return replay
+
+    @parameterized.named_parameters(('sync_ingestion', False), ('async_ingestion', True))
+    def test_games_ingested_during_training(self, async_ingestion):
+        data_queue = queue.Queue()
+        for _ in range(1200):
+            data_queue.put((self.game_seq, {'training_steps': 0, 'game_length': 5, 'num_samples': 5, 'time_per_game': 1.0}))
+
+        replay = self.run_learner(data_queue, async_ingestion)
+
+        if async_ingestion:
+            # The remaining games are ingested while the network is trained
+            self.assertEqual(replay.num_games_added, 1200)
+        else:
+            self.assertEqual(replay.num_games_added, 1000)
+            self.assertEqual(data_queue.qsize(), 200)
+
+    def test_games_from_old_checkpoint_are_discarded(self):
+        data_queue = queue.Queue()
+        for _ in range(1000):
+            data_queue.put((self.game_seq, {'training_steps': 0, 'game_length': 5, 'num_samples': 5, 'time_per_game': 1.0}))
+        for _ in range(100):
+            data_queue.put((self.game_seq, {'training_steps': -1, 'game_length': 5, 'num_samples': 5, 'time_per_game': 1.0}))
+
+        replay = self.run_learner(data_queue, True)
+        self.assertEqual(replay.num_games_added, 1000)
+        self.assertEqual(int(self.training_logs[-1]['dropped_games']), 100)
+
+    def test_ingestion_error_is_reported(self):
+        data_queue = queue.Queue()
+        # The game stats are missing 'num_samples'
+        data_queue.put((self.game_seq, {'training_steps': 0, 'game_length': 5, 'time_per_game': 1.0}))
+
+        with self.assertRaisesRegex(RuntimeError, 'ingestion thread') as context:
+            self.run_learner(data_queue, True)
+        self.assertIsInstance(context.exception.__cause__, KeyError)
+
+    def test_stale_games_are_accepted(self):
+        data_queue = queue.Queue()
+        for training_steps, num_games in [(0, 1000), (-1, 100), (0, 1000)]:
+            for _ in range(num_games):
+                data_queue.put(
+                    (
+                        self.game_seq,
+                        {'training_steps': training_steps, 'game_length': 5, 'num_samples': 5, 'time_per_game': 1.0},
+                    )
+                )
+
+        # The second 1000 games are from the previous checkpoint, once the first checkpoint is created
+        replay = self.run_learner(data_queue, False, max_staleness=1, max_training_steps=1000)
+        self.assertEqual(replay.num_games_added, 2000)
+        stats = self.training_logs[-1]
+        self.assertEqual(int(stats['accepted_games']), 2000)
+        self.assertEqual(int(stats['stale_games']), 1000)
+        self.assertEqual(int(stats['dropped_games']), 100)
+
+    def test_weights_are_published(self):
+        data_queue = queue.Queue()
+        for _ in range(1000):
+            data_queue.put((self.game_seq, {'training_steps': 0, 'game_length': 5, 'num_samples': 5, 'time_per_game': 1.0}))
+
+        network = AlphaZeroNet(self.state_shape, self.num_actions, 1, 4, 8, True)
+        weight_broadcast = WeightBroadcast(network)
+        self.run_learner(data_queue, False, weight_broadcast, network)
+
+        actor_network = AlphaZeroNet(self.state_shape, self.num_actions, 1, 4, 8, True)
+        self.assertEqual(weight_broadcast.load(actor_network), (1, 500))
+        # The checkpoint file written in the background has the same weights
+        loaded_state = torch.load(pipeline._decode_bytes(self.var_ckpt.value))
+        for k, v in actor_network.state_dict().items():
+            torch.testing.assert_close(v, network.state_dict()[k])
+            torch.testing.assert_close(v, loaded_state['network'][k])
+
+
+class _SwitchingInferenceClient(CountingEvalFunc):
+    """Mimics an inference server which switches to a new checkpoint after a number of requests."""
+
+    def __init__(self, num_actions, switch_after):
+        super().__init__(num_actions)
+        self.switch_after = switch_after
+        self.training_steps = 0
+        self.response_training_steps = None
+
+    def __call__(self, obs, batched=False):
+        if len(self.batch_sizes) == self.switch_after:
+            self.training_steps = 100
+        self.response_training_steps = self.training_steps
+        return super().__call__(obs, batched)
+
+
+class _StopAfterQueue(queue.Queue):
+    """Sets the stop event once enough games have been sent by the actor."""
+
+    def __init__(self, num_games, stop_event, on_put=None):
+        super().__init__()
+        self.num_games = num_games
+        self.stop_event = stop_event
+        self.on_put = on_put
+
+    def put(self, item, *args, **kwargs):
+        super().put(item, *args, **kwargs)
+        if self.on_put is not None:
+            self.on_put(item)
+        if self.qsize() >= self.num_games:
+            self.stop_event.set()
+
+
+class SelfplayActorLoopTest(absltest.TestCase):
+    def setUp(self):
+        super().setUp()
+        torch.manual_seed(1)
+        self.env = GomokuEnv(board_size=6, num_stack=2)
+        self.network = AlphaZeroNet(self.env.observation_space.shape, self.env.action_space.n, 1, 4, 8, True)
+
+    def run_actor(
+        self,
+        data_queue,
+        stop_event,
+        num_parallel,
+        num_games,
+        ckpt_event=None,
+        inference_client=None,
+        weight_broadcast=None,
+        max_staleness=0,
+        transposition_table_mb=0,
+    ):
+        pipeline.run_selfplay_actor_loop(
+            seed=1,
+            rank=0,
+            network=self.network if inference_client is None else None,
+            device=torch.device('cpu'),
+            data_queue=data_queue,
+            env=self.env,
+            num_simulations=8,
+            num_parallel=num_parallel,
+            c_puct_base=19652,
+            c_puct_init=1.25,
+            warm_up_steps=0,
+            check_resign_after_steps=0,
+            disable_resign_ratio=1.0,
+            save_sgf_dir=None,
+            save_sgf_interval=1,
+            logs_dir=self.create_tempdir().full_path,
+            load_ckpt=None,
+            log_level='INFO',
+            var_ckpt=types.SimpleNamespace(value=b''),
+            var_resign_threshold=types.SimpleNamespace(value=-1),
+            ckpt_event=ckpt_event if ckpt_event is not None else threading.Event(),
+            stop_event=stop_event,
+            inference_client=inference_client,
+            num_games=num_games,
+            weight_broadcast=weight_broadcast,
+            max_staleness=max_staleness,
+            transposition_table_mb=transposition_table_mb,
+        )
+
+    def test_concurrent_games_with_inference_server(self):
+        num_parallel = 4
+        num_games = 3
+        stop_event = threading.Event()
+        # The channels are sized the same way as the training driver programs
+        channels = InferenceChannels(
+            num_clients=1,
+            max_positions_per_request=num_parallel * num_games,
+            state_shape=self.env.observation_space.shape,
+            num_actions=self.env.action_space.n,
+        )
+        server = threading.Thread(
+            target=pipeline.run_inference_server_loop,
+            args=(
+                self.network,
+                torch.device('cpu'),
+                channels,
+                16,
+                0.001,
+                0,
+                60,
+                self.create_tempdir().full_path,
+                None,
+                'INFO',
+                types.SimpleNamespace(value=b''),
+                stop_event,
+            ),
+        )
+        server.start()
+
+        data_queue = _StopAfterQueue(num_games, stop_event)
+        try:
+            self.run_actor(data_queue, stop_event, num_parallel, num_games, inference_client=channels.client(0, stop_event))
+        finally:
+            stop_event.set()
+            server.join()
+
+        self.assertGreaterEqual(data_queue.qsize(), num_games)
+        game_seq, stats = data_queue.get()
+        self.assertEqual(stats['num_samples'], len(game_seq))
+
+    def test_games_spanning_server_switch(self):
+        for max_staleness in (0, 1):
+            for num_games in (1, 3):
+                stop_event = threading.Event()
+                data_queue = _StopAfterQueue(num_games, stop_event)
+                # The server switches checkpoint in the middle of the first games
+                client = _SwitchingInferenceClient(self.env.action_space.n, switch_after=10)
+                with mock.patch.object(pipeline.TranspositionTable, 'clear', autospec=True) as clear:
+                    self.run_actor(
+                        data_queue,
+                        stop_event,
+                        2,
+                        num_games,
+                        inference_client=client,
+                        max_staleness=max_staleness,
+                        transposition_table_mb=1,
+                    )
+                # The cached results from the old checkpoint are dropped as soon as the switch is seen
+                clear.assert_called_once()
+
+                recorded = [data_queue.get()[1] for _ in range(data_queue.qsize())]
+                if max_staleness == 0:
+                    # Games played by both checkpoints are discarded
+                    self.assertTrue(all(s['training_steps'] == 100 and s['server_switches'] == 0 for s in recorded))
+                else:
+                    # Games played by both checkpoints are tagged with the older checkpoint
+                    self.assertEqual(
+                        [(s['training_steps'], s['server_switches']) for s in recorded[:num_games]], [(0, 1)] * num_games
+                    )
+
+    def test_concurrent_games_wait_for_new_checkpoint(self):
+        stop_event = threading.Event()
+        ckpt_event = threading.Event()
+        ckpt_event.set()
+        data_queue = _StopAfterQueue(1, stop_event)
+
+        timer = threading.Timer(0.5, stop_event.set)
+        timer.start()
+        # Even stale games are accepted, no game is played while the learner is creating new checkpoint
+        self.run_actor(data_queue, stop_event, 2, 3, ckpt_event=ckpt_event, max_staleness=1)
+        timer.join()
+
+        self.assertEqual(data_queue.qsize(), 0)
+
+    def test_concurrent_games_switch_checkpoint_between_games(self):
+        num_games = 3
+        stop_event = threading.Event()
+        weight_broadcast = WeightBroadcast(self.network)
+        new_network = AlphaZeroNet(self.env.observation_space.shape, self.env.action_space.n, 1, 4, 8, True)
+
+        def weights_checksum():
+            return sum(float(p.sum()) for p in self.network.parameters())
+
+        checksums = {0: weights_checksum()}
+        recorded = []
+
+        def on_put(item):
+            recorded.append((item[1]['training_steps'], weights_checksum()))
+            # Publish new weights while the other games are still in progress
+            if len(recorded) == 1:
+                weight_broadcast.publish(new_network, 100)
+
+        data_queue = _StopAfterQueue(2 * num_games, stop_event, on_put)
+        self.run_actor(data_queue, stop_event, 2, num_games, weight_broadcast=weight_broadcast)
+        checksums[100] = sum(float(p.sum()) for p in new_network.parameters())
+
+        # The games in progress are finished with the old weights, and tagged with the old training steps
+        self.assertEqual([steps for steps, _ in recorded[:num_games]], [0] * num_games)
+        self.assertEqual(recorded[-1][0], 100)
+        for steps, checksum in recorded:
+            self.assertAlmostEqual(checksum, checksums[steps], places=3)
+
+
+class MatchTest(absltest.TestCase):
+    def setUp(self):
+        super().setUp()
+        torch.manual_seed(1)
+        self.env = GomokuEnv(board_size=6, num_stack=2)
+        self.network = AlphaZeroNet(self.env.observation_space.shape, self.env.action_space.n, 1, 4, 8, True)
+
+    def create_players(self, network):
+        return tuple(create_mcts_player(network, torch.device('cpu'), 8, 2, deterministic=d) for d in (False, True))
+
+    def test_play_match_game(self):
+        players = self.create_players(self.network)
+        for new_is_black in (True, False):
+            stats = pipeline.play_match_game(self.env, players, players, new_is_black, 2, 19652, 1.25)
+            self.assertEqual(stats['new_is_black'], new_is_black)
+            self.assertEqual(stats['game_length'], self.env.steps)
+            if self.env.winner is None:
+                self.assertEqual(stats['score'], 0.5)
+            else:
+                new_player = self.env.black_player if new_is_black else self.env.white_player
+                self.assertEqual(stats['score'], float(self.env.winner == new_player))
+
+    def test_cancel_match_game(self):
+        players = self.create_players(self.network)
+        num_checks = []
+
+        def should_cancel():
+            num_checks.append(1)
+            return len(num_checks) > 3
+
+        self.assertIsNone(pipeline.play_match_game(self.env, players, players, True, 2, 19652, 1.25, should_cancel))
+        self.assertEqual(self.env.steps, 3)
+
+    def test_openings_are_different(self):
+        players = self.create_players(self.network)
+        games = set()
+        for _ in range(5):
+            pipeline.play_match_game(self.env, players, players, True, 4, 19652, 1.25)
+            games.add(self.env.to_sgf())
+        self.assertGreater(len(games), 1)
+
+    def test_match_worker_pool(self):
+        pool = pipeline.MatchWorkerPool(
+            num_workers=2,
+            seed=1,
+            network=self.network,
+            device=torch.device('cpu'),
+            env=self.env,
+            num_simulations=8,
+            num_parallel=2,
+            c_puct_base=19652,
+            c_puct_init=1.25,
+            opening_steps=2,
+            transposition_table_mb=0,
+        )
+        try:
+            prev_network = AlphaZeroNet(self.env.observation_space.shape, self.env.action_space.n, 1, 4, 8, True)
+            # A large margin so the match never stops early
+            gate = SPRTGate(elo_margin=2000)
+            game_results = pool.play(self.network, prev_network, gate, 6, threading.Event())
+            self.assertLen(game_results, 6)
+            self.assertEqual(gate.num_games, 6)
+            self.assertEqual(sorted(r['new_is_black'] for r in game_results), [False] * 3 + [True] * 3)
+
+            # Stops as soon as the gate makes a decision
+            gate = SPRTGate(elo_margin=2000)
+            gate.update(1)
+            with mock.patch.object(SPRTGate, 'decision', new_callable=mock.PropertyMock, return_value='stronger'):
+                self.assertLen(pool.play(self.network, prev_network, gate, 6, threading.Event()), 1)
+            # The unfinished games are cancelled, and never reported to the next match
+            self.assertEqual(pool.active_match.value, 0)
+            gate = SPRTGate(elo_margin=2000)
+            self.assertLen(pool.play(self.network, prev_network, gate, 2, threading.Event()), 2)
+        finally:
+            pool.close()
+
+        for worker in pool.workers:
+            self.assertFalse(worker.is_alive())
+
+
+if __name__ == '__main__':
+    mp.set_start_method('spawn')
+    absltest.main()
@@ -0,0 +1,110 @@
+# Copyright (c) 2023 Michael Hu.
+# This code is part of the book "The Art of Reinforcement Learning: Fundamentals, Mathematics, and Implementation with Python.".
+# See the accompanying LICENSE file for details.
+
+
+"""Tests for prefetcher.py."""
+from absl.testing import absltest
+import threading
+import numpy as np
+import torch
+
+from prefetcher import BatchPrefetcher, sample_batches
+from replay import PackedUniformReplay, Transition
+
+
+BOARD_SIZE = 7
+STATE_SHAPE = (5, BOARD_SIZE, BOARD_SIZE)
+NUM_ACTIONS = BOARD_SIZE**2 + 1
+
+
+class FailingReplay:
+    def sample(self, batch_size):
+        raise RuntimeError('sample failed')
+
+
+class BatchPrefetcherTest(absltest.TestCase):
+    def setUp(self):
+        super().setUp()
+        rs = np.random.RandomState(1)
+        self.replay = PackedUniformReplay(100, np.random.RandomState(1), STATE_SHAPE, NUM_ACTIONS)
+        self.replay.add_game(
+            [
+                Transition(
+                    state=rs.randint(0, 2, size=STATE_SHAPE).astype(np.int8),
+                    pi_prob=rs.dirichlet(np.ones(NUM_ACTIONS)),
+                    value=float(rs.choice([-1.0, 1.0])),
+                )
+                for _ in range(50)
+            ]
+        )
+        self.stop_event = threading.Event()
+
+    def create_prefetcher(self, replay=None, argumentation=True):
+        return BatchPrefetcher(
+            replay=replay if replay is not None else self.replay,
+            batch_size=8,
+            argumentation=argumentation,
+            pin_memory=False,
+            num_workers=3,
+            max_prefetch=2,
+            stop_event=self.stop_event,
+        )
+
+    def test_invalid_arguments(self):
+        with self.assertRaisesRegex(ValueError, 'num_workers'):
+            BatchPrefetcher(self.replay, 8, False, False, 0, 2, self.stop_event)
+        with self.assertRaisesRegex(ValueError, 'max_prefetch'):
+            BatchPrefetcher(self.replay, 8, False, False, 2, 0, self.stop_event)
+
+    def test_yields_exact_number_of_batches(self):
+        batches = list(self.create_prefetcher().batches(25))
+
+        self.assertLen(batches, 25)
+        for batch in batches:
+            self.assertEqual(batch.state.shape, (8, *STATE_SHAPE))
+            self.assertEqual(batch.pi_prob.shape, (8, NUM_ACTIONS))
+            self.assertEqual(batch.value.shape, (8,))
+            for x in batch:
+                self.assertIsInstance(x, torch.Tensor)
+                self.assertEqual(x.dtype, torch.float32)
+            torch.testing.assert_close(batch.pi_prob.sum(dim=1), torch.ones(8))
+
+    def test_same_as_sample_batches_without_argumentation(self):
+        self.replay.random_state = np.random.RandomState(1)
+        # A single worker samples the batches in the same order
+        prefetcher = self.create_prefetcher(argumentation=False)
+        prefetcher.num_workers = 1
+        batches = list(prefetcher.batches(5))
+
+        self.replay.random_state = np.random.RandomState(1)
+        for batch, expected in zip(batches, sample_batches(self.replay, 8, 5)):
+            np.testing.assert_array_equal(batch.state.numpy(), expected.state)
+            np.testing.assert_allclose(batch.pi_prob.numpy(), expected.pi_prob)
+            np.testing.assert_array_equal(batch.value.numpy(), expected.value)
+
+    def test_stop_event(self):
+        count = 0
+        for _ in self.create_prefetcher().batches(1000):
+            count += 1
+            if count == 3:
+                self.stop_event.set()
+
+        self.assertEqual(count, 3)
+
+    def test_workers_joined_when_consumer_stops_early(self):
+        num_threads = threading.active_count()
+        batches = self.create_prefetcher().batches(1000)
+        next(batches)
+        self.assertGreater(threading.active_count(), num_threads)
+
+        batches.close()
+        self.assertEqual(threading.active_count(), num_threads)
+
+    def test_error_in_worker(self):
+        with self.assertRaisesRegex(RuntimeError, 'sample failed'):
+            list(self.create_prefetcher(FailingReplay()).batches(10))
+
+
+if __name__ == '__main__':
+    absltest.main()
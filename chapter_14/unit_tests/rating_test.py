@@ -0,0 +1,131 @@
+# Copyright (c) 2023 Michael Hu.
+# This code is part of the book "The Art of Reinforcement Learning: Fundamentals, Mathematics, and Implementation with Python.".
+# See the accompanying LICENSE file for details.
+
+
+"""Tests for rating.py."""
+from absl.testing import absltest, parameterized
+import numpy as np
+
+from rating import SPRT, SPRTGate, elo_to_score, fit_bradley_terry, score_to_elo
+
+
+def play_until_decision(gate, elo_diff, seed, max_games=5000):
+    rs = np.random.RandomState(seed)
+    score = elo_to_score(elo_diff)
+    while gate.decision is None and gate.num_games < max_games:
+        gate.update(float(rs.rand() < score))
+    return gate.decision
+
+
+class EloScoreTest(parameterized.TestCase):
+    @parameterized.parameters(-400, -35, 0, 35, 400)
+    def test_round_trip(self, elo_diff):
+        self.assertAlmostEqual(score_to_elo(elo_to_score(elo_diff)), elo_diff, places=6)
+
+    def test_equal_players(self):
+        self.assertEqual(elo_to_score(0), 0.5)
+
+    def test_clip_score(self):
+        self.assertTrue(np.isfinite(score_to_elo(1.0)))
+        self.assertTrue(np.isfinite(score_to_elo(0.0)))
+
+
+class SPRTTest(absltest.TestCase):
+    def test_invalid_arguments(self):
+        with self.assertRaisesRegex(ValueError, 'elo0'):
+            SPRT(10, 10)
+        with self.assertRaisesRegex(ValueError, 'alpha'):
+            SPRT(0, 10, alpha=0.5)
+
+    def test_counts(self):
+        sprt = SPRT(0, 35)
+        for score in [1, 1, 0.5, 0]:
+            sprt.update(score)
+        self.assertEqual((sprt.wins, sprt.draws, sprt.losses, sprt.num_games), (2, 1, 1, 4))
+
+    def test_no_games(self):
+        sprt = SPRT(0, 35)
+        self.assertEqual(sprt.llr, 0)
+        self.assertIsNone(sprt.status)
+
+    def test_accept_h1(self):
+        sprt = SPRT(0, 35)
+        for _ in range(20):
+            sprt.update(1)
+        self.assertEqual(sprt.status, 'H1')
+
+    def test_accept_h0(self):
+        sprt = SPRT(0, 35)
+        for _ in range(20):
+            sprt.update(0)
+        self.assertEqual(sprt.status, 'H0')
+
+    def test_confidence_interval(self):
+        sprt = SPRT(0, 35)
+        for score in [1, 0] * 50:
+            sprt.update(score)
+        elo, lower, upper = sprt.elo_confidence_interval()
+        self.assertAlmostEqual(elo, 0)
+        self.assertLess(lower, 0)
+        self.assertAlmostEqual(upper, -lower)
+
+
+class SPRTGateTest(parameterized.TestCase):
+    def test_invalid_arguments(self):
+        with self.assertRaisesRegex(ValueError, 'elo_margin'):
+            SPRTGate(0)
+
+    @parameterized.named_parameters(('stronger', 200, 'stronger'), ('weaker', -200, 'weaker'), ('equal', 0, 'equal'))
+    def test_decision(self, elo_diff, expected):
+        self.assertEqual(play_until_decision(SPRTGate(elo_margin=35), elo_diff, seed=1), expected)
+
+    def test_clearly_stronger_stops_early(self):
+        gate = SPRTGate(elo_margin=35)
+        play_until_decision(gate, 400, seed=1)
+        self.assertLess(gate.num_games, 50)
+
+
+class FitBradleyTerryTest(parameterized.TestCase):
+    def test_invalid_arguments(self):
+        with self.assertRaisesRegex(ValueError, 'square'):
+            fit_bradley_terry(np.zeros((2, 3)))
+        with self.assertRaisesRegex(ValueError, 'non-negative'):
+            fit_bradley_terry([[0, -1], [1, 0]])
+        with self.assertRaisesRegex(ValueError, 'prior_draws'):
+            fit_bradley_terry(np.zeros((2, 2)), prior_draws=0)
+
+    def test_two_players(self):
+        # With two players, the fitted Elo difference matches the score including the virtual draw
+        ratings = fit_bradley_terry([[0, 70], [30, 0]], anchor=1)
+        self.assertEqual(ratings[1], 0)
+        self.assertAlmostEqual(ratings[0], score_to_elo(70.5 / 101), places=4)
+
+    def test_recovers_true_ratings(self):
+        rs = np.random.RandomState(1)
+        true_ratings = np.array([0, 100, -200, 300, 50])
+        num_players = len(true_ratings)
+        scores = np.zeros((num_players, num_players))
+        for i in range(num_players):
+            for j in range(i + 1, num_players):
+                wins = rs.binomial(2000, elo_to_score(true_ratings[i] - true_ratings[j]))
+                scores[i, j], scores[j, i] = wins, 2000 - wins
+
+        ratings = fit_bradley_terry(scores, anchor=0)
+        np.testing.assert_allclose(ratings, true_ratings, atol=25)
+
+    def test_undefeated_player_is_finite(self):
+        ratings = fit_bradley_terry([[0, 10, 10], [0, 0, 5], [0, 5, 0]])
+        self.assertTrue(np.all(np.isfinite(ratings)))
+        self.assertGreater(ratings[0], ratings[1])
+        self.assertAlmostEqual(ratings[1], ratings[2])
+        self.assertAlmostEqual(ratings.mean(), 0)
+
+    def test_player_without_games(self):
+        ratings = fit_bradley_terry([[0, 6, 0], [4, 0, 0], [0, 0, 0]])
+        self.assertEqual(ratings[2], 0)
+        self.assertAlmostEqual(ratings[0], -ratings[1])
+
+
+if __name__ == '__main__':
+    absltest.main()
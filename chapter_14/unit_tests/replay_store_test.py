@@ -0,0 +1,142 @@
+# Copyright (c) 2023 Michael Hu.
+# This code is part of the book "The Art of Reinforcement Learning: Fundamentals, Mathematics, and Implementation with Python.".
+# See the accompanying LICENSE file for details.
+
+
+"""Tests for replay_store.py."""
+from absl.testing import absltest, parameterized
+import os
+import numpy as np
+
+from replay import PackedUniformReplay, Transition, UniformReplay
+from replay_store import ReplayStore
+
+
+STATE_SHAPE = (5, 7, 7)
+NUM_ACTIONS = 50
+
+
+def make_game(length, rs):
+    return [
+        Transition(
+            state=rs.randint(0, 2, size=STATE_SHAPE).astype(np.int8),
+            pi_prob=rs.dirichlet(np.ones(NUM_ACTIONS)),
+            value=float(rs.choice([-1.0, 1.0])),
+        )
+        for _ in range(length)
+    ]
+
+
+def create_replay(packed, capacity):
+    if packed:
+        return PackedUniformReplay(capacity, np.random.RandomState(1), STATE_SHAPE, NUM_ACTIONS)
+    return UniformReplay(capacity, np.random.RandomState(1), compress_data=True)
+
+
+class ReplayStoreTest(parameterized.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.rs = np.random.RandomState(1)
+        self.store_dir = os.path.join(self.create_tempdir().full_path, 'replay')
+
+    def assertSameReplay(self, replay, loaded_replay):
+        self.assertEqual(replay.num_games_added, loaded_replay.num_games_added)
+        self.assertEqual(replay.num_samples_added, loaded_replay.num_samples_added)
+        self.assertEqual(replay.size, loaded_replay.size)
+        start = replay.num_samples_added - replay.size
+        expected = replay.export_samples(start, replay.num_samples_added)
+        samples = loaded_replay.export_samples(start, replay.num_samples_added)
+        for x, y in zip(expected, samples):
+            np.testing.assert_array_equal(x, y)
+
+    @parameterized.named_parameters(('uniform_replay', False), ('packed_replay', True))
+    def test_save_and_load(self, packed):
+        replay = create_replay(packed, 100)
+        store = ReplayStore(self.store_dir)
+        for length in [10, 20, 5]:
+            replay.add_game(make_game(length, self.rs))
+            self.assertEqual(store.save(replay), length)
+
+        loaded_replay = create_replay(packed, 100)
+        self.assertEqual(ReplayStore(self.store_dir).load(loaded_replay), 35)
+        self.assertSameReplay(replay, loaded_replay)
+
+    def test_load_into_different_replay_type(self):
+        replay = create_replay(True, 100)
+        replay.add_game(make_game(30, self.rs))
+        ReplayStore(self.store_dir).save(replay)
+
+        loaded_replay = create_replay(False, 100)
+        ReplayStore(self.store_dir).load(loaded_replay)
+        self.assertSameReplay(replay, loaded_replay)
+
+    def test_only_new_samples_are_saved(self):
+        replay = create_replay(True, 100)
+        store = ReplayStore(self.store_dir)
+        replay.add_game(make_game(10, self.rs))
+        store.save(replay)
+        self.assertEqual(store.save(replay), 0)
+        self.assertLen(store.header['chunks'], 1)
+
+    def test_stale_chunks_are_deleted(self):
+        replay = create_replay(True, 30)
+        store = ReplayStore(self.store_dir)
+        for _ in range(5):
+            replay.add_game(make_game(12, self.rs))
+            store.save(replay)
+
+        # Only the last 30 samples [30, 60) are still in the replay
+        self.assertEqual([c['start'] for c in store.header['chunks']], [24, 36, 48])
+        self.assertLen(os.listdir(self.store_dir), 3 * 3 + 1)
+
+        loaded_replay = create_replay(True, 30)
+        self.assertEqual(ReplayStore(self.store_dir).load(loaded_replay), 30)
+        self.assertSameReplay(replay, loaded_replay)
+
+    def test_samples_overwritten_between_saves_are_skipped(self):
+        replay = create_replay(True, 30)
+        store = ReplayStore(self.store_dir)
+        replay.add_game(make_game(10, self.rs))
+        store.save(replay)
+        replay.add_game(make_game(50, self.rs))
+
+        self.assertEqual(store.save(replay), 30)
+        self.assertEqual([c['start'] for c in store.header['chunks']], [30])
+
+    def test_load_into_smaller_replay(self):
+        replay = create_replay(True, 100)
+        store = ReplayStore(self.store_dir)
+        for _ in range(4):
+            replay.add_game(make_game(15, self.rs))
+            store.save(replay)
+
+        loaded_replay = create_replay(True, 20)
+        self.assertEqual(ReplayStore(self.store_dir).load(loaded_replay), 20)
+        self.assertEqual(loaded_replay.size, 20)
+        expected = replay.export_samples(40, 60)
+        np.testing.assert_array_equal(expected.state, loaded_replay.export_samples(40, 60).state)
+
+    def test_clear(self):
+        replay = create_replay(True, 100)
+        store = ReplayStore(self.store_dir)
+        replay.add_game(make_game(10, self.rs))
+        store.save(replay)
+        store.clear()
+
+        self.assertEqual(os.listdir(self.store_dir), ['index.json'])
+        self.assertEqual(ReplayStore(self.store_dir).num_samples_added, 0)
+
+    def test_state_shape_mismatch(self):
+        replay = create_replay(True, 100)
+        store = ReplayStore(self.store_dir)
+        replay.add_game(make_game(10, self.rs))
+        store.save(replay)
+
+        other_replay = PackedUniformReplay(100, np.random.RandomState(1), (3, 7, 7), NUM_ACTIONS)
+        other_replay.add(Transition(state=np.zeros((3, 7, 7), dtype=np.int8), pi_prob=np.ones(NUM_ACTIONS), value=1.0))
+        with self.assertRaisesRegex(ValueError, 'state shape'):
+            store.save(other_replay)
+
+
+if __name__ == '__main__':
+    absltest.main()
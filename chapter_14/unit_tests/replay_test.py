@@ -0,0 +1,112 @@
+# Copyright (c) 2023 Michael Hu.
+# This code is part of the book "The Art of Reinforcement Learning: Fundamentals, Mathematics, and Implementation with Python.".
+# See the accompanying LICENSE file for details.
+
+
+"""Tests for replay.py."""
+from absl.testing import absltest
+import numpy as np
+
+from replay import PackedUniformReplay, Transition, UniformReplay
+
+
+STATE_SHAPE = (5, 7, 7)
+NUM_ACTIONS = 50
+
+
+def make_game(length, rs):
+    game_seq = []
+    for _ in range(length):
+        pi_prob = rs.rand(NUM_ACTIONS)
+        game_seq.append(
+            Transition(
+                state=rs.randint(0, 2, size=STATE_SHAPE).astype(np.int8),
+                pi_prob=pi_prob / pi_prob.sum(),
+                value=float(rs.choice([-1.0, 0.0, 1.0])),
+            )
+        )
+    return game_seq
+
+
+class PackedUniformReplayTest(absltest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.rs = np.random.RandomState(1)
+
+    def create_replay(self, capacity):
+        return PackedUniformReplay(capacity, np.random.RandomState(1), STATE_SHAPE, NUM_ACTIONS)
+
+    def assertSameTransitions(self, transitions, batch):
+        np.testing.assert_array_equal(np.stack([t.state for t in transitions]), batch.state)
+        np.testing.assert_allclose(np.stack([t.pi_prob for t in transitions]), batch.pi_prob, rtol=1e-6)
+        np.testing.assert_array_equal([t.value for t in transitions], batch.value)
+
+    def test_invalid_capacity(self):
+        with self.assertRaisesRegex(ValueError, 'capacity'):
+            self.create_replay(0)
+
+    def test_add_and_get(self):
+        replay = self.create_replay(100)
+        game_seq = make_game(20, self.rs)
+        replay.add_game(game_seq[:15])
+        for transition in game_seq[15:]:
+            replay.add(transition)
+
+        self.assertEqual(replay.size, 20)
+        self.assertEqual(replay.num_games_added, 1)
+        batch = replay.get(np.arange(20))
+        self.assertEqual(batch.state.dtype, np.int8)
+        self.assertEqual(batch.state.shape, (20, *STATE_SHAPE))
+        self.assertSameTransitions(game_seq, batch)
+
+    def test_circular_buffer(self):
+        replay = self.create_replay(10)
+        game_seq = make_game(7, self.rs) + make_game(8, self.rs)
+        replay.add_game(game_seq[:7])
+        replay.add_game(game_seq[7:])
+
+        self.assertEqual(replay.size, 10)
+        self.assertEqual(replay.num_samples_added, 15)
+        # The oldest 5 transitions are overwritten
+        self.assertSameTransitions(game_seq[10:] + game_seq[5:10], replay.get(np.arange(10)))
+
+    def test_game_longer_than_capacity(self):
+        replay = self.create_replay(10)
+        replay.add_game(make_game(3, self.rs))
+        game_seq = make_game(25, self.rs)
+        replay.add_game(game_seq)
+
+        self.assertEqual(replay.num_samples_added, 28)
+        self.assertSameTransitions(game_seq[-8:] + game_seq[-10:-8], replay.get(np.arange(10)))
+
+    def test_sample_same_as_uniform_replay(self):
+        replay = self.create_replay(50)
+        uniform_replay = UniformReplay(50, np.random.RandomState(1), compress_data=True)
+        for _ in range(8):
+            game_seq = make_game(self.rs.randint(1, 20), self.rs)
+            replay.add_game(game_seq)
+            uniform_replay.add_game(game_seq)
+
+        self.assertIsNone(self.create_replay(50).sample(4))
+        batch = replay.sample(32)
+        expected = uniform_replay.sample(32)
+        np.testing.assert_array_equal(expected.state, batch.state)
+        np.testing.assert_allclose(expected.pi_prob, batch.pi_prob, rtol=1e-6)
+        np.testing.assert_array_equal(expected.value, batch.value)
+
+    def test_get_and_set_state(self):
+        replay = self.create_replay(30)
+        replay.add_game(make_game(12, self.rs))
+
+        new_replay = self.create_replay(30)
+        new_replay.set_state(replay.get_state())
+        self.assertEqual(new_replay.num_games_added, 1)
+        self.assertEqual(new_replay.num_samples_added, 12)
+        np.testing.assert_array_equal(replay.get(np.arange(12)).state, new_replay.get(np.arange(12)).state)
+
+        with self.assertRaisesRegex(ValueError, 'transitions'):
+            self.create_replay(5).set_state(replay.get_state())
+
+
+if __name__ == '__main__':
+    absltest.main()
@@ -0,0 +1,134 @@
+# Copyright (c) 2023 Michael Hu.
+# This code is part of the book "The Art of Reinforcement Learning: Fundamentals, Mathematics, and Implementation with Python.".
+# See the accompanying LICENSE file for details.
+
+
+"""Tests for search_profiler.py and profile_summary.py."""
+from absl.testing import absltest
+from absl.testing import parameterized
+import numpy as np
+
+from envs.gomoku import GomokuEnv
+import mcts_v2
+import mcts_v3
+from profile_summary import format_table, summarize_profile
+from search_profiler import PHASES, SearchProfiler
+
+
+def _eval_func(obs, batched=False):
+    """Deterministic evaluation function, the outputs only depend on the input state."""
+
+    def _eval_one(x):
+        rs = np.random.RandomState(int(np.sum(x * np.arange(x.size).reshape(x.shape))) % 100000)
+        return rs.dirichlet(np.ones(49)).astype(np.float32), float(rs.uniform(-1, 1))
+
+    if not batched:
+        return _eval_one(obs)
+
+    pi, v = zip(*[_eval_one(x) for x in obs])
+    return list(pi), list(v)
+
+
+def _run_search(mcts, num_parallel, profiler, seed=1):
+    np.random.seed(seed)
+    env = GomokuEnv(board_size=7, num_stack=2)
+    env.reset()
+    eval_func = profiler.wrap(_eval_func) if profiler is not None else _eval_func
+    kwargs = dict(
+        env=env,
+        eval_func=eval_func,
+        root_node=None,
+        c_puct_base=19652,
+        c_puct_init=1.25,
+        num_simulations=50,
+        root_noise=True,
+        profiler=profiler,
+    )
+    if num_parallel > 1:
+        return mcts.parallel_uct_search(num_parallel=num_parallel, **kwargs)
+    return mcts.uct_search(**kwargs)
+
+
+class SearchProfilerTest(parameterized.TestCase):
+    @parameterized.named_parameters(('mcts_v2', mcts_v2), ('mcts_v3', mcts_v3))
+    def test_uct_search(self, mcts):
+        profiler = SearchProfiler()
+        _run_search(mcts, 1, profiler)
+        stats = profiler.stats()
+
+        self.assertEqual(stats['prof_searches'], 1)
+        # The root node is evaluated before the simulations
+        self.assertEqual(stats['prof_simulations'], 49)
+        self.assertEqual(stats['prof_nodes_created'], 50)
+        self.assertEqual(stats['prof_batches'], 50)
+        self.assertEqual(stats['prof_max_batch_size'], 1)
+        self.assertEqual(stats['prof_leaves'], 0)
+        self.assertGreaterEqual(stats['prof_max_depth'], 1)
+        self.assertGreaterEqual(stats['prof_mean_depth'], 1)
+        self.assertAlmostEqual(sum(stats[f'prof_{phase}_share'] for phase in PHASES), 1.0, places=3)
+        for phase in PHASES:
+            self.assertGreater(stats[f'prof_{phase}_time'], 0)
+
+    @parameterized.named_parameters(('mcts_v2', mcts_v2), ('mcts_v3', mcts_v3))
+    def test_parallel_uct_search(self, mcts):
+        profiler = SearchProfiler()
+        _run_search(mcts, 8, profiler)
+        stats = profiler.stats()
+
+        self.assertEqual(stats['prof_searches'], 1)
+        self.assertLessEqual(stats['prof_max_batch_size'], 8)
+        # Every leaf is evaluated, but only expanded once
+        self.assertEqual(stats['prof_positions'], stats['prof_leaves'] + 1)
+        self.assertEqual(stats['prof_nodes_created'], stats['prof_leaves'] - stats['prof_collisions'] + 1)
+        self.assertEqual(stats['prof_simulations'], stats['prof_leaves'])
+        self.assertGreaterEqual(stats['prof_collision_rate'], 0)
+        self.assertLessEqual(stats['prof_collision_rate'], 1)
+
+    @parameterized.named_parameters(
+        ('mcts_v2_serial', mcts_v2, 1),
+        ('mcts_v2_parallel', mcts_v2, 8),
+        ('mcts_v3_serial', mcts_v3, 1),
+        ('mcts_v3_parallel', mcts_v3, 8),
+    )
+    def test_same_search_results(self, mcts, num_parallel):
+        move, pi, *_ = _run_search(mcts, num_parallel, None)
+        profiled_move, profiled_pi, *_ = _run_search(mcts, num_parallel, SearchProfiler())
+
+        self.assertEqual(move, profiled_move)
+        np.testing.assert_allclose(pi, profiled_pi)
+
+    def test_reset_stats(self):
+        profiler = SearchProfiler()
+        _run_search(mcts_v2, 1, profiler)
+        profiler.reset_stats()
+        stats = profiler.stats()
+
+        self.assertEqual(stats['prof_simulations'], 0)
+        self.assertEqual(stats['prof_mean_batch_size'], 0)
+        for phase in PHASES:
+            self.assertEqual(stats[f'prof_{phase}_time'], 0)
+
+    def test_summarize_profile(self):
+        rows = []
+        for seed in (1, 2):
+            profiler = SearchProfiler()
+            _run_search(mcts_v3, 8, profiler, seed)
+            # The csv reader returns strings
+            rows.append({k: str(v) for k, v in profiler.stats().items()})
+
+        summary = summarize_profile(rows)
+        self.assertEqual(summary['games'], 2)
+        self.assertEqual(summary['searches'], 2)
+        self.assertLessEqual(summary['mean_batch_size'], 8)
+        self.assertAlmostEqual(sum(summary[f'{phase}_share'] for phase in PHASES), 1.0, places=3)
+
+        table = format_table(['run'], [summary])
+        self.assertIn('collision_rate', table)
+
+    def test_summarize_profile_empty(self):
+        with self.assertRaisesRegex(ValueError, 'rows'):
+            summarize_profile([])
+
+
+if __name__ == '__main__':
+    absltest.main()
@@ -0,0 +1,99 @@
+# Copyright (c) 2023 Michael Hu.
+# This code is part of the book "The Art of Reinforcement Learning: Fundamentals, Mathematics, and Implementation with Python.".
+# See the accompanying LICENSE file for details.
+
+
+"""Tests for tournament.py."""
+from absl.testing import absltest, parameterized
+from collections import Counter
+import multiprocessing as mp
+import os
+import numpy as np
+import torch
+
+from envs.gomoku import GomokuEnv
+from network import AlphaZeroNet
+from tournament import PlayerSpec, create_schedule, get_score_matrix, play_tournament
+
+
+class CreateScheduleTest(parameterized.TestCase):
+    def test_invalid_arguments(self):
+        with self.assertRaisesRegex(ValueError, 'num_players'):
+            create_schedule(1, 2)
+        with self.assertRaisesRegex(ValueError, 'games_per_pair'):
+            create_schedule(2, 0)
+        with self.assertRaisesRegex(ValueError, 'schedule'):
+            create_schedule(2, 2, 'swiss')
+
+    @parameterized.named_parameters(('round_robin', 'round_robin', 6), ('gauntlet', 'gauntlet', 3))
+    def test_pairs(self, schedule, num_pairs):
+        games = create_schedule(4, 4, schedule)
+        self.assertLen(games, num_pairs * 4)
+
+        pairs = Counter(tuple(sorted(game)) for game in games)
+        self.assertLen(pairs, num_pairs)
+        self.assertTrue(all(count == 4 for count in pairs.values()))
+        if schedule == 'gauntlet':
+            self.assertTrue(all(0 in game for game in games))
+
+    def test_alternating_colors(self):
+        games = create_schedule(3, 3)
+        self.assertEqual(games[:3], [(0, 1), (1, 0), (0, 1)])
+
+
+class PlayTournamentTest(absltest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.env = GomokuEnv(board_size=6, num_stack=2)
+        ckpt_dir = self.create_tempdir().full_path
+        self.players = []
+        for i, num_filters in enumerate([4, 8, 4]):
+            torch.manual_seed(i)
+            network = AlphaZeroNet(self.env.observation_space.shape, self.env.action_space.n, 1, num_filters, 8, True)
+            ckpt_file = os.path.join(ckpt_dir, f'player_{i}.ckpt')
+            torch.save({'network': network.state_dict()}, ckpt_file)
+            self.players.append(PlayerSpec(f'player_{i}', ckpt_file, 1, num_filters, 8, True))
+
+    def play(self, schedule, **kwargs):
+        return list(
+            play_tournament(
+                players=self.players,
+                schedule=schedule,
+                env=self.env,
+                device=torch.device('cpu'),
+                num_simulations=8,
+                num_parallel=2,
+                c_puct_base=19652,
+                c_puct_init=1.25,
+                **kwargs,
+            )
+        )
+
+    def test_invalid_arguments(self):
+        with self.assertRaisesRegex(ValueError, 'num_workers'):
+            self.play(create_schedule(3, 1), num_workers=0)
+        with self.assertRaisesRegex(ValueError, 'max_cached_networks'):
+            self.play(create_schedule(3, 1), num_workers=1, max_cached_networks=1)
+        with self.assertRaisesRegex(ValueError, 'player index'):
+            self.play([(0, 3)], num_workers=1)
+
+    def test_play_all_games(self):
+        schedule = create_schedule(len(self.players), 2)
+        # A small cache, so the networks are reloaded after being evicted
+        results = self.play(schedule, num_workers=2, max_cached_networks=2)
+
+        self.assertEqual(sorted(r['game'] for r in results), list(range(len(schedule))))
+        for result in results:
+            self.assertEqual((result['black'], result['white']), schedule[result['game']])
+            self.assertIn(result['black_score'], (0, 0.5, 1))
+            self.assertGreater(result['game_length'], 0)
+            self.assertIn('sgf', result)
+
+        scores = get_score_matrix(len(self.players), results)
+        self.assertEqual(scores.sum(), len(schedule))
+        np.testing.assert_array_equal(scores + scores.T, 2 * (1 - np.eye(len(self.players))))
+
+
+if __name__ == '__main__':
+    mp.set_start_method('spawn')
+    absltest.main()
@@ -3,12 +3,18 @@
 # See the accompanying LICENSE file for details.
 
 
-from absl.testing import absltest
+from absl.testing import absltest, parameterized
 import torch
 from transformation import (
+    NUM_SYMMETRIES,
+    SYMMETRIES,
     apply_horizontal_flip,
     apply_vertical_flip,
+    apply_random_transformation,
     apply_rotation,
+    apply_symmetries,
+    get_symmetry_tables,
+    inverse_transform_pi_probs,
     probs_to_3d,
     flatten_probs,
 )
@@ -333,5 +339,71 @@ class TestRotation(absltest.TestCase):
             self.assertTrue(torch.all(torch.eq(pi_probs_out[i, ...], expected_pi_probs)))
 
 
+class TestSymmetryTables(parameterized.TestCase):
+    def test_invalid_num_actions(self):
+        with self.assertRaisesRegex(ValueError, 'num_actions'):
+            get_symmetry_tables(3, 8)
+
+    @parameterized.named_parameters(('no_pass_move', 9), ('pass_move', 10))
+    def test_tables_are_permutations(self, num_actions):
+        board_table, action_table, inverse_action_table = get_symmetry_tables(3, num_actions)
+        self.assertEqual(board_table.shape, (NUM_SYMMETRIES, 9))
+        self.assertEqual(action_table.shape, (NUM_SYMMETRIES, num_actions))
+        # All symmetries are different, and each table is a permutation
+        self.assertLen({tuple(t.tolist()) for t in board_table}, NUM_SYMMETRIES)
+        for table, inverse_table in zip(action_table, inverse_action_table):
+            self.assertEqual(sorted(table.tolist()), list(range(num_actions)))
+            self.assertEqual(table[inverse_table].tolist(), list(range(num_actions)))
+        if num_actions == 10:
+            self.assertTrue(torch.all(action_table[:, -1] == 9))
+
+    def test_transpose(self):
+        board_size = 5
+        states = torch.randn(2, 3, board_size, board_size)
+        pi_probs = torch.randn(2, board_size * board_size + 1)
+        symmetries = torch.full((2,), SYMMETRIES.index('transpose'))
+        states_out, pi_probs_out = apply_symmetries(states, pi_probs, symmetries)
+
+        self.assertTrue(torch.equal(states_out, torch.transpose(states, 2, 3)))
+        expected_pi_probs = torch.transpose(probs_to_3d(pi_probs[:, :-1], board_size), 2, 3)
+        self.assertTrue(torch.equal(pi_probs_out[:, :-1], flatten_probs(expected_pi_probs, board_size)))
+        self.assertTrue(torch.equal(pi_probs_out[:, -1], pi_probs[:, -1]))
+
+    def test_per_sample_symmetries(self):
+        board_size = 7
+        states = torch.randn(NUM_SYMMETRIES, 4, board_size, board_size)
+        pi_probs = torch.randn(NUM_SYMMETRIES, board_size * board_size + 1)
+        symmetries = torch.randperm(NUM_SYMMETRIES)
+        states_out, pi_probs_out = apply_symmetries(states, pi_probs, symmetries)
+
+        # Same as applying the symmetry to each sample alone
+        for i in range(NUM_SYMMETRIES):
+            expected_state, expected_pi_probs = apply_symmetries(states[[i]], pi_probs[[i]], symmetries[[i]])
+            self.assertTrue(torch.equal(states_out[[i]], expected_state))
+            self.assertTrue(torch.equal(pi_probs_out[[i]], expected_pi_probs))
+
+        # The state planes and the action probabilities are transformed in the same way
+        states = probs_to_3d(pi_probs[:, :-1], board_size)
+        states_out, pi_probs_out = apply_symmetries(states, pi_probs, symmetries)
+        self.assertTrue(torch.equal(flatten_probs(states_out, board_size), pi_probs_out[:, :-1]))
+
+        # The inverse tables map the action probabilities back
+        self.assertTrue(torch.equal(inverse_transform_pi_probs(pi_probs_out, symmetries, board_size), pi_probs))
+
+    def test_apply_random_transformation(self):
+        torch.manual_seed(1)
+        board_size = 5
+        pi_probs = torch.randn(64, board_size * board_size)
+        states = probs_to_3d(pi_probs, board_size)
+        values = torch.randn(64)
+        states_out, pi_probs_out, values_out = apply_random_transformation(states, pi_probs, values)
+
+        self.assertTrue(torch.equal(flatten_probs(states_out, board_size), pi_probs_out))
+        self.assertTrue(torch.equal(values_out, values))
+        # Different samples in the batch use different symmetries
+        num_unchanged = torch.all(pi_probs_out == pi_probs, dim=1).sum().item()
+        self.assertLess(num_unchanged, 32)
+
+
 if __name__ == '__main__':
     absltest.main()
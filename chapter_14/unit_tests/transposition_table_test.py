@@ -0,0 +1,137 @@
+# Copyright (c) 2023 Michael Hu.
+# This code is part of the book "The Art of Reinforcement Learning: Fundamentals, Mathematics, and Implementation with Python.".
+# See the accompanying LICENSE file for details.
+
+
+"""Tests for transposition_table.py."""
+from absl.testing import absltest
+import numpy as np
+
+from envs.gomoku import GomokuEnv
+from transposition_table import TranspositionTable
+import mcts_v2
+
+
+class CountingEvalFunc:
+    """Deterministic evaluation function which counts the number of evaluated positions."""
+
+    def __init__(self, num_actions):
+        self.num_actions = num_actions
+        self.num_evaluated = 0
+
+    def _eval_one(self, x):
+        self.num_evaluated += 1
+        rs = np.random.RandomState(int(np.sum(x * np.arange(x.size).reshape(x.shape))) % 100000)
+        return rs.dirichlet(np.ones(self.num_actions)).astype(np.float32), float(rs.uniform(-1, 1))
+
+    def __call__(self, obs, batched=False):
+        if not batched:
+            return self._eval_one(obs)
+
+        pi, v = zip(*[self._eval_one(x) for x in obs])
+        return list(pi), list(v)
+
+
+class TranspositionTableTest(absltest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.env = GomokuEnv(board_size=7, num_stack=2)
+        self.state_shape = self.env.observation_space.shape
+        self.num_actions = self.env.action_space.n
+
+    def test_hash_includes_color_to_play(self):
+        table = TranspositionTable(self.state_shape, self.num_actions, random_state=np.random.RandomState(1))
+        obs = self.env.reset()
+        other_obs = obs.copy()
+        other_obs[-1] = 1 - other_obs[-1]
+
+        self.assertEqual(table.hash(obs), table.hash(obs.copy()))
+        self.assertNotEqual(table.hash(obs), table.hash(other_obs))
+        self.assertEqual(table.hash(np.stack([obs, other_obs]), batched=True), [table.hash(obs), table.hash(other_obs)])
+
+    def test_memory_budget(self):
+        table = TranspositionTable(self.state_shape, self.num_actions, max_memory_mb=1)
+        self.assertEqual(table.capacity, 1024**2 // table.entry_bytes)
+
+        with self.assertRaises(ValueError):
+            TranspositionTable(self.state_shape, self.num_actions, max_memory_mb=0)
+
+    def test_lru_eviction(self):
+        table = TranspositionTable(self.state_shape, self.num_actions, max_memory_mb=1)
+        table.capacity = 2
+        pi = np.ones(self.num_actions, dtype=np.float32)
+
+        table.insert(1, pi, 0.1)
+        table.insert(2, pi, 0.2)
+        self.assertIsNotNone(table.lookup(1))
+        table.insert(3, pi, 0.3)
+
+        self.assertLen(table, 2)
+        self.assertIsNone(table.lookup(2))
+        self.assertEqual(table.lookup(1)[1], 0.1)
+        self.assertEqual(table.lookup(3)[1], 0.3)
+        self.assertEqual(table.stats()['tt_evictions'], 1)
+        self.assertEqual(table.stats()['tt_hit_rate'], 0.75)
+
+        # Cached arrays are read only
+        with self.assertRaises(ValueError):
+            table.lookup(1)[0][0] = 0
+
+        table.clear()
+        self.assertLen(table, 0)
+
+    def test_wrap_batched(self):
+        table = TranspositionTable(self.state_shape, self.num_actions)
+        eval_func = CountingEvalFunc(self.num_actions)
+        cached_eval_func = table.wrap(eval_func)
+
+        obs = self.env.reset()
+        next_obs, *_ = self.env.step(0)
+        states = np.stack([obs, next_obs, obs])
+
+        expected_pi, expected_v = CountingEvalFunc(self.num_actions)(states, True)
+        pi, v = cached_eval_func(states[:1], True)
+        self.assertEqual(eval_func.num_evaluated, 1)
+
+        # Only the second state is not in the cache
+        pi, v = cached_eval_func(states, True)
+        self.assertEqual(eval_func.num_evaluated, 2)
+        np.testing.assert_allclose(np.stack(pi), np.stack(expected_pi))
+        self.assertEqual(v, expected_v)
+
+        pi, v = cached_eval_func(obs, False)
+        self.assertEqual(eval_func.num_evaluated, 2)
+        np.testing.assert_allclose(pi, expected_pi[0])
+        self.assertEqual(v, expected_v[0])
+
+    def test_same_search_results(self):
+        results = []
+        for use_cache in (False, True):
+            eval_func = CountingEvalFunc(self.num_actions)
+            if use_cache:
+                eval_func = TranspositionTable(self.state_shape, self.num_actions).wrap(eval_func)
+
+            env = GomokuEnv(board_size=7, num_stack=2)
+            env.reset()
+            np.random.seed(1)
+            moves = []
+            for _ in range(6):
+                move, *_ = mcts_v2.parallel_uct_search(
+                    env=env,
+                    eval_func=eval_func,
+                    root_node=None,
+                    c_puct_base=19652,
+                    c_puct_init=1.25,
+                    num_simulations=50,
+                    num_parallel=4,
+                    root_noise=True,
+                )
+                moves.append(move)
+                env.step(move)
+            results.append(moves)
+
+        self.assertEqual(results[0], results[1])
+
+
+if __name__ == '__main__':
+    absltest.main()
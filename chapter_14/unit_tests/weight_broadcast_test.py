@@ -0,0 +1,108 @@
+# Copyright (c) 2023 Michael Hu.
+# This code is part of the book "The Art of Reinforcement Learning: Fundamentals, Mathematics, and Implementation with Python.".
+# See the accompanying LICENSE file for details.
+
+
+"""Tests for weight_broadcast.py."""
+from absl.testing import absltest
+import multiprocessing as mp
+import threading
+import torch
+
+from network import AlphaZeroNet
+from weight_broadcast import WeightBroadcast
+
+
+STATE_SHAPE = (5, 7, 7)
+NUM_ACTIONS = 50
+
+
+def create_network(seed):
+    torch.manual_seed(seed)
+    return AlphaZeroNet(STATE_SHAPE, NUM_ACTIONS, 2, 8, 16)
+
+
+def train_one_step(network):
+    optimizer = torch.optim.SGD(network.parameters(), lr=0.1)
+    network.train()
+    pi_logits, v = network(torch.rand(4, *STATE_SHAPE))
+    loss = pi_logits.mean() + v.mean()
+    loss.backward()
+    optimizer.step()
+
+
+def load_weights_in_child_process(weight_broadcast, result_queue):
+    network = create_network(2)
+    if weight_broadcast.wait(0, timeout=30):
+        version, training_steps = weight_broadcast.load(network)
+        # Send numpy arrays, as tensors sent over the queue are backed by memory owned by this process
+        result_queue.put((version, training_steps, {k: v.numpy() for k, v in network.state_dict().items()}))
+
+
+class WeightBroadcastTest(absltest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.network = create_network(1)
+        train_one_step(self.network)
+        self.weight_broadcast = WeightBroadcast(self.network)
+
+    def assertSameWeights(self, expected, actual):
+        self.assertEqual(list(expected.keys()), list(actual.keys()))
+        for k in expected.keys():
+            torch.testing.assert_close(expected[k], actual[k], rtol=0, atol=0)
+
+    def test_publish_and_load(self):
+        self.assertEqual(self.weight_broadcast.version, 0)
+        self.assertEqual(self.weight_broadcast.publish(self.network, 1000), 1)
+
+        network = create_network(2)
+        self.assertEqual(self.weight_broadcast.load(network), (1, 1000))
+        # Includes the batch norm running statistics and counters
+        self.assertSameWeights(self.network.state_dict(), network.state_dict())
+
+    def test_load_is_in_place(self):
+        self.weight_broadcast.publish(self.network, 1000)
+        network = create_network(2)
+        params = list(network.parameters())
+        self.weight_broadcast.load(network)
+
+        for p, new_p in zip(params, network.parameters()):
+            self.assertIs(p, new_p)
+
+    def test_load_latest_version(self):
+        self.weight_broadcast.publish(self.network, 1000)
+        train_one_step(self.network)
+        self.weight_broadcast.publish(self.network, 2000)
+
+        network = create_network(2)
+        self.assertEqual(self.weight_broadcast.load(network), (2, 2000))
+        self.assertSameWeights(self.network.state_dict(), network.state_dict())
+
+    def test_wait_timeout(self):
+        self.assertFalse(self.weight_broadcast.wait(0, timeout=0.01))
+        self.weight_broadcast.publish(self.network, 1000)
+        self.assertTrue(self.weight_broadcast.wait(0, timeout=0.01))
+        self.assertFalse(self.weight_broadcast.wait(1, timeout=0.01))
+
+    def test_wait_is_notified(self):
+        timer = threading.Timer(0.1, self.weight_broadcast.publish, args=(self.network, 1000))
+        timer.start()
+        self.assertTrue(self.weight_broadcast.wait(0, timeout=30))
+        timer.join()
+
+    def test_load_in_another_process(self):
+        result_queue = mp.Queue()
+        process = mp.Process(target=load_weights_in_child_process, args=(self.weight_broadcast, result_queue))
+        process.start()
+        self.weight_broadcast.publish(self.network, 1000)
+
+        version, training_steps, state_dict = result_queue.get(timeout=60)
+        process.join()
+
+        self.assertEqual((version, training_steps), (1, 1000))
+        self.assertSameWeights(self.network.state_dict(), {k: torch.from_numpy(v) for k, v in state_dict.items()})
+
+
+if __name__ == '__main__':
+    mp.set_start_method('spawn')
+    absltest.main()
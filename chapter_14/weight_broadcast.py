@@ -0,0 +1,87 @@
+# Copyright (c) 2023 Michael Hu.
+# This code is part of the book "The Art of Reinforcement Learning: Fundamentals, Mathematics, and Implementation with Python.".
+# See the accompanying LICENSE file for details.
+
+
+"""Components to broadcast the latest neural network weights from the learner to the other processes.
+
+By default, the learner saves a checkpoint file after every `ckpt_interval` training steps, and every actor,
+the inference server, and the evaluator load the same file through `torch.load`, which goes through the disk
+and unpickling for each process.
+
+Instead, the `WeightBroadcast` keeps a flattened copy of the network weights in shared memory,
+along with a version counter. The learner writes the new weights and increases the version,
+and notifies the waiting processes through a condition variable, the other processes copy the weights in place
+into their own network once they see a new version.
+"""
+
+from typing import List, Tuple
+import multiprocessing as mp
+import torch
+
+
+class WeightBroadcast:
+    """Shared memory block for the flattened network weights, protected by a condition variable."""
+
+    def __init__(self, network: torch.nn.Module) -> None:
+        """
+        Args:
+            network: the neural network, only used to determine the layout of the weights.
+        """
+        # Floating point tensors and integer tensors (e.g. the number of batches tracked by batch norm)
+        # are stored in two separate blocks, so no precision is lost
+        self.layout: List[Tuple[str, torch.Size, bool, int]] = []
+        num_floats = num_ints = 0
+        for name, tensor in network.state_dict().items():
+            is_float = tensor.is_floating_point()
+            self.layout.append((name, tensor.shape, is_float, num_floats if is_float else num_ints))
+            if is_float:
+                num_floats += tensor.numel()
+            else:
+                num_ints += tensor.numel()
+
+        self.float_block = torch.zeros(num_floats, dtype=torch.float32).share_memory_()
+        self.int_block = torch.zeros(num_ints, dtype=torch.int64).share_memory_()
+
+        # Version 0 means no weights have been published yet
+        self.condition = mp.Condition()
+        self._version = mp.Value('q', 0, lock=False)
+        self._training_steps = mp.Value('q', 0, lock=False)
+
+    @property
+    def version(self) -> int:
+        """The version of the latest published weights."""
+        return self._version.value
+
+    def _views(self) -> List[Tuple[str, torch.Tensor]]:
+        views = []
+        for name, shape, is_float, offset in self.layout:
+            block = self.float_block if is_float else self.int_block
+            views.append((name, block[offset : offset + shape.numel()].view(shape)))  # noqa: E203
+        return views
+
+    @torch.no_grad()
+    def publish(self, network: torch.nn.Module, training_steps: int) -> int:
+        """Copy the network weights into shared memory, and notify all waiting processes, returns the new version."""
+        state_dict = network.state_dict()
+        with self.condition:
+            for name, view in self._views():
+                view.copy_(state_dict[name])
+            self._version.value += 1
+            self._training_steps.value = training_steps
+            self.condition.notify_all()
+            return self._version.value
+
+    @torch.no_grad()
+    def load(self, network: torch.nn.Module) -> Tuple[int, int]:
+        """Copy the latest weights in place into the network, returns the version and training steps of the weights."""
+        state_dict = network.state_dict()
+        with self.condition:
+            for name, view in self._views():
+                state_dict[name].copy_(view)
+            return self._version.value, self._training_steps.value
+
+    def wait(self, version: int, timeout: float) -> bool:
+        """Block until weights newer than `version` are published, returns False if timed out."""
+        with self.condition:
+            return self.condition.wait_for(lambda: self._version.value > version, timeout)